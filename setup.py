@@ -81,11 +81,15 @@ setup(
         'console_scripts': [
             'functest-run-suite = zaza.charm_lifecycle.func_test_runner:main',
             'functest-deploy = zaza.charm_lifecycle.deploy:main',
+            'functest-collect = zaza.charm_lifecycle.collect:main',
             'functest-configure = zaza.charm_lifecycle.configure:main',
             'functest-destroy = zaza.charm_lifecycle.destroy:main',
             'functest-prepare = zaza.charm_lifecycle.prepare:main',
+            'functest-redeploy = zaza.charm_lifecycle.redeploy:main',
             'functest-test = zaza.charm_lifecycle.test:main',
+            'functest-model-pool = zaza.charm_lifecycle.model_pool:main',
             'current-apps = zaza.model:main',
+            'model-benchmark = zaza.utilities.benchmark:main',
             'tempest-config = zaza.tempest_config:main',
         ]
     },
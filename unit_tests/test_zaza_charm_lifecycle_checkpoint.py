@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+import zaza.charm_lifecycle.checkpoint as lc_checkpoint
+import unit_tests.utils as ut_utils
+
+
+class TestCharmLifecycleCheckpoint(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCharmLifecycleCheckpoint, self).setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patch_object(lc_checkpoint.os, 'environ', new={
+            lc_checkpoint.CHECKPOINT_DIR_ENV: os.path.join(
+                self.tmpdir.name, 'checkpoints')})
+        self.patch_object(lc_checkpoint.time, 'time')
+        self.time.return_value = 1000
+
+    def tearDown(self):
+        super(TestCharmLifecycleCheckpoint, self).tearDown()
+        self.tmpdir.cleanup()
+
+    def test_get_checkpoint_file(self):
+        self.assertEqual(
+            lc_checkpoint.get_checkpoint_file('bundle1'),
+            os.path.join(self.tmpdir.name, 'checkpoints', 'bundle1.json'))
+
+    def test_save_load_clear(self):
+        self.assertIsNone(lc_checkpoint.load('bundle1'))
+        lc_checkpoint.save('bundle1', 'newmodel', ['deploy', 'prepare'])
+        self.assertEqual(lc_checkpoint.load('bundle1'), {
+            'bundle': 'bundle1',
+            'model_name': 'newmodel',
+            'phases': ['prepare', 'deploy'],
+            'leased_model': False,
+            'updated': 1000})
+        self.assertEqual(
+            os.listdir(os.path.join(self.tmpdir.name, 'checkpoints')),
+            ['bundle1.json'])
+        lc_checkpoint.clear('bundle1')
+        self.assertIsNone(lc_checkpoint.load('bundle1'))
+        # Clearing a missing checkpoint is not an error
+        lc_checkpoint.clear('bundle1')
+
+    def test_load_unreadable(self):
+        lc_checkpoint.save('bundle1', 'newmodel', ['prepare'])
+        with open(lc_checkpoint.get_checkpoint_file('bundle1'), 'w') as fh:
+            fh.write('{"model_name": ')
+        self.assertIsNone(lc_checkpoint.load('bundle1'))
+
+    def test_model_exists(self):
+        self.patch_object(lc_checkpoint.subprocess, 'call')
+        self.call.return_value = 0
+        self.assertTrue(lc_checkpoint.model_exists('newmodel'))
+        self.call.assert_called_once_with(
+            ['juju', 'show-model', 'newmodel'],
+            stdout=lc_checkpoint.subprocess.DEVNULL,
+            stderr=lc_checkpoint.subprocess.DEVNULL)
+        self.call.return_value = 1
+        self.assertFalse(lc_checkpoint.model_exists('newmodel'))
+
+    def test_get_resume_point(self):
+        self.patch_object(lc_checkpoint, 'model_exists')
+        self.assertIsNone(lc_checkpoint.get_resume_point('bundle1'))
+        lc_checkpoint.save('bundle1', 'newmodel', ['prepare', 'deploy'],
+                           leased_model=True)
+        self.model_exists.return_value = True
+        resume_point = lc_checkpoint.get_resume_point('bundle1')
+        self.assertEqual(resume_point['model_name'], 'newmodel')
+        self.assertEqual(resume_point['phases'], ['prepare', 'deploy'])
+        self.assertTrue(resume_point['leased_model'])
+        self.model_exists.assert_called_once_with('newmodel')
+        # The checkpoint is dropped once its model has gone
+        self.model_exists.return_value = False
+        self.assertIsNone(lc_checkpoint.get_resume_point('bundle1'))
+        self.assertIsNone(lc_checkpoint.load('bundle1'))
@@ -0,0 +1,180 @@
+from concurrent import futures
+import io
+import os
+import tarfile
+import tempfile
+import threading
+
+import mock
+
+import zaza.charm_lifecycle.collect as lc_collect
+import unit_tests.utils as ut_utils
+
+
+def _make_tarball(files):
+    fileobj = io.BytesIO()
+    with tarfile.open(fileobj=fileobj, mode='w:gz') as tar:
+        for name, data in files.items():
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+    fileobj.seek(0)
+    return fileobj
+
+
+class _SlowStream(io.BytesIO):
+    """Stream which stops part way through until the other streams do"""
+
+    def __init__(self, data, barrier, offset):
+        super(_SlowStream, self).__init__(data.read())
+        self.barrier = barrier
+        self.offset = offset
+
+    def read(self, size=-1):
+        if self.barrier and self.tell() >= self.offset:
+            barrier, self.barrier = self.barrier, None
+            barrier.wait()
+        return super(_SlowStream, self).read(size)
+
+
+class TestCharmLifecycleCollect(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCharmLifecycleCollect, self).setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmpdir.name, 'artifacts.tar.gz')
+
+    def tearDown(self):
+        super(TestCharmLifecycleCollect, self).tearDown()
+        self.tmpdir.cleanup()
+
+    def read_tarball(self):
+        with tarfile.open(self.output) as tar:
+            return {m.name: tar.extractfile(m).read()
+                    for m in tar.getmembers()}
+
+    def test_get_machines(self):
+        status = {
+            'machines': {
+                '1': {},
+                '0': {'containers': {'0/lxd/0': {}}}}}
+        self.assertEqual(lc_collect.get_machines(status),
+                         ['0', '0/lxd/0', '1'])
+        self.assertEqual(lc_collect.get_machines({}), [])
+
+    def test_get_remote_tar_command(self):
+        self.assertEqual(
+            lc_collect.get_remote_tar_command(
+                ['/var/log', '/etc/nova'], ['/var/log/journal']),
+            'sudo tar -czf - --ignore-failed-read --warning=no-file-changed '
+            '--exclude=var/log/journal -C / var/log etc/nova')
+
+    def test_collect_machine_logs(self):
+        self.patch_object(lc_collect.subprocess, 'Popen')
+        proc = mock.MagicMock()
+        proc.stdout = _make_tarball({
+            'var/log/juju/unit-app-0.log': b'unit log',
+            'var/log/nova/nova-compute.log': b'service log'})
+        proc.wait.return_value = 0
+        self.Popen.return_value = proc
+        with tarfile.open(self.output, 'w:gz') as tar:
+            self.assertEqual(
+                lc_collect.collect_machine_logs(
+                    'mymodel', '0/lxd/1', tar, threading.Lock()),
+                2)
+        self.Popen.assert_called_once_with(
+            ['juju', 'ssh', '--pty=false', '-m', 'mymodel', '0/lxd/1',
+             lc_collect.get_remote_tar_command(
+                 lc_collect.DEFAULT_LOG_PATHS,
+                 lc_collect.DEFAULT_EXCLUDE_PATHS)],
+            stdin=lc_collect.subprocess.DEVNULL,
+            stdout=lc_collect.subprocess.PIPE,
+            stderr=lc_collect.subprocess.DEVNULL)
+        self.assertEqual(self.read_tarball(), {
+            'machine-0-lxd-1/var/log/juju/unit-app-0.log': b'unit log',
+            'machine-0-lxd-1/var/log/nova/nova-compute.log': b'service log'})
+
+    def test_collect_machine_logs_concurrently(self):
+        # Each machine only gets past the middle of its file once the other
+        # has too, which deadlocks unless the transfers overlap
+        data = os.urandom(256 * 1024)
+        both_transferring = threading.Barrier(2, timeout=5)
+        procs = {}
+        for machine in ('0', '1'):
+            proc = mock.MagicMock()
+            proc.stdout = _SlowStream(
+                _make_tarball({'var/log/big.log': data}),
+                both_transferring, len(data) // 2)
+            proc.wait.return_value = 0
+            procs[machine] = proc
+        self.patch_object(lc_collect.subprocess, 'Popen')
+        self.Popen.side_effect = lambda cmd, **kwargs: procs[cmd[5]]
+        lock = threading.Lock()
+        with tarfile.open(self.output, 'w:gz') as tar, \
+                futures.ThreadPoolExecutor(max_workers=2) as executor:
+            jobs = [executor.submit(lc_collect.collect_machine_logs,
+                                    'mymodel', machine, tar, lock)
+                    for machine in procs]
+            self.assertEqual([job.result() for job in jobs], [1, 1])
+        self.assertEqual(self.read_tarball(), {
+            'machine-0/var/log/big.log': data,
+            'machine-1/var/log/big.log': data})
+
+    def test_collect_machine_logs_unreachable(self):
+        self.patch_object(lc_collect.subprocess, 'Popen')
+        proc = mock.MagicMock()
+        proc.stdout = io.BytesIO()
+        proc.wait.return_value = 255
+        self.Popen.return_value = proc
+        with tarfile.open(self.output, 'w:gz') as tar:
+            self.assertEqual(
+                lc_collect.collect_machine_logs(
+                    'mymodel', '3', tar, threading.Lock()),
+                0)
+
+    def test_collect(self):
+        self.patch_object(lc_collect.subprocess, 'check_output')
+        self.patch_object(lc_collect, 'collect_debug_log')
+        self.patch_object(lc_collect, 'collect_machine_logs')
+        self.check_output.return_value = (
+            b'machines:\n  "0": {}\n  "1": {}\n')
+        self.collect_machine_logs.side_effect = [1, Exception('no route')]
+        self.assertEqual(
+            lc_collect.collect('mymodel', output=self.output, concurrency=2),
+            self.output)
+        self.check_output.assert_called_once_with(
+            ['juju', 'status', '-m', 'mymodel', '--format', 'yaml'])
+        self.collect_debug_log.assert_called_once_with(
+            'mymodel', mock.ANY, mock.ANY)
+        self.collect_machine_logs.assert_has_calls([
+            mock.call('mymodel', '0', mock.ANY, mock.ANY, paths=None,
+                      exclude_paths=None),
+            mock.call('mymodel', '1', mock.ANY, mock.ANY, paths=None,
+                      exclude_paths=None)])
+        self.assertEqual(self.read_tarball(), {
+            'juju-status.yaml': self.check_output.return_value})
+
+    def test_collect_debug_log(self):
+        self.patch_object(lc_collect.subprocess, 'check_call')
+        self.check_call.side_effect = lambda cmd, stdout: stdout.write(
+            b'debug log')
+        with tarfile.open(self.output, 'w:gz') as tar:
+            lc_collect.collect_debug_log('mymodel', tar, threading.Lock())
+        self.check_call.assert_called_once_with(
+            ['juju', 'debug-log', '-m', 'mymodel', '--replay', '--no-tail'],
+            stdout=mock.ANY)
+        self.assertEqual(self.read_tarball(), {'debug-log.txt': b'debug log'})
+
+    def test_parser(self):
+        args = lc_collect.parse_args(['-m', 'mymodel'])
+        self.assertEqual(args.model_name, 'mymodel')
+        self.assertIsNone(args.output)
+        self.assertIsNone(args.paths)
+        self.assertEqual(args.concurrency,
+                         lc_collect.DEFAULT_COLLECT_CONCURRENCY)
+        args = lc_collect.parse_args(
+            ['-m', 'mymodel', '-o', 'out.tar.gz', '-p', '/var/log/juju',
+             '-p', '/etc/nova', '-c', '2'])
+        self.assertEqual(args.output, 'out.tar.gz')
+        self.assertEqual(args.paths, ['/var/log/juju', '/etc/nova'])
+        self.assertEqual(args.concurrency, 2)
@@ -1,11 +1,71 @@
+import asyncio
+import threading
+import time
+
 import mock
 
 import zaza.charm_lifecycle.configure as lc_configure
+import zaza.charm_lifecycle.error_watcher as lc_error_watcher
 import unit_tests.utils as ut_utils
 
 
 class TestCharmLifecycleConfigure(ut_utils.BaseTestCase):
 
+    def test_get_configure_graph(self):
+        self.assertEqual(
+            lc_configure.get_configure_graph(
+                ['my.func1', 'my.func2', 'my.func1']),
+            [('my.func1', []),
+             ('my.func2', [0]),
+             ('my.func1', [0, 1])])
+        self.assertEqual(
+            lc_configure.get_configure_graph([
+                'my.func1',
+                {'my.func2': {'depends': []}},
+                {'my.func3': {'depends': 'my.func1'}},
+                'my.func4',
+                {'my.func5': None},
+                {'my.func6': {'depends': ['my.func2', 'my.func4']}},
+                'my.func1',
+                {'my.func7': {'depends': ['my.func1', 'my.func8']}},
+                {'my.func8': {'depends': []}}]),
+            [('my.func1', []),
+             ('my.func2', []),
+             ('my.func3', [0]),
+             ('my.func4', [0, 1, 2]),
+             ('my.func5', []),
+             ('my.func6', [1, 3]),
+             ('my.func1', [0, 1, 2, 3, 4, 5]),
+             ('my.func7', [6, 8]),
+             ('my.func8', [])])
+
+    def test_get_configure_graph_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'unknown function my.func3'):
+            lc_configure.get_configure_graph([
+                'my.func1',
+                {'my.func2': {'depends': ['my.func3']}}])
+        with self.assertRaisesRegex(ValueError, 'circular'):
+            lc_configure.get_configure_graph([
+                {'my.func1': {'depends': ['my.func2']}},
+                'my.func2'])
+
+    def test_run_configure_step(self):
+        self.patch_object(lc_configure.utils, 'get_class',
+                          return_value=mock.MagicMock())
+        self.patch_object(lc_configure.timing, 'record')
+        self.record.return_value = {'name': 'my.func1'}
+        self.assertEqual(lc_configure.run_configure_step('my.func1'),
+                         {'name': 'my.func1'})
+        self.get_class.assert_called_once_with('my.func1')
+        self.get_class.return_value.assert_called_once_with()
+        self.record.assert_called_once_with(
+            'configure_step', 'my.func1', mock.ANY, mock.ANY, 'pass')
+        self.get_class.return_value.side_effect = Exception('Failed')
+        with self.assertRaisesRegex(Exception, 'Failed'):
+            lc_configure.run_configure_step('my.func1')
+        self.record.assert_called_with(
+            'configure_step', 'my.func1', mock.ANY, mock.ANY, 'fail')
+
     def test_run_configure_list(self):
         self.patch_object(lc_configure.utils, 'get_class')
         self.get_class.side_effect = lambda x: x
@@ -15,15 +75,142 @@ class TestCharmLifecycleConfigure(ut_utils.BaseTestCase):
         self.assertTrue(mock1.called)
         self.assertTrue(mock2.called)
 
+    def test_run_configure_graph(self):
+        self.patch_object(lc_configure.utils, 'get_class')
+        order = []
+        # func1 and func2 only finish once both have started
+        both_started = threading.Barrier(2, timeout=5)
+
+        def _func(name):
+            def _run():
+                if name in ('func1', 'func2') and len(order) < 2:
+                    both_started.wait()
+                order.append(name)
+            return _run
+        self.get_class.side_effect = _func
+        lc_configure.run_configure_graph([
+            ('func1', []),
+            ('func2', []),
+            ('func3', [0, 1]),
+            ('func1', [2])])
+        self.assertEqual(sorted(order[:2]), ['func1', 'func2'])
+        self.assertEqual(order[2:], ['func3', 'func1'])
+
+    def test_run_configure_graph_failure(self):
+        self.patch_object(lc_configure.utils, 'get_class')
+        func3 = mock.MagicMock()
+
+        def _get_class(name):
+            if name == 'func1':
+                return mock.MagicMock(side_effect=Exception('func1 failed'))
+            return {'func2': mock.MagicMock(), 'func3': func3}[name]
+        self.get_class.side_effect = _get_class
+        with self.assertRaisesRegex(Exception, 'func1 failed'):
+            lc_configure.run_configure_graph([
+                ('func1', []),
+                ('func2', []),
+                ('func3', [0])])
+        self.assertFalse(func3.called)
+
+    def test_is_configure_chain(self):
+        self.assertTrue(lc_configure.is_configure_chain(
+            lc_configure.get_configure_graph(['func1', 'func2', 'func3'])))
+        self.assertFalse(lc_configure.is_configure_chain(
+            lc_configure.get_configure_graph([
+                'func1', {'func2': {'depends': []}}])))
+
+    def _get_watcher(self):
+        unit = mock.MagicMock(workload_status='active',
+                              agent_status='executing')
+        juju_model = mock.MagicMock()
+        juju_model.units = {'app/0': unit}
+
+        async def _get_model(model_name):
+            return juju_model
+
+        self.patch_object(lc_error_watcher.zaza.model, 'async_get_model',
+                          new=_get_model)
+        watcher = lc_error_watcher.ErrorWatcher('newmodel')
+        self.addCleanup(watcher.stop)
+        watcher.start()
+
+        def _unit_error():
+            unit.workload_status = 'error'
+            unit.workload_status_message = 'hook failed: "config-changed"'
+            on_change = juju_model.add_observer.call_args[0][0]
+            lc_configure.zaza.model.run(
+                on_change(None, None, None, juju_model))
+        return watcher, _unit_error
+
+    def _run_aborted(self, graph, functions):
+        self.patch_object(lc_configure.utils, 'get_class')
+        self.get_class.side_effect = lambda name: functions[name]
+        self.patch_object(lc_configure.zaza.model, 'CANCEL_CHECK_INTERVAL',
+                          new=0.01)
+        watcher, self.unit_error = self._get_watcher()
+        start = time.time()
+        with self.assertRaises(lc_error_watcher.PhaseAborted):
+            with watcher.phase('configure'):
+                lc_configure.run_configure_graph(graph)
+        self.assertLess(time.time() - start, 5)
+
+    def test_run_configure_graph_aborted(self):
+        stopped = []
+        both_started = threading.Barrier(2, timeout=5)
+
+        def _wait_for_model():
+            both_started.wait()
+            try:
+                lc_configure.zaza.model.run(asyncio.sleep(10))
+            finally:
+                stopped.append(threading.current_thread())
+
+        def _fail():
+            both_started.wait()
+            try:
+                self.unit_error()
+                lc_configure.zaza.model.run(asyncio.sleep(10))
+            finally:
+                stopped.append(threading.current_thread())
+
+        self._run_aborted(
+            [('func1', []), ('func2', [])],
+            {'func1': _fail, 'func2': _wait_for_model})
+        # Both running functions were stopped before the phase ended
+        self.assertEqual(len(stopped), 2)
+        self.assertNotIn(threading.current_thread(), stopped)
+
+    def test_run_configure_chain_aborted(self):
+        stopped = []
+        func3 = mock.MagicMock()
+
+        def _fail():
+            try:
+                self.unit_error()
+                time.sleep(10)
+            finally:
+                stopped.append(threading.current_thread())
+
+        self._run_aborted(
+            [('func1', []), ('func2', [0]), ('func3', [0, 1])],
+            {'func1': mock.MagicMock(), 'func2': _fail, 'func3': func3})
+        # The chain runs in the calling thread, which is interrupted
+        self.assertEqual(stopped, [threading.current_thread()])
+        self.assertFalse(func3.called)
+
     def test_configure(self):
         self.patch_object(lc_configure, 'run_configure_list')
         mock1 = mock.MagicMock()
         mock2 = mock.MagicMock()
         lc_configure.configure('modelname', [mock1, mock2])
-        self.run_configure_list.assert_called_once_with([mock1, mock2])
+        self.run_configure_list.assert_called_once_with(
+            [mock1, mock2], workers=lc_configure.DEFAULT_CONFIGURE_WORKERS)
 
     def test_parser(self):
         args = lc_configure.parse_args(
             ['-m', 'modelname', '-c', 'my.func1', 'my.func2'])
         self.assertEqual(args.configfuncs, ['my.func1', 'my.func2'])
         self.assertEqual(args.model_name, 'modelname')
+        self.assertEqual(args.workers, lc_configure.DEFAULT_CONFIGURE_WORKERS)
+        args = lc_configure.parse_args(['-m', 'modelname', '-w', '2'])
+        self.assertEqual(args.workers, 2)
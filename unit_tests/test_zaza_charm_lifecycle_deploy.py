@@ -1,5 +1,9 @@
+import asyncio
 import jinja2
 import mock
+import os
+import tempfile
+import yaml
 
 import zaza.charm_lifecycle.deploy as lc_deploy
 import unit_tests.utils as ut_utils
@@ -7,6 +11,11 @@ import unit_tests.utils as ut_utils
 
 class TestCharmLifecycleDeploy(ut_utils.BaseTestCase):
 
+    def setUp(self):
+        super(TestCharmLifecycleDeploy, self).setUp()
+        self.patch_object(lc_deploy, 'JINJA2_ENVS', new={})
+        self.patch_object(lc_deploy, 'RENDER_CACHE', new={})
+
     def test_is_valid_env_key(self):
         self.assertTrue(lc_deploy.is_valid_env_key('OS_VIP04'))
         self.assertTrue(lc_deploy.is_valid_env_key('FIP_RANGE'))
@@ -53,6 +62,26 @@ class TestCharmLifecycleDeploy(ut_utils.BaseTestCase):
                 'charm_location': '../../../mycharm',
                 'charm_name': 'mycharm'})
 
+    def test_get_template_overlay_context_cached(self):
+        self.patch_object(lc_deploy, 'get_template_context_from_env')
+        self.patch_object(lc_deploy, 'get_charm_config_context')
+        self.get_template_context_from_env.return_value = {}
+        self.get_charm_config_context.return_value = {
+            'charm_name': 'mycharm'}
+        lc_deploy.get_template_overlay_context()
+        hash1 = lc_deploy.get_template_overlay_context_hash()
+        self.assertEqual(
+            lc_deploy.get_template_overlay_context(),
+            {'charm_name': 'mycharm'})
+        self.assertEqual(lc_deploy.get_template_overlay_context_hash(), hash1)
+        self.get_charm_config_context.assert_called_once_with()
+        self.get_template_context_from_env.assert_called_once_with()
+        lc_deploy.reset_render_cache()
+        self.get_charm_config_context.return_value = {
+            'charm_name': 'othercharm'}
+        self.assertNotEqual(
+            lc_deploy.get_template_overlay_context_hash(), hash1)
+
     def test_get_overlay_template_dir(self):
         self.assertEqual(
             lc_deploy.get_overlay_template_dir(),
@@ -69,6 +98,13 @@ class TestCharmLifecycleDeploy(ut_utils.BaseTestCase):
             lc_deploy.get_jinja2_env(),
             jinja_env_mock)
         self.FileSystemLoader.assert_called_once_with('mytemplatedir')
+        # The environment is reused
+        self.assertEqual(
+            lc_deploy.get_jinja2_env(),
+            jinja_env_mock)
+        self.Environment.assert_called_once_with(
+            loader=self.FileSystemLoader.return_value,
+            bytecode_cache=mock.ANY)
 
     def test_get_template_name(self):
         self.assertEqual(
@@ -118,6 +154,47 @@ class TestCharmLifecycleDeploy(ut_utils.BaseTestCase):
         self.get_template.return_value = None
         self.assertIsNone(lc_deploy.render_overlay('mybundle.yaml', '/tmp/'))
 
+    def test_render_overlays_cached(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        template_dir = os.path.join(tmpdir.name, 'overlays')
+        os.mkdir(template_dir)
+        with open(os.path.join(template_dir, 'mybundle.yaml.j2'), 'w') as fh:
+            fh.write('vip: {{ OS_VIP00 }}\n')
+        self.patch_object(lc_deploy, 'get_overlay_template_dir')
+        self.get_overlay_template_dir.return_value = template_dir
+        self.patch_object(lc_deploy, 'get_overlay_cache_dir')
+        self.get_overlay_cache_dir.return_value = os.path.join(
+            tmpdir.name, 'cache')
+        self.patch_object(lc_deploy, 'get_template_context_from_env')
+        self.get_template_context_from_env.return_value = {
+            'OS_VIP00': '10.0.0.1'}
+        self.patch_object(lc_deploy, 'get_charm_config_context')
+        self.get_charm_config_context.return_value = {
+            'charm_name': 'mycharm',
+            'charm_location': '../../../mycharm'}
+        self.patch_object(lc_deploy, 'render_template',
+                          side_effect=lc_deploy.render_template)
+        local, overlay = lc_deploy.render_overlays('bundles/mybundle.yaml')
+        self.assertEqual(os.path.basename(local), 'local-charm-overlay.yaml')
+        self.assertEqual(os.path.basename(overlay), 'mybundle.yaml')
+        with open(overlay) as fh:
+            self.assertEqual(fh.read(), 'vip: 10.0.0.1')
+        with open(local) as fh:
+            self.assertIn('charm: ../../../mycharm', fh.read())
+        # Rendering again reuses the files
+        self.assertEqual(
+            lc_deploy.render_overlays('bundles/mybundle.yaml'),
+            [local, overlay])
+        self.assertEqual(self.render_template.call_count, 2)
+        # A change to the template renders a new file
+        with open(os.path.join(template_dir, 'mybundle.yaml.j2'), 'w') as fh:
+            fh.write('vip: {{ OS_VIP00 }}-new\n')
+        self.assertEqual(
+            lc_deploy.render_overlays('bundles/mybundle.yaml')[0], local)
+        self.assertNotEqual(
+            lc_deploy.render_overlays('bundles/mybundle.yaml')[1], overlay)
+
     def test_render_overlays(self):
         RESP = {
             'mybundles/mybundle.yaml': '/tmp/mybundle.yaml'}
@@ -139,6 +216,182 @@ class TestCharmLifecycleDeploy(ut_utils.BaseTestCase):
             lc_deploy.render_overlays('mybundles/mybundle.yaml', '/tmp'),
             ['/tmp/local.yaml'])
 
+    def test_merge_overlay(self):
+        bundle_data = {
+            'series': 'bionic',
+            'applications': {
+                'keystone': {
+                    'charm': 'cs:keystone',
+                    'num_units': 1,
+                    'options': {'debug': True, 'worker-multiplier': 0.25}},
+                'mysql': {'charm': 'cs:percona-cluster'},
+                'glance': {'charm': 'cs:glance'}},
+            'relations': [
+                ['keystone:shared-db', 'mysql:shared-db'],
+                ['glance:identity-service', 'keystone:identity-service']]}
+        lc_deploy.merge_overlay(bundle_data, {
+            'series': 'xenial',
+            'applications': {
+                'keystone': {
+                    'charm': '../../../keystone',
+                    'options': {'debug': False}},
+                'glance': None,
+                'vault': {'charm': 'cs:vault'}},
+            'relations': [
+                ['keystone:shared-db', 'mysql:shared-db'],
+                ['vault:certificates', 'keystone:certificates']]})
+        self.assertEqual(bundle_data, {
+            'series': 'xenial',
+            'applications': {
+                'keystone': {
+                    'charm': '../../../keystone',
+                    'num_units': 1,
+                    'options': {'debug': False, 'worker-multiplier': 0.25}},
+                'mysql': {'charm': 'cs:percona-cluster'},
+                'vault': {'charm': 'cs:vault'}},
+            'relations': [
+                ['keystone:shared-db', 'mysql:shared-db'],
+                ['vault:certificates', 'keystone:certificates']]})
+
+    def test_get_merged_bundle(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bundle_dir = os.path.join(tmpdir, 'tests', 'bundles')
+            os.makedirs(bundle_dir)
+            bundle = os.path.join(bundle_dir, 'base.yaml')
+            with open(bundle, 'w') as fh:
+                yaml.safe_dump({'services': {
+                    'mysql': {'charm': 'cs:percona-cluster'},
+                    'keystone': {'charm': 'cs:keystone'}}}, fh)
+            overlay = os.path.join(tmpdir, 'local-charm-overlay.yaml')
+            with open(overlay, 'w') as fh:
+                fh.write(lc_deploy.LOCAL_OVERLAY_TEMPLATE.replace(
+                    '{{ charm_name }}', 'keystone').replace(
+                        '{{ charm_location }}', '../../../keystone'))
+            bundle_data = lc_deploy.get_merged_bundle(bundle, [overlay])
+        self.assertEqual(bundle_data, {'services': {
+            'mysql': {'charm': 'cs:percona-cluster'},
+            'keystone': {'charm': os.path.join(os.path.dirname(tmpdir),
+                                               'keystone')}}})
+        self.assertEqual(lc_deploy.get_bundle_applications(bundle_data),
+                         ['keystone', 'mysql'])
+
+    def test_get_application_progress(self):
+        model = mock.MagicMock()
+        model.applications = {
+            'keystone': mock.MagicMock(units=[
+                mock.MagicMock(workload_status='active'),
+                mock.MagicMock(workload_status='waiting'),
+                mock.MagicMock(workload_status='active')]),
+            'mysql': mock.MagicMock(units=[])}
+        self.assertEqual(
+            lc_deploy.get_application_progress(model, 'keystone'),
+            '3 unit(s): 2 active, 1 waiting')
+        self.assertEqual(
+            lc_deploy.get_application_progress(model, 'mysql'),
+            '0 unit(s)')
+        self.assertEqual(
+            lc_deploy.get_application_progress(model, 'vault'),
+            'waiting to be added')
+
+    def test_deploy_bundle_native(self):
+        self.patch_object(lc_deploy.logging, 'info')
+        deployed = {}
+        model = mock.MagicMock()
+        model.applications = {}
+
+        async def _deploy(bundle_file):
+            with open(bundle_file) as fh:
+                deployed.update(yaml.safe_load(fh))
+            observer = model.add_observer.call_args[0][0]
+            model.applications['keystone'] = mock.MagicMock(units=[
+                mock.MagicMock(workload_status='maintenance')])
+            await observer(
+                mock.MagicMock(entity='unit',
+                               data={'application': 'keystone'}),
+                None, None, model)
+            model.applications['keystone'].units[0].workload_status = 'active'
+        model.deploy.side_effect = _deploy
+        self.patch_object(lc_deploy.zaza.model, 'run_in_model',
+                          return_value=ut_utils.ModelContext(model))
+        bundle_data = {'applications': {'keystone': {'charm': 'cs:keystone'}}}
+        lc_deploy.deploy_bundle_native('bun.yaml', 'newmodel', bundle_data)
+        self.run_in_model.assert_called_once_with('newmodel')
+        self.assertEqual(deployed, bundle_data)
+        self.info.assert_has_calls([
+            mock.call('keystone: 1 unit(s): 1 maintenance'),
+            mock.call('keystone: 1 unit(s): 1 active')])
+
+    def test_deploy_and_wait(self):
+        self.patch_object(lc_deploy, 'render_overlays', return_value=[])
+        self.patch_object(lc_deploy, 'get_merged_bundle',
+                          return_value={'applications': {'keystone': {}}})
+        self.patch_object(lc_deploy.timing, 'record')
+        calls = []
+
+        async def _deploy(bundle, model_name, bundle_data):
+            calls.append('deploy started')
+            await asyncio.sleep(0.01)
+            calls.append('deploy finished')
+
+        async def _wait(model_name, states, applications=None,
+                        deployed=None):
+            calls.append('wait started')
+            # The wait cannot finish until the deploy has
+            await deployed.wait()
+            calls.append('wait finished')
+        self.patch_object(lc_deploy, 'async_deploy_bundle_native',
+                          new=_deploy)
+        self.patch_object(lc_deploy.zaza.model,
+                          'async_wait_for_application_states', new=_wait)
+        lc_deploy.deploy_and_wait('bun.yaml', 'newmodel', {})
+        self.assertEqual(
+            calls,
+            ['deploy started', 'wait started', 'deploy finished',
+             'wait finished'])
+        self.assertEqual(
+            [c[0][0] for c in self.record.call_args_list],
+            ['deploy_bundle', 'deploy_wait'])
+
+    def test_deploy_and_wait_failure(self):
+        self.patch_object(lc_deploy, 'render_overlays', return_value=[])
+        self.patch_object(lc_deploy, 'get_merged_bundle',
+                          return_value={'applications': {'keystone': {}}})
+        cancelled = []
+
+        async def _deploy(bundle, model_name, bundle_data):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def _wait(model_name, states, applications=None,
+                        deployed=None):
+            raise lc_deploy.zaza.model.UnitError([])
+        self.patch_object(lc_deploy, 'async_deploy_bundle_native',
+                          new=_deploy)
+        self.patch_object(lc_deploy.zaza.model,
+                          'async_wait_for_application_states', new=_wait)
+        with self.assertRaises(lc_deploy.zaza.model.UnitError):
+            lc_deploy.deploy_and_wait('bun.yaml', 'newmodel', {})
+        self.assertEqual(cancelled, [True])
+
+    def test_deploy_native(self):
+        self.patch_object(lc_deploy.utils, 'get_charm_config')
+        self.get_charm_config.return_value = {
+            'target_deploy_status': {'vault': {'workload-status': 'blocked'}}}
+        self.patch_object(lc_deploy, 'deploy_bundle')
+        self.patch_object(lc_deploy, 'deploy_and_wait')
+        self.patch_object(lc_deploy, 'deploy_bundle_native')
+        lc_deploy.deploy('bun.yaml', 'newmodel', native=True)
+        self.deploy_and_wait.assert_called_once_with(
+            'bun.yaml', 'newmodel', {'vault': {'workload-status': 'blocked'}})
+        self.assertFalse(self.deploy_bundle.called)
+        lc_deploy.deploy('bun.yaml', 'newmodel', wait=False, native=True)
+        self.deploy_bundle_native.assert_called_once_with(
+            'bun.yaml', 'newmodel')
+        self.assertFalse(self.deploy_bundle.called)
+
     def test_deploy_bundle(self):
         self.patch_object(lc_deploy.utils, 'get_charm_config')
         self.get_charm_config.return_value = {}
@@ -191,6 +444,12 @@ class TestCharmLifecycleDeploy(ut_utils.BaseTestCase):
         self.assertEqual(args.model, 'mymodel')
         self.assertEqual(args.bundle, 'bun.yaml')
         self.assertTrue(args.wait)
+        self.assertFalse(args.native)
+        args = lc_deploy.parse_args([
+            '-m', 'mymodel',
+            '-b', 'bun.yaml',
+            '--native'])
+        self.assertTrue(args.native)
 
     def test_parser_nowait(self):
         args = lc_deploy.parse_args([
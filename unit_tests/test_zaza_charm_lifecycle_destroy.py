@@ -1,3 +1,5 @@
+import mock
+
 import zaza.charm_lifecycle.destroy as lc_destroy
 import unit_tests.utils as ut_utils
 
@@ -5,8 +7,10 @@ import unit_tests.utils as ut_utils
 class TestCharmLifecycleDestroy(ut_utils.BaseTestCase):
 
     def test_destroy_model(self):
+        self.patch_object(lc_destroy.zaza.model, 'disconnect_model')
         self.patch_object(lc_destroy.subprocess, 'check_call')
         lc_destroy.destroy_model('doomed')
+        self.disconnect_model.assert_called_once_with('doomed')
         self.check_call.assert_called_once_with(
             ['juju', 'destroy-model', '--yes', 'doomed'])
 
@@ -15,6 +19,44 @@ class TestCharmLifecycleDestroy(ut_utils.BaseTestCase):
         lc_destroy.destroy('doomed')
         self.destroy_model.assert_called_once_with('doomed')
 
+    def test_destroy_background(self):
+        self.patch_object(lc_destroy, 'destroy_model_in_background')
+        lc_destroy.destroy('doomed', background=True)
+        self.destroy_model_in_background.assert_called_once_with('doomed')
+
+    def test_destroy_model_in_background(self):
+        self.patch_object(lc_destroy, 'PENDING_DESTROYS', new={})
+        self.patch_object(lc_destroy.zaza.model, 'disconnect_model')
+        self.patch_object(lc_destroy.subprocess, 'Popen')
+        self.Popen.return_value = 'proc'
+        lc_destroy.destroy_model_in_background('doomed')
+        self.disconnect_model.assert_called_once_with('doomed')
+        self.Popen.assert_called_once_with(
+            ['juju', 'destroy-model', '--yes', 'doomed'])
+        self.assertEqual(lc_destroy.PENDING_DESTROYS, {'doomed': 'proc'})
+
+    def test_wait_for_background_destroys(self):
+        self.patch_object(lc_destroy, 'PENDING_DESTROYS', new={})
+        done = mock.MagicMock()
+        done.wait.return_value = 0
+        failed = mock.MagicMock()
+        failed.wait.return_value = 1
+        stuck = mock.MagicMock()
+        stuck.wait.side_effect = lc_destroy.subprocess.TimeoutExpired(
+            'juju', 10)
+        lc_destroy.PENDING_DESTROYS.update({
+            'done': done,
+            'failed': failed,
+            'stuck': stuck})
+        self.assertEqual(
+            lc_destroy.wait_for_background_destroys(timeout=10),
+            ['failed', 'stuck'])
+        self.assertEqual(lc_destroy.PENDING_DESTROYS, {})
+
+    def test_wait_for_background_destroys_none(self):
+        self.patch_object(lc_destroy, 'PENDING_DESTROYS', new={})
+        self.assertEqual(lc_destroy.wait_for_background_destroys(), [])
+
     def test_parser(self):
         args = lc_destroy.parse_args(['-m', 'doomed'])
         self.assertEqual(args.model_name, 'doomed')
@@ -0,0 +1,112 @@
+import signal
+import time
+
+import mock
+
+import zaza.charm_lifecycle.error_watcher as lc_error_watcher
+import unit_tests.utils as ut_utils
+
+
+class TestCharmLifecycleErrorWatcher(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCharmLifecycleErrorWatcher, self).setUp()
+        self.unit = mock.MagicMock()
+        self.unit.workload_status = 'maintenance'
+        self.unit.agent_status = 'executing'
+        self.juju_model = mock.MagicMock()
+        self.juju_model.units = {'app/0': self.unit}
+
+        async def _get_model(model_name):
+            return self.juju_model
+
+        self.patch_object(lc_error_watcher.zaza.model, 'async_get_model',
+                          new=_get_model)
+        self.watcher = lc_error_watcher.ErrorWatcher('newmodel')
+        self.addCleanup(self.watcher.stop)
+
+    def unit_changed(self):
+        on_change = self.juju_model.add_observer.call_args[0][0]
+        lc_error_watcher.zaza.model.run(
+            on_change(None, None, None, self.juju_model))
+
+    def test_phase(self):
+        self.watcher.start()
+        self.juju_model.add_observer.assert_called_once_with(
+            mock.ANY, entity_type='unit')
+        with self.watcher.phase('deploy'):
+            self.unit_changed()
+        self.assertEqual(self.watcher.errors, {})
+
+    def test_phase_aborted(self):
+        self.watcher.start()
+        with self.assertRaises(lc_error_watcher.PhaseAborted) as context:
+            with self.watcher.phase('configure'):
+                self.unit.workload_status = 'error'
+                self.unit.workload_status_message = 'hook failed: "install"'
+                self.unit_changed()
+                # The phase is interrupted rather than left to finish
+                time.sleep(10)
+        self.assertEqual(context.exception.phase, 'configure')
+        self.assertEqual(
+            str(context.exception),
+            'Aborted configure phase, unit(s) in error state: app/0 '
+            '(workload error: hook failed: "install")')
+
+    def test_error_between_phases(self):
+        self.watcher.start()
+        self.unit.agent_status = 'error'
+        self.unit.agent_status_message = 'lost'
+        self.unit_changed()
+        with self.assertRaises(lc_error_watcher.PhaseAborted) as context:
+            with self.watcher.phase('test'):
+                self.fail('Phase should not run')
+        self.assertEqual(context.exception.errors,
+                         {'app/0': 'agent error: lost'})
+
+    def test_interrupt_as_phase_ends(self):
+        watcher = self.watcher
+
+        class _SignalOnEnter(object):
+            # Delivers the signal as the phase takes the lock to end
+            def __init__(self, lock):
+                self.lock = lock
+
+            def __enter__(self):
+                self.lock.__enter__()
+                watcher._lock = self.lock
+                watcher._on_signal(lc_error_watcher.ABORT_SIGNAL, None)
+
+            def __exit__(self, *args):
+                return self.lock.__exit__(*args)
+
+        self.watcher.start()
+        with self.assertRaises(lc_error_watcher.PhaseAborted):
+            with self.watcher.phase('configure'):
+                self.watcher._lock = _SignalOnEnter(self.watcher._lock)
+        self.assertIsNone(self.watcher.phase_name)
+        # Once the phase has ended the signal is ignored
+        self.watcher._on_signal(lc_error_watcher.ABORT_SIGNAL, None)
+
+    def test_abort_deferred(self):
+        self.watcher.start()
+        finished = []
+        with self.assertRaises(lc_error_watcher.PhaseAborted):
+            with self.watcher.phase('configure'):
+                with lc_error_watcher.abort_deferred():
+                    self.unit.workload_status = 'error'
+                    self.unit_changed()
+                    time.sleep(0.1)
+                    finished.append('deferred')
+                self.fail('Abort should be raised as the block ends')
+        self.assertEqual(finished, ['deferred'])
+
+    def test_stop(self):
+        previous = signal.getsignal(lc_error_watcher.ABORT_SIGNAL)
+        self.watcher.start()
+        self.watcher.stop()
+        self.assertEqual(signal.getsignal(lc_error_watcher.ABORT_SIGNAL),
+                         previous)
+        self.unit.workload_status = 'error'
+        self.unit_changed()
+        self.assertEqual(self.watcher.errors, {})
@@ -6,6 +6,13 @@ import unit_tests.utils as ut_utils
 
 class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
 
+    def setUp(self):
+        super(TestCharmLifecycleFuncTestRunner, self).setUp()
+        self.patch_object(lc_func_test_runner.error_watcher, 'ErrorWatcher',
+                          return_value=mock.MagicMock())
+        self.patch_object(lc_func_test_runner.checkpoint, 'save')
+        self.patch_object(lc_func_test_runner.checkpoint, 'clear')
+
     def test_generate_model_name(self):
         self.patch_object(lc_func_test_runner.uuid, "uuid4")
         self.uuid4.return_value = "longer-than-12characters"
@@ -18,6 +25,15 @@ class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
         self.assertFalse(args.keep_model)
         self.assertFalse(args.smoke)
         self.assertIsNone(args.bundle)
+        self.assertEqual(args.parallel, 1)
+        self.assertFalse(args.background_destroy)
+        self.assertIsNone(args.timing_report)
+        self.assertEqual(args.model_pool_size, 0)
+        self.assertFalse(args.resume)
+        self.assertFalse(args.keep_failed_model)
+        self.assertFalse(args.reuse_model)
+        self.assertIsNone(args.junit_xml)
+        self.assertIsNone(args.json_summary)
         # Test flags
         args = lc_func_test_runner.parse_args(['--keep-model'])
         self.assertTrue(args.keep_model)
@@ -25,6 +41,25 @@ class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
         self.assertTrue(args.smoke)
         args = lc_func_test_runner.parse_args(['--bundle', 'mybundle'])
         self.assertEqual(args.bundle, 'mybundle')
+        args = lc_func_test_runner.parse_args(['--parallel', '3'])
+        self.assertEqual(args.parallel, 3)
+        args = lc_func_test_runner.parse_args(['--background-destroy'])
+        self.assertTrue(args.background_destroy)
+        args = lc_func_test_runner.parse_args(
+            ['--timing-report', 'timing.jsonl'])
+        self.assertEqual(args.timing_report, 'timing.jsonl')
+        args = lc_func_test_runner.parse_args(['--model-pool', '2'])
+        self.assertEqual(args.model_pool_size, 2)
+        args = lc_func_test_runner.parse_args(
+            ['--resume', '--keep-failed-model'])
+        self.assertTrue(args.resume)
+        self.assertTrue(args.keep_failed_model)
+        args = lc_func_test_runner.parse_args(['--reuse-model'])
+        self.assertTrue(args.reuse_model)
+        args = lc_func_test_runner.parse_args(
+            ['--junit-xml', 'results.xml', '--json-summary', 'results.json'])
+        self.assertEqual(args.junit_xml, 'results.xml')
+        self.assertEqual(args.json_summary, 'results.json')
 
     def test_func_test_runner(self):
         self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
@@ -49,8 +84,10 @@ class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
             mock.call('newmodel'),
             mock.call('newmodel')]
         deploy_calls = [
-            mock.call('./tests/bundles/bundle1.yaml', 'newmodel'),
-            mock.call('./tests/bundles/bundle2.yaml', 'newmodel')]
+            mock.call('./tests/bundles/bundle1.yaml', 'newmodel',
+                      native=False),
+            mock.call('./tests/bundles/bundle2.yaml', 'newmodel',
+                      native=False)]
         configure_calls = [
             mock.call('newmodel', [
                 'zaza.charm_tests.mycharm.setup.basic_setup'
@@ -61,10 +98,12 @@ class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
         test_calls = [
             mock.call('newmodel', [
                 'zaza.charm_tests.mycharm.tests.SmokeTest',
-                'zaza.charm_tests.mycharm.tests.ComplexTest']),
+                'zaza.charm_tests.mycharm.tests.ComplexTest'],
+                workers=1, junit_xml=None, json_summary=None),
             mock.call('newmodel', [
                 'zaza.charm_tests.mycharm.tests.SmokeTest',
-                'zaza.charm_tests.mycharm.tests.ComplexTest'])]
+                'zaza.charm_tests.mycharm.tests.ComplexTest'],
+                workers=1, junit_xml=None, json_summary=None)]
         destroy_calls = [
             mock.call('newmodel'),
             mock.call('newmodel')]
@@ -95,7 +134,8 @@ class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
                 'zaza.charm_tests.mycharm.tests.ComplexTest']}
         lc_func_test_runner.func_test_runner(smoke=True)
         deploy_calls = [
-            mock.call('./tests/bundles/bundle2.yaml', 'newmodel')]
+            mock.call('./tests/bundles/bundle2.yaml', 'newmodel',
+                      native=False)]
         self.deploy.assert_has_calls(deploy_calls)
 
     def test_func_test_runner_specify_bundle(self):
@@ -119,5 +159,417 @@ class TestCharmLifecycleFuncTestRunner(ut_utils.BaseTestCase):
                 'zaza.charm_tests.mycharm.tests.ComplexTest']}
         lc_func_test_runner.func_test_runner(bundle='maveric-filebeat')
         deploy_calls = [
-            mock.call('./tests/bundles/maveric-filebeat.yaml', 'newmodel')]
+            mock.call('./tests/bundles/maveric-filebeat.yaml', 'newmodel',
+                      native=False)]
         self.deploy.assert_has_calls(deploy_calls)
+
+    def test_func_test_runner_background_destroy(self):
+        self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.patch_object(
+            lc_func_test_runner.destroy, 'wait_for_background_destroys')
+        self.generate_model_name.side_effect = ['model1', 'model2']
+        self.get_charm_config.return_value = {
+            'charm_name': 'mycharm',
+            'gate_bundles': ['bundle1', 'bundle2'],
+            'configure': [],
+            'tests': []}
+        lc_func_test_runner.func_test_runner(background_destroy=True)
+        self.destroy.assert_has_calls([
+            mock.call('model1', background=True),
+            mock.call('model2', background=True)])
+        self.wait_for_background_destroys.assert_called_once_with()
+
+    def test_func_test_runner_background_destroy_failure(self):
+        self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.collect, 'collect')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.patch_object(
+            lc_func_test_runner.destroy, 'wait_for_background_destroys')
+        self.generate_model_name.side_effect = ['model1', 'model2']
+        self.deploy.side_effect = [None, Exception('boom')]
+        self.get_charm_config.return_value = {
+            'charm_name': 'mycharm',
+            'gate_bundles': ['bundle1', 'bundle2'],
+            'configure': [],
+            'tests': []}
+        with self.assertRaises(Exception):
+            lc_func_test_runner.func_test_runner(background_destroy=True)
+        self.collect.assert_called_once_with('model2')
+        self.destroy.assert_has_calls([
+            mock.call('model1', background=True),
+            mock.call('model2', background=True)])
+        self.wait_for_background_destroys.assert_called_once_with()
+
+    def test_func_test_runner_reuse_model(self):
+        self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner, 'run_bundle')
+        self.patch_object(lc_func_test_runner.redeploy, 'can_redeploy',
+                          return_value=True)
+        self.generate_model_name.return_value = 'newmodel'
+        test_config = {
+            'charm_name': 'mycharm',
+            'gate_bundles': ['bundle1', 'bundle2', 'bundle3'],
+            'configure': [],
+            'tests': []}
+        self.get_charm_config.return_value = test_config
+        lc_func_test_runner.func_test_runner(reuse_model=True)
+        self.generate_model_name.assert_called_once_with()
+        self.can_redeploy.assert_has_calls([
+            mock.call('./tests/bundles/bundle2.yaml', 'newmodel'),
+            mock.call('./tests/bundles/bundle3.yaml', 'newmodel')])
+        self.run_bundle.assert_has_calls([
+            mock.call('newmodel', 'bundle1', test_config,
+                      destroy_model=False, background_destroy=False,
+                      leased_model=False, completed_phases=[],
+                      keep_failed_model=False, reuse_model=False,
+                      junit_xml=None, json_summary=None),
+            mock.call('newmodel', 'bundle2', test_config,
+                      destroy_model=False, background_destroy=False,
+                      leased_model=False, completed_phases=[],
+                      keep_failed_model=False, reuse_model=True,
+                      junit_xml=None, json_summary=None),
+            mock.call('newmodel', 'bundle3', test_config,
+                      destroy_model=True, background_destroy=False,
+                      leased_model=False, completed_phases=[],
+                      keep_failed_model=False, reuse_model=True,
+                      junit_xml=None, json_summary=None)])
+
+    def test_func_test_runner_reuse_model_fallback(self):
+        self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner, 'run_bundle')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.patch_object(lc_func_test_runner.redeploy, 'can_redeploy',
+                          return_value=False)
+        self.generate_model_name.side_effect = ['model1', 'model2']
+        test_config = {
+            'charm_name': 'mycharm',
+            'gate_bundles': ['bundle1', 'bundle2'],
+            'configure': [],
+            'tests': []}
+        self.get_charm_config.return_value = test_config
+        lc_func_test_runner.func_test_runner(reuse_model=True)
+        # bundle2 cannot be applied over model1 so gets a model of its own
+        self.destroy.assert_called_once_with('model1', background=False)
+        self.run_bundle.assert_has_calls([
+            mock.call('model1', 'bundle1', test_config,
+                      destroy_model=False, background_destroy=False,
+                      leased_model=False, completed_phases=[],
+                      keep_failed_model=False, reuse_model=False,
+                      junit_xml=None, json_summary=None),
+            mock.call('model2', 'bundle2', test_config,
+                      destroy_model=True, background_destroy=False,
+                      leased_model=False, completed_phases=[],
+                      keep_failed_model=False, reuse_model=False,
+                      junit_xml=None, json_summary=None)])
+
+    def test_func_test_runner_reuse_model_failure(self):
+        self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner, 'run_bundle')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.generate_model_name.return_value = 'newmodel'
+        self.get_charm_config.return_value = {
+            'charm_name': 'mycharm',
+            'gate_bundles': ['bundle1', 'bundle2'],
+            'configure': [],
+            'tests': []}
+        self.run_bundle.side_effect = Exception('Deploy failed')
+        with self.assertRaisesRegex(Exception, 'Deploy failed'):
+            lc_func_test_runner.func_test_runner(reuse_model=True)
+        self.assertEqual(self.run_bundle.call_count, 1)
+        # The model kept for the next bundle is not left behind
+        self.destroy.assert_called_once_with('newmodel')
+
+    def test_run_bundle_reuse_model(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.redeploy, 'redeploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        lc_func_test_runner.run_bundle(
+            'newmodel', 'bundle2', {'configure': [], 'tests': []},
+            destroy_model=False, reuse_model=True)
+        self.assertFalse(self.prepare.called)
+        self.assertFalse(self.deploy.called)
+        self.redeploy.assert_called_once_with(
+            './tests/bundles/bundle2.yaml', 'newmodel')
+        self.assertTrue(self.test.called)
+        self.assertFalse(self.destroy.called)
+
+    def test_get_bundle_report_file(self):
+        self.assertEqual(
+            lc_func_test_runner.get_bundle_report_file(
+                'results/junit.xml', 'bundle1'),
+            'results/junit-bundle1.xml')
+        self.assertEqual(
+            lc_func_test_runner.get_bundle_report_file('summary', 'bundle1'),
+            'summary-bundle1')
+        self.assertIsNone(
+            lc_func_test_runner.get_bundle_report_file(None, 'bundle1'))
+
+    def test_run_bundle_reports(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        lc_func_test_runner.run_bundle(
+            'newmodel', 'bundle1', {'configure': [], 'tests': ['t.Test1']},
+            junit_xml='results.xml', json_summary='results.json')
+        self.test.assert_called_once_with(
+            'newmodel', ['t.Test1'], workers=1,
+            junit_xml='results-bundle1.xml',
+            json_summary='results-bundle1.json')
+
+    def test_func_test_runner_parallel(self):
+        self.patch_object(lc_func_test_runner.utils, 'get_charm_config')
+        self.patch_object(lc_func_test_runner, 'run_bundles_in_parallel')
+        test_config = {
+            'charm_name': 'mycharm',
+            'gate_bundles': ['bundle1', 'bundle2'],
+            'configure': [],
+            'tests': []}
+        self.get_charm_config.return_value = test_config
+        lc_func_test_runner.func_test_runner(keep_model=True, parallel=2,
+                                             background_destroy=True)
+        self.run_bundles_in_parallel.assert_called_once_with(
+            [('bundle1', test_config, True),
+             ('bundle2', test_config, False)],
+            2,
+            model_pool_size=0,
+            resume=False,
+            keep_failed_model=False,
+            junit_xml=None,
+            json_summary=None,
+            background_destroy=True)
+
+    def test_get_model_name(self):
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner.model_pool, 'lease_model')
+        self.generate_model_name.return_value = 'newmodel'
+        self.assertEqual(lc_func_test_runner.get_model_name(),
+                         ('newmodel', False))
+        self.assertFalse(self.lease_model.called)
+        self.assertEqual(lc_func_test_runner.get_model_name(2),
+                         ('newmodel', False))
+        self.lease_model.assert_called_once_with(size=2)
+        self.lease_model.return_value = 'zaza-pool-123'
+        self.assertEqual(lc_func_test_runner.get_model_name(2),
+                         ('zaza-pool-123', True))
+
+    def test_run_bundle_leased_model(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.patch_object(lc_func_test_runner.model_pool, 'release_model')
+        lc_func_test_runner.run_bundle(
+            'zaza-pool-123', 'bundle1',
+            {'configure': [], 'tests': [], 'native_deploy': True},
+            leased_model=True)
+        self.assertFalse(self.prepare.called)
+        self.deploy.assert_called_once_with(
+            './tests/bundles/bundle1.yaml', 'zaza-pool-123', native=True)
+        self.destroy.assert_called_once_with('zaza-pool-123')
+        self.release_model.assert_called_once_with('zaza-pool-123')
+
+    def test_run_bundle_failure(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.collect, 'collect')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.test.side_effect = Exception('Test failed')
+        self.collect.side_effect = Exception('Collect failed')
+        with self.assertRaisesRegex(Exception, 'Test failed'):
+            lc_func_test_runner.run_bundle(
+                'newmodel', 'bundle1', {'configure': [], 'tests': []})
+        self.collect.assert_called_once_with('newmodel')
+        self.destroy.assert_called_once_with('newmodel')
+
+    def test_run_bundle_aborted(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.collect, 'collect')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        watcher = self.ErrorWatcher.return_value
+        watcher.phase.return_value.__exit__.side_effect = [
+            None,
+            lc_func_test_runner.error_watcher.PhaseAborted(
+                'configure', {'app/0': 'workload error: hook failed'})]
+        with self.assertRaises(lc_func_test_runner.error_watcher.PhaseAborted):
+            lc_func_test_runner.run_bundle(
+                'newmodel', 'bundle1', {'configure': [], 'tests': []})
+        self.ErrorWatcher.assert_called_once_with('newmodel')
+        watcher.start.assert_called_once_with()
+        watcher.phase.assert_has_calls([
+            mock.call('deploy'), mock.call('configure')], any_order=True)
+        self.assertFalse(self.test.called)
+        self.collect.assert_called_once_with('newmodel')
+        self.destroy.assert_called_once_with('newmodel')
+        self.assertTrue(watcher.stop.called)
+
+    def test_run_bundle_checkpoints(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        phases = []
+        self.save.side_effect = lambda b, m, p, **kw: phases.append(list(p))
+        lc_func_test_runner.run_bundle(
+            'newmodel', 'bundle1', {'configure': [], 'tests': []})
+        self.assertEqual(phases, [
+            ['prepare'],
+            ['prepare', 'deploy'],
+            ['prepare', 'deploy', 'configure'],
+            ['prepare', 'deploy', 'configure', 'test']])
+        self.save.assert_called_with('bundle1', 'newmodel', mock.ANY,
+                                     leased_model=False)
+        self.clear.assert_called_once_with('bundle1')
+
+    def test_run_bundle_resume(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        lc_func_test_runner.run_bundle(
+            'oldmodel', 'bundle1',
+            {'configure': ['conf.f1'], 'tests': [], 'test_workers': 3},
+            completed_phases=['prepare', 'deploy'])
+        self.assertFalse(self.prepare.called)
+        self.assertFalse(self.deploy.called)
+        self.configure.assert_called_once_with('oldmodel', ['conf.f1'])
+        self.test.assert_called_once_with('oldmodel', [], workers=3,
+                                          junit_xml=None, json_summary=None)
+        self.save.assert_called_with(
+            'bundle1', 'oldmodel', ['prepare', 'deploy', 'configure', 'test'],
+            leased_model=False)
+        self.destroy.assert_called_once_with('oldmodel')
+        self.clear.assert_called_once_with('bundle1')
+
+    def test_run_bundle_keep_failed_model(self):
+        self.patch_object(lc_func_test_runner.prepare, 'prepare')
+        self.patch_object(lc_func_test_runner.deploy, 'deploy')
+        self.patch_object(lc_func_test_runner.configure, 'configure')
+        self.patch_object(lc_func_test_runner.test, 'test')
+        self.patch_object(lc_func_test_runner.collect, 'collect')
+        self.patch_object(lc_func_test_runner.destroy, 'destroy')
+        self.patch_object(lc_func_test_runner.model_pool, 'release_model')
+        self.configure.side_effect = Exception('Configure failed')
+        with self.assertRaisesRegex(Exception, 'Configure failed'):
+            lc_func_test_runner.run_bundle(
+                'zaza-pool-123', 'bundle1', {'configure': [], 'tests': []},
+                leased_model=True, keep_failed_model=True)
+        self.save.assert_called_with(
+            'bundle1', 'zaza-pool-123', ['prepare', 'deploy'],
+            leased_model=True)
+        self.collect.assert_called_once_with('zaza-pool-123')
+        self.assertFalse(self.destroy.called)
+        self.assertFalse(self.release_model.called)
+        self.assertFalse(self.clear.called)
+
+    def test_get_bundle_model(self):
+        self.patch_object(lc_func_test_runner, 'get_model_name',
+                          return_value=('newmodel', False))
+        self.patch_object(lc_func_test_runner.checkpoint, 'get_resume_point')
+        self.assertEqual(
+            lc_func_test_runner.get_bundle_model('bundle1'),
+            ('newmodel', False, []))
+        self.assertFalse(self.get_resume_point.called)
+        self.assertEqual(
+            lc_func_test_runner.get_bundle_model('bundle1', resume=True),
+            ('newmodel', False, []))
+        self.get_resume_point.return_value = {
+            'model_name': 'oldmodel',
+            'phases': ['prepare', 'deploy'],
+            'leased_model': False}
+        self.assertEqual(
+            lc_func_test_runner.get_bundle_model('bundle1', 2, resume=True),
+            ('oldmodel', False, ['prepare', 'deploy']))
+        self.get_resume_point.assert_called_with('bundle1')
+        self.assertEqual(self.get_model_name.call_count, 2)
+
+    def test_run_bundle_worker(self):
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner, 'run_bundle')
+        self.patch_object(lc_func_test_runner.logging, 'basicConfig')
+        self.patch_object(lc_func_test_runner.zaza.model,
+                          'shutdown')
+        self.generate_model_name.return_value = 'newmodel'
+        self.assertEqual(
+            lc_func_test_runner.run_bundle_worker(('bundle1', {}, True)),
+            ('bundle1', 'newmodel', None))
+        self.run_bundle.assert_called_once_with(
+            'newmodel', 'bundle1', {}, destroy_model=True,
+            background_destroy=False, leased_model=False,
+            completed_phases=[], keep_failed_model=False,
+            junit_xml=None, json_summary=None)
+        self.shutdown.assert_called_once_with()
+        self.run_bundle.side_effect = Exception('Test run failed')
+        self.assertEqual(
+            lc_func_test_runner.run_bundle_worker(('bundle1', {}, True)),
+            ('bundle1', 'newmodel', 'Test run failed'))
+
+    def test_run_bundle_worker_background_destroy(self):
+        self.patch_object(lc_func_test_runner, 'generate_model_name')
+        self.patch_object(lc_func_test_runner, 'run_bundle')
+        self.patch_object(lc_func_test_runner.logging, 'basicConfig')
+        self.patch_object(lc_func_test_runner.zaza.model, 'shutdown')
+        self.patch_object(lc_func_test_runner.destroy,
+                          'wait_for_background_destroys')
+        self.generate_model_name.return_value = 'newmodel'
+        self.run_bundle.side_effect = Exception('Test run failed')
+        lc_func_test_runner.run_bundle_worker(('bundle1', {}, True),
+                                              background_destroy=True)
+        self.assertTrue(
+            self.run_bundle.call_args[1]['background_destroy'])
+        # The worker does not return until its model is destroyed
+        self.wait_for_background_destroys.assert_called_once_with()
+
+    def test_run_bundles_in_parallel(self):
+        self.patch_object(lc_func_test_runner.multiprocessing, 'get_context')
+        context = mock.MagicMock()
+        pool = mock.MagicMock()
+        self.get_context.return_value = context
+        context.Pool.return_value = pool
+        pool.imap_unordered.return_value = [
+            ('bundle2', 'model2', None),
+            ('bundle1', 'model1', None)]
+        lc_func_test_runner.run_bundles_in_parallel(['job1', 'job2'], 2)
+        self.get_context.assert_called_once_with('spawn')
+        context.Pool.assert_called_once_with(
+            processes=2, maxtasksperchild=1)
+        worker, jobs = pool.imap_unordered.call_args[0]
+        self.assertEqual(worker.func, lc_func_test_runner.run_bundle_worker)
+        self.assertEqual(worker.keywords, {'model_pool_size': 0,
+                                           'resume': False,
+                                           'keep_failed_model': False,
+                                           'junit_xml': None,
+                                           'json_summary': None,
+                                           'background_destroy': False})
+        self.assertEqual(jobs, ['job1', 'job2'])
+        pool.imap_unordered.return_value = [
+            ('bundle2', 'model2', 'Test run failed'),
+            ('bundle1', 'model1', None)]
+        with self.assertRaises(Exception):
+            lc_func_test_runner.run_bundles_in_parallel(['job1', 'job2'], 2)
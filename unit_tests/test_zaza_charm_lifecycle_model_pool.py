@@ -0,0 +1,122 @@
+import os
+import tempfile
+
+import zaza.charm_lifecycle.model_pool as lc_model_pool
+import unit_tests.utils as ut_utils
+
+
+class TestCharmLifecycleModelPool(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCharmLifecycleModelPool, self).setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patch_object(lc_model_pool.os, 'environ', new={
+            lc_model_pool.STATE_FILE_ENV: os.path.join(
+                self.tmpdir.name, 'pool', 'state.json')})
+        self.patch_object(lc_model_pool.prepare, 'add_model')
+        self.patch_object(lc_model_pool.destroy, 'destroy_model')
+        self.patch_object(lc_model_pool, 'generate_pool_model_name')
+        self.patch_object(lc_model_pool, 'TOP_UP_THREADS', new=[])
+        self.patch_object(lc_model_pool.subprocess, 'check_output',
+                          return_value=b'ctrl1:admin/default\n')
+        self.patch_object(lc_model_pool.time, 'time')
+        self.time.return_value = 1000
+        self.generate_pool_model_name.side_effect = [
+            'zaza-pool-{}'.format(i) for i in range(10)]
+
+    def tearDown(self):
+        super(TestCharmLifecycleModelPool, self).tearDown()
+        self.tmpdir.cleanup()
+
+    def get_states(self):
+        with lc_model_pool.locked_state() as models:
+            return {k: v['state'] for k, v in models.items()}
+
+    def test_top_up(self):
+        self.assertEqual(lc_model_pool.top_up(size=2),
+                         ['zaza-pool-0', 'zaza-pool-1'])
+        self.add_model.assert_any_call('zaza-pool-0', switch=False)
+        self.add_model.assert_any_call('zaza-pool-1', switch=False)
+        self.assertEqual(self.get_states(), {
+            'zaza-pool-0': 'ready',
+            'zaza-pool-1': 'ready'})
+        # The pool is full so nothing more is added
+        self.assertEqual(lc_model_pool.top_up(size=2), [])
+
+    def test_top_up_failure(self):
+        self.add_model.side_effect = [Exception('no'), None]
+        self.assertEqual(lc_model_pool.top_up(size=2), ['zaza-pool-1'])
+        self.assertEqual(self.get_states(), {'zaza-pool-1': 'ready'})
+
+    def test_lease_model(self):
+        self.patch_object(lc_model_pool, 'top_up_in_background')
+        self.assertIsNone(lc_model_pool.lease_model(size=2))
+        self.top_up_in_background.assert_called_once_with(2)
+        lc_model_pool.top_up(size=2)
+        self.assertEqual(lc_model_pool.lease_model(size=2), 'zaza-pool-0')
+        self.assertEqual(self.get_states(), {
+            'zaza-pool-0': 'leased',
+            'zaza-pool-1': 'ready'})
+        lc_model_pool.release_model('zaza-pool-0')
+        self.assertEqual(self.get_states(), {'zaza-pool-1': 'ready'})
+
+    def test_top_up_in_background(self):
+        lc_model_pool.top_up_in_background(size=1)
+        lc_model_pool.wait_for_top_up()
+        self.assertEqual(self.get_states(), {'zaza-pool-0': 'ready'})
+        self.assertEqual(lc_model_pool.TOP_UP_THREADS, [])
+
+    def test_collect_leaked_models(self):
+        self.patch_object(lc_model_pool, 'top_up_in_background')
+        lc_model_pool.top_up(size=3)
+        lc_model_pool.lease_model()
+        self.time.return_value = 1000 + lc_model_pool.DEFAULT_MAX_AGE + 1
+        lc_model_pool.lease_model()
+        self.assertEqual(lc_model_pool.collect_leaked_models(),
+                         ['zaza-pool-0'])
+        self.destroy_model.assert_called_once_with('zaza-pool-0')
+        self.assertEqual(self.get_states(), {
+            'zaza-pool-1': 'leased',
+            'zaza-pool-2': 'ready'})
+
+    def test_drain(self):
+        self.patch_object(lc_model_pool, 'top_up_in_background')
+        lc_model_pool.top_up(size=2)
+        lc_model_pool.lease_model()
+        self.assertEqual(lc_model_pool.drain(), ['zaza-pool-1'])
+        self.destroy_model.assert_called_once_with('zaza-pool-1')
+        self.assertEqual(self.get_states(), {'zaza-pool-0': 'leased'})
+
+    def test_get_controller(self):
+        self.assertEqual(lc_model_pool.get_controller(), 'ctrl1')
+        self.check_output.assert_called_once_with(['juju', 'switch'])
+
+    def test_other_controller(self):
+        self.patch_object(lc_model_pool, 'top_up_in_background')
+        lc_model_pool.top_up(size=2)
+        lc_model_pool.lease_model()
+        self.time.return_value = 1000 + lc_model_pool.DEFAULT_MAX_AGE + 1
+        self.check_output.return_value = b'ctrl2:admin/default\n'
+        # The models of ctrl1 are not leased, counted, collected or drained
+        self.assertIsNone(lc_model_pool.lease_model())
+        self.assertEqual(lc_model_pool.collect_leaked_models(), [])
+        self.assertEqual(lc_model_pool.drain(), [])
+        self.assertEqual(lc_model_pool.top_up(size=1), ['zaza-pool-2'])
+        self.assertFalse(self.destroy_model.called)
+        with lc_model_pool.locked_state() as models:
+            self.assertEqual(
+                {k: (v['state'], v['controller']) for k, v in models.items()},
+                {'zaza-pool-0': ('leased', 'ctrl1'),
+                 'zaza-pool-1': ('ready', 'ctrl1'),
+                 'zaza-pool-2': ('ready', 'ctrl2')})
+
+    def test_parser(self):
+        args = lc_model_pool.parse_args([])
+        self.assertEqual(args.size, lc_model_pool.DEFAULT_POOL_SIZE)
+        self.assertFalse(args.collect)
+        self.assertFalse(args.drain)
+        args = lc_model_pool.parse_args(
+            ['--size', '5', '--collect', '--max-age', '60'])
+        self.assertEqual(args.size, 5)
+        self.assertTrue(args.collect)
+        self.assertEqual(args.max_age, 60)
@@ -20,6 +20,13 @@ class TestCharmLifecyclePrepare(ut_utils.BaseTestCase):
                 '--config', 'use-default-secgroup=true'
             ])
 
+    def test_add_model_no_switch(self):
+        self.patch_object(lc_prepare.subprocess, 'check_call')
+        lc_prepare.add_model('newmodel', switch=False)
+        cmd = self.check_call.call_args[0][0]
+        self.assertEqual(cmd[:3], ['juju', 'add-model', 'newmodel'])
+        self.assertEqual(cmd[-1], '--no-switch')
+
     def test_prepare(self):
         self.patch_object(lc_prepare, 'add_model')
         lc_prepare.add_model('newmodel')
@@ -0,0 +1,421 @@
+import asyncio
+import mock
+
+import zaza.charm_lifecycle.redeploy as lc_redeploy
+import unit_tests.utils as ut_utils
+
+
+def _async_mock(return_value=None):
+    calls = mock.MagicMock()
+
+    async def _call(*args, **kwargs):
+        calls(*args, **kwargs)
+        return return_value
+    _call.mock = calls
+    return _call
+
+
+BUNDLE = {
+    'series': 'bionic',
+    'applications': {
+        'keystone': {
+            'charm': '/tmp/builds/keystone',
+            'num_units': 3,
+            'options': {'debug': True, 'worker-multiplier': 0.25}},
+        'mysql': {
+            'charm': 'cs:percona-cluster',
+            'num_units': 1},
+        'glance': {
+            'charm': 'cs:~openstack-charmers-next/glance',
+            'series': 'xenial',
+            'num_units': 1},
+        'vault': {
+            'charm': 'cs:vault-20',
+            'num_units': 1,
+            'to': ['lxd:0']}},
+    'machines': {'0': {}, '1': {}},
+    'relations': [
+        ['keystone', 'mysql'],
+        ['glance:identity-service', 'keystone:identity-service'],
+        ['vault:shared-db', 'mysql:shared-db'],
+        ['vault:certificates', 'keystone:certificates']]}
+
+MODEL_STATE = {
+    'applications': {
+        'keystone': {
+            'charm': 'local:bionic/keystone-0',
+            'series': 'bionic',
+            'num_units': 1,
+            'subordinate': False,
+            'options': {'debug': True, 'verbose': True}},
+        'mysql': {
+            'charm': 'cs:percona-cluster-276',
+            'series': 'bionic',
+            'num_units': 1,
+            'subordinate': False,
+            'options': {}},
+        'glance': {
+            'charm': 'cs:~openstack-charmers-next/bionic/glance-300',
+            'series': 'bionic',
+            'num_units': 1,
+            'subordinate': False,
+            'options': {}},
+        'cinder': {
+            'charm': 'cs:cinder-10',
+            'series': 'bionic',
+            'num_units': 1,
+            'subordinate': False,
+            'options': {}}},
+    'relations': [
+        ['keystone:shared-db', 'mysql:shared-db'],
+        ['glance:identity-service', 'keystone:identity-service'],
+        ['cinder:identity-service', 'keystone:identity-service']]}
+
+
+class TestCharmLifecycleRedeploy(ut_utils.BaseTestCase):
+
+    def test_parse_charm(self):
+        self.assertEqual(
+            lc_redeploy.parse_charm('cs:~openstack-charmers/bionic/glance-3'),
+            ('~openstack-charmers', 'glance', 3))
+        self.assertEqual(lc_redeploy.parse_charm('cs:glance'),
+                         (None, 'glance', None))
+        self.assertEqual(lc_redeploy.parse_charm('local:bionic/keystone-0'),
+                         (None, 'keystone', 0))
+        self.assertEqual(lc_redeploy.parse_charm('../../../keystone/'),
+                         (None, 'keystone', None))
+
+    def test_charm_matches(self):
+        self.assertTrue(lc_redeploy.charm_matches(
+            '/tmp/keystone', 'local:bionic/keystone-2'))
+        self.assertFalse(lc_redeploy.charm_matches(
+            '/tmp/keystone', 'cs:keystone-2'))
+        self.assertTrue(lc_redeploy.charm_matches(
+            'cs:keystone', 'cs:bionic/keystone-2'))
+        self.assertTrue(lc_redeploy.charm_matches(
+            'cs:keystone-2', 'cs:bionic/keystone-2'))
+        self.assertFalse(lc_redeploy.charm_matches(
+            'cs:keystone-3', 'cs:bionic/keystone-2'))
+        self.assertFalse(lc_redeploy.charm_matches(
+            'cs:~me/keystone', 'cs:bionic/keystone-2'))
+
+    def test_relation_matches(self):
+        self.assertTrue(lc_redeploy.relation_matches(
+            ['keystone', 'mysql'],
+            ['keystone:shared-db', 'mysql:shared-db']))
+        self.assertTrue(lc_redeploy.relation_matches(
+            ['mysql:shared-db', 'keystone'],
+            ['keystone:shared-db', 'mysql:shared-db']))
+        self.assertFalse(lc_redeploy.relation_matches(
+            ['mysql:db-admin', 'keystone'],
+            ['keystone:shared-db', 'mysql:shared-db']))
+
+    def test_get_bundle_diff(self):
+        diff = lc_redeploy.get_bundle_diff(BUNDLE, MODEL_STATE)
+        self.assertEqual(diff, {
+            'add': ['vault'],
+            'remove': ['cinder'],
+            'replace': ['glance'],
+            'scale': {'keystone': 3},
+            'set': {'keystone': {'worker-multiplier': 0.25}},
+            'reset': {'keystone': ['verbose']},
+            'add_relations': [
+                ['glance:identity-service', 'keystone:identity-service'],
+                ['vault:shared-db', 'mysql:shared-db'],
+                ['vault:certificates', 'keystone:certificates']],
+            'remove_relations': []})
+        self.assertEqual(lc_redeploy.get_changed_applications(diff),
+                         ['glance', 'keystone', 'mysql', 'vault'])
+
+    def test_get_bundle_diff_unchanged(self):
+        diff = lc_redeploy.get_bundle_diff(
+            {'applications': {'mysql': {'charm': 'cs:percona-cluster'}},
+             'relations': []},
+            {'applications': {'mysql': MODEL_STATE['applications']['mysql']},
+             'relations': [['mysql:shared-db', 'keystone:shared-db']]})
+        self.assertEqual(diff['remove_relations'],
+                         [['mysql:shared-db', 'keystone:shared-db']])
+        self.assertEqual(lc_redeploy.get_changed_applications(diff),
+                         ['keystone', 'mysql'])
+        diff['remove_relations'] = []
+        self.assertEqual(lc_redeploy.get_changed_applications(diff), [])
+
+    def test_get_partial_bundle(self):
+        self.assertEqual(
+            lc_redeploy.get_partial_bundle(BUNDLE, ['glance', 'vault']),
+            {'series': 'bionic',
+             'applications': {
+                 'glance': BUNDLE['applications']['glance'],
+                 'vault': BUNDLE['applications']['vault']},
+             'machines': {'0': {}},
+             'relations': []})
+
+    def test_parse_placement(self):
+        self.assertEqual(lc_redeploy.parse_placement('lxd:0'), ('lxd', '0'))
+        self.assertEqual(lc_redeploy.parse_placement(1), (None, '1'))
+        self.assertEqual(lc_redeploy.parse_placement('keystone/0'),
+                         (None, 'keystone/0'))
+
+    def test_get_existing_placements(self):
+        bundle = {
+            'applications': {
+                'keystone': {'charm': 'cs:keystone', 'to': ['0']},
+                'vault': {'charm': 'cs:vault', 'to': ['lxd:0']},
+                'glance': {'charm': 'cs:glance', 'to': 'lxd:keystone/0'},
+                'mysql': {'charm': 'cs:mysql', 'to': ['1', 'lxd:new']},
+                'cinder': {'charm': 'cs:cinder', 'to': ['lxd:mysql/0']}},
+            'machines': {'0': {}, '1': {}}}
+        self.assertEqual(
+            lc_redeploy.get_existing_placements(
+                bundle, ['vault', 'glance', 'mysql', 'cinder']),
+            {'vault': ['lxd:0'], 'glance': ['lxd:keystone/0']})
+        with self.assertRaises(lc_redeploy.PlacementError):
+            lc_redeploy.get_partial_bundle(bundle, ['vault'])
+        # Placements within the applications being deployed are kept
+        self.assertEqual(
+            lc_redeploy.get_partial_bundle(bundle, ['mysql', 'cinder']),
+            {'applications': {
+                'mysql': bundle['applications']['mysql'],
+                'cinder': bundle['applications']['cinder']},
+             'machines': {'1': {}},
+             'relations': []})
+
+    def test_can_redeploy(self):
+        self.patch_object(lc_redeploy.utils, 'set_juju_model')
+        self.patch_object(lc_redeploy.deploy, 'render_overlays',
+                          return_value=[])
+        self.patch_object(lc_redeploy.deploy, 'get_merged_bundle',
+                          return_value=BUNDLE)
+        self.patch_object(lc_redeploy, 'get_model_state',
+                          return_value=MODEL_STATE)
+        self.assertTrue(lc_redeploy.can_redeploy('bun.yaml', 'newmodel'))
+        self.patch_object(lc_redeploy.logging, 'warning')
+        bundle = dict(BUNDLE, applications=dict(
+            BUNDLE['applications'],
+            glance=dict(BUNDLE['applications']['glance'],
+                        to=['lxd:keystone/0'])))
+        self.get_merged_bundle.return_value = bundle
+        self.assertFalse(lc_redeploy.can_redeploy('bun.yaml', 'newmodel'))
+        self.assertTrue(self.warning.called)
+
+    def test_get_model_state(self):
+        model = mock.MagicMock()
+        keystone = mock.MagicMock()
+        keystone.safe_data = {'charm-url': 'local:bionic/keystone-0',
+                              'series': 'bionic',
+                              'subordinate': False}
+        keystone.units = ['keystone/0', 'keystone/1']
+        keystone.get_config = _async_mock({
+            'debug': {'value': True, 'source': 'user'},
+            'verbose': {'value': False, 'source': 'default'}})
+        model.applications = {'keystone': keystone}
+        relation = mock.MagicMock(is_peer=False)
+        relation.safe_data = {'key': 'keystone:shared-db mysql:shared-db'}
+        peer = mock.MagicMock(is_peer=True)
+        model.relations = [relation, peer]
+        self.patch_object(lc_redeploy.zaza.model, 'run_in_model',
+                          return_value=ut_utils.ModelContext(model))
+        self.assertEqual(lc_redeploy.get_model_state('newmodel'), {
+            'applications': {
+                'keystone': {
+                    'charm': 'local:bionic/keystone-0',
+                    'series': 'bionic',
+                    'num_units': 2,
+                    'subordinate': False,
+                    'options': {'debug': True}}},
+            'relations': [['keystone:shared-db', 'mysql:shared-db']]})
+
+    def test_apply_bundle_diff(self):
+        self.patch_object(lc_redeploy.logging, 'info')
+        model = mock.MagicMock()
+        apps = {}
+        for name in ('keystone', 'mysql', 'glance', 'cinder'):
+            app = mock.MagicMock()
+            for method in ('destroy', 'destroy_relation', 'add_unit',
+                           'destroy_unit', 'set_config', 'reset_config'):
+                setattr(app, method, _async_mock())
+            app.units = [mock.MagicMock(entity_id='{}/0'.format(name))]
+            apps[name] = app
+
+        async def _destroy(name):
+            model.applications.pop(name)
+        apps['cinder'].destroy = lambda: _destroy('cinder')
+        apps['glance'].destroy = lambda: _destroy('glance')
+        model.applications = dict(apps)
+        model.add_relation = _async_mock()
+        self.patch_object(lc_redeploy.zaza.model, 'run_in_model',
+                          return_value=ut_utils.ModelContext(model))
+        self.patch_object(lc_redeploy.deploy, 'async_deploy_bundle_native',
+                          new=_async_mock())
+        diff = lc_redeploy.get_bundle_diff(BUNDLE, MODEL_STATE)
+        diff['remove_relations'] = [
+            ['keystone:shared-db', 'mysql:shared-db']]
+        lc_redeploy.apply_bundle_diff('bun.yaml', 'newmodel', BUNDLE, diff)
+        apps['keystone'].destroy_relation.mock.assert_called_once_with(
+            'shared-db', 'mysql:shared-db')
+        self.assertNotIn('cinder', model.applications)
+        self.assertNotIn('glance', model.applications)
+        self.async_deploy_bundle_native.mock.assert_called_once_with(
+            'bun.yaml', 'newmodel',
+            lc_redeploy.get_partial_bundle(BUNDLE, ['vault', 'glance']))
+        apps['keystone'].add_unit.mock.assert_called_once_with(count=2)
+        apps['keystone'].set_config.mock.assert_called_once_with(
+            {'worker-multiplier': '0.25'})
+        apps['keystone'].reset_config.mock.assert_called_once_with(
+            ['verbose'])
+        # Relations between new and existing applications are added after
+        # the new applications are deployed
+        model.add_relation.mock.assert_has_calls([
+            mock.call('glance:identity-service', 'keystone:identity-service'),
+            mock.call('vault:shared-db', 'mysql:shared-db'),
+            mock.call('vault:certificates', 'keystone:certificates')])
+
+    def test_apply_bundle_diff_scale_down(self):
+        self.patch_object(lc_redeploy.logging, 'info')
+        model = mock.MagicMock()
+        app = mock.MagicMock()
+        app.destroy_unit = _async_mock()
+        app.units = [mock.MagicMock(entity_id='keystone/{}'.format(i))
+                     for i in (10, 2, 1)]
+        model.applications = {'keystone': app}
+        self.patch_object(lc_redeploy.zaza.model, 'run_in_model',
+                          return_value=ut_utils.ModelContext(model))
+        diff = lc_redeploy.get_bundle_diff(
+            {'applications': {'keystone': {'charm': 'cs:keystone',
+                                           'num_units': 1}}},
+            {'applications': {'keystone': {
+                'charm': 'cs:keystone-1', 'series': 'bionic',
+                'num_units': 3, 'subordinate': False, 'options': {}}},
+             'relations': []})
+        lc_redeploy.apply_bundle_diff('bun.yaml', 'newmodel', {}, diff)
+        app.destroy_unit.mock.assert_called_once_with(
+            'keystone/2', 'keystone/10')
+
+    def _get_idle_model(self):
+        # keystone is active and idle from the previous bundle
+        model = mock.MagicMock()
+        app = mock.MagicMock()
+        app.units = [mock.MagicMock(entity_id='keystone/0',
+                                    workload_status='active',
+                                    agent_status='idle')]
+        model.applications = {'keystone': app}
+        self.observers = []
+        model.add_observer.side_effect = (
+            lambda observer, entity_type: self.observers.append(observer))
+        self.patch_object(lc_redeploy.zaza.model, 'run_in_model',
+                          return_value=ut_utils.ModelContext(model))
+        return model, app
+
+    def _get_config_diff(self):
+        return lc_redeploy.get_bundle_diff(
+            {'applications': {'keystone': {'charm': 'cs:keystone',
+                                           'options': {'debug': True}}}},
+            {'applications': {'keystone': {
+                'charm': 'cs:keystone-1', 'series': 'bionic',
+                'num_units': 1, 'subordinate': False, 'options': {}}},
+             'relations': []})
+
+    def test_apply_bundle_diff_waits_for_hooks(self):
+        self.patch_object(lc_redeploy.logging, 'info')
+        model, app = self._get_idle_model()
+        events = []
+
+        async def _hook():
+            await asyncio.sleep(0.05)
+            events.append('config-changed')
+            delta = mock.MagicMock()
+            delta.data = {'application': 'keystone',
+                          'agent-status': {'current': 'executing',
+                                           'message': 'running config-changed '
+                                                      'hook'}}
+            for observer in self.observers:
+                await observer(delta, None, None, model)
+
+        async def _set_config(config):
+            # The change is only seen by the observer registered before it
+            self.assertEqual(len(self.observers), 1)
+            asyncio.ensure_future(_hook())
+        app.set_config = _set_config
+        lc_redeploy.apply_bundle_diff(
+            'bun.yaml', 'newmodel', {}, self._get_config_diff(),
+            change_timeout=10)
+        events.append('applied')
+        self.assertEqual(events, ['config-changed', 'applied'])
+
+    def test_apply_bundle_diff_no_hooks(self):
+        self.patch_object(lc_redeploy.logging, 'info')
+        self.patch_object(lc_redeploy.logging, 'warning')
+        model, app = self._get_idle_model()
+        app.set_config = _async_mock()
+        lc_redeploy.apply_bundle_diff(
+            'bun.yaml', 'newmodel', {}, self._get_config_diff(),
+            change_timeout=0.1)
+        self.warning.assert_called_once_with(
+            'No unit of keystone ran a hook within 0.1s')
+        # Without a change_timeout the units are not watched
+        self.observers.clear()
+        lc_redeploy.apply_bundle_diff(
+            'bun.yaml', 'newmodel', {}, self._get_config_diff())
+        self.assertEqual(self.observers, [])
+
+    def test_redeploy(self):
+        self.patch_object(lc_redeploy.deploy, 'render_overlays',
+                          return_value=['overlay.yaml'])
+        self.patch_object(lc_redeploy.deploy, 'get_merged_bundle',
+                          return_value=BUNDLE)
+        self.patch_object(lc_redeploy, 'get_model_state',
+                          return_value=MODEL_STATE)
+        self.patch_object(lc_redeploy, 'apply_bundle_diff')
+        self.patch_object(lc_redeploy.utils, 'get_charm_config',
+                          return_value={})
+        self.patch_object(lc_redeploy.zaza.model,
+                          'wait_for_application_states')
+        self.assertEqual(lc_redeploy.redeploy('bun.yaml', 'newmodel'),
+                         ['glance', 'keystone', 'mysql', 'vault'])
+        self.get_merged_bundle.assert_called_once_with(
+            'bun.yaml', ['overlay.yaml'])
+        self.apply_bundle_diff.assert_called_once_with(
+            'bun.yaml', 'newmodel', BUNDLE,
+            lc_redeploy.get_bundle_diff(BUNDLE, MODEL_STATE),
+            change_timeout=lc_redeploy.DEFAULT_CHANGE_TIMEOUT)
+        self.wait_for_application_states.assert_called_once_with(
+            'newmodel', {},
+            applications=['glance', 'keystone', 'mysql', 'vault'])
+
+    def test_redeploy_existing_placement(self):
+        self.patch_object(lc_redeploy.deploy, 'render_overlays',
+                          return_value=[])
+        self.patch_object(lc_redeploy.deploy, 'get_merged_bundle',
+                          return_value=dict(BUNDLE, applications=dict(
+                              BUNDLE['applications'],
+                              vault=dict(BUNDLE['applications']['vault'],
+                                         to=['lxd:keystone/0']))))
+        self.patch_object(lc_redeploy, 'get_model_state',
+                          return_value=MODEL_STATE)
+        self.patch_object(lc_redeploy, 'apply_bundle_diff')
+        with self.assertRaises(lc_redeploy.PlacementError):
+            lc_redeploy.redeploy('bun.yaml', 'newmodel')
+        # Nothing is changed in the model
+        self.assertFalse(self.apply_bundle_diff.called)
+
+    def test_redeploy_unchanged(self):
+        self.patch_object(lc_redeploy.deploy, 'render_overlays',
+                          return_value=[])
+        self.patch_object(lc_redeploy.deploy, 'get_merged_bundle',
+                          return_value={'applications': {}})
+        self.patch_object(lc_redeploy, 'get_model_state',
+                          return_value={'applications': {}, 'relations': []})
+        self.patch_object(lc_redeploy, 'apply_bundle_diff')
+        self.patch_object(lc_redeploy.zaza.model,
+                          'wait_for_application_states')
+        self.assertEqual(lc_redeploy.redeploy('bun.yaml', 'newmodel'), [])
+        self.assertFalse(self.wait_for_application_states.called)
+
+    def test_parser(self):
+        args = lc_redeploy.parse_args(['-m', 'mymodel', '-b', 'bun.yaml'])
+        self.assertEqual(args.model, 'mymodel')
+        self.assertEqual(args.bundle, 'bun.yaml')
+        self.assertTrue(args.wait)
+        args = lc_redeploy.parse_args(
+            ['-m', 'mymodel', '-b', 'bun.yaml', '--no-wait'])
+        self.assertFalse(args.wait)
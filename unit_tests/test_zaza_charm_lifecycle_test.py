@@ -1,11 +1,99 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+import xml.etree.ElementTree as ElementTree
+
 import mock
 
 import zaza.charm_lifecycle.test as lc_test
 import unit_tests.utils as ut_utils
 
+# Lets the example ParallelTest classes check they run at the same time
+_parallel_barrier = threading.Barrier(2, timeout=5)
+# Threads the example WaitingTest classes were stopped in
+_stopped = []
+
+
+# The example test classes are only run by the tests below
+class ExampleTest(unittest.TestCase):
+
+    __test__ = False
+
+    def test_pass(self):
+        pass
+
+    def test_fail(self):
+        self.fail('Not working')
+
+    @unittest.skip('Not needed')
+    def test_skip(self):
+        pass
+
+
+class SetUpClassErrorTest(unittest.TestCase):
+
+    __test__ = False
+
+    @classmethod
+    def setUpClass(cls):
+        raise Exception('No model')
+
+    def test_pass(self):
+        pass
+
+
+class ParallelTest1(unittest.TestCase):
+
+    __test__ = False
+
+    def test_together(self):
+        _parallel_barrier.wait()
+
+
+class ParallelTest2(ParallelTest1):
+    pass
+
+
+class WaitingTest1(unittest.TestCase):
+
+    __test__ = False
+
+    def test_wait_for_model(self):
+        try:
+            lc_test.zaza.model.run(asyncio.sleep(10))
+        finally:
+            _stopped.append(threading.current_thread())
+
+
+class WaitingTest2(WaitingTest1):
+    pass
+
+
+class SerialTest(unittest.TestCase):
+
+    __test__ = False
+    zaza_serial = True
+
+    def test_pass(self):
+        pass
+
 
 class TestCharmLifecycleTest(ut_utils.BaseTestCase):
 
+    def setUp(self):
+        super(TestCharmLifecycleTest, self).setUp()
+        self.patch_object(lc_test.utils, 'get_class')
+        self.get_class.side_effect = lambda x: globals()[x]
+        self.patch_object(lc_test.sys, 'stderr', new=mock.MagicMock())
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
     def test_run_test_list(self):
         loader_mock = mock.MagicMock()
         runner_mock = mock.MagicMock()
@@ -13,7 +101,8 @@ class TestCharmLifecycleTest(ut_utils.BaseTestCase):
         self.patch_object(lc_test.unittest, 'TextTestRunner')
         self.TestLoader.return_value = loader_mock
         self.TextTestRunner.return_value = runner_mock
-        self.patch_object(lc_test.utils, 'get_class')
+        runner_mock.run.return_value.wasSuccessful.return_value = True
+        runner_mock.run.return_value.test_reports = []
         self.get_class.side_effect = lambda x: x
         test_class1_mock = mock.MagicMock()
         test_class2_mock = mock.MagicMock()
@@ -23,11 +112,143 @@ class TestCharmLifecycleTest(ut_utils.BaseTestCase):
             mock.call(test_class2_mock)]
         loader_mock.loadTestsFromTestCase.assert_has_calls(loader_calls)
 
+    def test_run_test_class(self):
+        stream = mock.MagicMock()
+        result = lc_test.run_test_class('ExampleTest', stream=stream)
+        self.assertEqual(result['name'], 'ExampleTest')
+        self.assertEqual(result['outcome'], 'fail')
+        outcomes = {t['name'].split('.')[-1]: t['outcome']
+                    for t in result['tests']}
+        self.assertEqual(outcomes, {
+            'test_pass': 'pass',
+            'test_fail': 'fail',
+            'test_skip': 'skip'})
+        messages = {t['name'].split('.')[-1]: t['message']
+                    for t in result['tests']}
+        self.assertIsNone(messages['test_pass'])
+        self.assertIn('AssertionError: Not working', messages['test_fail'])
+        self.assertEqual(messages['test_skip'], 'Not needed')
+        self.assertTrue(stream.write.called)
+
+    def test_run_test_class_setup_error(self):
+        result = lc_test.run_test_class('SetUpClassErrorTest')
+        self.assertEqual(result['outcome'], 'fail')
+        self.assertEqual(len(result['tests']), 1)
+        self.assertEqual(result['tests'][0]['outcome'], 'error')
+        self.assertIn('setUpClass', result['tests'][0]['name'])
+        self.assertIn('No model', result['tests'][0]['message'])
+
+    def test_run_test_class_load_error(self):
+        self.patch_object(lc_test.logging, 'exception')
+        result = lc_test.run_test_class('MissingTest')
+        self.assertEqual(result['outcome'], 'error')
+        self.assertEqual(result['tests'][0]['name'], 'MissingTest')
+        self.assertIn('KeyError', result['tests'][0]['message'])
+
+    def test_get_test_batches(self):
+        self.assertEqual(
+            lc_test.get_test_batches([
+                'ParallelTest1', 'ParallelTest2', 'SerialTest',
+                'ExampleTest', 'MissingTest', 'SerialTest']),
+            [['ParallelTest1', 'ParallelTest2'],
+             ['SerialTest'],
+             ['ExampleTest', 'MissingTest'],
+             ['SerialTest']])
+
+    def test_get_shard(self):
+        tests = ['t1', 't2', 't3', 't4', 't5']
+        self.assertEqual(lc_test.get_shard(tests, (1, 2)), ['t1', 't3', 't5'])
+        self.assertEqual(lc_test.get_shard(tests, (2, 2)), ['t2', 't4'])
+
+    def test_run_test_list_parallel(self):
+        junit_xml = os.path.join(self.tmpdir.name, 'junit.xml')
+        json_summary = os.path.join(self.tmpdir.name, 'summary.json')
+        lc_test.run_test_list(
+            ['ParallelTest1', 'ParallelTest2', 'SerialTest'],
+            workers=2,
+            junit_xml=junit_xml,
+            json_summary=json_summary)
+        with open(json_summary) as fh:
+            summary = json.load(fh)
+        self.assertEqual(
+            [c['name'] for c in summary['classes']],
+            ['ParallelTest1', 'ParallelTest2', 'SerialTest'])
+        self.assertEqual(summary['tests'], 3)
+        self.assertEqual(summary['pass'], 3)
+        root = ElementTree.parse(junit_xml).getroot()
+        self.assertEqual(root.get('tests'), '3')
+        self.assertEqual(root.get('failures'), '0')
+
+    def test_run_test_list_parallel_aborted(self):
+        self.patch_object(lc_test.zaza.model, 'CANCEL_CHECK_INTERVAL',
+                          new=0.01)
+
+        def _interrupt(signum, frame):
+            raise KeyboardInterrupt()
+
+        previous = signal.signal(signal.SIGUSR2, _interrupt)
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous)
+        main_thread_id = threading.get_ident()
+        timer = threading.Timer(
+            0.2, signal.pthread_kill, (main_thread_id, signal.SIGUSR2))
+        del _stopped[:]
+        start = time.time()
+        timer.start()
+        with self.assertRaises(KeyboardInterrupt):
+            lc_test.run_test_list(['WaitingTest1', 'WaitingTest2'],
+                                  workers=2)
+        # Both classes were stopped before the phase ended
+        self.assertEqual(len(_stopped), 2)
+        self.assertLess(time.time() - start, 5)
+
+    def test_run_test_list_failure(self):
+        junit_xml = os.path.join(self.tmpdir.name, 'junit.xml')
+        json_summary = os.path.join(self.tmpdir.name, 'summary.json')
+        with self.assertRaisesRegex(AssertionError,
+                                    'ExampleTest, SetUpClassErrorTest'):
+            lc_test.run_test_list(
+                ['ExampleTest', 'SetUpClassErrorTest', 'SerialTest'],
+                junit_xml=junit_xml,
+                json_summary=json_summary)
+        with open(json_summary) as fh:
+            summary = json.load(fh)
+        # Every class runs despite the earlier failures
+        self.assertEqual(
+            [(c['name'], c['outcome']) for c in summary['classes']],
+            [('ExampleTest', 'fail'),
+             ('SetUpClassErrorTest', 'fail'),
+             ('SerialTest', 'pass')])
+        self.assertEqual(
+            {k: summary[k] for k in ('tests', 'pass', 'fail', 'error',
+                                     'skip')},
+            {'tests': 5, 'pass': 2, 'fail': 1, 'error': 1, 'skip': 1})
+        root = ElementTree.parse(junit_xml).getroot()
+        self.assertEqual(
+            [s.get('name') for s in root.findall('testsuite')],
+            ['ExampleTest', 'SetUpClassErrorTest', 'SerialTest'])
+        testcases = {t.get('name'): t
+                     for t in root.find('testsuite').findall('testcase')}
+        self.assertEqual(
+            testcases['test_fail'].find('failure').get('message'),
+            'AssertionError: Not working')
+        self.assertIsNotNone(testcases['test_skip'].find('skipped'))
+        self.assertEqual(
+            testcases['test_pass'].get('classname'),
+            'unit_tests.test_zaza_charm_lifecycle_test.ExampleTest')
+
     def test_test(self):
         self.patch_object(lc_test, 'run_test_list')
-        lc_test.run_test_list(['test_class1', 'test_class2'])
+        lc_test.test('modelname', ['test_class1', 'test_class2'], workers=2)
         self.run_test_list.assert_called_once_with(
-            ['test_class1', 'test_class2'])
+            ['test_class1', 'test_class2'], workers=2, junit_xml=None,
+            json_summary=None)
+
+    def test_parse_shard(self):
+        self.assertEqual(lc_test.parse_shard('2/4'), (2, 4))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            lc_test.parse_shard('2')
+        with self.assertRaises(argparse.ArgumentTypeError):
+            lc_test.parse_shard('5/4')
 
     def test_parser(self):
         args = lc_test.parse_args(
@@ -36,3 +257,12 @@ class TestCharmLifecycleTest(ut_utils.BaseTestCase):
             args.tests,
             ['my.test_class1', 'my.test_class2'])
         self.assertEqual(args.model_name, 'modelname')
+        self.assertEqual(args.workers, 1)
+        self.assertIsNone(args.shard)
+        args = lc_test.parse_args(
+            ['-m', 'modelname', '-w', '4', '--shard', '1/2', '--junit-xml',
+             'junit.xml', '--json-summary', 'summary.json'])
+        self.assertEqual(args.workers, 4)
+        self.assertEqual(args.shard, (1, 2))
+        self.assertEqual(args.junit_xml, 'junit.xml')
+        self.assertEqual(args.json_summary, 'summary.json')
@@ -0,0 +1,94 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import zaza.charm_lifecycle.timing as lc_timing
+import unit_tests.utils as ut_utils
+
+
+class TestCharmLifecycleTiming(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestCharmLifecycleTiming, self).setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.report_file = os.path.join(self.tmpdir.name, 'timing.jsonl')
+        self.patch_object(lc_timing, 'CONTEXT', new={})
+        self.patch_object(lc_timing.os, 'environ', new={})
+
+    def tearDown(self):
+        super(TestCharmLifecycleTiming, self).tearDown()
+        self.tmpdir.cleanup()
+
+    def read_report(self):
+        with open(self.report_file) as fh:
+            return [json.loads(line) for line in fh.readlines()]
+
+    def test_write_event_no_report(self):
+        lc_timing.write_event({'phase': 'deploy'})
+        self.assertFalse(os.path.exists(self.report_file))
+
+    def test_record(self):
+        lc_timing.set_report_file(self.report_file)
+        lc_timing.record('deploy', 'bun.yaml', 10.0, 12.5, 'pass',
+                         model='newmodel')
+        self.assertEqual(
+            self.read_report(),
+            [{
+                'phase': 'deploy',
+                'name': 'bun.yaml',
+                'start': 10.0,
+                'end': 12.5,
+                'duration': 2.5,
+                'outcome': 'pass',
+                'model': 'newmodel'}])
+
+    def test_timed(self):
+        lc_timing.set_report_file(self.report_file)
+        with lc_timing.context(bundle='base'):
+            with lc_timing.timed('prepare', model='newmodel'):
+                pass
+            with self.assertRaises(ValueError):
+                with lc_timing.timed('configure_step', 'my.func'):
+                    raise ValueError()
+        self.assertEqual(lc_timing.CONTEXT, {})
+        events = self.read_report()
+        self.assertEqual(
+            [(e['phase'], e['name'], e['outcome'], e['bundle'])
+             for e in events],
+            [('prepare', None, 'pass', 'base'),
+             ('configure_step', 'my.func', 'fail', 'base')])
+        self.assertEqual(events[0]['model'], 'newmodel')
+        for event in events:
+            self.assertGreaterEqual(event['end'], event['start'])
+
+    def test_timed_text_test_result(self):
+        lc_timing.set_report_file(self.report_file)
+
+        class _Test(unittest.TestCase):
+
+            def test_error(self):
+                raise ValueError()
+
+            def test_fail(self):
+                self.fail()
+
+            def test_pass(self):
+                pass
+
+            @unittest.skip('skipped')
+            def test_skip(self):
+                pass
+
+        suite = unittest.TestLoader().loadTestsFromTestCase(_Test)
+        unittest.TextTestRunner(
+            stream=io.StringIO(),
+            resultclass=lc_timing.TimedTextTestResult).run(suite)
+        self.assertEqual(
+            [(e['phase'], e['name'].split('.')[-1], e['outcome'])
+             for e in self.read_report()],
+            [('test_case', 'test_error', 'error'),
+             ('test_case', 'test_fail', 'fail'),
+             ('test_case', 'test_pass', 'pass'),
+             ('test_case', 'test_skip', 'skip')])
@@ -0,0 +1,166 @@
+import mock
+
+import zaza.configure.network as network
+import unit_tests.utils as ut_utils
+
+
+class TestConfigureNetwork(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestConfigureNetwork, self).setUp()
+        self.network_config = {
+            "network_type": "gre",
+            "router_name": "provider-router",
+            "private_net_cidr": "192.168.21.0/24",
+            "external_dns": "10.5.0.2",
+            "external_net_cidr": "10.5.0.0/16",
+            "external_net_name": "ext_net",
+            "external_subnet_name": "ext_net_subnet",
+            "default_gateway": "10.5.0.1",
+            "start_floating_ip": "10.5.150.0",
+            "end_floating_ip": "10.5.200.254"}
+        self.secgroup = {
+            "id": "secgroup_id",
+            "name": "default",
+            "project_id": "project_id",
+            "security_group_rules": []}
+        self.empty_state = {
+            "networks": [],
+            "subnets": [],
+            "routers": [],
+            "address_scopes": [],
+            "subnetpools": [],
+            "security_groups": [self.secgroup],
+            "ports": []}
+        self.configured_state = {
+            "networks": [
+                {"id": "ext_net_id", "name": "ext_net"},
+                {"id": "private_id", "name": "private"}],
+            "subnets": [
+                {"id": "ext_subnet_id", "name": "ext_net_subnet"},
+                {"id": "private_subnet_id", "name": "private_subnet",
+                 "dns_nameservers": ["10.5.0.2"]}],
+            "routers": [
+                {"id": "router_id", "name": "provider-router",
+                 "external_gateway_info": {"network_id": "ext_net_id"}}],
+            "address_scopes": [],
+            "subnetpools": [],
+            "security_groups": [dict(self.secgroup, security_group_rules=[
+                {"port_range_min": 22, "protocol": "tcp"},
+                {"port_range_min": None, "protocol": "icmp"}])],
+            "ports": [{"network_id": "private_id"}]}
+
+    def get_neutron_client(self):
+        neutron_client = mock.MagicMock()
+        neutron_client.create_network.side_effect = lambda msg: {
+            "network": {"id": "{}_id".format(msg["network"]["name"])}}
+        neutron_client.create_subnet.side_effect = lambda msg: {
+            "subnet": {"id": "{}_id".format(msg["subnet"]["name"])}}
+        neutron_client.create_router.return_value = {
+            "router": {"id": "router_id"}}
+        neutron_client.create_security_group_rule.return_value = {
+            "security_group_rule": {"id": "rule_id"}}
+        return neutron_client
+
+    def test_get_sdn_state(self):
+        neutron_client = mock.MagicMock()
+        neutron_client.list_networks.return_value = {"networks": ["net"]}
+        neutron_client.list_subnets.return_value = {"subnets": []}
+        neutron_client.list_routers.return_value = {"routers": []}
+        neutron_client.list_security_groups.return_value = {
+            "security_groups": []}
+        neutron_client.list_ports.return_value = {"ports": []}
+        state = network.get_sdn_state(neutron_client, self.network_config)
+        self.assertEqual(state["networks"], ["net"])
+        self.assertEqual(state["subnetpools"], [])
+        neutron_client.list_ports.assert_called_once_with(
+            device_owner="network:router_interface")
+        self.assertFalse(neutron_client.list_subnetpools.called)
+
+    def test_plan_sdn_configured(self):
+        resources, steps = network.plan_sdn(
+            self.network_config, self.configured_state, "project_id")
+        self.assertEqual(steps, [])
+        self.assertEqual(resources["router"]["id"], "router_id")
+
+    def test_plan_sdn_dns_changed(self):
+        self.network_config["external_dns"] = "10.5.0.3"
+        _, steps = network.plan_sdn(
+            self.network_config, self.configured_state, "project_id")
+        self.assertEqual([step["name"] for step in steps], ["subnet_dns"])
+
+    def test_plan_sdn_no_secgroup(self):
+        self.empty_state["security_groups"] = []
+        with self.assertRaises(Exception):
+            network.plan_sdn(self.network_config, self.empty_state,
+                             "project_id")
+
+    def test_plan_and_apply_sdn(self):
+        resources, steps = network.plan_sdn(
+            self.network_config, self.empty_state, "project_id")
+        self.assertEqual(
+            sorted(step["name"] for step in steps),
+            ["external_network", "external_subnet", "ping_rule",
+             "project_network", "project_subnet", "router",
+             "router_gateway", "router_interface", "ssh_rule",
+             "subnet_dns"])
+        neutron_client = self.get_neutron_client()
+        resources = network.apply_sdn_plan(neutron_client, resources, steps)
+        self.assertEqual(resources["project_subnet"]["id"],
+                         "private_subnet_id")
+        neutron_client.add_gateway_router.assert_called_once_with(
+            router="router_id",
+            body={"network_id": "ext_net_id"})
+        neutron_client.add_interface_router.assert_called_once_with(
+            "router_id",
+            {"subnet_id": "private_subnet_id"})
+        neutron_client.update_subnet.assert_called_once_with(
+            "private_subnet_id",
+            {"subnet": {"dns_nameservers": ["10.5.0.2"]}})
+        self.assertEqual(
+            neutron_client.create_security_group_rule.call_count, 2)
+
+    def test_plan_sdn_uses_openstack_utils(self):
+        self.patch_object(network.openstack_utils, "new_external_network",
+                          return_value={"id": "ext_net_id"})
+        self.empty_state["security_groups"][0]["security_group_rules"] = [
+            {"port_range_min": 22, "protocol": "tcp"}]
+        resources, steps = network.plan_sdn(
+            self.network_config, self.empty_state, "project_id")
+        self.assertNotIn("ssh_rule", [step["name"] for step in steps])
+        neutron_client = self.get_neutron_client()
+        network.apply_sdn_plan(neutron_client, resources, steps)
+        self.new_external_network.assert_called_once_with(
+            neutron_client, "project_id", net_name="ext_net")
+        # Only the project network is created directly
+        self.assertEqual(neutron_client.create_network.call_count, 1)
+
+    def test_apply_sdn_plan_failure(self):
+        def _fail(neutron_client, resources):
+            raise ValueError()
+
+        steps = [
+            {"name": "a", "depends": [], "description": "a", "apply": _fail},
+            {"name": "b", "depends": ["a"], "description": "b",
+             "apply": mock.MagicMock()}]
+        with self.assertRaises(ValueError):
+            network.apply_sdn_plan(mock.MagicMock(), {}, steps)
+        self.assertFalse(steps[1]["apply"].called)
+
+    def test_setup_sdn_plan_only(self):
+        self.patch_object(network.openstack_utils,
+                          "get_keystone_session_client")
+        self.patch_object(network.openstack_utils,
+                          "get_neutron_session_client")
+        self.patch_object(network.openstack_utils, "get_project_id",
+                          return_value="project_id")
+        self.patch_object(network, "get_sdn_state",
+                          return_value=self.empty_state)
+        self.patch_object(network, "apply_sdn_plan")
+        plan = network.setup_sdn(self.network_config,
+                                 keystone_session="session",
+                                 plan_only=True)
+        self.assertIn("Create router provider-router", plan)
+        self.assertFalse(self.apply_sdn_plan.called)
+        network.setup_sdn(self.network_config, keystone_session="session")
+        self.assertTrue(self.apply_sdn_plan.called)
@@ -1,6 +1,9 @@
 import aiounittest
 import asyncio.futures
+from concurrent import futures
 import mock
+import threading
+import time
 
 import unit_tests.utils as ut_utils
 from juju import loop
@@ -57,11 +60,13 @@ class TestModel(ut_utils.BaseTestCase):
         self.unit1.name = 'app/2'
         self.unit1.entity_id = 'app/2'
         self.unit1.machine = 'machine3'
+        self.unit1.safe_data = {'machine-id': '3'}
         self.unit2 = mock.MagicMock()
         self.unit2.public_address = 'ip2'
         self.unit2.name = 'app/4'
         self.unit2.entity_id = 'app/4'
         self.unit2.machine = 'machine7'
+        self.unit2.safe_data = {'machine-id': '7'}
         self.unit1.run.side_effect = _run
         self.unit1.scp_to.side_effect = _scp_to
         self.unit2.scp_to.side_effect = _scp_to
@@ -89,6 +94,17 @@ class TestModel(ut_utils.BaseTestCase):
         async def _connect():
             return
 
+        async def _get_status():
+            return self.status
+
+        self.status = mock.MagicMock()
+        self.status.applications = {
+            'app': {'units': {
+                'app/2': {'leader': False,
+                          'subordinates': {'sub/0': {'leader': True}}},
+                'app/4': {'leader': True}}},
+            'otherapp': {'units': {'otherapp/0': {}}}}
+        self.Model_mock.get_status.side_effect = _get_status
         self.Model_mock.connect.side_effect = _connect
         self.Model_mock.connect_model.side_effect = _connect_model
         self.Model_mock.disconnect.side_effect = _disconnect
@@ -98,6 +114,9 @@ class TestModel(ut_utils.BaseTestCase):
             'app/4': self.unit2}
         self.model_name = "testmodel"
         self.Model_mock.info.name = self.model_name
+        self.patch_object(model, 'MODEL_POOL', new={})
+        self.patch_object(model, 'ZAZA_MODEL_POOL', new={})
+        self.patch_object(model, '_MODEL_LOCKS', new={})
 
     def test_run_in_model(self):
         self.patch_object(model, 'Model')
@@ -108,14 +127,162 @@ class TestModel(ut_utils.BaseTestCase):
                 return mymodel
         self.assertEqual(loop.run(_wrapper()), self.Model_mock)
         self.Model_mock.connect_model.assert_called_once_with('modelname')
+        self.assertFalse(self.Model_mock.disconnect.called)
+
+    def test_get_model_reuses_connection(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        self.Model_mock.is_connected.return_value = True
+        self.assertEqual(model.get_model('modelname'), self.Model_mock)
+        self.assertEqual(model.get_model('modelname'), self.Model_mock)
+        self.Model_mock.connect_model.assert_called_once_with('modelname')
+        self.assertEqual(model.MODEL_POOL, {'modelname': self.Model_mock})
+
+    def test_get_model_from_threads(self):
+        self.patch_object(model, 'Model')
+        connected = []
+
+        def _new_model():
+            juju_model = mock.MagicMock()
+
+            async def _connect_model(model_name):
+                await asyncio.sleep(0.05)
+                connected.append(juju_model)
+
+            juju_model.connect_model.side_effect = _connect_model
+            return juju_model
+
+        self.Model.side_effect = _new_model
+        with futures.ThreadPoolExecutor(max_workers=4) as executor:
+            models = list(executor.map(
+                lambda _: model.get_model('modelname'), range(4)))
+        self.assertEqual(len(connected), 1)
+        self.assertEqual(models, connected * 4)
+        self.assertEqual(model.MODEL_POOL, {'modelname': connected[0]})
+
+    def test_get_model_reconnects_stale(self):
+        self.patch_object(model, 'Model')
+        stale_model = mock.MagicMock()
+        stale_model.is_connected.return_value = False
+        stale_model.disconnect.side_effect = self.Model_mock.disconnect
+        model.MODEL_POOL['modelname'] = stale_model
+        self.Model.return_value = self.Model_mock
+        self.assertEqual(model.get_model('modelname'), self.Model_mock)
+        stale_model.disconnect.assert_called_once_with()
+        self.Model_mock.connect_model.assert_called_once_with('modelname')
+
+    def test_disconnect_models(self):
+        model.MODEL_POOL['modelname'] = self.Model_mock
+        model.disconnect_models()
         self.Model_mock.disconnect.assert_called_once_with()
+        self.assertEqual(model.MODEL_POOL, {})
+
+    def test_disconnect_model(self):
+        other_model = mock.MagicMock()
+        zaza_model = mock.MagicMock()
+        model.MODEL_POOL.update({
+            'modelname': self.Model_mock,
+            'othermodel': other_model})
+        model.ZAZA_MODEL_POOL['modelname'] = zaza_model
+        model.disconnect_model('modelname')
+        self.Model_mock.disconnect.assert_called_once_with()
+        zaza_model.close.assert_called_once_with()
+        self.assertEqual(model.MODEL_POOL, {'othermodel': other_model})
+        self.assertEqual(model.ZAZA_MODEL_POOL, {})
+        # Disconnecting a model which is not in the pool is harmless
+        model.disconnect_model('modelname')
+
+    def test_run_from_threads(self):
+        async def _double(value):
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        with futures.ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(executor.map(
+                lambda value: model.run(_double(value)), range(10)))
+        self.assertEqual(results, [value * 2 for value in range(10)])
+
+    def test_run_steps(self):
+        async def _value(value):
+            return value
+
+        self.assertIsNone(model.run())
+        self.assertEqual(model.run(_value(1), _value(2)), 2)
+
+    def test_run_cancel_on(self):
+        self.patch_object(model, 'CANCEL_CHECK_INTERVAL', new=0.01)
+        cancel = threading.Event()
+        cancelled = []
+
+        async def _wait():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def _value(value):
+            return value
+
+        def _worker():
+            with model.cancel_on(cancel):
+                self.assertEqual(model.run(_value(1)), 1)
+                try:
+                    model.run(_wait())
+                except model.RunCancelled:
+                    pass
+                else:
+                    self.fail('run was not cancelled')
+                # Later calls are cancelled straight away
+                with self.assertRaises(model.RunCancelled):
+                    model.run(_wait())
+
+        with futures.ThreadPoolExecutor(max_workers=1) as executor:
+            job = executor.submit(_worker)
+            time.sleep(0.1)
+            cancel.set()
+            job.result(timeout=5)
+        # The coroutine is cancelled in the event loop thread
+        for _ in range(100):
+            if cancelled:
+                break
+            time.sleep(0.01)
+        self.assertTrue(cancelled)
+        # Outside the with block run is not cancelled
+        self.assertEqual(model.run(_value(2)), 2)
+
+    def test_run_from_event_loop_thread(self):
+        async def _nested():
+            coro = asyncio.sleep(0)
+            try:
+                model.run(coro)
+            except RuntimeError:
+                return 'refused'
+
+        self.assertEqual(model.run(_nested()), 'refused')
+
+    def test_shutdown(self):
+        async def _loop():
+            return asyncio.get_event_loop()
+
+        model.MODEL_POOL['modelname'] = self.Model_mock
+        first_loop = model.run(_loop())
+        thread = model._LOOP_THREAD
+        model.shutdown()
+        self.Model_mock.disconnect.assert_called_once_with()
+        self.assertTrue(first_loop.is_closed())
+        self.assertFalse(thread.is_alive())
+        self.assertIsNone(model._LOOP)
+        # A new loop is started on demand
+        self.assertIsNot(model.run(_loop()), first_loop)
+        # Shutting down twice is harmless
+        model.shutdown()
+        model.shutdown()
 
     def test_scp_to_unit(self):
         self.patch_object(model, 'Model')
-        self.patch_object(model, 'get_unit_from_name')
-        self.get_unit_from_name.return_value = self.unit1
         self.Model.return_value = self.Model_mock
-        model.scp_to_unit('modelname', 'app/1', '/tmp/src', '/tmp/dest')
+        model.scp_to_unit('modelname', 'app/2', '/tmp/src', '/tmp/dest')
         self.unit1.scp_to.assert_called_once_with(
             '/tmp/src', '/tmp/dest', proxy=False, scp_opts='', user='ubuntu')
 
@@ -128,12 +295,57 @@ class TestModel(ut_utils.BaseTestCase):
         self.unit2.scp_to.assert_called_once_with(
             '/tmp/src', '/tmp/dest', proxy=False, scp_opts='', user='ubuntu')
 
+    def test_scp_to_all_units_failure(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+
+        async def _scp_to_fail(source, destination, user=None, proxy=None,
+                               scp_opts=None):
+            raise model.JujuError('scp failed')
+        self.unit2.scp_to.side_effect = _scp_to_fail
+        with self.assertRaises(model.FanOutError) as context:
+            model.scp_to_all_units('modelname', 'app', '/tmp/src',
+                                   '/tmp/dest')
+        self.assertEqual(list(context.exception.errors.keys()), ['app/4'])
+
+    def test_scp_to_all_units_keep_going(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        error = model.JujuError('scp failed')
+
+        async def _scp_to_fail(source, destination, user=None, proxy=None,
+                               scp_opts=None):
+            raise error
+        self.unit1.scp_to.side_effect = _scp_to_fail
+        self.assertEqual(
+            model.scp_to_all_units('modelname', 'app', '/tmp/src',
+                                   '/tmp/dest', keep_going=True),
+            {'app/2': error, 'app/4': None})
+        self.unit2.scp_to.assert_called_once_with(
+            '/tmp/src', '/tmp/dest', proxy=False, scp_opts='', user='ubuntu')
+
+    def test_scp_from_all_units(self):
+        self.patch_object(model, 'Model')
+        self.patch_object(model.os, 'makedirs')
+        self.Model.return_value = self.Model_mock
+        self.assertEqual(
+            model.scp_from_all_units('modelname', 'app', '/tmp/src',
+                                     '/tmp/dest'),
+            {'app/2': None, 'app/4': None})
+        self.makedirs.assert_has_calls([
+            mock.call('/tmp/dest/app_2', exist_ok=True),
+            mock.call('/tmp/dest/app_4', exist_ok=True)])
+        self.unit1.scp_from.assert_called_once_with(
+            '/tmp/src', '/tmp/dest/app_2', proxy=False, scp_opts='',
+            user='ubuntu')
+        self.unit2.scp_from.assert_called_once_with(
+            '/tmp/src', '/tmp/dest/app_4', proxy=False, scp_opts='',
+            user='ubuntu')
+
     def test_scp_from_unit(self):
         self.patch_object(model, 'Model')
-        self.patch_object(model, 'get_unit_from_name')
-        self.get_unit_from_name.return_value = self.unit1
         self.Model.return_value = self.Model_mock
-        model.scp_from_unit('modelname', 'app/1', '/tmp/src', '/tmp/dest')
+        model.scp_from_unit('modelname', 'app/2', '/tmp/src', '/tmp/dest')
         self.unit1.scp_from.assert_called_once_with(
             '/tmp/src', '/tmp/dest', proxy=False, scp_opts='', user='ubuntu')
 
@@ -172,19 +384,197 @@ class TestModel(ut_utils.BaseTestCase):
         expected = {'Code': '0', 'Stderr': '', 'Stdout': 'RESULT'}
         self.cmd = cmd = 'somecommand someargument'
         self.patch_object(model, 'Model')
-        self.patch_object(model, 'get_unit_from_name')
-        self.get_unit_from_name.return_value = self.unit1
         self.Model.return_value = self.Model_mock
-        self.assertEqual(model.run_on_unit('app/2', 'modelname', cmd),
+        self.assertEqual(model.run_on_unit('modelname', 'app/2', cmd),
                          expected)
         self.unit1.run.assert_called_once_with(cmd, timeout=None)
 
+    def test_run_on_units(self):
+        expected = {'Code': '0', 'Stderr': '', 'Stdout': 'RESULT'}
+        self.cmd = cmd = 'somecommand someargument'
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        self.unit2.run.side_effect = self.unit1.run.side_effect
+        self.assertEqual(
+            model.run_on_units('modelname', ['app/2', 'app/4'], cmd),
+            {'app/2': expected, 'app/4': expected})
+        self.unit1.run.assert_called_once_with(cmd, timeout=None)
+        self.unit2.run.assert_called_once_with(cmd, timeout=None)
+        self.Model_mock.connect_model.assert_called_once_with('modelname')
+
+    def test_run_on_application(self):
+        expected = {'Code': '0', 'Stderr': '', 'Stdout': 'RESULT'}
+        self.cmd = cmd = 'somecommand someargument'
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        self.unit2.run.side_effect = self.unit1.run.side_effect
+        self.assertEqual(
+            model.run_on_application('modelname', 'app', cmd),
+            {'app/2': expected, 'app/4': expected})
+        self.unit1.run.assert_called_once_with(cmd, timeout=None)
+        self.unit2.run.assert_called_once_with(cmd, timeout=None)
+
+    def _unit_delta(self, delta_type, data):
+        delta = mock.MagicMock()
+        delta.type = delta_type
+        delta.data = data
+        delta.get_id.return_value = data['name']
+        return delta
+
+    def test_zaza_model(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        zaza_model = model.get_zaza_model('modelname')
+        self.assertIs(model.get_zaza_model('modelname'), zaza_model)
+        self.Model_mock.connect_model.assert_called_once_with('modelname')
+        self.assertIs(zaza_model.get_unit('app/2'), self.unit1)
+        self.assertEqual(zaza_model.get_units_on_machine('7'), [self.unit2])
+        self.assertEqual(zaza_model.get_units_on_machine('1'), [])
+        self.assertIs(zaza_model.get_leader('app'), self.unit2)
+        self.assertIsNone(zaza_model.get_leader('otherapp'))
+        self.assertEqual(self.Model_mock.get_status.call_count, 1)
+
+    def test_zaza_model_deltas(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        zaza_model = model.get_zaza_model('modelname')
+        on_change = self.Model_mock.add_observer.call_args[0][0]
+        self.assertEqual(
+            self.Model_mock.add_observer.call_args[1],
+            {'entity_type': 'unit'})
+        zaza_model.update_leaders()
+        unit3 = mock.MagicMock()
+        model.run(on_change(
+            self._unit_delta('add', {'name': 'app/5', 'machine-id': '7'}),
+            None, unit3, self.Model_mock))
+        model.run(on_change(
+            self._unit_delta('change', {'name': 'app/4', 'machine-id': '7'}),
+            self.unit2, self.unit2, self.Model_mock))
+        self.assertIs(zaza_model.get_unit('app/5'), unit3)
+        self.assertEqual(zaza_model.get_units_on_machine('7'),
+                         [self.unit2, unit3])
+        self.assertEqual(zaza_model.leaders, {'app': 'app/4', 'sub': 'sub/0'})
+        model.run(on_change(
+            self._unit_delta('remove', {'name': 'app/5', 'machine-id': '7'}),
+            unit3, unit3, self.Model_mock))
+        self.assertEqual(zaza_model.units,
+                         {'app/2': self.unit1, 'app/4': self.unit2})
+        self.assertEqual(zaza_model.get_units_on_machine('7'), [self.unit2])
+        self.assertEqual(zaza_model.leaders, {'app': 'app/4', 'sub': 'sub/0'})
+        model.run(on_change(
+            self._unit_delta('remove', {'name': 'app/4', 'machine-id': '7'}),
+            self.unit2, self.unit2, self.Model_mock))
+        self.assertEqual(zaza_model.leaders, {'sub': 'sub/0'})
+        self.assertEqual(zaza_model.machine_units,
+                         {'3': {'app/2': self.unit1}})
+        self.assertEqual(zaza_model.unit_machines, {'app/2': '3'})
+
+    def test_zaza_model_unit_moves_machine(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        zaza_model = model.get_zaza_model('modelname')
+        on_change = self.Model_mock.add_observer.call_args[0][0]
+        model.run(on_change(
+            self._unit_delta('change', {'name': 'app/2', 'machine-id': '7'}),
+            self.unit1, self.unit1, self.Model_mock))
+        self.assertEqual(zaza_model.get_units_on_machine('3'), [])
+        self.assertEqual(zaza_model.get_units_on_machine('7'),
+                         [self.unit1, self.unit2])
+        self.assertEqual(zaza_model.machine_units,
+                         {'7': {'app/2': self.unit1, 'app/4': self.unit2}})
+        self.assertEqual(zaza_model.unit_machines,
+                         {'app/2': '7', 'app/4': '7'})
+
+    def test_zaza_model_leader_lost(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        zaza_model = model.get_zaza_model('modelname')
+        on_change = self.Model_mock.add_observer.call_args[0][0]
+        self.status.applications['app']['units']['app/2']['leader'] = True
+        zaza_model.update_leaders()
+        model.run(on_change(
+            self._unit_delta('change', {'name': 'app/4', 'machine-id': '7',
+                                        'agent-status': {'current': 'lost'}}),
+            self.unit2, self.unit2, self.Model_mock))
+        self.assertEqual(zaza_model.leaders, {'sub': 'sub/0'})
+        zaza_model.update_leaders()
+        model.run(on_change(
+            self._unit_delta('change', {'name': 'app/4', 'machine-id': '7',
+                                        'life': 'dying'}),
+            self.unit2, self.unit2, self.Model_mock))
+        self.assertEqual(zaza_model.leaders, {'sub': 'sub/0'})
+
+    def test_zaza_model_leaders_from_status(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        sub_unit = mock.MagicMock()
+        sub_unit.safe_data = {'machine-id': None}
+        self.Model_mock.units['sub/0'] = sub_unit
+        zaza_model = model.get_zaza_model('modelname')
+        self.assertEqual(zaza_model.leaders, {})
+        self.assertIs(zaza_model.get_leader('app'), self.unit2)
+        self.assertIs(zaza_model.get_leader('sub'), sub_unit)
+        self.assertEqual(self.Model_mock.get_status.call_count, 1)
+        zaza_model.invalidate_leader('sub')
+        self.assertEqual(zaza_model.leaders, {'app': 'app/4'})
+        self.assertIs(zaza_model.get_leader('sub'), sub_unit)
+        self.assertEqual(self.Model_mock.get_status.call_count, 2)
+        zaza_model.invalidate_leader()
+        self.assertEqual(zaza_model.leaders, {})
+
+    def test_zaza_model_leader_ttl(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        self.patch_object(model.time, 'monotonic', return_value=100)
+        zaza_model = model.get_zaza_model('modelname')
+        self.assertIs(zaza_model.get_leader('app'), self.unit2)
+        # Leadership moves without any unit delta saying so
+        app_units = self.status.applications['app']['units']
+        app_units['app/2']['leader'] = True
+        app_units['app/4']['leader'] = False
+        self.monotonic.return_value = 100 + model.DEFAULT_LEADER_TTL
+        self.assertIs(zaza_model.get_leader('app'), self.unit2)
+        self.assertEqual(self.Model_mock.get_status.call_count, 1)
+        self.monotonic.return_value = 101 + model.DEFAULT_LEADER_TTL
+        self.assertIs(zaza_model.get_leader('app'), self.unit1)
+        self.assertEqual(self.Model_mock.get_status.call_count, 2)
+        self.assertIs(zaza_model.get_leader('app', refresh=True), self.unit1)
+        self.assertEqual(self.Model_mock.get_status.call_count, 3)
+
+    def test_get_leader_unit(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        self.assertIs(model.get_leader_unit('modelname', 'app'), self.unit2)
+        self.assertIs(model.get_leader_unit('modelname', 'app'), self.unit2)
+        self.assertEqual(self.Model_mock.get_status.call_count, 1)
+
+    def test_zaza_model_unit_not_indexed(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        zaza_model = model.get_zaza_model('modelname')
+        unit3 = mock.MagicMock()
+        unit3.safe_data = {'machine-id': '9'}
+        self.Model_mock.units['app/5'] = unit3
+        self.assertIs(zaza_model.get_unit('app/5'), unit3)
+        self.assertEqual(zaza_model.get_units_on_machine('9'), [unit3])
+        with self.assertRaises(KeyError):
+            zaza_model.get_unit('app/6')
+
+    def test_zaza_model_reconnect(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        zaza_model = model.get_zaza_model('modelname')
+        new_model = mock.MagicMock()
+        new_model.units = {'app/2': self.unit1}
+        model.MODEL_POOL['modelname'] = new_model
+        self.assertEqual(zaza_model.get_units_on_machine('7'), [])
+        self.assertIs(zaza_model.model, new_model)
+        self.assertTrue(new_model.add_observer.called)
+
     def test_run_action(self):
         self.patch_object(model, 'Model')
-        self.patch_object(model, 'get_unit_from_name')
-        self.get_unit_from_name.return_value = self.unit1
         self.Model.return_value = self.Model_mock
-        model.run_action('app/2', 'modelname', 'backup',
+        model.run_action('modelname', 'app/2', 'backup',
                          {'backup_dir': '/dev/null'})
         self.unit1.run_action.assert_called_once_with(
             'backup',
@@ -205,25 +595,43 @@ class TestModel(ut_utils.BaseTestCase):
         model.run_action_on_leader('modelname', 'app', 'backup',
                                    {'backup_dir': '/dev/null'})
         self.assertFalse(self.unit1.called)
+        self.assertFalse(self.unit1.is_leader_from_status.called)
+        self.assertFalse(self.unit2.is_leader_from_status.called)
         self.unit2.run_action.assert_called_once_with(
             'backup',
             backup_dir='/dev/null')
 
-    def _application_states_setup(self, setup, units_idle=True):
-        self.system_ready = True
+    def test_run_action_on_leader_moved(self):
+        self.patch_object(model, 'Model')
+        self.Model.return_value = self.Model_mock
+        failed_action = mock.MagicMock()
+        failed_action.status = 'failed'
+        failed_action.wait.side_effect = self.run_action.wait.side_effect
 
-        async def _block_until(f, timeout=None):
-            result = f()
-            if not result:
-                self.system_ready = False
-            return
+        async def _run_failed_action(command, **params):
+            # The leader has moved since it was cached
+            app_units = self.status.applications['app']['units']
+            app_units['app/2']['leader'] = True
+            app_units['app/4']['leader'] = False
+            return failed_action
 
-        async def _all_units_idle():
-            return units_idle
-        self.Model_mock.block_until.side_effect = _block_until
+        self.unit2.run_action.side_effect = _run_failed_action
+        self.assertIs(
+            model.run_action_on_leader('modelname', 'app', 'backup',
+                                       {'backup_dir': '/dev/null'}),
+            self.run_action)
+        self.unit2.run_action.assert_called_once_with(
+            'backup',
+            backup_dir='/dev/null')
+        self.unit1.run_action.assert_called_once_with(
+            'backup',
+            backup_dir='/dev/null')
+        self.assertEqual(self.Model_mock.get_status.call_count, 2)
+
+    def _application_states_setup(self, setup, units_idle=True):
         self.patch_object(model, 'Model')
         self.Model.return_value = self.Model_mock
-        self.Model_mock.all_units_idle.return_value = _all_units_idle
+        self.Model_mock.all_units_idle.return_value = units_idle
         p_mock_ws = mock.PropertyMock(
             return_value=setup['workload-status'])
         p_mock_wsmsg = mock.PropertyMock(
@@ -261,6 +669,21 @@ class TestModel(ut_utils.BaseTestCase):
         with self.assertRaises(model.UnitError):
             model.check_model_for_hard_errors(self.Model_mock)
 
+    def test_get_unit_errors(self):
+        unit1 = mock.MagicMock(workload_status='error',
+                               workload_status_message='hook failed')
+        unit2 = mock.MagicMock(workload_status='unknown',
+                               agent_status='error',
+                               agent_status_message='lost')
+        unit3 = mock.MagicMock(workload_status='active',
+                               agent_status='idle')
+        juju_model = mock.MagicMock()
+        juju_model.units = {'app/0': unit1, 'app/1': unit2, 'app/2': unit3}
+        self.assertEqual(
+            model.get_unit_errors(juju_model),
+            {'app/0': 'workload error: hook failed',
+             'app/1': 'agent error: lost'})
+
     def test_check_unit_workload_status(self):
         self.patch_object(model, 'check_model_for_hard_errors')
         self._application_states_setup({
@@ -321,26 +744,194 @@ class TestModel(ut_utils.BaseTestCase):
                 self.unit1,
                 prefixes=('Readyish', 'Unit is ready')))
 
+    def test_units_pending_application_states(self):
+        self._application_states_setup({
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready'})
+        self.assertEqual(
+            model.units_pending_application_states(
+                self.Model_mock, {}, ('Unit is ready',)),
+            {})
+        self.assertEqual(
+            model.units_pending_application_states(
+                self.Model_mock,
+                {'app': {'workload-status': 'blocked'}},
+                ('Unit is ready',)),
+            {'app/2': 'active: Unit is ready',
+             'app/4': 'active: Unit is ready'})
+
+    def test_units_pending_application_states_applications(self):
+        self._application_states_setup({
+            'workload-status': 'blocked',
+            'workload-status-message': 'Unit is ready'})
+        self.assertEqual(
+            model.units_pending_application_states(
+                self.Model_mock, {}, ('Unit is ready',),
+                applications=['otherapp']),
+            {'otherapp': 'not in model'})
+        self.assertEqual(
+            model.units_pending_application_states(
+                self.Model_mock, {}, ('Unit is ready',),
+                applications=['app']),
+            {'app/2': 'blocked: Unit is ready',
+             'app/4': 'blocked: Unit is ready'})
+
+    def test_units_idle(self):
+        self._application_states_setup({
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready'})
+        self.unit1.agent_status = 'idle'
+        self.unit2.agent_status = 'executing'
+        self.assertTrue(model.units_idle(self.Model_mock))
+        self.assertFalse(
+            model.units_idle(self.Model_mock, applications=['app']))
+        self.assertFalse(
+            model.units_idle(self.Model_mock, applications=['otherapp']))
+        self.unit2.agent_status = 'idle'
+        self.assertTrue(
+            model.units_idle(self.Model_mock, applications=['app']))
+
+    def test_units_pending_application_states_error(self):
+        self._application_states_setup({
+            'workload-status': 'error',
+            'workload-status-message': 'hook failed'})
+        with self.assertRaises(model.UnitError):
+            model.units_pending_application_states(
+                self.Model_mock, {}, ('Unit is ready',))
+
     def test_wait_for_application_states(self):
         self._application_states_setup({
             'workload-status': 'active',
             'workload-status-message': 'Unit is ready'})
         model.wait_for_application_states('modelname', timeout=1)
-        self.assertTrue(self.system_ready)
+        self.assertTrue(self.Model_mock.add_observer.called)
+
+    def test_wait_for_application_states_applications(self):
+        self._application_states_setup({
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready'},
+            units_idle=False)
+        self.unit1.agent_status = 'idle'
+        self.unit2.agent_status = 'idle'
+        model.wait_for_application_states('modelname', timeout=1,
+                                          applications=['app'])
+        with self.assertRaises(asyncio.TimeoutError):
+            model.wait_for_application_states('modelname', timeout=0.1,
+                                              applications=['otherapp'])
+
+    def test_wait_for_application_states_deployed(self):
+        self._application_states_setup({
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready'})
+
+        async def _test():
+            deployed = asyncio.Event()
+            wait = asyncio.ensure_future(
+                model.async_wait_for_application_states(
+                    'modelname', timeout=5, deployed=deployed))
+            await asyncio.sleep(0.05)
+            # The units are idle and ready but the deploy has not finished
+            self.assertFalse(wait.done())
+            # Hooks for relations added last are still running
+            self.Model_mock.all_units_idle.return_value = False
+            deployed.set()
+            await asyncio.sleep(0.05)
+            self.assertFalse(wait.done())
+            self.Model_mock.all_units_idle.return_value = True
+            on_change = self.Model_mock.add_observer.call_args[0][0]
+            await on_change(None, None, None, self.Model_mock)
+            await asyncio.wait_for(wait, 1)
+        model.run(_test())
+
+    def _config_change_setup(self, hook_runs=True):
+        self._application_states_setup({
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready'})
+        self.patch_object(model, 'async_wait_for_application_states')
+        calls = []
+
+        async def _wait(model_name, states, timeout=None,
+                        applications=None):
+            calls.append('wait')
+
+        async def _set_config(configuration):
+            calls.append('set_config')
+            if not hook_runs:
+                return
+            on_change = self.Model_mock.add_observer.call_args[0][0]
+            for data in [
+                    {'application': 'otherapp',
+                     'agent-status': {'current': 'executing',
+                                      'message': 'running config-changed '
+                                                 'hook'}},
+                    {'application': 'app',
+                     'agent-status': {'current': 'executing',
+                                      'message': 'running update-status '
+                                                 'hook'}}]:
+                delta = mock.MagicMock()
+                delta.data = data
+                await on_change(delta, None, None, self.Model_mock)
+                calls.append('not applied')
+            delta = mock.MagicMock()
+            delta.data = {'application': 'app',
+                          'agent-status': {
+                              'current': 'executing',
+                              'message': 'running config-changed hook'}}
+            await on_change(delta, None, None, self.Model_mock)
+
+        self.async_wait_for_application_states.side_effect = _wait
+        self.mymodel.applications['app'].set_config.side_effect = _set_config
+        return calls
+
+    def test_set_application_config_and_wait(self):
+        calls = self._config_change_setup()
+        self.patch_object(model.logging, 'warning')
+        model.set_application_config_and_wait(
+            'modelname', 'app', {'key': 'value'}, change_timeout=0.5)
+        self.assertFalse(self.warning.called)
+        self.mymodel.applications['app'].set_config.assert_called_once_with(
+            {'key': 'value'})
+        self.assertEqual(
+            calls, ['set_config', 'not applied', 'not applied', 'wait'])
+        self.async_wait_for_application_states.assert_called_once_with(
+            'modelname', None, timeout=2700, applications=['app'])
+
+    def test_set_application_config_and_wait_no_hook(self):
+        calls = self._config_change_setup(hook_runs=False)
+        self.patch_object(model.logging, 'warning')
+        model.set_application_config_and_wait(
+            'modelname', 'app', {'key': 'value'}, change_timeout=0.1)
+        self.assertEqual(calls, ['set_config', 'wait'])
+        self.assertTrue(self.warning.called)
+
+    def test_wait_for_application_states_not_idle(self):
+        self._application_states_setup({
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready'},
+            units_idle=False)
+        with self.assertRaises(asyncio.TimeoutError):
+            model.wait_for_application_states('modelname', timeout=0.1)
 
     def test_wait_for_application_states_not_ready_ws(self):
         self._application_states_setup({
             'workload-status': 'blocked',
             'workload-status-message': 'Unit is ready'})
-        model.wait_for_application_states('modelname', timeout=1)
-        self.assertFalse(self.system_ready)
+        with self.assertRaises(asyncio.TimeoutError):
+            model.wait_for_application_states('modelname', timeout=0.1)
 
     def test_wait_for_application_states_not_ready_wsmsg(self):
         self._application_states_setup({
             'workload-status': 'active',
             'workload-status-message': 'Unit is not ready'})
-        model.wait_for_application_states('modelname', timeout=1)
-        self.assertFalse(self.system_ready)
+        with self.assertRaises(asyncio.TimeoutError):
+            model.wait_for_application_states('modelname', timeout=0.1)
+
+    def test_wait_for_application_states_error(self):
+        self._application_states_setup({
+            'workload-status': 'error',
+            'workload-status-message': 'hook failed: "install"'})
+        with self.assertRaises(model.UnitError):
+            model.wait_for_application_states('modelname', timeout=1)
 
     def test_wait_for_application_states_blocked_ok(self):
         self._application_states_setup({
@@ -351,7 +942,6 @@ class TestModel(ut_utils.BaseTestCase):
             states={'app': {
                 'workload-status': 'blocked'}},
             timeout=1)
-        self.assertTrue(self.system_ready)
 
     def test_wait_for_application_states_bespoke_msg(self):
         self._application_states_setup({
@@ -362,7 +952,6 @@ class TestModel(ut_utils.BaseTestCase):
             states={'app': {
                 'workload-status-message': 'Sure, I could do something'}},
             timeout=1)
-        self.assertTrue(self.system_ready)
 
     def test_wait_for_application_states_bespoke_msg_bloked_ok(self):
         self._application_states_setup({
@@ -374,7 +963,6 @@ class TestModel(ut_utils.BaseTestCase):
                 'workload-status': 'blocked',
                 'workload-status-message': 'Sure, I could do something'}},
             timeout=1)
-        self.assertTrue(self.system_ready)
 
     def test_get_current_model(self):
         self.patch_object(model, 'Model')
@@ -443,3 +1031,51 @@ class AsyncModelTests(aiounittest.AsyncTestCase):
             return True
 
         await model.async_block_until(_f, _g, timeout=0.1)
+
+    async def test_async_fan_out_concurrency(self):
+        running = []
+        peak = []
+
+        async def _f(unit):
+            running.append(unit)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(unit)
+            return unit.entity_id
+
+        units = []
+        for i in range(5):
+            unit = mock.MagicMock()
+            unit.entity_id = 'app/{}'.format(i)
+            units.append(unit)
+        results = await model.async_fan_out(units, _f, concurrency=2)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(results, {u.entity_id: u.entity_id for u in units})
+
+    async def test_async_wait_for_application_states_on_change(self):
+        unit = mock.MagicMock()
+        unit.entity_id = 'app/0'
+        unit.workload_status = 'maintenance'
+        unit.workload_status_message = 'Installing'
+        app = mock.MagicMock()
+        app.units = [unit]
+        juju_model = mock.MagicMock()
+        juju_model.applications = {'app': app}
+        juju_model.units = {'app/0': unit}
+        juju_model.all_units_idle.return_value = True
+
+        async def _get_model(model_name):
+            return juju_model
+
+        with mock.patch.object(model, 'async_get_model',
+                               side_effect=_get_model):
+            waiter = asyncio.ensure_future(
+                model.async_wait_for_application_states('modelname',
+                                                        timeout=1))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            unit.workload_status = 'active'
+            unit.workload_status_message = 'Unit is ready'
+            on_change = juju_model.add_observer.call_args[0][0]
+            await on_change(None, None, None, juju_model)
+            await asyncio.wait_for(waiter, 0.5)
@@ -0,0 +1,45 @@
+import unit_tests.utils as ut_utils
+import zaza.model
+from zaza.utilities import benchmark
+
+
+class TestBenchmark(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestBenchmark, self).setUp()
+        self.patch_object(zaza.model, 'MODEL_POOL', new={})
+
+    def test_get_applications(self):
+        self.assertEqual(benchmark.get_applications(25, 10), {
+            'app0': 10,
+            'app1': 10,
+            'app2': 5})
+
+    def test_benchmark_model(self):
+        results = benchmark.benchmark_model(4, units_per_application=2,
+                                            settle_steps=2,
+                                            settle_interval=0.01)
+        self.assertEqual(results['units'], 4)
+        self.assertEqual(
+            results['helpers']['get_status']['calls']['Client.FullStatus'],
+            1)
+        # The model's AllWatcher may be waiting on a Next call at any time
+        settled_calls = results['helpers'][
+            'wait_for_application_states (settled)']['calls']
+        settled_calls.pop('AllWatcher.Next', None)
+        self.assertEqual(settled_calls, {})
+        indexed_calls = results['helpers'][
+            'ZazaModel.get_unit (all units)']['calls']
+        indexed_calls.pop('AllWatcher.Next', None)
+        self.assertEqual(indexed_calls, {})
+        self.assertGreater(results['memory'], 0)
+        self.assertGreaterEqual(results['settle_detection_lag'], 0)
+        self.assertIn('4 units, latency 0s', benchmark.format_results(
+            [results]))
+
+    def test_parser(self):
+        args = benchmark.parse_args([])
+        self.assertEqual(args.unit_counts, benchmark.DEFAULT_UNIT_COUNTS)
+        args = benchmark.parse_args(['--units', '5,50', '--latency', '0.1'])
+        self.assertEqual(args.unit_counts, [5, 50])
+        self.assertEqual(args.latency, 0.1)
@@ -0,0 +1,102 @@
+import mock
+import os
+import sys
+
+import unit_tests.utils as ut_utils
+import zaza.model
+from zaza.utilities import fake_juju
+
+
+class TestFakeJuju(ut_utils.BaseTestCase):
+
+    def setUp(self):
+        super(TestFakeJuju, self).setUp()
+        self.patch_object(zaza.model, 'MODEL_POOL', new={})
+        self.patch_object(zaza.model, 'ZAZA_MODEL_POOL', new={})
+        self.fake_model = fake_juju.FakeModel(
+            'fakemodel',
+            {'app': 2, 'otherapp': 1},
+            workload_status='maintenance',
+            workload_status_message='Installing',
+            agent_status='executing')
+
+    def test_get_fake_agent_version(self):
+        connector = mock.MagicMock(spec=['SUPPORTED_JUJU_API_PREFIX'])
+        connector.SUPPORTED_JUJU_API_PREFIX = '2.9.'
+        version = mock.MagicMock(spec=['CLIENT_VERSION'])
+        version.CLIENT_VERSION = '3.5.2.0'
+        with mock.patch.dict('sys.modules', {
+                'juju.client.connector': connector,
+                'juju.version': version}):
+            self.assertEqual(fake_juju.get_fake_agent_version(), '2.9.0')
+            # libjuju 3 has no prefix and checks the major version
+            sys.modules['juju.client.connector'] = mock.MagicMock(spec=[])
+            self.assertEqual(fake_juju.get_fake_agent_version(), '3.5.0')
+            sys.modules['juju.version'] = mock.MagicMock(spec=[])
+            self.assertEqual(fake_juju.get_fake_agent_version(), '2.4.0')
+
+    def test_fake_model_deltas(self):
+        deltas = self.fake_model.deltas_since(0)
+        self.assertEqual(
+            sorted((d[0], d[2].get('name', d[2].get('id'))) for d in deltas),
+            [('application', 'app'), ('application', 'otherapp'),
+             ('machine', '0'), ('machine', '1'), ('machine', '2'),
+             ('unit', 'app/0'), ('unit', 'app/1'), ('unit', 'otherapp/0')])
+        # Like Juju, leadership is only reported by the model status
+        self.assertFalse([d for d in deltas if 'leader' in d[2]])
+        revision = self.fake_model.revision
+        self.assertEqual(self.fake_model.deltas_since(revision), [])
+        self.assertEqual(
+            self.fake_model.update({'app': {'agent-status': 'idle'}}),
+            ['app/0', 'app/1'])
+        self.assertEqual(
+            [(d[1], d[2]['name'], d[2]['agent-status']['current'])
+             for d in self.fake_model.deltas_since(revision)],
+            [('change', 'app/1', 'idle'), ('change', 'app/0', 'idle')])
+        revision = self.fake_model.revision
+        self.fake_model.remove_unit('app/1')
+        self.assertEqual(
+            [(d[1], d[2]['name'])
+             for d in self.fake_model.deltas_since(revision)],
+            [('remove', 'app/1')])
+        self.assertEqual(self.fake_model.units, ['otherapp/0', 'app/0'])
+
+    def test_settle_script(self):
+        script = fake_juju.settle_script(self.fake_model, steps=2,
+                                         interval=0.5)
+        self.assertEqual([delay for delay, _ in script], [0.5, 0.5])
+        self.assertEqual(sorted(script[0][1]), ['app/0', 'otherapp/0'])
+        self.assertEqual(script[1][1]['app/1'], {
+            'workload-status': 'active',
+            'workload-status-message': 'Unit is ready',
+            'agent-status': 'idle'})
+
+    def test_fake_controller(self):
+        with fake_juju.FakeController([self.fake_model]) as controller:
+            self.assertEqual(os.environ['JUJU_DATA'], controller.juju_data)
+            try:
+                model = zaza.model.get_model('fakemodel')
+                self.assertEqual(model.info.name, 'fakemodel')
+                self.assertEqual(
+                    sorted(model.units), ['app/0', 'app/1', 'otherapp/0'])
+                status = zaza.model.get_status('fakemodel')
+                self.assertEqual(
+                    status.applications['app']['units']['app/1'][
+                        'workload-status']['status'],
+                    'maintenance')
+                self.assertEqual(
+                    zaza.model.get_leader_unit('fakemodel', 'app').name,
+                    'app/0')
+                controller.reset_calls()
+                played = controller.play(
+                    'fakemodel',
+                    fake_juju.settle_script(self.fake_model, interval=0.01))
+                zaza.model.wait_for_application_states('fakemodel',
+                                                       timeout=30)
+                played.result(timeout=5)
+                self.assertEqual(list(controller.calls), ['AllWatcher.Next'])
+                self.assertEqual(
+                    model.units['app/1'].workload_status, 'active')
+            finally:
+                zaza.model.disconnect_models()
+        self.assertIsNone(controller.juju_data)
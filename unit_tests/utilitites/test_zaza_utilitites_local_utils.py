@@ -22,8 +22,11 @@ class TestLocalUtils(ut_utils.BaseTestCase):
             "subordinate-to": [self.application]}
         self.juju_status = mock.MagicMock()
         self.juju_status.name = "juju_status_object"
-        self.juju_status.applications.get.return_value = self.application_data
-        self.juju_status.machines.get.return_value = self.machine_data
+        self.juju_status.applications = {
+            self.application: self.application_data,
+            self.subordinate_application: self.subordinate_application_data}
+        self.juju_status.machines = {self.machine: self.machine_data}
+        self.patch_object(_local_utils, "STATUS_SNAPSHOTS", new={})
 
         # Model
         self.patch_object(_local_utils, "model")
@@ -116,14 +119,34 @@ class TestLocalUtils(ut_utils.BaseTestCase):
         self.assertEqual(_local_utils.get_full_juju_status(), self.juju_status)
         self.model.get_status.assert_called_once_with(self.model_name)
 
-    def test_get_application_status(self):
-        self.patch_object(_local_utils, "get_full_juju_status")
-        self.get_full_juju_status.return_value = self.juju_status
+    def test_get_status_snapshot(self):
+        snapshot = _local_utils.get_status_snapshot()
+        self.assertEqual(snapshot.status, self.juju_status)
+        self.assertEqual(snapshot.application(self.application),
+                         self.application_data)
+        self.assertEqual(snapshot.unit(self.unit), self.unit_data)
+        self.assertEqual(snapshot.machine(self.machine), self.machine_data)
+
+        # Snapshot is reused until it expires or is invalidated
+        self.assertEqual(_local_utils.get_status_snapshot(), snapshot)
+        self.model.get_status.assert_called_once_with(self.model_name)
+        _local_utils.invalidate_status_snapshot()
+        self.assertNotEqual(_local_utils.get_status_snapshot(), snapshot)
+        self.assertEqual(self.model.get_status.call_count, 2)
+        snapshot = _local_utils.get_status_snapshot()
+        snapshot.created -= _local_utils.STATUS_SNAPSHOT_TTL + 1
+        self.assertNotEqual(_local_utils.get_status_snapshot(), snapshot)
+        self.assertEqual(self.model.get_status.call_count, 3)
+
+    def test_status_snapshot_subordinate_units(self):
+        self.unit_data["subordinates"] = {"sub/0": {"leader": True}}
+        snapshot = _local_utils.StatusSnapshot(self.juju_status)
+        self.assertEqual(snapshot.unit("sub/0"), {"leader": True})
 
+    def test_get_application_status(self):
         # Full status juju object return
         self.assertEqual(
             _local_utils.get_application_status(), self.juju_status)
-        self.get_full_juju_status.assert_called_once()
 
         # Application only dictionary return
         self.assertEqual(
@@ -134,21 +157,19 @@ class TestLocalUtils(ut_utils.BaseTestCase):
         self.assertEqual(
             _local_utils.get_application_status(unit=self.unit),
             self.unit_data)
+        self.model.get_status.assert_called_once_with(self.model_name)
 
     def test_get_machine_status(self):
-        self.patch_object(_local_utils, "get_full_juju_status")
-        self.get_full_juju_status.return_value = self.juju_status
-
         # All machine data
         self.assertEqual(
             _local_utils.get_machine_status(self.machine),
             self.machine_data)
-        self.get_full_juju_status.assert_called_once()
 
         # Request a specific key
         self.assertEqual(
             _local_utils.get_machine_status(self.machine, self.key),
             self.key_data)
+        self.model.get_status.assert_called_once_with(self.model_name)
 
     def test_get_machines_for_application(self):
         self.patch_object(_local_utils, "get_application_status")
@@ -175,11 +196,42 @@ class TestLocalUtils(ut_utils.BaseTestCase):
             [self.machine])
 
     def test_get_machine_uuids_for_application(self):
-        self.patch_object(_local_utils, "get_machines_for_application")
-        self.get_machines_for_application.return_value = [self.machine]
-
         self.assertEqual(
             _local_utils.get_machine_uuids_for_application(self.application),
             [self.machine_data.get("instance-id")])
-        self.get_machines_for_application.assert_called_once_with(
-            self.application)
+        self.model.get_status.assert_called_once_with(self.model_name)
+
+    def test_remote_run(self):
+        self.model.run_on_unit.return_value = {
+            "Code": "0", "Stdout": "RESULT", "Stderr": ""}
+        self.assertEqual(_local_utils.remote_run(self.unit, "cmd"), "RESULT")
+        self.model.run_on_unit.assert_called_once_with(
+            self.model_name, self.unit, "cmd", timeout=None)
+
+        # Failed command
+        self.model.run_on_unit.return_value = {
+            "Code": "1", "Stdout": "", "Stderr": "ERROR"}
+        with self.assertRaises(Exception):
+            _local_utils.remote_run(self.unit, "cmd")
+        self.assertEqual(
+            _local_utils.remote_run(self.unit, "cmd", fatal=False), "ERROR")
+
+    def test_get_pkg_version(self):
+        _dpkg_out = "ii  keystone  2:13.0.0-0ubuntu1  all  OpenStack\n"
+        self.model.run_on_application.return_value = {
+            "keystone/0": {"Code": "0", "Stdout": _dpkg_out, "Stderr": ""},
+            "keystone/1": {"Code": "0", "Stdout": _dpkg_out, "Stderr": ""}}
+        self.assertEqual(
+            _local_utils.get_pkg_version("keystone", "keystone"),
+            "2:13.0.0-0ubuntu1")
+        self.model.run_on_application.assert_called_once_with(
+            self.model_name, "keystone", "dpkg -l | grep keystone",
+            timeout=None)
+
+        # Mismatched versions
+        self.model.run_on_application.return_value["keystone/1"] = {
+            "Code": "0",
+            "Stdout": "ii  keystone  2:12.0.0-0ubuntu1  all  OpenStack\n",
+            "Stderr": ""}
+        with self.assertRaises(Exception):
+            _local_utils.get_pkg_version("keystone", "keystone")
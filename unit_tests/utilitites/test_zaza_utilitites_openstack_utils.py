@@ -138,6 +138,107 @@ class TestOpenStackUtils(ut_utils.BaseTestCase):
         self.neutronclient.create_network.assert_called_once_with(
             network_msg)
 
+    def test_find_neutron_resource(self):
+        self.assertEqual(
+            openstack_utils.find_neutron_resource(
+                self.neutronclient, "networks", self.ext_net),
+            self.network["network"])
+        self.neutronclient.list_networks.assert_called_once_with(
+            name=self.ext_net)
+        self.neutronclient.list_networks.return_value = {"networks": []}
+        self.assertIsNone(openstack_utils.find_neutron_resource(
+            self.neutronclient, "networks", self.ext_net))
+
+    def test_add_neutron_secgroup_rules(self):
+        secgroup = {"id": "secgroup_id",
+                    "name": "default",
+                    "tenant_id": self.project_id,
+                    "security_group_rules": [
+                        {"port_range_min": 22, "protocol": "tcp"}]}
+        self.neutronclient.list_security_groups.return_value = {
+            "security_groups": [secgroup]}
+        openstack_utils.add_neutron_secgroup_rules(
+            self.neutronclient, self.project_id)
+        self.neutronclient.create_security_group_rule.assert_called_once_with(
+            {"security_group_rule": {"security_group_id": "secgroup_id",
+                                     "protocol": "icmp",
+                                     "direction": "ingress"}})
+
+        # No default security group for the project
+        with self.assertRaises(Exception):
+            openstack_utils.add_neutron_secgroup_rules(
+                self.neutronclient, "other_project")
+
+    def test_configure_gateway_ext_port(self):
+        self.patch_object(openstack_utils, "get_gateway_uuids",
+                          return_value=["uuid1", "uuid2", "uuid3"])
+        self.patch_object(openstack_utils, "deprecated_external_networking",
+                          return_value=False)
+        self.patch_object(openstack_utils, "get_application_config_option",
+                          return_value="")
+        self.patch_object(openstack_utils.lifecycle_utils, "get_juju_model",
+                          return_value="modelname")
+        self.patch_object(openstack_utils.model,
+                          "set_application_config_and_wait")
+        self.patch_object(openstack_utils._local_utils,
+                          "invalidate_status_snapshot")
+        servers = {}
+        for uuid in ["uuid2", "uuid3"]:
+            servers[uuid] = mock.MagicMock()
+            servers[uuid].id = uuid
+            servers[uuid].name = "{}-name".format(uuid)
+        novaclient = mock.MagicMock()
+        novaclient.servers.get.side_effect = lambda uuid: servers[uuid]
+        neutronclient = mock.MagicMock()
+        neutronclient.list_ports.return_value = {"ports": [
+            {"id": "port1", "name": "uuid1-name_ext-port",
+             "device_id": "uuid1", "mac_address": "mac1"},
+            {"id": "port2", "name": "uuid2-name_ext-port",
+             "device_id": "", "mac_address": "mac2"},
+            {"id": "other", "name": "other",
+             "device_id": "uuid1", "mac_address": "mac0"}]}
+        neutronclient.create_port.return_value = {"ports": [
+            {"id": "port3", "name": "uuid3-name_ext-port",
+             "device_id": "", "mac_address": "mac3"}]}
+        openstack_utils.configure_gateway_ext_port(
+            novaclient, neutronclient, net_id="net_id")
+        neutronclient.list_ports.assert_called_once_with(network_id="net_id")
+        self.assertEqual(
+            sorted(c[0][0] for c in novaclient.servers.get.call_args_list),
+            ["uuid2", "uuid3"])
+        neutronclient.create_port.assert_called_once_with(body={"ports": [{
+            "admin_state_up": True,
+            "name": "uuid3-name_ext-port",
+            "network_id": "net_id",
+            "port_security_enabled": False}]})
+        servers["uuid2"].interface_attach.assert_called_once_with(
+            port_id="port2", net_id=None, fixed_ip=None)
+        servers["uuid3"].interface_attach.assert_called_once_with(
+            port_id="port3", net_id=None, fixed_ip=None)
+        self.set_application_config_and_wait.assert_called_once_with(
+            "modelname", "neutron-gateway",
+            configuration={"data-port": "br-ex:mac1 br-ex:mac2 br-ex:mac3"})
+
+    def test_configure_gateway_ext_port_configured(self):
+        self.patch_object(openstack_utils, "get_gateway_uuids",
+                          return_value=["uuid1"])
+        self.patch_object(openstack_utils, "deprecated_external_networking",
+                          return_value=True)
+        self.patch_object(openstack_utils, "get_application_config_option",
+                          return_value="mac1")
+        self.patch_object(openstack_utils.model,
+                          "set_application_config_and_wait")
+        novaclient = mock.MagicMock()
+        neutronclient = mock.MagicMock()
+        neutronclient.list_ports.return_value = {"ports": [
+            {"id": "port1", "name": "uuid1-name_ext-port",
+             "device_id": "uuid1", "mac_address": "mac1"}]}
+        openstack_utils.configure_gateway_ext_port(
+            novaclient, neutronclient, net_id="net_id")
+        self.assertFalse(novaclient.servers.get.called)
+        self.assertFalse(neutronclient.create_port.called)
+        self.assertFalse(self.set_application_config_and_wait.called)
+
     def test_get_keystone_scope(self):
         self.patch_object(openstack_utils, "get_current_os_versions")
 
@@ -149,6 +250,13 @@ class TestOpenStackUtils(ut_utils.BaseTestCase):
         self.assertEqual(openstack_utils.get_keystone_scope(), "PROJECT")
 
     def test_get_overcloud_keystone_session(self):
+        self.patch_object(openstack_utils, "KEYSTONE_SESSIONS", new={})
+        self.patch_object(openstack_utils.lifecycle_utils, "get_juju_model",
+                          return_value="modelname")
+        self.patch_object(openstack_utils, "get_keystone_config",
+                          return_value={"vip": "10.0.0.10"})
+        self.patch_object(openstack_utils, "get_current_os_versions",
+                          return_value={"keystone": "queens"})
         self.patch_object(openstack_utils, "get_keystone_session")
         self.patch_object(openstack_utils, "get_keystone_scope")
         self.patch_object(openstack_utils, "get_overcloud_auth")
@@ -159,8 +267,49 @@ class TestOpenStackUtils(ut_utils.BaseTestCase):
 
         openstack_utils.get_overcloud_keystone_session()
         self.get_keystone_session.assert_called_once_with(_auth, scope=_scope)
+        self.get_overcloud_auth.assert_called_once_with(
+            keystone_config={"vip": "10.0.0.10"}, os_version="queens")
+        self.get_keystone_scope.assert_called_once_with(os_version="queens")
+
+    def test_get_overcloud_keystone_session_cached(self):
+        self.patch_object(openstack_utils, "KEYSTONE_SESSIONS", new={})
+        self.patch_object(openstack_utils.lifecycle_utils, "get_juju_model",
+                          return_value="modelname")
+        self.patch_object(openstack_utils, "get_keystone_config",
+                          return_value={"vip": "10.0.0.10"})
+        self.patch_object(openstack_utils, "get_current_os_versions",
+                          return_value={"keystone": "queens"})
+        self.patch_object(openstack_utils, "get_keystone_scope")
+        self.patch_object(openstack_utils, "get_overcloud_auth")
+        self.patch_object(openstack_utils, "get_keystone_session")
+        self.get_keystone_session.side_effect = ["session1", "session2",
+                                                 "session3", "session4"]
+        self.assertEqual(
+            openstack_utils.get_overcloud_keystone_session(), "session1")
+        self.assertEqual(
+            openstack_utils.get_overcloud_keystone_session(), "session1")
+        self.get_current_os_versions.assert_called_once_with("keystone")
+        # A change to the keystone config replaces the session
+        self.get_keystone_config.return_value = {"vip": "10.0.0.11"}
+        self.assertEqual(
+            openstack_utils.get_overcloud_keystone_session(), "session2")
+        self.assertEqual(
+            openstack_utils.get_overcloud_keystone_session(), "session2")
+        # Sessions are kept per model
+        self.get_juju_model.return_value = "othermodel"
+        self.assertEqual(
+            openstack_utils.get_overcloud_keystone_session(), "session3")
+        openstack_utils.invalidate_keystone_sessions("othermodel")
+        self.assertEqual(
+            list(openstack_utils.KEYSTONE_SESSIONS.keys()),
+            [("modelname", "overcloud")])
+        openstack_utils.invalidate_keystone_sessions()
+        self.assertEqual(openstack_utils.KEYSTONE_SESSIONS, {})
 
     def test_get_undercloud_keystone_session(self):
+        self.patch_object(openstack_utils, "KEYSTONE_SESSIONS", new={})
+        self.patch_object(openstack_utils.lifecycle_utils, "get_juju_model",
+                          return_value="modelname")
         self.patch_object(openstack_utils, "get_keystone_session")
         self.patch_object(openstack_utils, "get_keystone_scope")
         self.patch_object(openstack_utils, "get_undercloud_auth")
@@ -171,3 +320,84 @@ class TestOpenStackUtils(ut_utils.BaseTestCase):
 
         openstack_utils.get_undercloud_keystone_session()
         self.get_keystone_session.assert_called_once_with(_auth, scope=_scope)
+        openstack_utils.get_undercloud_keystone_session()
+        self.get_keystone_session.assert_called_once_with(_auth, scope=_scope)
+
+    def test_get_os_code_info(self):
+        self.assertEqual(
+            openstack_utils.get_os_code_info('keystone', '2:13.0.0-0ubuntu1'),
+            'queens')
+        self.assertEqual(
+            openstack_utils.get_os_code_info('nova-common', '2015.1.0'),
+            'kilo')
+
+    def test_get_current_os_versions(self):
+        self.patch_object(openstack_utils.lifecycle_utils, "get_juju_model",
+                          return_value="modelname")
+        self.patch_object(openstack_utils.model, "async_run_on_application")
+        pkg_versions = {
+            'keystone': '2:13.0.0-0ubuntu1',
+            'nova-common': '2:17.0.1-0ubuntu1'}
+        runs = []
+
+        async def _run_on_application(model_name, application, command):
+            runs.append((model_name, application, command))
+            pkg = command.split()[-1]
+            return {
+                '{}/{}'.format(application, i): {
+                    'Code': '0',
+                    'Stdout': pkg_versions[pkg],
+                    'Stderr': ''}
+                for i in range(2)}
+
+        self.async_run_on_application.side_effect = _run_on_application
+        self.assertEqual(
+            openstack_utils.get_current_os_versions(
+                ['keystone', 'nova-compute', 'vault']),
+            {'keystone': 'queens', 'nova-compute': 'queens'})
+        self.assertEqual(
+            sorted(runs),
+            [('modelname', 'keystone',
+              "dpkg-query -W -f='${Version}' keystone"),
+             ('modelname', 'nova-compute',
+              "dpkg-query -W -f='${Version}' nova-common")])
+
+    def test_get_current_os_versions_mismatch(self):
+        self.patch_object(openstack_utils.model, "async_run_on_application")
+
+        async def _run_on_application(model_name, application, command):
+            return {
+                'keystone/0': {'Code': '0', 'Stdout': '2:13.0.0-0ubuntu1'},
+                'keystone/1': {'Code': '0', 'Stdout': '2:12.0.0-0ubuntu1'}}
+
+        self.async_run_on_application.side_effect = _run_on_application
+        with self.assertRaises(Exception):
+            openstack_utils.get_current_os_versions(
+                'keystone', model_name='modelname')
+
+    def test_get_keystone_config(self):
+        self.patch_object(openstack_utils.lifecycle_utils, "get_juju_model",
+                          return_value="modelname")
+        self.patch_object(openstack_utils.model, "get_application_config")
+        self.get_application_config.return_value = {
+            "vip": {"value": "10.0.0.10"},
+            "use-https": {"value": "no"}}
+        self.assertEqual(
+            openstack_utils.get_keystone_config(),
+            {"vip": "10.0.0.10", "use-https": "no"})
+        self.get_application_config.assert_called_once_with(
+            "modelname", "keystone")
+
+    def test_get_overcloud_auth(self):
+        self.patch_object(openstack_utils, "get_keystone_config")
+        self.patch_object(openstack_utils, "get_current_os_versions")
+        auth = openstack_utils.get_overcloud_auth(
+            keystone_config={
+                "vip": "10.0.0.10",
+                "use-https": "no",
+                "preferred-api-version": 2},
+            os_version="mitaka")
+        self.assertEqual(auth["OS_AUTH_URL"], "http://10.0.0.10:5000/v2.0")
+        self.assertEqual(auth["API_VERSION"], 2)
+        self.assertFalse(self.get_keystone_config.called)
+        self.assertFalse(self.get_current_os_versions.called)
@@ -39,6 +39,19 @@ def patch_open():
         yield mock_open, mock_file
 
 
+class ModelContext(object):
+    '''Async context manager standing in for zaza.model.run_in_model.'''
+
+    def __init__(self, model):
+        self.model = model
+
+    async def __aenter__(self):
+        return self.model
+
+    async def __aexit__(self, *args):
+        return False
+
+
 class BaseTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import subprocess
+import time
+
+# Phases run for each bundle, in order
+PHASES = ['prepare', 'deploy', 'configure', 'test']
+# Environment variable naming the directory checkpoints are kept in
+CHECKPOINT_DIR_ENV = 'ZAZA_CHECKPOINT_DIR'
+DEFAULT_CHECKPOINT_DIR = './tests/.checkpoints'
+
+
+def get_checkpoint_file(bundle):
+    """Return the path of the checkpoint file for a bundle
+
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :returns: Path to checkpoint file
+    :rtype: str
+    """
+    return os.path.join(
+        os.path.expanduser(
+            os.environ.get(CHECKPOINT_DIR_ENV, DEFAULT_CHECKPOINT_DIR)),
+        '{}.json'.format(bundle))
+
+
+def save(bundle, model_name, phases, leased_model=False):
+    """Record the phases completed for a bundle
+
+    The file is replaced atomically so that a run killed part way through
+    writing it leaves the previous checkpoint in place.
+
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :param model_name: Name of model the bundle is being run in
+    :type model_name: str
+    :param phases: Phases which have completed
+    :type phases: [str, str,...]
+    :param leased_model: Whether the model was leased from the model pool
+    :type leased_model: boolean
+    """
+    checkpoint_file = get_checkpoint_file(bundle)
+    os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+    tmp_file = '{}.tmp'.format(checkpoint_file)
+    with open(tmp_file, 'w') as fh:
+        json.dump({
+            'bundle': bundle,
+            'model_name': model_name,
+            'phases': [p for p in PHASES if p in phases],
+            'leased_model': leased_model,
+            'updated': time.time()}, fh, indent=2, sort_keys=True)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def load(bundle):
+    """Return the checkpoint for a bundle
+
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :returns: Checkpoint with the 'model_name', completed 'phases' and
+              whether the model was leased, or None if there is none
+    :rtype: dict or None
+    """
+    try:
+        with open(get_checkpoint_file(bundle), 'r') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logging.warning("Ignoring unreadable checkpoint for bundle {}"
+                        .format(bundle))
+        return None
+
+
+def clear(bundle):
+    """Remove the checkpoint for a bundle
+
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    """
+    try:
+        os.remove(get_checkpoint_file(bundle))
+    except FileNotFoundError:
+        pass
+
+
+def model_exists(model_name):
+    """Return whether the model is known to the current controller
+
+    :param model_name: Name of model
+    :type model_name: str
+    :returns: Whether the model exists
+    :rtype: boolean
+    """
+    return subprocess.call(
+        ['juju', 'show-model', model_name],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL) == 0
+
+
+def get_resume_point(bundle):
+    """Return the checkpoint to resume a bundle from
+
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :returns: Checkpoint, or None if the bundle should be run from the start
+    :rtype: dict or None
+    """
+    resume_point = load(bundle)
+    if not resume_point:
+        return None
+    if not model_exists(resume_point['model_name']):
+        logging.warning(
+            "Model {} from the checkpoint of bundle {} no longer exists, "
+            "starting again".format(resume_point['model_name'], bundle))
+        clear(bundle)
+        return None
+    logging.info("Resuming bundle {} in model {}, phases done: {}".format(
+        bundle,
+        resume_point['model_name'],
+        ', '.join(resume_point['phases']) or 'none'))
+    return resume_point
@@ -0,0 +1,258 @@
+import argparse
+from concurrent import futures
+import io
+import logging
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+import yaml
+
+import zaza.charm_lifecycle.timing as timing
+
+# Paths copied from every machine, the service logs live alongside the juju
+# agent logs under /var/log
+DEFAULT_LOG_PATHS = ['/var/log']
+# Paths under DEFAULT_LOG_PATHS which are not worth copying
+DEFAULT_EXCLUDE_PATHS = ['/var/log/journal']
+# Maximum number of machines to copy logs from at once
+DEFAULT_COLLECT_CONCURRENCY = 8
+DEFAULT_ARTIFACT_FILE = '{model_name}-artifacts.tar.gz'
+# Bytes of a remote file held in memory before it is spooled to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+def get_machines(status):
+    """Return the ids of the machines and containers in the model
+
+    :param status: Juju status of the model
+    :type status: dict
+    :returns: Machine ids
+    :rtype: [str, str,...]
+    """
+    machine_ids = []
+
+    def _add(machines):
+        for machine_id, machine in sorted((machines or {}).items()):
+            machine_ids.append(machine_id)
+            _add(machine.get('containers'))
+    _add(status.get('machines'))
+    return machine_ids
+
+
+def add_bytes(tar, lock, name, data):
+    """Add data to the tarball as a file with the given name
+
+    :param tar: Tarball to add file to
+    :type tar: tarfile.TarFile
+    :param lock: Lock serialising writes to the tarball
+    :type lock: threading.Lock
+    :param name: Name of file in tarball
+    :type name: str
+    :param data: Contents of file
+    :type data: bytes
+    """
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    member.mtime = time.time()
+    with lock:
+        tar.addfile(member, io.BytesIO(data))
+
+
+def get_remote_tar_command(paths, exclude_paths=None):
+    """Return a command which writes a gzipped tar of paths to stdout
+
+    :param paths: Paths to include
+    :type paths: [str, str,...]
+    :param exclude_paths: Paths to leave out
+    :type exclude_paths: [str, str,...]
+    :returns: Shell command
+    :rtype: str
+    """
+    cmd = ['sudo', 'tar', '-czf', '-', '--ignore-failed-read',
+           '--warning=no-file-changed']
+    for path in exclude_paths or []:
+        cmd.append('--exclude={}'.format(path.lstrip('/')))
+    cmd.extend(['-C', '/'])
+    cmd.extend([path.lstrip('/') for path in paths])
+    return ' '.join(cmd)
+
+
+def collect_machine_logs(model_name, machine, tar, lock,
+                         paths=None, exclude_paths=None):
+    """Stream logs from a machine into the tarball
+
+    The machine tars up the paths and writes them to the ssh session. Each
+    file is read from the session into a spool file, so that machines copy
+    at the same time, and then added to the tarball under machine-<id>/.
+
+    :param model_name: Name of model
+    :type model_name: str
+    :param machine: Id of machine
+    :type machine: str
+    :param tar: Tarball to add files to
+    :type tar: tarfile.TarFile
+    :param lock: Lock serialising writes to the tarball
+    :type lock: threading.Lock
+    :param paths: Paths to copy
+    :type paths: [str, str,...]
+    :param exclude_paths: Paths to leave out
+    :type exclude_paths: [str, str,...]
+    :returns: Number of files copied
+    :rtype: int
+    """
+    if paths is None:
+        paths = DEFAULT_LOG_PATHS
+    if exclude_paths is None:
+        exclude_paths = DEFAULT_EXCLUDE_PATHS
+    prefix = 'machine-{}'.format(machine.replace('/', '-'))
+    proc = subprocess.Popen(
+        ['juju', 'ssh', '--pty=false', '-m', model_name, machine,
+         get_remote_tar_command(paths, exclude_paths)],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL)
+    copied = 0
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode='r|gz') as remote_tar:
+            for member in remote_tar:
+                with tempfile.SpooledTemporaryFile(
+                        max_size=SPOOL_MAX_SIZE) as spool:
+                    fileobj = None
+                    if member.isreg():
+                        # Only the write to the tarball holds the lock, not
+                        # the transfer from the machine
+                        shutil.copyfileobj(
+                            remote_tar.extractfile(member), spool)
+                        spool.seek(0)
+                        fileobj = spool
+                    elif member.islnk():
+                        member.linkname = '{}/{}'.format(
+                            prefix, member.linkname)
+                    member.name = '{}/{}'.format(prefix, member.name)
+                    with lock:
+                        tar.addfile(member, fileobj)
+                copied += 1
+    except tarfile.TarError as e:
+        logging.warning("Failed to read logs from machine {}: {}".format(
+            machine, e))
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+    if returncode != 0:
+        logging.warning("Copying logs from machine {} exited with code {}"
+                        .format(machine, returncode))
+    logging.info("Collected {} files from machine {}".format(copied, machine))
+    return copied
+
+
+def collect_debug_log(model_name, tar, lock):
+    """Add the whole debug-log of the model to the tarball
+
+    :param model_name: Name of model
+    :type model_name: str
+    :param tar: Tarball to add file to
+    :type tar: tarfile.TarFile
+    :param lock: Lock serialising writes to the tarball
+    :type lock: threading.Lock
+    """
+    with tempfile.TemporaryFile() as fh:
+        subprocess.check_call(
+            ['juju', 'debug-log', '-m', model_name, '--replay', '--no-tail'],
+            stdout=fh)
+        member = tarfile.TarInfo('debug-log.txt')
+        member.size = fh.tell()
+        member.mtime = time.time()
+        fh.seek(0)
+        with lock:
+            tar.addfile(member, fh)
+
+
+def collect(model_name, output=None, paths=None, exclude_paths=None,
+            concurrency=DEFAULT_COLLECT_CONCURRENCY):
+    """Collect the logs, juju status and debug-log of a model into a tarball
+
+    Logs are copied from up to concurrency machines at once. A failure to
+    collect from one machine is logged and does not stop the others.
+
+    :param model_name: Name of model
+    :type model_name: str
+    :param output: Tarball to write, defaults to
+                   <model_name>-artifacts.tar.gz
+    :type output: str
+    :param paths: Paths to copy from each machine
+    :type paths: [str, str,...]
+    :param exclude_paths: Paths to leave out
+    :type exclude_paths: [str, str,...]
+    :param concurrency: Maximum number of machines to copy from at once
+    :type concurrency: int
+    :returns: Path to tarball
+    :rtype: str
+    """
+    output = output or DEFAULT_ARTIFACT_FILE.format(model_name=model_name)
+    logging.info("Collecting artifacts from model {} into {}".format(
+        model_name, output))
+    lock = threading.Lock()
+    with timing.timed('collect', model=model_name), \
+            tarfile.open(output, 'w:gz') as tar:
+        try:
+            status = subprocess.check_output(
+                ['juju', 'status', '-m', model_name, '--format', 'yaml'])
+        except subprocess.CalledProcessError:
+            logging.exception("Failed to get status of model {}".format(
+                model_name))
+            status = b''
+        add_bytes(tar, lock, 'juju-status.yaml', status)
+        machines = get_machines(yaml.safe_load(status) or {})
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            jobs = {
+                executor.submit(collect_debug_log, model_name, tar, lock):
+                    'debug-log'}
+            for machine in machines:
+                job = executor.submit(
+                    collect_machine_logs, model_name, machine, tar, lock,
+                    paths=paths, exclude_paths=exclude_paths)
+                jobs[job] = 'machine {}'.format(machine)
+            for job in futures.as_completed(jobs):
+                if job.exception():
+                    logging.error("Failed to collect {}: {}".format(
+                        jobs[job], job.exception()))
+    return output
+
+
+def parse_args(args):
+    """Parse command line arguments
+
+    :param args: List of configure functions functions
+    :type list: [str1, str2,...] List of command line arguments
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model-name', help='Name of model to collect',
+                        required=True)
+    parser.add_argument('-o', '--output',
+                        help='Tarball to write, defaults to '
+                             '<model name>-artifacts.tar.gz',
+                        required=False)
+    parser.add_argument('-p', '--path', dest='paths', action='append',
+                        help='Path to copy from each machine, may be given '
+                             'more than once. Defaults to /var/log',
+                        required=False)
+    parser.add_argument('-c', '--concurrency', type=int,
+                        help='Number of machines to copy from at once',
+                        required=False)
+    parser.set_defaults(concurrency=DEFAULT_COLLECT_CONCURRENCY)
+    return parser.parse_args(args)
+
+
+def main():
+    """Collect artifacts from a model"""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(sys.argv[1:])
+    collect(args.model_name, output=args.output, paths=args.paths,
+            concurrency=args.concurrency)
@@ -1,29 +1,251 @@
-import asyncio
 import argparse
+import collections
+from concurrent import futures
 import logging
 import sys
+import threading
+import time
 
+import zaza.charm_lifecycle.error_watcher as error_watcher
+import zaza.charm_lifecycle.timing as timing
 import zaza.charm_lifecycle.utils as utils
+import zaza.model
 
+# Maximum number of configure functions to run at once
+DEFAULT_CONFIGURE_WORKERS = 4
 
-def run_configure_list(functions):
-    """Run the configure scripts as defined in the list of test classes in
-       series.
+
+def get_configure_graph(functions):
+    """Return the configure functions with the entries each depends on
+
+    A function given as a string depends on every entry before it, so a plain
+    list runs in series as it always has, and the same function may be listed
+    more than once. A function given as a dict declares its own dependencies
+    and runs as soon as they have finished, eg:
+
+        configure:
+          - zaza.charm_tests.vault.setup.auto_initialize
+          - zaza.charm_tests.neutron.setup.basic_overcloud_network:
+              depends: []
+          - zaza.charm_tests.dragent.configure.setup:
+              depends:
+                - zaza.charm_tests.neutron.setup.basic_overcloud_network
+
+    A dependency names the closest entry before it for that function, or the
+    first one after it if there is none before.
+
+    :param functions: List of configure functions
+    :type functions: [str or {str: {'depends': [str, ...]}}, ...]
+    :returns: Each configure function, in list order, with the positions in
+              the list of the entries it depends on
+    :rtype: [(str, [int, ...]), ...]
+    :raises: ValueError if a dependency is unknown or there is a cycle
+    """
+    entries = []
+    for entry in functions:
+        if isinstance(entry, dict):
+            for func, options in entry.items():
+                depends = (options or {}).get('depends') or []
+                if isinstance(depends, str):
+                    depends = [depends]
+                entries.append((func, list(depends)))
+        else:
+            entries.append((entry, None))
+    positions = collections.defaultdict(list)
+    for index, (func, _) in enumerate(entries):
+        positions[func].append(index)
+    graph = []
+    for index, (func, depends) in enumerate(entries):
+        if depends is None:
+            graph.append((func, list(range(index))))
+            continue
+        dependency_indexes = []
+        for dependency in depends:
+            if dependency not in positions:
+                raise ValueError(
+                    "Configure function {} depends on unknown function {}"
+                    .format(func, dependency))
+            earlier = [i for i in positions[dependency] if i < index]
+            later = [i for i in positions[dependency] if i > index]
+            dependency_indexes.append(earlier[-1] if earlier else later[0])
+        graph.append((func, dependency_indexes))
+    done = set()
+    remaining = set(range(len(graph)))
+    while remaining:
+        ready = [i for i in remaining if done.issuperset(graph[i][1])]
+        if not ready:
+            raise ValueError("Configure functions have circular dependencies: "
+                             "{}".format(', '.join(sorted(
+                                 set(graph[i][0] for i in remaining)))))
+        done.update(ready)
+        remaining.difference_update(ready)
+    return graph
+
+
+def run_configure_step(func):
+    """Run a configure function and record how long it took
+
+    :param func: Configure function
+    :type func: str
+    :returns: Timing event of the function
+    :rtype: dict
+    """
+    start = time.time()
+    outcome = 'fail'
+    try:
+        utils.get_class(func)()
+        outcome = 'pass'
+    finally:
+        event = timing.record('configure_step', str(func), start, time.time(),
+                              outcome)
+    return event
+
+
+def log_configure_report(events, start):
+    """Log when each configure function started and how long it took
+
+    :param events: Timing event of each configure function which ran
+    :type events: [dict, ...]
+    :param start: Start time of the configure phase
+    :type start: float
+    """
+    logging.info("Configure step timings:")
+    for event in sorted(events, key=lambda e: e['start']):
+        logging.info("  {:>8.1f}s +{:<8.1f}s {} {}".format(
+            event['start'] - start, event['duration'], event['outcome'],
+            event['name']))
+
+
+def is_configure_chain(graph):
+    """Return whether the functions of a graph can only run one at a time
+
+    :param graph: Each configure function with the positions in the graph
+                  of the entries it depends on, see get_configure_graph
+    :type graph: [(str, [int, ...]), ...]
+    :returns: Whether each entry depends on the one before it
+    :rtype: bool
+    """
+    return all(index - 1 in depends
+               for index, (_, depends) in enumerate(graph) if index)
+
+
+def _run_cancellable_step(func, cancel):
+    with zaza.model.cancel_on(cancel):
+        return run_configure_step(func)
+
+
+def _run_configure_inline(graph, events):
+    done = set()
+    while len(done) < len(graph):
+        index = min(i for i, (_, depends) in enumerate(graph)
+                    if i not in done and done.issuperset(depends))
+        try:
+            events.append(run_configure_step(graph[index][0]))
+        except Exception as e:
+            logging.error("Configure function {} failed: {}".format(
+                graph[index][0], e))
+            return [e]
+        done.add(index)
+    return []
+
+
+def _run_configure_parallel(graph, workers, events):
+    done = set()
+    running = {}
+    errors = []
+    cancel = threading.Event()
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            if not errors:
+                for index, (func, depends) in enumerate(graph):
+                    if (index not in done and
+                            index not in running.values() and
+                            done.issuperset(depends)):
+                        with error_watcher.abort_deferred():
+                            running[executor.submit(
+                                _run_cancellable_step, func, cancel)] = index
+            if not running:
+                break
+            # Wait in steps so that an abort signal is handled promptly, see
+            # zaza.model.run
+            finished, _ = futures.wait(
+                running, timeout=zaza.model.CANCEL_CHECK_INTERVAL,
+                return_when=futures.FIRST_COMPLETED)
+            for job in finished:
+                index = running.pop(job)
+                try:
+                    events.append(job.result())
+                    done.add(index)
+                except Exception as e:
+                    logging.error("Configure function {} failed: {}".format(
+                        graph[index][0], e))
+                    errors.append(e)
+    except BaseException:
+        # The phase is being aborted, stop the running functions rather than
+        # leave them acting on the model
+        cancel.set()
+        if running:
+            logging.info("Waiting for configure functions to stop: {}".format(
+                ', '.join(graph[index][0] for index in running.values())))
+        raise
+    finally:
+        executor.shutdown(wait=True)
+    return errors
+
+
+def run_configure_graph(graph, workers=DEFAULT_CONFIGURE_WORKERS):
+    """Run the configure functions as soon as their dependencies finish
+
+    Up to workers functions run at once. If a function fails no more are
+    started, those already running are left to finish and the first error
+    is raised.
+
+    A graph which is a chain, such as a plain list, or workers of 1, runs in
+    the calling thread, so an aborted phase interrupts the running function.
+    Otherwise the functions run on worker threads and an aborted phase
+    cancels them at their next zaza.model call, see zaza.model.cancel_on, and
+    waits for them to stop.
+
+    :param graph: Each configure function with the positions in the graph
+                  of the entries it depends on, see get_configure_graph
+    :type graph: [(str, [int, ...]), ...]
+    :param workers: Maximum number of functions to run at once
+    :type workers: int
+    """
+    start = time.time()
+    events = []
+    if workers == 1 or is_configure_chain(graph):
+        errors = _run_configure_inline(graph, events)
+    else:
+        errors = _run_configure_parallel(graph, workers, events)
+    log_configure_report(events, start)
+    if errors:
+        raise errors[0]
+
+
+def run_configure_list(functions, workers=DEFAULT_CONFIGURE_WORKERS):
+    """Run the configure scripts as defined in the list of test classes,
+       running functions which do not depend on each other at the same time.
 
     :param functions: List of configure functions functions
     :type tests: ['zaza.charms_tests.svc.setup', ...]
+    :param workers: Maximum number of functions to run at once
+    :type workers: int
     """
-    for func in functions:
-        utils.get_class(func)()
+    run_configure_graph(get_configure_graph(functions), workers=workers)
 
 
-def configure(model_name, functions):
+def configure(model_name, functions, workers=DEFAULT_CONFIGURE_WORKERS):
     """Run all post-deployment configuration steps
 
     :param functions: List of configure functions functions
-    :type tests: ['zaza.charms_tests.svc.setup', ...]"""
+    :type tests: ['zaza.charms_tests.svc.setup', ...]
+    :param workers: Maximum number of functions to run at once
+    :type workers: int"""
     utils.set_juju_model(model_name)
-    run_configure_list(functions)
+    with timing.timed('configure', model=model_name):
+        run_configure_list(functions, workers=workers)
 
 
 def parse_args(args):
@@ -40,6 +262,10 @@ def parse_args(args):
                         required=False)
     parser.add_argument('-m', '--model-name', help='Name of model to remove',
                         required=True)
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Number of configure functions to run at once',
+                        required=False)
+    parser.set_defaults(workers=DEFAULT_CONFIGURE_WORKERS)
     return parser.parse_args(args)
 
 
@@ -50,5 +276,5 @@ def main():
     logging.basicConfig(level=logging.INFO)
     args = parse_args(sys.argv[1:])
     funcs = args.configfuncs or utils.get_charm_config()['configure']
-    configure(args.model_name, funcs)
-    asyncio.get_event_loop().close()
+    configure(args.model_name, funcs, workers=args.workers)
+    zaza.model.shutdown()
@@ -1,15 +1,26 @@
 import argparse
+import asyncio
+import collections
+import copy
+import hashlib
 import jinja2
+import json
 import logging
 import os
 import subprocess
 import sys
 import tempfile
+import time
+import yaml
 
 import zaza.model
+import zaza.charm_lifecycle.timing as timing
 import zaza.charm_lifecycle.utils as utils
 
 DEFAULT_OVERLAY_TEMPLATE_DIR = 'tests/bundles/overlays'
+# Rendered overlays are kept in a subdirectory of this directory named after
+# the hashes of the template and the context used to render it
+DEFAULT_OVERLAY_CACHE_DIR = '~/.cache/zaza/overlays'
 VALID_ENVIRONMENT_KEY_PREFIXES = [
     'FIP_RANGE',
     'GATEWAY',
@@ -23,6 +34,19 @@ applications:
   {{ charm_name }}:
     charm: {{ charm_location }}
 """
+LOCAL_OVERLAY_NAME = 'local-charm-overlay.yaml'
+
+# Jinja2 environments keyed on template directory
+JINJA2_ENVS = {}
+# Template context, compiled local overlay template and hashes of them which
+# only need to be worked out once per run. Cleared by reset_render_cache.
+RENDER_CACHE = {}
+
+
+def reset_render_cache():
+    """Forget the cached jinja2 environments, templates and context"""
+    JINJA2_ENVS.clear()
+    RENDER_CACHE.clear()
 
 
 def is_valid_env_key(key):
@@ -67,16 +91,34 @@ def get_charm_config_context():
 def get_template_overlay_context():
     """Combine contexts which can be used for overlay template rendering
 
+    The context is only worked out on the first call, later calls return the
+    same context.
+
     :returns: Context for template rendering
     :rtype: dict
     """
-    context = {}
-    contexts = [
-        get_template_context_from_env(),
-        get_charm_config_context()]
-    for c in contexts:
-        context.update(c)
-    return context
+    if 'context' not in RENDER_CACHE:
+        context = {}
+        contexts = [
+            get_template_context_from_env(),
+            get_charm_config_context()]
+        for c in contexts:
+            context.update(c)
+        RENDER_CACHE['context'] = context
+    return RENDER_CACHE['context']
+
+
+def get_template_overlay_context_hash():
+    """Return a hash of the context used for overlay template rendering
+
+    :returns: Hex digest of the context
+    :rtype: str
+    """
+    if 'context_hash' not in RENDER_CACHE:
+        RENDER_CACHE['context_hash'] = hashlib.sha256(json.dumps(
+            get_template_overlay_context(),
+            sort_keys=True).encode()).hexdigest()
+    return RENDER_CACHE['context_hash']
 
 
 def get_overlay_template_dir():
@@ -88,16 +130,32 @@ def get_overlay_template_dir():
     return DEFAULT_OVERLAY_TEMPLATE_DIR
 
 
+def get_overlay_cache_dir():
+    """Return the directory to keep rendered overlays in.
+
+    :returns: Overlay cache dir
+    :rtype: str
+    """
+    return os.path.expanduser(DEFAULT_OVERLAY_CACHE_DIR)
+
+
 def get_jinja2_env():
     """Return a jinja2 environment that can be used to render templates from.
 
+    One environment is created per template directory and reused, so
+    templates are only compiled once per run. Compiled templates are also
+    kept in a bytecode cache for use by later runs.
+
     :returns: Jinja2 template loader
     :rtype: jinja2.Environment
     """
     template_dir = get_overlay_template_dir()
-    return jinja2.Environment(
-        loader=jinja2.FileSystemLoader(template_dir)
-    )
+    if template_dir not in JINJA2_ENVS:
+        JINJA2_ENVS[template_dir] = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(template_dir),
+            bytecode_cache=jinja2.FileSystemBytecodeCache()
+        )
+    return JINJA2_ENVS[template_dir]
 
 
 def get_template_name(target_file):
@@ -126,6 +184,33 @@ def get_template(target_file):
     return template
 
 
+def get_template_hash(target_file):
+    """Return a hash of the source of the template for the given file
+
+    :param target_file: File to be rendered
+    :type target_file: str
+    :returns: Hex digest of the template source
+    :rtype: str
+    """
+    jinja2_env = get_jinja2_env()
+    source, _, _ = jinja2_env.loader.get_source(
+        jinja2_env,
+        get_template_name(target_file))
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def get_local_overlay_template():
+    """Return the compiled local overlay template
+
+    :returns: Template object used to generate the local overlay
+    :rtype: jinja2.Template
+    """
+    if 'local_template' not in RENDER_CACHE:
+        RENDER_CACHE['local_template'] = jinja2.Environment(
+            loader=jinja2.BaseLoader).from_string(LOCAL_OVERLAY_TEMPLATE)
+    return RENDER_CACHE['local_template']
+
+
 def render_template(template, target_file):
     """Render the template to the file supplied
 
@@ -139,12 +224,44 @@ def render_template(template, target_file):
             template.render(get_template_overlay_context()))
 
 
-def render_overlay(overlay_name, target_dir):
+def render_cached_template(template, template_hash, overlay_name):
+    """Render the template into the overlay cache unless already rendered
+
+    Rendered overlays are stored under the hashes of the template and the
+    template context, so an overlay rendered from the same template with the
+    same context is reused.
+
+    :param template: Template to be rendered
+    :type template: jinja2.Template
+    :param template_hash: Hash of the template source
+    :type template_hash: str
+    :param overlay_name: File name for rendered template
+    :type overlay_name: str
+    :returns: Path to rendered overlay
+    :rtype: str
+    """
+    target_dir = os.path.join(
+        get_overlay_cache_dir(),
+        '{}-{}'.format(template_hash[:16],
+                       get_template_overlay_context_hash()[:16]))
+    rendered_template_file = os.path.join(target_dir, overlay_name)
+    if not os.path.exists(rendered_template_file):
+        os.makedirs(target_dir, exist_ok=True)
+        # Render to a temporary file first so that other runs never see a
+        # partially written overlay.
+        tmp_file = '{}.{}.tmp'.format(rendered_template_file, os.getpid())
+        render_template(template, tmp_file)
+        os.rename(tmp_file, rendered_template_file)
+    return rendered_template_file
+
+
+def render_overlay(overlay_name, target_dir=None):
     """Render the overlay template in the directory supplied
 
     :param overlay_name: Name of overlay to be rendered
     :type overlay_name: str
-    :param target_dir: Directory to render overlay in
+    :param target_dir: Directory to render overlay in, defaults to the
+                       overlay cache
     :type overlay_name: str
     :returns: Path to rendered overlay
     :rtype: str
@@ -152,6 +269,11 @@ def render_overlay(overlay_name, target_dir):
     template = get_template(overlay_name)
     if not template:
         return
+    if not target_dir:
+        return render_cached_template(
+            template,
+            get_template_hash(overlay_name),
+            os.path.basename(overlay_name))
     rendered_template_file = os.path.join(
         target_dir,
         os.path.basename(overlay_name))
@@ -159,29 +281,35 @@ def render_overlay(overlay_name, target_dir):
     return rendered_template_file
 
 
-def render_local_overlay(target_dir):
+def render_local_overlay(target_dir=None):
     """Render the local overlay template in the directory supplied
 
-    :param target_dir: Directory to render overlay in
+    :param target_dir: Directory to render overlay in, defaults to the
+                       overlay cache
     :type overlay_name: str
     :returns: Path to rendered overlay
     :rtype: str
     """
-    template = jinja2.Environment(loader=jinja2.BaseLoader).from_string(
-        LOCAL_OVERLAY_TEMPLATE)
+    template = get_local_overlay_template()
+    if not target_dir:
+        return render_cached_template(
+            template,
+            hashlib.sha256(LOCAL_OVERLAY_TEMPLATE.encode()).hexdigest(),
+            LOCAL_OVERLAY_NAME)
     rendered_template_file = os.path.join(
         target_dir,
-        os.path.basename('local-charm-overlay.yaml'))
+        os.path.basename(LOCAL_OVERLAY_NAME))
     render_template(template, rendered_template_file)
     return rendered_template_file
 
 
-def render_overlays(bundle, target_dir):
+def render_overlays(bundle, target_dir=None):
     """Render the overlays for the given bundle in the directory provided
 
     :param bundle: Name of bundle being deployed
     :type bundle: str
-    :param target_dir: Directory to render overlay in
+    :param target_dir: Directory to render overlay in, defaults to the
+                       overlay cache
     :type overlay_name: str
     :returns: List of rendered overlays
     :rtype: [str, str,...]
@@ -203,13 +331,229 @@ def deploy_bundle(bundle, model):
     """
     logging.info("Deploying bundle {}".format(bundle))
     cmd = ['juju', 'deploy', '-m', model, bundle]
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        for overlay in render_overlays(bundle, tmpdirname):
-            cmd.extend(['--overlay', overlay])
-        subprocess.check_call(cmd)
+    for overlay in render_overlays(bundle):
+        cmd.extend(['--overlay', overlay])
+    subprocess.check_call(cmd)
+
+
+def is_local_charm(charm):
+    """Return whether the charm of a bundle application is a local path
+
+    :param charm: Charm of application
+    :type charm: str
+    :returns: Whether the charm is a path
+    :rtype: bool
+    """
+    return charm.startswith(('.', '/', '~'))
+
+
+def merge_overlay(bundle_data, overlay_data):
+    """Apply an overlay to a bundle, as juju deploy --overlay does
+
+    Applications in the overlay are merged key by key into those of the
+    bundle, with the config options of an application merged option by
+    option. An application set to null in the overlay is removed along with
+    its relations. Relations are added to those of the bundle and any other
+    top level key replaces the one in the bundle.
+
+    :param bundle_data: Bundle, which is modified in place
+    :type bundle_data: dict
+    :param overlay_data: Overlay to apply
+    :type overlay_data: dict
+    :returns: The bundle
+    :rtype: dict
+    """
+    apps_key = 'services' if 'services' in bundle_data else 'applications'
+    apps = bundle_data.setdefault(apps_key, {})
+    for key, value in (overlay_data or {}).items():
+        if key in ('applications', 'services'):
+            for app_name, app in (value or {}).items():
+                if app is None:
+                    apps.pop(app_name, None)
+                    bundle_data['relations'] = [
+                        r for r in bundle_data.get('relations', [])
+                        if not any(e.split(':')[0] == app_name for e in r)]
+                    continue
+                merged = apps.setdefault(app_name, {})
+                for app_key, app_value in app.items():
+                    if (isinstance(app_value, dict) and
+                            isinstance(merged.get(app_key), dict)):
+                        merged[app_key].update(app_value)
+                    else:
+                        merged[app_key] = copy.deepcopy(app_value)
+        elif key == 'relations':
+            relations = bundle_data.setdefault('relations', [])
+            for relation in value or []:
+                if relation not in relations:
+                    relations.append(relation)
+        else:
+            bundle_data[key] = copy.deepcopy(value)
+    return bundle_data
+
+
+def get_merged_bundle(bundle, overlays):
+    """Return the bundle with the overlays applied
+
+    Relative local charm paths, in the bundle and the overlays, are relative
+    to the directory of the bundle, as they are for juju deploy. They are
+    made absolute so that the bundle can be deployed from anywhere.
+
+    :param bundle: Path to bundle file
+    :type bundle: str
+    :param overlays: Paths to overlay files
+    :type overlays: [str, str,...]
+    :returns: Bundle
+    :rtype: dict
+    """
+    with open(bundle, 'r') as fh:
+        bundle_data = yaml.safe_load(fh) or {}
+    for overlay in overlays:
+        with open(overlay, 'r') as fh:
+            merge_overlay(bundle_data, yaml.safe_load(fh))
+    bundle_dir = os.path.dirname(os.path.abspath(bundle))
+    apps = bundle_data.get('applications', bundle_data.get('services', {}))
+    for app in apps.values():
+        charm = app.get('charm')
+        if charm and is_local_charm(charm):
+            app['charm'] = os.path.normpath(
+                os.path.join(bundle_dir, os.path.expanduser(charm)))
+    return bundle_data
+
+
+def get_bundle_applications(bundle_data):
+    """Return the names of the applications in a bundle
+
+    :param bundle_data: Bundle
+    :type bundle_data: dict
+    :returns: Application names
+    :rtype: [str, str,...]
+    """
+    return sorted(
+        bundle_data.get('applications', bundle_data.get('services', {})))
+
+
+def get_application_progress(model, application):
+    """Return a summary of how far through deployment an application is
+
+    :param model: Model object to check in
+    :type model: juju.Model
+    :param application: Name of application
+    :type application: str
+    :returns: Number of units of the application in each workload status
+    :rtype: str
+    """
+    app = model.applications.get(application)
+    if app is None:
+        return 'waiting to be added'
+    statuses = collections.Counter(u.workload_status for u in app.units)
+    progress = '{} unit(s)'.format(len(app.units))
+    if statuses:
+        progress += ': ' + ', '.join(
+            '{} {}'.format(count, status)
+            for status, count in sorted(statuses.items()))
+    return progress
+
 
+async def async_deploy_bundle_native(bundle, model_name, bundle_data=None):
+    """Deploy the bundle and overlays with the model API
 
-def deploy(bundle, model, wait=True):
+    A line is logged each time the number of units of an application, or
+    their workload statuses, change.
+
+    :param bundle: Path to bundle file
+    :type bundle: str
+    :param model_name: Name of model to deploy bundle in
+    :type model_name: str
+    :param bundle_data: Bundle with overlays applied, defaults to applying
+                        the rendered overlays of the bundle
+    :type bundle_data: dict
+    """
+    if bundle_data is None:
+        bundle_data = get_merged_bundle(bundle, render_overlays(bundle))
+    applications = get_bundle_applications(bundle_data)
+    logging.info("Deploying bundle {} ({} applications)".format(
+        bundle, len(applications)))
+    reported = {}
+    async with zaza.model.run_in_model(model_name) as model:
+
+        def _report(application):
+            if application not in applications:
+                return
+            progress = get_application_progress(model, application)
+            if reported.get(application) != progress:
+                logging.info("{}: {}".format(application, progress))
+                reported[application] = progress
+
+        async def _on_change(delta, old_obj, new_obj, model):
+            if delta.entity == 'application':
+                _report(delta.data.get('name'))
+            elif delta.entity == 'unit':
+                _report(delta.data.get('application'))
+
+        # The model only holds a weak reference to the observer, so it is
+        # dropped once the deploy completes.
+        model.add_observer(_on_change)
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml') as fh:
+            yaml.safe_dump(bundle_data, fh, default_flow_style=False)
+            fh.flush()
+            await model.deploy(fh.name)
+        for application in applications:
+            _report(application)
+
+deploy_bundle_native = zaza.model.sync_wrapper(async_deploy_bundle_native)
+
+
+async def async_deploy_and_wait(bundle, model_name, states=None):
+    """Deploy the bundle with the model API while waiting for it to settle
+
+    The wait for the units to reach their target states starts at once
+    rather than after all the applications, units and relations have been
+    added. The units are only taken to be idle once the deploy completes, so
+    that hooks run for the last changes are waited for too.
+
+    :param bundle: Path to bundle file
+    :type bundle: str
+    :param model_name: Name of model to deploy bundle in
+    :type model_name: str
+    :param states: States to wait for, see
+                   zaza.model.async_wait_for_application_states
+    :type states: dict
+    """
+    bundle_data = get_merged_bundle(bundle, render_overlays(bundle))
+    applications = get_bundle_applications(bundle_data)
+    start = time.time()
+    deployed = asyncio.Event()
+
+    async def _deploy():
+        await async_deploy_bundle_native(bundle, model_name, bundle_data)
+        timing.record('deploy_bundle', bundle, start, time.time(), 'pass',
+                      model=model_name)
+        deployed.set()
+
+    deploy_task = asyncio.ensure_future(_deploy())
+    logging.info("Waiting for environment to settle")
+    wait_task = asyncio.ensure_future(
+        zaza.model.async_wait_for_application_states(
+            model_name, states, applications=applications,
+            deployed=deployed))
+    try:
+        done, _ = await asyncio.wait(
+            [deploy_task, wait_task], return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+        await deploy_task
+        await wait_task
+        timing.record('deploy_wait', bundle, start, time.time(), 'pass',
+                      model=model_name)
+    finally:
+        for task in (deploy_task, wait_task):
+            if not task.done():
+                task.cancel()
+
+deploy_and_wait = zaza.model.sync_wrapper(async_deploy_and_wait)
+
+
+def deploy(bundle, model, wait=True, native=False):
     """Run all steps to complete deployment
 
     :param bundle: Path to bundle file
@@ -218,15 +562,33 @@ def deploy(bundle, model, wait=True):
     :type model: str
     :param wait: Whether to wait until deployment completes
     :type model: bool
+    :param native: Whether to deploy with the model API, rather than juju
+                   deploy, and wait while the deploy is still running
+    :type native: bool
     """
-    deploy_bundle(bundle, model)
-    if wait:
-        test_config = utils.get_charm_config()
-        logging.info("Waiting for environment to settle")
-        utils.set_juju_model(model)
-        zaza.model.wait_for_application_states(
-            model,
-            test_config.get('target_deploy_status', {}))
+    with timing.timed('deploy', bundle, model=model):
+        if native:
+            utils.set_juju_model(model)
+            if wait:
+                test_config = utils.get_charm_config()
+                deploy_and_wait(
+                    bundle,
+                    model,
+                    test_config.get('target_deploy_status', {}))
+            else:
+                with timing.timed('deploy_bundle', bundle, model=model):
+                    deploy_bundle_native(bundle, model)
+            return
+        with timing.timed('deploy_bundle', bundle, model=model):
+            deploy_bundle(bundle, model)
+        if wait:
+            test_config = utils.get_charm_config()
+            logging.info("Waiting for environment to settle")
+            utils.set_juju_model(model)
+            with timing.timed('deploy_wait', bundle, model=model):
+                zaza.model.wait_for_application_states(
+                    model,
+                    test_config.get('target_deploy_status', {}))
 
 
 def parse_args(args):
@@ -247,7 +609,11 @@ def parse_args(args):
     parser.add_argument('--no-wait', dest='wait',
                         help='Do not wait for deployment to settle',
                         action='store_false')
-    parser.set_defaults(wait=True)
+    parser.add_argument('--native', dest='native',
+                        help=('Deploy with the model API and wait for the '
+                              'deployment to settle while it is running'),
+                        action='store_true')
+    parser.set_defaults(wait=True, native=False)
     return parser.parse_args(args)
 
 
@@ -255,4 +621,5 @@ def main():
     """Deploy bundle"""
     logging.basicConfig(level=logging.INFO)
     args = parse_args(sys.argv[1:])
-    deploy(args.bundle, args.model, wait=args.wait)
+    deploy(args.bundle, args.model, wait=args.wait, native=args.native)
+    zaza.model.shutdown()
@@ -2,25 +2,88 @@ import argparse
 import logging
 import subprocess
 import sys
+import time
+
+import zaza.charm_lifecycle.timing as timing
+import zaza.model
+
+# Time in seconds to wait for background model destroys to complete
+DEFAULT_DESTROY_TIMEOUT = 1800
+# Model destroys running in the background, model name -> subprocess.Popen
+PENDING_DESTROYS = {}
 
 
 def destroy_model(model_name):
-    """Remove a model with the given name
+    """Remove a model with the given name, closing any pooled connection
 
     :param model: Name of model to remove
     :type bundle: str
     """
     logging.info("Remove model {}".format(model_name))
+    zaza.model.disconnect_model(model_name)
     subprocess.check_call(['juju', 'destroy-model', '--yes', model_name])
 
 
-def destroy(model_name):
+def destroy_model_in_background(model_name):
+    """Start removing a model with the given name and return immediately
+
+    The pooled connection to the model is closed first. The removal is
+    tracked so that it can be waited for with wait_for_background_destroys.
+
+    :param model: Name of model to remove
+    :type bundle: str
+    """
+    logging.info("Remove model {} in background".format(model_name))
+    zaza.model.disconnect_model(model_name)
+    PENDING_DESTROYS[model_name] = subprocess.Popen(
+        ['juju', 'destroy-model', '--yes', model_name])
+
+
+def wait_for_background_destroys(timeout=DEFAULT_DESTROY_TIMEOUT):
+    """Wait for all model removals running in the background to complete
+
+    :param timeout: Time to wait for all removals to complete
+    :type timeout: int
+    :returns: Names of models which were not removed
+    :rtype: [str, str,...]
+    """
+    deadline = time.time() + timeout
+    not_destroyed = []
+    while PENDING_DESTROYS:
+        model_name, proc = PENDING_DESTROYS.popitem()
+        logging.info("Waiting for removal of model {}".format(model_name))
+        with timing.timed('destroy_wait', model=model_name):
+            try:
+                returncode = proc.wait(
+                    timeout=max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                logging.warning("Timed out waiting for removal of model {}"
+                                .format(model_name))
+                not_destroyed.append(model_name)
+                continue
+            if returncode != 0:
+                logging.warning("Removal of model {} failed with code {}"
+                                .format(model_name, returncode))
+                not_destroyed.append(model_name)
+    if not_destroyed:
+        logging.warning("Models not removed: {}".format(
+            ', '.join(sorted(not_destroyed))))
+    return sorted(not_destroyed)
+
+
+def destroy(model_name, background=False):
     """Run all steps to cleaup after a test run
 
     :param model: Name of model to remove
     :type bundle: str
+    :param background: Whether to return before the model has been removed
+    :type background: bool
     """
-    destroy_model(model_name)
+    with timing.timed('destroy', model=model_name, background=background):
+        if background:
+            destroy_model_in_background(model_name)
+        else:
+            destroy_model(model_name)
 
 
 def parse_args(args):
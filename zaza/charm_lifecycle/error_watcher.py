@@ -0,0 +1,166 @@
+import contextlib
+import logging
+import signal
+import threading
+
+import zaza.model
+
+# Signal sent to the main thread when a unit enters an error state
+ABORT_SIGNAL = signal.SIGUSR1
+
+
+class PhaseAborted(Exception):
+    """Raised when a phase is stopped because units entered an error state"""
+
+    def __init__(self, phase, errors):
+        """Describe which units failed during which phase
+
+        :param phase: Name of phase which was running
+        :type phase: str
+        :param errors: Error status and message keyed by unit name
+        :type errors: {str: str}
+        """
+        self.phase = phase
+        self.errors = errors
+        super(PhaseAborted, self).__init__(
+            "Aborted {} phase, unit(s) in error state: {}".format(
+                phase,
+                ', '.join('{} ({})'.format(k, v)
+                          for k, v in sorted(errors.items()))))
+
+
+class _Interrupt(KeyboardInterrupt):
+    """Raised in the main thread to stop the running phase
+
+    Derived from KeyboardInterrupt so that it is not swallowed by code, such
+    as unittest, which catches every Exception.
+    """
+
+
+@contextlib.contextmanager
+def abort_deferred():
+    """Hold back an abort of the running phase until the with block ends
+
+    For code which must not be interrupted half way, such as handing a job
+    to a thread pool, which would otherwise lose track of the started
+    thread. An abort signalled meanwhile is raised as the block ends.
+    """
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, [ABORT_SIGNAL])
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+class ErrorWatcher(object):
+    """Watch a model for units in an error state while phases run
+
+    The model is watched from the zaza.model event loop thread. When a unit
+    first enters an error state the main thread is sent ABORT_SIGNAL, which
+    stops the phase it is running and raises PhaseAborted from the phase
+    context manager. Errors seen between phases abort the next phase as soon
+    as it starts.
+
+    Example:
+        watcher = ErrorWatcher(model_name)
+        watcher.start()
+        try:
+            with watcher.phase('deploy'):
+                deploy.deploy(bundle, model_name)
+        finally:
+            watcher.stop()
+    """
+
+    def __init__(self, model_name):
+        """Create a watcher for the model
+
+        :param model_name: Name of model to watch
+        :type model_name: str
+        """
+        self.model_name = model_name
+        self.phase_name = None
+        self.errors = {}
+        self._observer = None
+        self._previous_handler = None
+        self._main_thread_id = None
+        # Reentrant, as the signal handler takes it in the main thread, which
+        # may already hold it
+        self._lock = threading.RLock()
+
+    def start(self):
+        """Start watching the model
+
+        Watching is only possible from the main thread, elsewhere a warning
+        is logged and the phases run unwatched.
+        """
+        try:
+            self._previous_handler = signal.signal(ABORT_SIGNAL,
+                                                   self._on_signal)
+        except ValueError:
+            logging.warning("Not watching model {} for unit errors outside "
+                            "of the main thread".format(self.model_name))
+            return
+        self._main_thread_id = threading.get_ident()
+        zaza.model.run(self._async_start())
+
+    async def _async_start(self):
+        model = await zaza.model.async_get_model(self.model_name)
+
+        async def _on_unit_change(delta, old_obj, new_obj, model):
+            self._check(model)
+
+        # The model only holds a weak reference to the observer, so it is
+        # dropped when the watcher stops.
+        self._observer = _on_unit_change
+        model.add_observer(self._observer, entity_type='unit')
+        self._check(model)
+
+    def _check(self, model):
+        with self._lock:
+            if self._observer is None or self.errors:
+                return
+            errors = zaza.model.get_unit_errors(model)
+            if errors:
+                self.errors = errors
+                signal.pthread_kill(self._main_thread_id, ABORT_SIGNAL)
+
+    def _on_signal(self, signum, frame):
+        with self._lock:
+            if self.phase_name is not None:
+                raise _Interrupt()
+
+    def _end_phase(self):
+        with self._lock:
+            self.phase_name = None
+
+    def stop(self):
+        """Stop watching the model"""
+        with self._lock:
+            self._observer = None
+            if self._previous_handler is not None:
+                signal.signal(ABORT_SIGNAL, self._previous_handler)
+                self._previous_handler = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Run the with block as a phase which is aborted on unit errors
+
+        :param name: Name of phase, eg deploy
+        :type name: str
+        :raises: PhaseAborted
+        """
+        # The phase is ended inside the try, so that an interrupt which
+        # arrives as it ends is still turned into PhaseAborted rather than
+        # escaping the with block
+        try:
+            with self._lock:
+                self.phase_name = name
+            try:
+                if self.errors:
+                    raise PhaseAborted(name, self.errors)
+                yield
+            finally:
+                self._end_phase()
+        except _Interrupt:
+            self._end_phase()
+            raise PhaseAborted(name, self.errors) from None
@@ -1,29 +1,394 @@
 import argparse
-import asyncio
+import functools
 import logging
+import multiprocessing
 import os
 import sys
 import uuid
 
+import zaza.charm_lifecycle.checkpoint as checkpoint
+import zaza.charm_lifecycle.collect as collect
 import zaza.charm_lifecycle.configure as configure
 import zaza.charm_lifecycle.destroy as destroy
+import zaza.charm_lifecycle.error_watcher as error_watcher
+import zaza.charm_lifecycle.model_pool as model_pool
 import zaza.charm_lifecycle.utils as utils
 import zaza.charm_lifecycle.prepare as prepare
+import zaza.charm_lifecycle.redeploy as redeploy
 import zaza.charm_lifecycle.deploy as deploy
 import zaza.charm_lifecycle.test as test
+import zaza.charm_lifecycle.timing as timing
+import zaza.model
 
 
 def generate_model_name():
     return 'zaza-{}'.format(str(uuid.uuid4())[-12:])
 
 
-def func_test_runner(keep_model=False, smoke=False, bundle=None):
+def get_model_name(model_pool_size=0):
+    """Return the name of the model to run a bundle in
+
+    If model_pool_size is set a model is leased from the model pool, falling
+    back to a new model name if the pool has no model ready.
+
+    :param model_pool_size: Number of models to keep ready in the pool
+    :type model_pool_size: int
+    :returns: Model name and whether the model was leased from the pool
+    :rtype: (str, bool)
+    """
+    if model_pool_size:
+        model_name = model_pool.lease_model(size=model_pool_size)
+        if model_name:
+            return model_name, True
+    return generate_model_name(), False
+
+
+def get_bundle_model(bundle, model_pool_size=0, resume=False):
+    """Return the model to run a bundle in and the phases already done
+
+    If resume is set and the bundle has a checkpoint whose model still
+    exists the bundle carries on in that model from the first phase which
+    did not complete.
+
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :param model_pool_size: Number of models to keep ready in the pool
+    :type model_pool_size: int
+    :param resume: Whether to resume from the checkpoint of a previous run
+    :type resume: boolean
+    :returns: Model name, whether the model was leased from the pool and the
+              phases already completed in it
+    :rtype: (str, bool, [str, str,...])
+    """
+    if resume:
+        resume_point = checkpoint.get_resume_point(bundle)
+        if resume_point:
+            return (resume_point['model_name'],
+                    resume_point.get('leased_model', False),
+                    resume_point['phases'])
+    model_name, leased_model = get_model_name(model_pool_size)
+    return model_name, leased_model, []
+
+
+def get_bundle_report_file(path, bundle):
+    """Return the name of the file to write a report of a bundle run to
+
+    The bundle name is added before the extension of path so that the
+    reports of each bundle in a run are kept apart, eg results.xml becomes
+    results-bundle1.xml.
+
+    :param path: File name given for the reports of the run
+    :type path: str or None
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :returns: File name for the report of the bundle, None if path is None
+    :rtype: str or None
+    """
+    if not path:
+        return None
+    base, ext = os.path.splitext(path)
+    return '{}-{}{}'.format(base, bundle, ext)
+
+
+def run_bundle(model_name, bundle, test_config, destroy_model=True,
+               background_destroy=False, leased_model=False,
+               completed_phases=None, keep_failed_model=False,
+               reuse_model=False, junit_xml=None, json_summary=None):
+    """Run all the phases for a single bundle in the given model
+
+    The model is watched for units in an error state throughout deploy,
+    configure and test, and the running phase is aborted as soon as one is
+    seen. If any of those phases fails the artifacts of the model are
+    collected before it is destroyed.
+
+    A checkpoint of the model name and the phases done is written after each
+    phase completes. It is removed once the bundle passes or its model is
+    destroyed, so a run which dies, or whose failed model is kept, can be
+    resumed from the phase it stopped at.
+
+    If reuse_model is set the model already has the previous bundle deployed
+    in it, and only the differences between that and this bundle are
+    applied.
+
+    :param model_name: Name of model to deploy bundle in
+    :type model_name: str
+    :param bundle: Name of bundle (excluding file ext)
+    :type bundle: str
+    :param test_config: Charm test config, as read from tests.yaml
+    :type test_config: dict
+    :param destroy_model: Whether to destroy model at end of run
+    :type destroy_model: boolean
+    :param background_destroy: Whether to carry on while the model is being
+                               destroyed
+    :type background_destroy: boolean
+    :param leased_model: Whether the model was leased from the model pool
+                         and so already exists
+    :type leased_model: boolean
+    :param completed_phases: Phases already completed in the model by an
+                             earlier run, which are skipped
+    :type completed_phases: [str, str,...]
+    :param keep_failed_model: Whether to keep the model if a phase fails so
+                              that the run can be resumed
+    :type keep_failed_model: boolean
+    :param reuse_model: Whether to change the bundle already deployed in the
+                        model into this one rather than deploying from
+                        scratch
+    :type reuse_model: boolean
+    :param junit_xml: File to write JUnit XML test results to, with the
+                      bundle name added, see get_bundle_report_file
+    :type junit_xml: str
+    :param json_summary: File to write a JSON summary of test results to,
+                         with the bundle name added
+    :type json_summary: str
+    """
+    done = list(completed_phases or [])
+    if reuse_model and 'prepare' not in done:
+        done.append('prepare')
+
+    def _completed(phase):
+        done.append(phase)
+        checkpoint.save(bundle, model_name, done, leased_model=leased_model)
+
+    failed = False
+    with timing.context(bundle=bundle, model=model_name), \
+            timing.timed('bundle', bundle):
+        # Prepare
+        if 'prepare' not in done:
+            if not leased_model:
+                prepare.prepare(model_name)
+            _completed('prepare')
+        watcher = error_watcher.ErrorWatcher(model_name)
+        try:
+            watcher.start()
+            # Deploy
+            if 'deploy' not in done:
+                bundle_file = os.path.join(utils.BUNDLE_DIR,
+                                           '{}.yaml'.format(bundle))
+                with watcher.phase('deploy'):
+                    if reuse_model:
+                        redeploy.redeploy(bundle_file, model_name)
+                    else:
+                        deploy.deploy(
+                            bundle_file,
+                            model_name,
+                            native=test_config.get('native_deploy', False))
+                _completed('deploy')
+            # Configure
+            if 'configure' not in done:
+                with watcher.phase('configure'):
+                    configure.configure(model_name, test_config['configure'])
+                _completed('configure')
+            # Test
+            if 'test' not in done:
+                with watcher.phase('test'):
+                    test.test(
+                        model_name,
+                        test_config['tests'],
+                        workers=test_config.get('test_workers',
+                                                test.DEFAULT_TEST_WORKERS),
+                        junit_xml=get_bundle_report_file(junit_xml, bundle),
+                        json_summary=get_bundle_report_file(json_summary,
+                                                            bundle))
+                _completed('test')
+        except Exception as e:
+            failed = True
+            watcher.stop()
+            if isinstance(e, error_watcher.PhaseAborted):
+                logging.error(str(e))
+            # Collect
+            try:
+                collect.collect(model_name)
+            except Exception:
+                logging.exception(
+                    "Failed to collect artifacts from model {}".format(
+                        model_name))
+            raise
+        finally:
+            watcher.stop()
+            if failed and keep_failed_model:
+                logging.info(
+                    "Keeping model {} of failed bundle {}, rerun with "
+                    "--resume to carry on from the failed phase".format(
+                        model_name, bundle))
+            else:
+                # Destroy
+                if destroy_model:
+                    if background_destroy:
+                        destroy.destroy(model_name, background=True)
+                    else:
+                        destroy.destroy(model_name)
+                if leased_model:
+                    model_pool.release_model(model_name)
+            if not failed or (destroy_model and not keep_failed_model):
+                checkpoint.clear(bundle)
+
+
+def run_bundle_worker(job, model_pool_size=0, resume=False,
+                      keep_failed_model=False, junit_xml=None,
+                      json_summary=None, background_destroy=False):
+    """Run all the phases for a bundle in a worker process
+
+    Log messages from the worker are prefixed with the bundle name so that
+    output from bundles running in parallel can be told apart. If
+    background_destroy is set the model is destroyed while the worker waits
+    for the model pool top up, and the worker waits for the destroy before
+    returning.
+
+    :param job: Bundle name, charm test config and whether to destroy model
+    :type job: (str, dict, boolean)
+    :param model_pool_size: Number of models to keep ready in the pool
+    :type model_pool_size: int
+    :param resume: Whether to resume from the checkpoint of a previous run
+    :type resume: boolean
+    :param keep_failed_model: Whether to keep the model if a phase fails
+    :type keep_failed_model: boolean
+    :param junit_xml: File to write JUnit XML test results to, with the
+                      bundle name added, see get_bundle_report_file
+    :type junit_xml: str
+    :param json_summary: File to write a JSON summary of test results to,
+                         with the bundle name added
+    :type json_summary: str
+    :param background_destroy: Whether to destroy the model in the
+                               background
+    :type background_destroy: boolean
+    :returns: Bundle name, model name and the error if the run failed
+    :rtype: (str, str, str or None)
+    """
+    bundle, test_config, destroy_model = job
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[{}] %(asctime)s [%(levelname)s] %(message)s'.format(bundle))
+    model_name, leased_model, completed_phases = get_bundle_model(
+        bundle, model_pool_size, resume=resume)
+    error = None
+    try:
+        run_bundle(model_name, bundle, test_config,
+                   destroy_model=destroy_model,
+                   background_destroy=background_destroy,
+                   leased_model=leased_model,
+                   completed_phases=completed_phases,
+                   keep_failed_model=keep_failed_model,
+                   junit_xml=junit_xml, json_summary=json_summary)
+    except Exception as e:
+        logging.exception("Run of bundle {} failed".format(bundle))
+        error = str(e) or e.__class__.__name__
+    finally:
+        zaza.model.shutdown()
+        model_pool.wait_for_top_up()
+        if background_destroy:
+            destroy.wait_for_background_destroys()
+    return bundle, model_name, error
+
+
+def run_bundles_in_parallel(jobs, parallel, model_pool_size=0, resume=False,
+                            keep_failed_model=False, junit_xml=None,
+                            json_summary=None, background_destroy=False):
+    """Run bundles in separate worker processes, parallel at a time
+
+    :param jobs: Bundle name, charm test config and whether to destroy model
+                 for each bundle
+    :type jobs: [(str, dict, boolean), ...]
+    :param parallel: Maximum number of bundles to run at once
+    :type parallel: int
+    :param model_pool_size: Number of models to keep ready in the pool
+    :type model_pool_size: int
+    :param resume: Whether to resume from the checkpoint of a previous run
+    :type resume: boolean
+    :param keep_failed_model: Whether to keep the model if a phase fails
+    :type keep_failed_model: boolean
+    :param junit_xml: File to write JUnit XML test results to, with the
+                      bundle name added, see get_bundle_report_file
+    :type junit_xml: str
+    :param json_summary: File to write a JSON summary of test results to,
+                         with the bundle name added
+    :type json_summary: str
+    :param background_destroy: Whether each worker destroys its model in the
+                               background, see run_bundle_worker
+    :type background_destroy: boolean
+    :raises: Exception if any bundle failed
+    """
+    # Spawn rather than fork workers so that no event loop or model
+    # connections are shared with the parent process.
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(processes=parallel, maxtasksperchild=1)
+    try:
+        results = list(pool.imap_unordered(
+            functools.partial(run_bundle_worker,
+                              model_pool_size=model_pool_size,
+                              resume=resume,
+                              keep_failed_model=keep_failed_model,
+                              junit_xml=junit_xml,
+                              json_summary=json_summary,
+                              background_destroy=background_destroy),
+            jobs))
+    finally:
+        pool.close()
+        pool.join()
+    failed = []
+    logging.info("Bundle run summary:")
+    for bundle, model_name, error in sorted(results):
+        if error:
+            failed.append(bundle)
+            logging.info("  FAIL {} (model {}): {}".format(
+                bundle, model_name, error))
+        else:
+            logging.info("  PASS {} (model {})".format(bundle, model_name))
+    if failed:
+        raise Exception("Bundle run(s) failed: {}".format(', '.join(failed)))
+
+
+def func_test_runner(keep_model=False, smoke=False, bundle=None, parallel=1,
+                     background_destroy=False, model_pool_size=0,
+                     resume=False, keep_failed_model=False,
+                     reuse_model=False, junit_xml=None, json_summary=None):
     """Deploy the bundles and run the tests as defined by the charms tests.yaml
 
+    If background_destroy is set each model is destroyed while the next
+    bundle is prepared and deployed, and the run waits for all the destroys
+    to finish at the end. When bundles run in parallel each worker waits for
+    the destroy of its own model before returning.
+
+    If model_pool_size is set models are leased from a pool of ready models
+    rather than being added at the start of each bundle, and the pool is
+    topped back up to model_pool_size in the background.
+
+    If resume is set each bundle with a checkpoint from an earlier run
+    carries on in the model of that run from the phase it stopped at.
+
+    If reuse_model is set, and the bundles are run one after another, each
+    bundle after the first is applied as a diff to the model of the bundle
+    before it, and only the last model is destroyed. A bundle which places
+    new applications onto machines or units already in the model is deployed
+    into a new model instead.
+
+    If junit_xml or json_summary are set the test results of each bundle
+    are written to a file of that name with the bundle name added before
+    the extension, see get_bundle_report_file.
+
     :param keep_model: Whether to destroy model at end of run
     :type keep_model: boolean
     :param smoke: Whether to just run smoke test.
     :type smoke: boolean
+    :param bundle: Bundle to run instead of those listed in tests.yaml
+    :type bundle: str
+    :param parallel: Maximum number of bundles to run at once
+    :type parallel: int
+    :param background_destroy: Whether to destroy models in the background
+    :type background_destroy: boolean
+    :param model_pool_size: Number of models to keep ready in the pool
+    :type model_pool_size: int
+    :param resume: Whether to resume from the checkpoints of a previous run
+    :type resume: boolean
+    :param keep_failed_model: Whether to keep the model of a failed bundle
+                              so that the run can be resumed
+    :type keep_failed_model: boolean
+    :param reuse_model: Whether to deploy each bundle over the model of the
+                        bundle before it
+    :type reuse_model: boolean
+    :param junit_xml: File to write JUnit XML test results to
+    :type junit_xml: str
+    :param json_summary: File to write a JSON summary of test results to
+    :type json_summary: str
     """
     test_config = utils.get_charm_config()
     if bundle:
@@ -35,26 +400,67 @@ def func_test_runner(keep_model=False, smoke=False, bundle=None):
             bundle_key = 'gate_bundles'
         bundles = test_config[bundle_key]
     last_test = bundles[-1]
-    for t in bundles:
-        model_name = generate_model_name()
-        # Prepare
-        prepare.prepare(model_name)
-        # Deploy
-        deploy.deploy(
-            os.path.join(utils.BUNDLE_DIR, '{}.yaml'.format(t)),
-            model_name)
-        # Configure
-        configure.configure(model_name, test_config['configure'])
-        # Test
-        test.test(model_name, test_config['tests'])
-        # Destroy
-        # Keep the model from the last run if keep_model is true, this is to
-        # maintian compat with osci and should change when the zaza collect
-        # functions take over from osci for artifact collection.
-        if keep_model and t == last_test:
-            pass
+    # Keep the model from the last run if keep_model is true, this is to
+    # maintian compat with osci and should change when the zaza collect
+    # functions take over from osci for artifact collection.
+    jobs = [(t, test_config, not (keep_model and t == last_test))
+            for t in bundles]
+    with timing.timed('run', test_config.get('charm_name')):
+        if model_pool_size:
+            model_pool.collect_leaked_models()
+        if parallel > 1 and len(jobs) > 1:
+            if reuse_model:
+                logging.warning("Models are not reused when running bundles "
+                                "in parallel")
+            run_bundles_in_parallel(jobs, parallel,
+                                    model_pool_size=model_pool_size,
+                                    resume=resume,
+                                    keep_failed_model=keep_failed_model,
+                                    junit_xml=junit_xml,
+                                    json_summary=json_summary,
+                                    background_destroy=background_destroy)
         else:
-            destroy.destroy(model_name)
+            try:
+                reused_model = None
+                for index, (t, _, destroy_model) in enumerate(jobs):
+                    # Keep the model for the next bundle to be deployed over
+                    keep_for_next = reuse_model and index < len(jobs) - 1
+                    if reused_model and not redeploy.can_redeploy(
+                            os.path.join(utils.BUNDLE_DIR,
+                                         '{}.yaml'.format(t)),
+                            reused_model):
+                        logging.warning(
+                            "Deploying bundle {} into a new model".format(t))
+                        destroy.destroy(reused_model,
+                                        background=background_destroy)
+                        reused_model = None
+                    if reused_model:
+                        model_name, leased_model, completed_phases = (
+                            reused_model, False, [])
+                    else:
+                        model_name, leased_model, completed_phases = (
+                            get_bundle_model(t, model_pool_size,
+                                             resume=resume))
+                    try:
+                        run_bundle(model_name, t, test_config,
+                                   destroy_model=(destroy_model and
+                                                  not keep_for_next),
+                                   background_destroy=background_destroy,
+                                   leased_model=leased_model,
+                                   completed_phases=completed_phases,
+                                   keep_failed_model=keep_failed_model,
+                                   reuse_model=bool(reused_model),
+                                   junit_xml=junit_xml,
+                                   json_summary=json_summary)
+                    except Exception:
+                        if keep_for_next and not keep_failed_model:
+                            destroy.destroy(model_name)
+                        raise
+                    reused_model = model_name if keep_for_next else None
+            finally:
+                if background_destroy:
+                    destroy.wait_for_background_destroys()
+                model_pool.wait_for_top_up()
 
 
 def parse_args(args):
@@ -75,15 +481,64 @@ def parse_args(args):
     parser.add_argument('-b', '--bundle',
                         help='Override the bundle to be run',
                         required=False)
-    parser.set_defaults(keep_model=False, smoke=False)
+    parser.add_argument('--parallel', type=int,
+                        help='Number of bundles to run at once',
+                        required=False)
+    parser.add_argument('--background-destroy', dest='background_destroy',
+                        help=('Destroy each model while the next bundle is '
+                              'deployed'),
+                        action='store_true')
+    parser.add_argument('--timing-report', dest='timing_report',
+                        help=('File to append a JSON line with the duration '
+                              'and outcome of each phase to'),
+                        required=False)
+    parser.add_argument('--model-pool', dest='model_pool_size', type=int,
+                        help=('Lease models from a pool of this many ready '
+                              'models'),
+                        required=False)
+    parser.add_argument('--resume', dest='resume',
+                        help=('Carry on each bundle from the phase it '
+                              'stopped at in the previous run'),
+                        action='store_true')
+    parser.add_argument('--keep-failed-model', dest='keep_failed_model',
+                        help=('Keep the model of a failed bundle so that the '
+                              'run can be resumed'),
+                        action='store_true')
+    parser.add_argument('--reuse-model', dest='reuse_model',
+                        help=('Deploy each bundle over the model of the '
+                              'bundle before it, applying only what differs'),
+                        action='store_true')
+    parser.add_argument('--junit-xml', dest='junit_xml',
+                        help=('File to write JUnit XML test results to, the '
+                              'bundle name is added before the extension'),
+                        required=False)
+    parser.add_argument('--json-summary', dest='json_summary',
+                        help=('File to write a JSON summary of test results '
+                              'to, the bundle name is added before the '
+                              'extension'),
+                        required=False)
+    parser.set_defaults(keep_model=False, smoke=False, parallel=1,
+                        background_destroy=False, model_pool_size=0,
+                        resume=False, keep_failed_model=False,
+                        reuse_model=False)
     return parser.parse_args(args)
 
 
 def main():
     logging.basicConfig(level=logging.INFO)
     args = parse_args(sys.argv[1:])
+    if args.timing_report:
+        timing.set_report_file(args.timing_report)
     func_test_runner(
         keep_model=args.keep_model,
         smoke=args.smoke,
-        bundle=args.bundle)
-    asyncio.get_event_loop().close()
+        bundle=args.bundle,
+        parallel=args.parallel,
+        background_destroy=args.background_destroy,
+        model_pool_size=args.model_pool_size,
+        resume=args.resume,
+        keep_failed_model=args.keep_failed_model,
+        reuse_model=args.reuse_model,
+        junit_xml=args.junit_xml,
+        json_summary=args.json_summary)
+    zaza.model.shutdown()
@@ -0,0 +1,295 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import zaza.charm_lifecycle.destroy as destroy
+import zaza.charm_lifecycle.prepare as prepare
+
+POOL_MODEL_PREFIX = 'zaza-pool-'
+DEFAULT_POOL_SIZE = 3
+# Models which have been leased, or have been being created, for longer than
+# this many seconds are considered to have leaked
+DEFAULT_MAX_AGE = 24 * 60 * 60
+# Environment variable naming the file the pool state is kept in
+STATE_FILE_ENV = 'ZAZA_MODEL_POOL_STATE'
+DEFAULT_STATE_FILE = '~/.local/share/zaza/model-pool.json'
+
+CREATING = 'creating'
+READY = 'ready'
+LEASED = 'leased'
+
+# Threads started by top_up_in_background
+TOP_UP_THREADS = []
+
+
+def get_state_file():
+    """Return the path of the file the pool state is kept in
+
+    :returns: Path to state file
+    :rtype: str
+    """
+    return os.path.expanduser(
+        os.environ.get(STATE_FILE_ENV, DEFAULT_STATE_FILE))
+
+
+@contextlib.contextmanager
+def locked_state():
+    """Load the pool state and save any changes made to it in the with block
+
+    The state file is locked for the duration of the with block so that
+    several runs on the same host can share the pool. The state is a dict of
+    model name to a dict with the 'state' of the model, the 'since' time it
+    entered that state, the 'owner' which put it there and the 'controller'
+    the model is on.
+    """
+    state_file = get_state_file()
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    with open(state_file, 'a+') as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            fh.seek(0)
+            contents = fh.read()
+            models = json.loads(contents) if contents else {}
+            yield models
+            fh.seek(0)
+            fh.truncate()
+            json.dump(models, fh, indent=2, sort_keys=True)
+            fh.flush()
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def get_owner():
+    """Return a string identifying this process
+
+    :returns: Host name and process id
+    :rtype: str
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def get_controller():
+    """Return the name of the current controller
+
+    Pool models are added to, leased from and destroyed on the current
+    controller, so only the entries of the pool on it are acted on.
+
+    :returns: Controller name
+    :rtype: str
+    """
+    output = subprocess.check_output(['juju', 'switch'])
+    return output.decode('utf-8').strip().split(':')[0]
+
+
+def generate_pool_model_name():
+    """Return a new name for a pool model
+
+    :returns: Model name
+    :rtype: str
+    """
+    return '{}{}'.format(POOL_MODEL_PREFIX, str(uuid.uuid4())[-12:])
+
+
+def _set_model_state(models, model_name, state, controller):
+    models[model_name] = {
+        'state': state,
+        'since': time.time(),
+        'owner': get_owner(),
+        'controller': controller}
+
+
+def _get_controller_models(models, controller):
+    return {name: m for name, m in models.items()
+            if m.get('controller') == controller}
+
+
+def top_up(size=DEFAULT_POOL_SIZE):
+    """Add models until the pool has size models which are ready to lease
+
+    Models already being created by other runs on the same controller count
+    towards the size.
+
+    :param size: Number of models to keep ready
+    :type size: int
+    :returns: Names of models added to the pool
+    :rtype: [str, str,...]
+    """
+    controller = get_controller()
+    with locked_state() as models:
+        available = len([
+            m for m in _get_controller_models(models, controller).values()
+            if m['state'] in (CREATING, READY)])
+        new_models = [generate_pool_model_name()
+                      for _ in range(size - available)]
+        for model_name in new_models:
+            _set_model_state(models, model_name, CREATING, controller)
+    added = []
+    for model_name in new_models:
+        try:
+            prepare.add_model(model_name, switch=False)
+        except Exception:
+            logging.exception("Failed to add pool model {}"
+                              .format(model_name))
+            with locked_state() as models:
+                models.pop(model_name, None)
+            continue
+        with locked_state() as models:
+            _set_model_state(models, model_name, READY, controller)
+        added.append(model_name)
+    return added
+
+
+def top_up_in_background(size=DEFAULT_POOL_SIZE):
+    """Start topping up the pool in a background thread
+
+    :param size: Number of models to keep ready
+    :type size: int
+    :returns: Thread topping up the pool
+    :rtype: threading.Thread
+    """
+    thread = threading.Thread(target=top_up, args=(size,))
+    thread.daemon = True
+    thread.start()
+    TOP_UP_THREADS.append(thread)
+    return thread
+
+
+def wait_for_top_up():
+    """Wait for all background top ups started by this process to finish"""
+    while TOP_UP_THREADS:
+        TOP_UP_THREADS.pop().join()
+
+
+def lease_model(size=DEFAULT_POOL_SIZE):
+    """Lease the oldest ready model on the current controller from the pool
+
+    The pool is then topped back up.
+
+    :param size: Number of models to keep ready
+    :type size: int
+    :returns: Name of leased model or None if no model was ready
+    :rtype: str or None
+    """
+    model_name = None
+    controller = get_controller()
+    with locked_state() as models:
+        ready = sorted(
+            (m['since'], name)
+            for name, m in _get_controller_models(models, controller).items()
+            if m['state'] == READY)
+        if ready:
+            model_name = ready[0][1]
+            _set_model_state(models, model_name, LEASED, controller)
+    if size:
+        top_up_in_background(size)
+    if model_name:
+        logging.info("Leased model {} from pool".format(model_name))
+    return model_name
+
+
+def release_model(model_name):
+    """Remove a leased model from the pool once it has been finished with
+
+    :param model_name: Name of model to release
+    :type model_name: str
+    """
+    with locked_state() as models:
+        models.pop(model_name, None)
+
+
+def collect_leaked_models(max_age=DEFAULT_MAX_AGE):
+    """Destroy models which have been leased or creating for too long
+
+    Only models on the current controller are destroyed.
+
+    :param max_age: Age in seconds after which a model has leaked
+    :type max_age: int
+    :returns: Names of models destroyed
+    :rtype: [str, str,...]
+    """
+    cutoff = time.time() - max_age
+    controller = get_controller()
+    with locked_state() as models:
+        leaked = sorted(
+            name for name, m in _get_controller_models(
+                models, controller).items()
+            if m['state'] in (CREATING, LEASED) and m['since'] < cutoff)
+        for model_name in leaked:
+            models.pop(model_name)
+    collected = []
+    for model_name in leaked:
+        logging.info("Collecting leaked pool model {}".format(model_name))
+        try:
+            destroy.destroy_model(model_name)
+        except Exception:
+            logging.exception("Failed to destroy leaked pool model {}"
+                              .format(model_name))
+            continue
+        collected.append(model_name)
+    return collected
+
+
+def drain():
+    """Destroy all models on the current controller which are ready to lease
+
+    :returns: Names of models destroyed
+    :rtype: [str, str,...]
+    """
+    controller = get_controller()
+    with locked_state() as models:
+        ready = sorted(
+            name for name, m in _get_controller_models(
+                models, controller).items()
+            if m['state'] == READY)
+        for model_name in ready:
+            models.pop(model_name)
+    for model_name in ready:
+        destroy.destroy_model(model_name)
+    return ready
+
+
+def parse_args(args):
+    """Parse command line arguments
+
+    :param args: List of configure functions functions
+    :type list: [str1, str2,...] List of command line arguments
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--size', type=int,
+                        help='Number of models to keep ready',
+                        required=False)
+    parser.add_argument('--collect', dest='collect',
+                        help='Destroy leaked models',
+                        action='store_true')
+    parser.add_argument('--max-age', dest='max_age', type=int,
+                        help='Age in seconds after which a model has leaked',
+                        required=False)
+    parser.add_argument('--drain', dest='drain',
+                        help='Destroy all models which are ready to lease',
+                        action='store_true')
+    parser.set_defaults(size=DEFAULT_POOL_SIZE, collect=False,
+                        max_age=DEFAULT_MAX_AGE, drain=False)
+    return parser.parse_args(args)
+
+
+def main():
+    """Top up, collect leaked models from or drain the model pool"""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(sys.argv[1:])
+    if args.collect:
+        collect_leaked_models(max_age=args.max_age)
+    if args.drain:
+        drain()
+    else:
+        top_up(size=args.size)
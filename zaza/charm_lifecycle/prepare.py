@@ -3,6 +3,7 @@ import logging
 import subprocess
 import sys
 
+import zaza.charm_lifecycle.timing as timing
 
 MODEL_DEFAULTS = [
     # Model defaults from charm-test-infra
@@ -20,14 +21,19 @@ MODEL_DEFAULTS = [
 ]
 
 
-def add_model(model_name):
+def add_model(model_name, switch=True):
     """Add a model with the given name
 
     :param model: Name of model to add
     :type bundle: str
+    :param switch: Whether to make the new model the current model
+    :type switch: bool
     """
     logging.info("Adding model {}".format(model_name))
-    subprocess.check_call(['juju', 'add-model', model_name] + MODEL_DEFAULTS)
+    cmd = ['juju', 'add-model', model_name] + MODEL_DEFAULTS
+    if not switch:
+        cmd.append('--no-switch')
+    subprocess.check_call(cmd)
 
 
 def prepare(model_name):
@@ -36,7 +42,8 @@ def prepare(model_name):
     :param model: Name of model to add
     :type bundle: str
     """
-    add_model(model_name)
+    with timing.timed('prepare', model=model_name):
+        add_model(model_name)
 
 
 def parse_args(args):
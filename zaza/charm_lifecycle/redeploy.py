@@ -0,0 +1,526 @@
+import argparse
+import asyncio
+import logging
+import re
+import sys
+
+import zaza.model
+import zaza.charm_lifecycle.deploy as deploy
+import zaza.charm_lifecycle.timing as timing
+import zaza.charm_lifecycle.utils as utils
+
+# Seconds to wait for removed applications to leave the model
+DEFAULT_REMOVE_TIMEOUT = 1800
+# Seconds to wait for applications changed in place to start running hooks
+DEFAULT_CHANGE_TIMEOUT = 300
+
+
+class PlacementError(Exception):
+    """Raised when a bundle cannot be applied to a model as a diff"""
+
+    def __init__(self, placements):
+        """Describe the placements which cannot be applied
+
+        :param placements: Placement directives keyed by application name
+        :type placements: {str: [str, ...]}
+        """
+        self.placements = placements
+        super(PlacementError, self).__init__(
+            "Placement of {} refers to machines or units already in the "
+            "model".format(
+                ', '.join('{} ({})'.format(k, ', '.join(v))
+                          for k, v in sorted(placements.items()))))
+
+
+def parse_charm(charm):
+    """Return the owner, name and revision of a charm
+
+    Works for charm store and local charm URLs, as found in the model, and
+    for charm paths, as found in bundles.
+
+    :param charm: Charm URL or path
+    :type charm: str
+    :returns: Owner, name and revision, owner and revision may be None
+    :rtype: (str or None, str, int or None)
+    """
+    if deploy.is_local_charm(charm):
+        return None, charm.rstrip('/').split('/')[-1], None
+    parts = charm.split(':', 1)[-1].split('/')
+    owner = parts[0] if parts[0].startswith('~') else None
+    match = re.match(r'^(.*)-(\d+)$', parts[-1])
+    if match:
+        return owner, match.group(1), int(match.group(2))
+    return owner, parts[-1], None
+
+
+def charm_matches(bundle_charm, model_charm):
+    """Return whether the charm in the model is the one the bundle wants
+
+    The revision is only compared if the bundle pins one. A local charm is
+    taken to match the local charm of the same name in the model.
+
+    :param bundle_charm: Charm of application in bundle
+    :type bundle_charm: str
+    :param model_charm: Charm URL of application in model
+    :type model_charm: str
+    :returns: Whether the charms match
+    :rtype: bool
+    """
+    bundle_owner, bundle_name, bundle_revision = parse_charm(bundle_charm)
+    model_owner, model_name, model_revision = parse_charm(model_charm)
+    if deploy.is_local_charm(bundle_charm):
+        return model_charm.startswith('local:') and bundle_name == model_name
+    return (bundle_owner == model_owner and
+            bundle_name == model_name and
+            bundle_revision in (None, model_revision))
+
+
+def parse_endpoint(endpoint):
+    """Split an endpoint into application and relation name
+
+    :param endpoint: Endpoint, eg keystone:shared-db or keystone
+    :type endpoint: str
+    :returns: Application and relation name, which may be None
+    :rtype: (str, str or None)
+    """
+    application, _, name = endpoint.partition(':')
+    return application, name or None
+
+
+def relation_matches(bundle_relation, model_relation):
+    """Return whether a bundle relation describes a relation in the model
+
+    :param bundle_relation: Endpoints of relation in bundle, the relation
+                            names may be left out
+    :type bundle_relation: [str, str]
+    :param model_relation: Endpoints of relation in model
+    :type model_relation: [str, str]
+    :returns: Whether the relations match
+    :rtype: bool
+    """
+    def _matches(bundle_endpoint, model_endpoint):
+        bundle_app, bundle_name = parse_endpoint(bundle_endpoint)
+        model_app, model_name = parse_endpoint(model_endpoint)
+        return (bundle_app == model_app and
+                bundle_name in (None, model_name))
+    first, second = bundle_relation
+    return ((_matches(first, model_relation[0]) and
+             _matches(second, model_relation[1])) or
+            (_matches(first, model_relation[1]) and
+             _matches(second, model_relation[0])))
+
+
+async def async_get_model_state(model_name):
+    """Return the applications and relations of a model
+
+    :param model_name: Name of model
+    :type model_name: str
+    :returns: The 'applications' of the model, with their charm URL, series,
+              number of units, whether they are subordinate and the config
+              options set by the user, and the endpoints of each non-peer
+              relation
+    :rtype: dict
+    """
+    async with zaza.model.run_in_model(model_name) as model:
+        names = sorted(model.applications)
+        configs = await asyncio.gather(
+            *[model.applications[n].get_config() for n in names])
+        applications = {}
+        for name, config in zip(names, configs):
+            app = model.applications[name]
+            applications[name] = {
+                'charm': app.safe_data['charm-url'],
+                'series': app.safe_data.get('series'),
+                'num_units': len(app.units),
+                'subordinate': app.safe_data.get('subordinate', False),
+                'options': {k: v.get('value') for k, v in config.items()
+                            if v.get('source') == 'user'}}
+        relations = sorted(
+            rel.safe_data['key'].split(' ')
+            for rel in model.relations if not rel.is_peer)
+    return {'applications': applications, 'relations': relations}
+
+get_model_state = zaza.model.sync_wrapper(async_get_model_state)
+
+
+def get_bundle_diff(bundle_data, model_state):
+    """Return the changes which turn the model into the bundle
+
+    Applications whose charm or series differs are removed and added again.
+    Changes to constraints and placement of existing applications are not
+    applied.
+
+    :param bundle_data: Bundle with overlays applied
+    :type bundle_data: dict
+    :param model_state: Applications and relations of the model, as returned
+                        by get_model_state
+    :type model_state: dict
+    :returns: Names of applications to 'add', 'remove' and 'replace', units
+              to 'scale' each application to, options to 'set' and 'reset'
+              and relations to 'add_relations' and 'remove_relations'
+    :rtype: dict
+    """
+    diff = {
+        'add': [],
+        'remove': [],
+        'replace': [],
+        'scale': {},
+        'set': {},
+        'reset': {},
+        'add_relations': [],
+        'remove_relations': []}
+    bundle_apps = bundle_data.get('applications',
+                                  bundle_data.get('services', {}))
+    model_apps = model_state['applications']
+    default_series = bundle_data.get('series')
+    for name in sorted(set(model_apps) - set(bundle_apps)):
+        diff['remove'].append(name)
+    for name, app in sorted(bundle_apps.items()):
+        if name not in model_apps:
+            diff['add'].append(name)
+            continue
+        live = model_apps[name]
+        series = app.get('series') or default_series
+        if (not charm_matches(app['charm'], live['charm']) or
+                (series and live['series'] and series != live['series'])):
+            diff['replace'].append(name)
+            continue
+        if ('num_units' in app and not live['subordinate'] and
+                app['num_units'] != live['num_units']):
+            diff['scale'][name] = app['num_units']
+        options = app.get('options') or {}
+        changed = {k: v for k, v in sorted(options.items())
+                   if live['options'].get(k) != v}
+        if changed:
+            diff['set'][name] = changed
+        reset = sorted(set(live['options']) - set(options))
+        if reset:
+            diff['reset'][name] = reset
+    # Relations of removed or replaced applications go with them
+    gone = set(diff['remove'] + diff['replace'])
+    model_relations = [
+        r for r in model_state['relations']
+        if not gone.intersection(parse_endpoint(e)[0] for e in r)]
+    bundle_relations = bundle_data.get('relations', [])
+    for relation in bundle_relations:
+        if not any(relation_matches(relation, r) for r in model_relations):
+            diff['add_relations'].append(list(relation))
+    for relation in model_relations:
+        if not any(relation_matches(r, relation) for r in bundle_relations):
+            diff['remove_relations'].append(relation)
+    return diff
+
+
+def get_changed_applications(diff):
+    """Return the applications in the bundle which the diff changes
+
+    :param diff: Changes, as returned by get_bundle_diff
+    :type diff: dict
+    :returns: Application names
+    :rtype: [str, str,...]
+    """
+    changed = set(diff['add'] + diff['replace'])
+    changed.update(diff['scale'], diff['set'], diff['reset'])
+    for relation in diff['add_relations'] + diff['remove_relations']:
+        changed.update(parse_endpoint(e)[0] for e in relation)
+    return sorted(changed - set(diff['remove']))
+
+
+def parse_placement(directive):
+    """Split a bundle placement directive into container type and target
+
+    :param directive: Placement, eg lxd:0, keystone/0, lxd:new or 1
+    :type directive: str or int
+    :returns: Container type, which may be None, and the bundle machine,
+              unit or application the directive places onto
+    :rtype: (str or None, str)
+    """
+    container, _, target = str(directive).rpartition(':')
+    return container or None, target
+
+
+def _get_placements(app):
+    to = app.get('to') or []
+    return [to] if isinstance(to, str) else to
+
+
+def get_existing_placements(bundle_data, applications):
+    """Return placements of applications onto what is already in the model
+
+    When the given applications are deployed over a model with the rest of
+    the bundle already in it, a placement onto a bundle machine used by one
+    of the other applications, or onto one of their units, refers to a
+    machine the model already has. A bundle of just the given applications
+    cannot express that.
+
+    :param bundle_data: Bundle with overlays applied
+    :type bundle_data: dict
+    :param applications: Names of applications to be deployed
+    :type applications: [str, str,...]
+    :returns: Such placement directives keyed by application name
+    :rtype: {str: [str, ...]}
+    """
+    apps = bundle_data.get('applications', bundle_data.get('services', {}))
+    existing_machines = set()
+    for name, app in apps.items():
+        if name in applications:
+            continue
+        for directive in _get_placements(app):
+            target = parse_placement(directive)[1]
+            if target.isdigit():
+                existing_machines.add(target)
+    placements = {}
+    for name in applications:
+        for directive in _get_placements(apps[name]):
+            target = parse_placement(directive)[1]
+            if target.isdigit():
+                existing = target in existing_machines
+            else:
+                existing = (target != 'new' and
+                            target.split('/')[0] not in applications)
+            if existing:
+                placements.setdefault(name, []).append(str(directive))
+    return placements
+
+
+def get_partial_bundle(bundle_data, applications):
+    """Return the part of the bundle which deploys the given applications
+
+    Only the relations between the given applications, and the machines they
+    are placed on, are kept.
+
+    :param bundle_data: Bundle with overlays applied
+    :type bundle_data: dict
+    :param applications: Names of applications to keep
+    :type applications: [str, str,...]
+    :returns: Bundle
+    :rtype: dict
+    :raises: PlacementError if the applications are placed onto machines or
+             units of the rest of the bundle
+    """
+    existing = get_existing_placements(bundle_data, applications)
+    if existing:
+        raise PlacementError(existing)
+    apps_key = 'services' if 'services' in bundle_data else 'applications'
+    partial = {k: v for k, v in bundle_data.items()
+               if k not in (apps_key, 'relations', 'machines')}
+    partial[apps_key] = {name: bundle_data[apps_key][name]
+                         for name in applications}
+    partial['relations'] = [
+        r for r in bundle_data.get('relations', [])
+        if all(parse_endpoint(e)[0] in applications for e in r)]
+    placements = set()
+    for app in partial[apps_key].values():
+        for directive in _get_placements(app):
+            placements.add(parse_placement(directive)[1])
+    machines = {k: v for k, v in (bundle_data.get('machines') or {}).items()
+                if str(k) in placements}
+    if machines:
+        partial['machines'] = machines
+    return partial
+
+
+def _config_value(value):
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
+
+
+async def async_apply_bundle_diff(bundle, model_name, bundle_data, diff,
+                                  timeout=DEFAULT_REMOVE_TIMEOUT,
+                                  change_timeout=None):
+    """Make the changes to the model which turn it into the bundle
+
+    If change_timeout is given, wait until a unit of every application which
+    is changed in place has started running a hook, or change_timeout has
+    passed. Until then those applications can still look settled from before
+    the change. The units are watched from before the first change is made,
+    so a hook is seen however quickly it runs.
+
+    :param bundle: Path to bundle file
+    :type bundle: str
+    :param model_name: Name of model
+    :type model_name: str
+    :param bundle_data: Bundle with overlays applied
+    :type bundle_data: dict
+    :param diff: Changes, as returned by get_bundle_diff
+    :type diff: dict
+    :param timeout: Seconds to wait for removed applications to go
+    :type timeout: int
+    :param change_timeout: Seconds to wait for the applications changed in
+                           place to start running hooks
+    :type change_timeout: int or None
+    """
+    new = diff['add'] + diff['replace']
+    pending = set(get_changed_applications(diff)) - set(new)
+    changing = asyncio.Event()
+
+    async def _on_unit_change(delta, old_obj, new_obj, model):
+        agent_status = delta.data.get('agent-status') or {}
+        if agent_status.get('current') == 'executing':
+            pending.discard(delta.data.get('application'))
+            if not pending:
+                changing.set()
+
+    async with zaza.model.run_in_model(model_name) as model:
+        if change_timeout is not None and pending:
+            # The model only holds a weak reference to the observer, so it
+            # is dropped once this coroutine completes.
+            model.add_observer(_on_unit_change, entity_type='unit')
+        for relation in diff['remove_relations']:
+            logging.info("Removing relation {}".format(' '.join(relation)))
+            await model.applications[
+                parse_endpoint(relation[0])[0]].destroy_relation(
+                    parse_endpoint(relation[0])[1], relation[1])
+        gone = diff['remove'] + diff['replace']
+        for name in gone:
+            logging.info("Removing application {}".format(name))
+            await model.applications[name].destroy()
+        if gone:
+            async def _removed():
+                return not set(gone).intersection(model.applications)
+            await zaza.model.async_block_until(_removed, timeout=timeout)
+        if new:
+            await deploy.async_deploy_bundle_native(
+                bundle, model_name, get_partial_bundle(bundle_data, new))
+        for name, num_units in sorted(diff['scale'].items()):
+            app = model.applications[name]
+            logging.info("Scaling {} from {} to {} unit(s)".format(
+                name, len(app.units), num_units))
+            if num_units > len(app.units):
+                await app.add_unit(count=num_units - len(app.units))
+            else:
+                units = sorted(app.units,
+                               key=lambda u: int(u.entity_id.split('/')[1]))
+                await app.destroy_unit(
+                    *[u.entity_id for u in units[num_units:]])
+        for name, options in sorted(diff['set'].items()):
+            logging.info("Setting {} options: {}".format(
+                name, ', '.join(sorted(options))))
+            await model.applications[name].set_config(
+                {k: _config_value(v) for k, v in options.items()})
+        for name, options in sorted(diff['reset'].items()):
+            logging.info("Resetting {} options: {}".format(
+                name, ', '.join(options)))
+            await model.applications[name].reset_config(options)
+        # Relations between the new applications came with their bundle
+        for relation in diff['add_relations']:
+            if all(parse_endpoint(e)[0] in new for e in relation):
+                continue
+            logging.info("Adding relation {}".format(' '.join(relation)))
+            await model.add_relation(*relation)
+        if change_timeout is not None and pending:
+            try:
+                await asyncio.wait_for(changing.wait(), change_timeout)
+            except asyncio.TimeoutError:
+                logging.warning("No unit of {} ran a hook within {}s".format(
+                    ', '.join(sorted(pending)), change_timeout))
+
+apply_bundle_diff = zaza.model.sync_wrapper(async_apply_bundle_diff)
+
+
+def can_redeploy(bundle, model):
+    """Return whether the bundle can be applied to the model as a diff
+
+    :param bundle: Path to bundle file
+    :type bundle: str
+    :param model: Name of model the previous bundle is deployed in
+    :type model: str
+    :returns: Whether redeploy can change the model into the bundle
+    :rtype: bool
+    """
+    utils.set_juju_model(model)
+    bundle_data = deploy.get_merged_bundle(
+        bundle, deploy.render_overlays(bundle))
+    diff = get_bundle_diff(bundle_data, get_model_state(model))
+    existing = get_existing_placements(
+        bundle_data, diff['add'] + diff['replace'])
+    if existing:
+        logging.warning("Unable to redeploy {} over model {}: {}".format(
+            bundle, model, PlacementError(existing)))
+        return False
+    return True
+
+
+def redeploy(bundle, model, wait=True):
+    """Change the bundle deployed in the model into the given bundle
+
+    Only the differences between the model and the bundle, with its
+    overlays, are applied and only the applications which changed are waited
+    for. Applications changed in place are only waited for once they have
+    started running hooks for the change.
+
+    :param bundle: Path to bundle file
+    :type bundle: str
+    :param model: Name of model the previous bundle is deployed in
+    :type model: str
+    :param wait: Whether to wait until the changed applications settle
+    :type wait: bool
+    :returns: Names of changed applications
+    :rtype: [str, str,...]
+    :raises: PlacementError, before the model is changed, if new
+             applications are placed onto machines or units already in the
+             model
+    """
+    utils.set_juju_model(model)
+    with timing.timed('deploy', bundle, model=model):
+        with timing.timed('deploy_bundle', bundle, model=model):
+            bundle_data = deploy.get_merged_bundle(
+                bundle, deploy.render_overlays(bundle))
+            diff = get_bundle_diff(bundle_data, get_model_state(model))
+            existing = get_existing_placements(
+                bundle_data, diff['add'] + diff['replace'])
+            if existing:
+                raise PlacementError(existing)
+            changed = get_changed_applications(diff)
+            logging.info(
+                "Redeploying bundle {} over model {}: adding {}, removing "
+                "{}, replacing {}, changing {}".format(
+                    bundle, model,
+                    ', '.join(diff['add']) or 'none',
+                    ', '.join(diff['remove']) or 'none',
+                    ', '.join(diff['replace']) or 'none',
+                    ', '.join(sorted(set(changed) - set(
+                        diff['add'] + diff['replace']))) or 'none'))
+            apply_bundle_diff(
+                bundle, model, bundle_data, diff,
+                change_timeout=DEFAULT_CHANGE_TIMEOUT if wait else None)
+        if wait and changed:
+            test_config = utils.get_charm_config()
+            logging.info("Waiting for {} to settle".format(', '.join(changed)))
+            with timing.timed('deploy_wait', bundle, model=model):
+                zaza.model.wait_for_application_states(
+                    model,
+                    test_config.get('target_deploy_status', {}),
+                    applications=changed)
+    return changed
+
+
+def parse_args(args):
+    """Parse command line arguments
+
+    :param args: List of command line arguments
+    :type args: [str1, str2,...]
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model',
+                        help='Model the previous bundle is deployed in',
+                        required=True)
+    parser.add_argument('-b', '--bundle',
+                        help='Bundle to change the model to',
+                        required=True)
+    parser.add_argument('--no-wait', dest='wait',
+                        help='Do not wait for the changes to settle',
+                        action='store_false')
+    parser.set_defaults(wait=True)
+    return parser.parse_args(args)
+
+
+def main():
+    """Change the bundle deployed in a model"""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(sys.argv[1:])
+    redeploy(args.bundle, args.model, wait=args.wait)
+    zaza.model.shutdown()
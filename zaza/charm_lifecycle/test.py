@@ -1,30 +1,381 @@
-import asyncio
 import argparse
+from concurrent import futures
+import io
+import json
 import logging
 import unittest
 import sys
+import threading
+import time
+import traceback
+import xml.etree.ElementTree as ElementTree
 
+import zaza.charm_lifecycle.error_watcher as error_watcher
+import zaza.charm_lifecycle.timing as timing
 import zaza.charm_lifecycle.utils as utils
+import zaza.model
 
+# Test classes with this attribute set to True never run at the same time as
+# another test class, eg because they change charm config
+SERIAL_ATTRIBUTE = 'zaza_serial'
+# Maximum number of test classes to run at once
+DEFAULT_TEST_WORKERS = 1
 
-def run_test_list(tests):
-    """Run the tests as defined in the list of test classes in series.
+_output_lock = threading.Lock()
+
+
+class ReportingTestResult(timing.TimedTextTestResult):
+    """Test result which keeps the duration and outcome of each test"""
+
+    def __init__(self, *args, **kwargs):
+        super(ReportingTestResult, self).__init__(*args, **kwargs)
+        self.test_reports = []
+        self._current_test = None
+        self._test_message = None
+
+    def startTest(self, test):
+        self._current_test = test
+        self._test_message = None
+        super(ReportingTestResult, self).startTest(test)
+
+    def _add_message(self, test, outcome, message):
+        if test is self._current_test:
+            self._test_message = message
+        else:
+            # Errors in setUpClass and tearDownClass are not part of any
+            # test, so are reported on their own
+            self.test_reports.append({
+                'name': test.id(),
+                'duration': 0,
+                'outcome': outcome,
+                'message': message})
+
+    def addError(self, test, err):
+        super(ReportingTestResult, self).addError(test, err)
+        self._add_message(test, 'error', self.errors[-1][1])
+
+    def addFailure(self, test, err):
+        super(ReportingTestResult, self).addFailure(test, err)
+        self._add_message(test, 'fail', self.failures[-1][1])
+
+    def addSkip(self, test, reason):
+        super(ReportingTestResult, self).addSkip(test, reason)
+        self._add_message(test, 'skip', reason)
+
+    def stopTest(self, test):
+        super(ReportingTestResult, self).stopTest(test)
+        self.test_reports.append({
+            'name': test.id(),
+            'duration': round(time.time() - self._test_start, 3),
+            'outcome': self._test_outcome,
+            'message': self._test_message})
+        self._current_test = None
+
+
+def get_shard(tests, shard):
+    """Return the test classes in the given shard
 
     :param tests: List of test class strings
     :type tests: ['zaza.charms_tests.svc.TestSVCClass1', ...]
-    :raises: AssertionError if test run fails
+    :param shard: Number of shard, counting from 1, and number of shards
+    :type shard: (int, int)
+    :returns: Test classes in the shard
+    :rtype: ['zaza.charms_tests.svc.TestSVCClass1', ...]
+    """
+    index, count = shard
+    return tests[index - 1::count]
+
+
+def is_serial(test_class_name):
+    """Return whether a test class must not run alongside another
+
+    :param test_class_name: Test class string
+    :type test_class_name: str
+    :returns: Whether the class is marked as serial
+    :rtype: boolean
     """
-    for _testcase in tests:
-        testcase = utils.get_class(_testcase)
+    try:
+        return getattr(utils.get_class(test_class_name), SERIAL_ATTRIBUTE,
+                       False) is True
+    except Exception:
+        # The error is reported when the class is run
+        return False
+
+
+def get_test_batches(tests):
+    """Split the test classes into batches which may run at the same time
+
+    Classes stay in list order. Each serial class is a batch on its own and
+    the classes between serial classes form a batch.
+
+    :param tests: List of test class strings
+    :type tests: ['zaza.charms_tests.svc.TestSVCClass1', ...]
+    :returns: Batches of test classes
+    :rtype: [[str, ...], ...]
+    """
+    batches = []
+    batch = []
+    for test_class_name in tests:
+        if is_serial(test_class_name):
+            if batch:
+                batches.append(batch)
+                batch = []
+            batches.append([test_class_name])
+        else:
+            batch.append(test_class_name)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def run_test_class(test_class_name, stream=None):
+    """Run the tests in a test class
+
+    :param test_class_name: Test class string
+    :type test_class_name: str
+    :param stream: Stream to write test output to, defaults to stderr
+    :type stream: io.TextIOBase
+    :returns: Name, start, duration, outcome and tests of the class
+    :rtype: dict
+    """
+    name = str(test_class_name)
+    start = time.time()
+    try:
+        testcase = utils.get_class(test_class_name)
         suite = unittest.TestLoader().loadTestsFromTestCase(testcase)
-        test_result = unittest.TextTestRunner(verbosity=2).run(suite)
-        assert test_result.wasSuccessful(), "Test run failed"
+        test_result = unittest.TextTestRunner(
+            stream=stream,
+            verbosity=2,
+            resultclass=ReportingTestResult).run(suite)
+        tests = test_result.test_reports
+        outcome = 'pass' if test_result.wasSuccessful() else 'fail'
+    except Exception:
+        logging.exception("Failed to run test class {}".format(name))
+        tests = [{
+            'name': name,
+            'duration': 0,
+            'outcome': 'error',
+            'message': traceback.format_exc()}]
+        outcome = 'error'
+    end = time.time()
+    timing.record('test_class', name, start, end, outcome)
+    return {
+        'name': name,
+        'start': start,
+        'duration': round(end - start, 3),
+        'outcome': outcome,
+        'tests': tests}
+
+
+def _run_buffered(test_class_name, cancel):
+    stream = io.StringIO()
+    try:
+        with zaza.model.cancel_on(cancel):
+            return run_test_class(test_class_name, stream=stream)
+    finally:
+        with _output_lock:
+            sys.stderr.write(stream.getvalue())
+            sys.stderr.flush()
+
+
+def run_test_batch(batch, executor, cancel=None):
+    """Run the test classes of a batch at the same time
+
+    The output of each class is held back until the class has finished so
+    that the output of classes running together is not interleaved.
+
+    :param batch: Test class strings
+    :type batch: [str, ...]
+    :param executor: Pool to run the classes on
+    :type executor: concurrent.futures.Executor
+    :param cancel: Event which cancels the running classes at their next
+                   zaza.model call once set, see zaza.model.cancel_on
+    :type cancel: threading.Event
+    :returns: Result of each class, in batch order
+    :rtype: [dict, ...]
+    """
+    cancel = cancel or threading.Event()
+    with error_watcher.abort_deferred():
+        jobs = [executor.submit(_run_buffered, t, cancel) for t in batch]
+    # Wait in steps so that an abort signal is handled promptly, see
+    # zaza.model.run
+    pending = jobs
+    while pending:
+        _, pending = futures.wait(
+            pending, timeout=zaza.model.CANCEL_CHECK_INTERVAL)
+    return [job.result() for job in jobs]
+
+
+def get_summary(results):
+    """Return the totals and results of a test run
+
+    :param results: Result of each test class
+    :type results: [dict, ...]
+    :returns: Summary of run
+    :rtype: dict
+    """
+    summary = {
+        'tests': 0,
+        'pass': 0,
+        'fail': 0,
+        'error': 0,
+        'skip': 0,
+        'duration': 0,
+        'classes': results}
+    if results:
+        summary['duration'] = round(
+            max(r['start'] + r['duration'] for r in results) -
+            min(r['start'] for r in results), 3)
+    for result in results:
+        for test_report in result['tests']:
+            summary['tests'] += 1
+            summary[test_report['outcome']] += 1
+    return summary
+
+
+def write_json_summary(summary, json_file):
+    """Write the summary of a test run as JSON
+
+    :param summary: Summary of run
+    :type summary: dict
+    :param json_file: Path to write to
+    :type json_file: str
+    """
+    with open(json_file, 'w') as fh:
+        json.dump(summary, fh, indent=2, sort_keys=True)
 
 
-def test(model_name, tests):
-    """Run all steps to execute tests against the model"""
+def write_junit_xml(summary, xml_file):
+    """Write the results of a test run as JUnit XML
+
+    :param summary: Summary of run
+    :type summary: dict
+    :param xml_file: Path to write to
+    :type xml_file: str
+    """
+    outcome_tags = {'fail': 'failure', 'error': 'error', 'skip': 'skipped'}
+    testsuites = ElementTree.Element('testsuites', {
+        'tests': str(summary['tests']),
+        'failures': str(summary['fail']),
+        'errors': str(summary['error']),
+        'skipped': str(summary['skip']),
+        'time': str(summary['duration'])})
+    for result in summary['classes']:
+        counts = {o: 0 for o in outcome_tags}
+        for test_report in result['tests']:
+            counts[test_report['outcome']] = counts.get(
+                test_report['outcome'], 0) + 1
+        testsuite = ElementTree.SubElement(testsuites, 'testsuite', {
+            'name': result['name'],
+            'tests': str(len(result['tests'])),
+            'failures': str(counts['fail']),
+            'errors': str(counts['error']),
+            'skipped': str(counts['skip']),
+            'time': str(result['duration'])})
+        for test_report in result['tests']:
+            classname, _, name = test_report['name'].rpartition('.')
+            testcase = ElementTree.SubElement(testsuite, 'testcase', {
+                'classname': classname or result['name'],
+                'name': name,
+                'time': str(test_report['duration'])})
+            tag = outcome_tags.get(test_report['outcome'])
+            if tag:
+                message = test_report['message'] or ''
+                element = ElementTree.SubElement(testcase, tag, {
+                    'message': message.strip().splitlines()[-1]
+                    if message.strip() else ''})
+                if tag != 'skipped':
+                    element.text = message
+    ElementTree.ElementTree(testsuites).write(
+        xml_file, encoding='utf-8', xml_declaration=True)
+
+
+def run_test_list(tests, workers=DEFAULT_TEST_WORKERS, junit_xml=None,
+                  json_summary=None):
+    """Run the tests as defined in the list of test classes.
+
+    Up to workers classes run at the same time, other than those marked as
+    serial which always run on their own. Every class is run even if an
+    earlier one fails. Classes which run on their own run in the calling
+    thread. If the phase is aborted while classes run at the same time they
+    are cancelled at their next zaza.model call, and waited for.
+
+    :param tests: List of test class strings
+    :type tests: ['zaza.charms_tests.svc.TestSVCClass1', ...]
+    :param workers: Maximum number of test classes to run at once
+    :type workers: int
+    :param junit_xml: File to write JUnit XML results to
+    :type junit_xml: str
+    :param json_summary: File to write a JSON summary of results to
+    :type json_summary: str
+    :raises: AssertionError if test run fails
+    """
+    results = []
+    cancel = threading.Event()
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        for batch in get_test_batches(tests):
+            if workers > 1 and len(batch) > 1:
+                results.extend(run_test_batch(batch, executor, cancel=cancel))
+            else:
+                results.extend(run_test_class(t) for t in batch)
+    except BaseException:
+        # The phase is being aborted, stop the running classes rather than
+        # leave them acting on the model
+        cancel.set()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+    summary = get_summary(results)
+    if junit_xml:
+        write_junit_xml(summary, junit_xml)
+    if json_summary:
+        write_json_summary(summary, json_summary)
+    logging.info("Ran {tests} tests in {duration}s: {pass} passed, {fail} "
+                 "failed, {error} errors, {skip} skipped".format(**summary))
+    failed = [r['name'] for r in results if r['outcome'] != 'pass']
+    assert not failed, "Test run failed: {}".format(', '.join(failed))
+
+
+def test(model_name, tests, workers=DEFAULT_TEST_WORKERS, junit_xml=None,
+         json_summary=None):
+    """Run all steps to execute tests against the model
+
+    :param model_name: Name of model to run tests against
+    :type model_name: str
+    :param tests: List of test class strings
+    :type tests: ['zaza.charms_tests.svc.TestSVCClass1', ...]
+    :param workers: Maximum number of test classes to run at once
+    :type workers: int
+    :param junit_xml: File to write JUnit XML results to
+    :type junit_xml: str
+    :param json_summary: File to write a JSON summary of results to
+    :type json_summary: str
+    """
     utils.set_juju_model(model_name)
-    run_test_list(tests)
+    with timing.timed('test', model=model_name):
+        run_test_list(tests, workers=workers, junit_xml=junit_xml,
+                      json_summary=json_summary)
+
+
+def parse_shard(value):
+    """Parse a shard given as INDEX/COUNT, eg 2/4
+
+    :param value: Shard to parse
+    :type value: str
+    :returns: Number of shard, counting from 1, and number of shards
+    :rtype: (int, int)
+    :raises: argparse.ArgumentTypeError
+    """
+    try:
+        index, count = [int(v) for v in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Shard must be INDEX/COUNT, eg 1/4, not {}".format(value))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(
+            "Shard index must be between 1 and {}".format(count))
+    return index, count
 
 
 def parse_args(args):
@@ -41,6 +392,20 @@ def parse_args(args):
                         required=False)
     parser.add_argument('-m', '--model-name', help='Name of model to remove',
                         required=True)
+    parser.add_argument('-w', '--workers', type=int,
+                        help='Number of test classes to run at once',
+                        required=False)
+    parser.add_argument('--shard', type=parse_shard,
+                        help=('Only run shard INDEX of COUNT, eg 1/4, of the '
+                              'test classes'),
+                        required=False)
+    parser.add_argument('--junit-xml', dest='junit_xml',
+                        help='File to write JUnit XML results to',
+                        required=False)
+    parser.add_argument('--json-summary', dest='json_summary',
+                        help='File to write a JSON summary of results to',
+                        required=False)
+    parser.set_defaults(workers=DEFAULT_TEST_WORKERS)
     return parser.parse_args(args)
 
 
@@ -50,5 +415,8 @@ def main():
     logging.basicConfig(level=logging.INFO)
     args = parse_args(sys.argv[1:])
     tests = args.tests or utils.get_charm_config()['tests']
-    test(args.model_name, tests)
-    asyncio.get_event_loop().close()
+    if args.shard:
+        tests = get_shard(tests, args.shard)
+    test(args.model_name, tests, workers=args.workers,
+         junit_xml=args.junit_xml, json_summary=args.json_summary)
+    zaza.model.shutdown()
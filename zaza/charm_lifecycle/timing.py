@@ -0,0 +1,142 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import unittest
+
+# Environment variable naming the file to write the timing report to. Using
+# the environment means the setting is inherited by worker processes.
+REPORT_FILE_ENV = 'ZAZA_TIMING_REPORT'
+# Attributes, such as bundle and model name, added to every event recorded
+# by this process
+CONTEXT = {}
+
+_report_lock = threading.Lock()
+
+
+def get_report_file():
+    """Return the file the timing report is written to
+
+    :returns: Path to report file or None if no report is being written
+    :rtype: str or None
+    """
+    return os.environ.get(REPORT_FILE_ENV)
+
+
+def set_report_file(report_file):
+    """Write the timing report of this process and its children to the file
+
+    :param report_file: Path to report file
+    :type report_file: str
+    """
+    os.environ[REPORT_FILE_ENV] = os.path.abspath(report_file)
+
+
+def write_event(event):
+    """Append the event as a line of JSON to the report file, if there is one
+
+    :param event: Event to record
+    :type event: dict
+    """
+    report_file = get_report_file()
+    if not report_file:
+        return
+    with _report_lock:
+        with open(report_file, 'a') as fh:
+            fh.write(json.dumps(event, sort_keys=True) + '\n')
+
+
+def record(phase, name, start, end, outcome, **attrs):
+    """Record an event covering the time between start and end
+
+    :param phase: Phase of the run, eg deploy
+    :type phase: str
+    :param name: Name of the item being timed, eg a configure function
+    :type name: str or None
+    :param start: Start time in seconds since the epoch
+    :type start: float
+    :param end: End time in seconds since the epoch
+    :type end: float
+    :param outcome: How the item finished, eg pass or fail
+    :type outcome: str
+    :returns: The event recorded
+    :rtype: dict
+    """
+    event = dict(CONTEXT)
+    event.update(attrs)
+    event.update({
+        'phase': phase,
+        'name': name,
+        'start': start,
+        'end': end,
+        'duration': round(end - start, 3),
+        'outcome': outcome})
+    write_event(event)
+    return event
+
+
+@contextlib.contextmanager
+def context(**attrs):
+    """Add the attributes to every event recorded inside the with block
+
+    :param attrs: Attributes to add, eg bundle='base'
+    :type attrs: dict
+    """
+    saved = dict(CONTEXT)
+    CONTEXT.update(attrs)
+    try:
+        yield
+    finally:
+        CONTEXT.clear()
+        CONTEXT.update(saved)
+
+
+@contextlib.contextmanager
+def timed(phase, name=None, **attrs):
+    """Record how long the with block takes and whether it raised
+
+    :param phase: Phase of the run, eg deploy
+    :type phase: str
+    :param name: Name of the item being timed, eg a configure function
+    :type name: str or None
+    :param attrs: Extra attributes for the event, eg model='zaza-123'
+    :type attrs: dict
+    """
+    start = time.time()
+    outcome = 'fail'
+    try:
+        yield
+        outcome = 'pass'
+    finally:
+        record(phase, name, start, time.time(), outcome, **attrs)
+
+
+class TimedTextTestResult(unittest.TextTestResult):
+    """Test result which records the duration and outcome of each test"""
+
+    def startTest(self, test):
+        self._test_start = time.time()
+        self._test_outcome = 'pass'
+        super(TimedTextTestResult, self).startTest(test)
+
+    def addError(self, test, err):
+        self._test_outcome = 'error'
+        super(TimedTextTestResult, self).addError(test, err)
+
+    def addFailure(self, test, err):
+        self._test_outcome = 'fail'
+        super(TimedTextTestResult, self).addFailure(test, err)
+
+    def addSkip(self, test, reason):
+        self._test_outcome = 'skip'
+        super(TimedTextTestResult, self).addSkip(test, reason)
+
+    def addUnexpectedSuccess(self, test):
+        self._test_outcome = 'fail'
+        super(TimedTextTestResult, self).addUnexpectedSuccess(test)
+
+    def stopTest(self, test):
+        super(TimedTextTestResult, self).stopTest(test)
+        record('test_case', test.id(), self._test_start, time.time(),
+               self._test_outcome)
@@ -48,20 +48,22 @@ def test_bgp_routes(peer_application_name="quagga", keystone_session=None):
     # routes to propogate via BGP. Do a binary backoff.
     @tenacity.retry(wait=tenacity.wait_exponential(multiplier=1, max=60),
                     reraise=True, stop=tenacity.stop_after_attempt(8))
-    def _assert_cidr_in_peer_routing_table(peer_unit, cidr):
+    def _assert_cidrs_in_peer_routing_table(peer_unit, cidrs):
         logging.debug("Checking for {} on BGP peer {}"
-                      .format(cidr, peer_unit))
+                      .format(', '.join(cidrs), peer_unit))
         # Run show ip route bgp on BGP peer
         routes = _local_utils.remote_run(
             peer_unit, remote_cmd='vtysh -c "show ip route bgp"')
         logging.debug(routes)
-        assert cidr in routes, (
-            "CIDR, {}, not found in BGP peer's routing table" .format(cidr))
+        for cidr in cidrs:
+            assert cidr in routes, (
+                "CIDR, {}, not found in BGP peer's routing table"
+                .format(cidr))
 
-    _assert_cidr_in_peer_routing_table(peer_unit, private_cidr)
+    _assert_cidrs_in_peer_routing_table(peer_unit,
+                                        [private_cidr, floating_ip_cidr])
     logging.info("Private subnet CIDR, {}, found in routing table"
                  .format(private_cidr))
-    _assert_cidr_in_peer_routing_table(peer_unit, floating_ip_cidr)
     logging.info("Floating IP CIDR, {}, found in routing table"
                  .format(floating_ip_cidr))
 
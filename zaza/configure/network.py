@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import argparse
+import functools
 import logging
 import sys
 
+from concurrent import futures
+
 from zaza.utilities import _local_utils
 from zaza.utilities import openstack_utils
 
@@ -72,15 +75,306 @@ As a script from CLI with a YAML file of configuration:
 """
 
 
-def setup_sdn(network_config, keystone_session=None):
+# Maximum number of neutron API calls setup_sdn makes at once
+DEFAULT_SDN_WORKERS = 4
+DEFAULT_ROUTER_NAME = "provider-router"
+PROJECT_NETWORK_NAME = "private"
+PROJECT_SUBNET_NAME = "private_subnet"
+
+
+def get_sdn_state(neutron_client, network_config):
+    """List the existing neutron resources managed by setup_sdn
+
+    Each resource type is listed once, and all the types are listed at the
+    same time.
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param network_config: Network configuration settings dictionary
+    :type network_config: dict
+    :returns: Lists of resources keyed on resource type, eg 'networks'
+    :rtype: dict
+    """
+
+    listers = {
+        "networks": neutron_client.list_networks,
+        "subnets": neutron_client.list_subnets,
+        "routers": neutron_client.list_routers,
+        "security_groups": neutron_client.list_security_groups,
+        "ports": functools.partial(
+            neutron_client.list_ports,
+            device_owner="network:router_interface"),
+    }
+    if network_config.get("subnetpool_prefix"):
+        listers["address_scopes"] = neutron_client.list_address_scopes
+        listers["subnetpools"] = neutron_client.list_subnetpools
+    else:
+        listers["address_scopes"] = lambda: {"address_scopes": []}
+        listers["subnetpools"] = lambda: {"subnetpools": []}
+    with futures.ThreadPoolExecutor(max_workers=len(listers)) as executor:
+        results = {key: executor.submit(lister)
+                   for key, lister in listers.items()}
+    return {key: result.result()[key] for key, result in results.items()}
+
+
+def _find_by_name(resources, name):
+    for resource in resources:
+        if resource.get("name") == name:
+            return resource
+
+
+def plan_sdn(network_config, state, project_id):
+    """Work out what setup_sdn needs to create given the existing resources
+
+    Each step of the plan is a dict with the 'name' of the resource it
+    creates, the names of the resources it 'depends' on, a 'description' and
+    an 'apply' function. 'apply' is called with the neutron client and the
+    resources created so far and returns the new resource.
+
+    :param network_config: Network configuration settings dictionary
+    :type network_config: dict
+    :param state: Existing resources, as returned by get_sdn_state
+    :type state: dict
+    :param project_id: Project ID
+    :type project_id: string
+    :returns: Existing resources keyed on name and the steps to create the
+              missing ones
+    :rtype: (dict, [dict, ...])
+    """
+
+    resources = {}
+    steps = []
+
+    def _step(name, existing, depends, description, apply):
+        if existing:
+            resources[name] = existing
+        else:
+            steps.append({
+                "name": name,
+                "depends": depends,
+                "description": description,
+                "apply": apply})
+
+    ip_version = network_config.get("ip_version") or 4
+    router_name = network_config.get("router_name", DEFAULT_ROUTER_NAME)
+
+    # External network, subnet and router
+    ext_net_name = network_config["external_net_name"]
+    ext_network = _find_by_name(state["networks"], ext_net_name)
+
+    def _create_external_network(neutron_client, resources):
+        return openstack_utils.new_external_network(
+            neutron_client, project_id, net_name=ext_net_name)
+
+    _step("external_network", ext_network, [],
+          "Create external network {}".format(ext_net_name),
+          _create_external_network)
+
+    ext_subnet_name = network_config["external_subnet_name"]
+
+    def _create_external_subnet(neutron_client, resources):
+        return openstack_utils.new_external_subnet(
+            neutron_client, project_id, resources["external_network"],
+            default_gateway=network_config.get("default_gateway"),
+            cidr=network_config.get("external_net_cidr"),
+            start_floating_ip=network_config.get("start_floating_ip"),
+            end_floating_ip=network_config.get("end_floating_ip"),
+            subnet_name=ext_subnet_name)
+
+    _step("external_subnet",
+          _find_by_name(state["subnets"], ext_subnet_name),
+          ["external_network"],
+          "Create external subnet {}".format(ext_subnet_name),
+          _create_external_subnet)
+
+    router = _find_by_name(state["routers"], router_name)
+
+    def _create_router(neutron_client, resources):
+        return openstack_utils.new_provider_router(
+            neutron_client, project_id, router_name=router_name)
+
+    _step("router", router, [],
+          "Create router {}".format(router_name),
+          _create_router)
+
+    gateway = None
+    if router and ext_network:
+        gateway_info = router.get("external_gateway_info") or {}
+        gateway = gateway_info.get("network_id") == ext_network["id"]
+
+    def _plug_extnet_into_router(neutron_client, resources):
+        openstack_utils.add_router_gateway(
+            neutron_client, resources["router"],
+            resources["external_network"])
+        return True
+
+    _step("router_gateway", gateway, ["router", "external_network"],
+          "Plug {} into router {}".format(ext_net_name, router_name),
+          _plug_extnet_into_router)
+
+    # Address scope and subnetpool
+    subnetpool_depends = []
+    if network_config.get("subnetpool_prefix"):
+        scope_name = network_config.get("address_scope")
+
+        def _create_address_scope(neutron_client, resources):
+            return openstack_utils.new_address_scope(
+                neutron_client, project_id, scope_name,
+                ip_version=ip_version)
+
+        _step("address_scope",
+              _find_by_name(state["address_scopes"], scope_name),
+              [],
+              "Create address scope {}".format(scope_name),
+              _create_address_scope)
+
+        pool_name = network_config.get("subnetpool_name")
+
+        def _create_subnetpool(neutron_client, resources):
+            return openstack_utils.new_subnetpool(
+                neutron_client, project_id, pool_name,
+                network_config["subnetpool_prefix"],
+                resources["address_scope"])
+
+        _step("subnetpool",
+              _find_by_name(state["subnetpools"], pool_name),
+              ["address_scope"],
+              "Create subnetpool {}".format(pool_name),
+              _create_subnetpool)
+        subnetpool_depends = ["subnetpool"]
+
+    # Project network, subnet and router interface
+    project_network = _find_by_name(state["networks"], PROJECT_NETWORK_NAME)
+
+    def _create_project_network(neutron_client, resources):
+        return openstack_utils.new_project_network(
+            neutron_client, project_id, net_name=PROJECT_NETWORK_NAME,
+            network_type=network_config["network_type"])
+
+    _step("project_network", project_network, [],
+          "Create project network {}".format(PROJECT_NETWORK_NAME),
+          _create_project_network)
+
+    project_subnet = _find_by_name(state["subnets"], PROJECT_SUBNET_NAME)
+
+    def _create_project_subnet(neutron_client, resources):
+        return openstack_utils.new_project_subnet(
+            neutron_client, project_id, resources["project_network"],
+            network_config.get("private_net_cidr"),
+            subnet_name=PROJECT_SUBNET_NAME,
+            subnetpool=resources.get("subnetpool"),
+            ip_version=ip_version)
+
+    _step("project_subnet", project_subnet,
+          ["project_network"] + subnetpool_depends,
+          "Create project subnet {}".format(PROJECT_SUBNET_NAME),
+          _create_project_subnet)
+
+    dns_servers = network_config["external_dns"].split(",")
+    dns = None
+    if project_subnet:
+        dns = (sorted(project_subnet.get("dns_nameservers") or []) ==
+               sorted(dns_servers))
+
+    def _update_subnet_dns(neutron_client, resources):
+        openstack_utils.update_subnet_dns(
+            neutron_client, resources["project_subnet"],
+            network_config["external_dns"])
+        return True
+
+    _step("subnet_dns", dns, ["project_subnet"],
+          "Set DNS servers of {} to {}".format(
+              PROJECT_SUBNET_NAME, network_config["external_dns"]),
+          _update_subnet_dns)
+
+    interface = None
+    if project_network:
+        interface = any(
+            port["network_id"] == project_network["id"]
+            for port in state["ports"])
+
+    def _plug_subnet_into_router(neutron_client, resources):
+        openstack_utils.add_router_interface(
+            neutron_client, resources["router"],
+            resources["project_subnet"])
+        return True
+
+    _step("router_interface", interface, ["router", "project_subnet"],
+          "Plug {} into router {}".format(PROJECT_SUBNET_NAME, router_name),
+          _plug_subnet_into_router)
+
+    # Security group rules
+    secgroup = openstack_utils.find_default_secgroup(
+        state["security_groups"], project_id)
+    missing_rules = openstack_utils.get_missing_secgroup_rules(secgroup)
+    for rule_name in openstack_utils.NEUTRON_SECGROUP_RULES:
+
+        def _create_rule(neutron_client, resources, rule_name=rule_name):
+            return openstack_utils.new_secgroup_rule(
+                neutron_client, secgroup, rule_name)
+
+        _step("{}_rule".format(rule_name), rule_name not in missing_rules,
+              [], "Add {} security group rule".format(rule_name),
+              _create_rule)
+
+    return resources, steps
+
+
+def apply_sdn_plan(neutron_client, resources, steps,
+                   max_workers=DEFAULT_SDN_WORKERS):
+    """Run the steps of a plan, running steps in parallel where possible
+
+    A step is started as soon as all the resources it depends on exist.
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param resources: Existing resources keyed on name
+    :type resources: dict
+    :param steps: Steps to create the missing resources
+    :type steps: [dict, ...]
+    :param max_workers: Maximum number of steps to run at once
+    :type max_workers: int
+    :returns: All resources keyed on name
+    :rtype: dict
+    """
+
+    resources = dict(resources)
+    pending = list(steps)
+    running = {}
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            for step in list(pending):
+                if all(d in resources for d in step["depends"]):
+                    pending.remove(step)
+                    logging.info(step["description"])
+                    future = executor.submit(
+                        step["apply"], neutron_client, resources)
+                    running[future] = step
+            if not running:
+                raise Exception("Unable to apply steps: {}".format(
+                    ", ".join(step["name"] for step in pending)))
+            done, _ = futures.wait(
+                running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                resources[step["name"]] = future.result()
+    return resources
+
+
+def setup_sdn(network_config, keystone_session=None, plan_only=False):
     """Setup Software Defined Network
 
+    The existing resources are listed up front and only the missing ones are
+    created, so running this against a configured cloud makes no changes.
+
     :param network_config: Network configuration settings dictionary
     :type network_config: dict
     :param keystone_session: Keystone session object for overcloud
     :type keystone_session: keystoneauth1.session.Session object
-    :returns: None
-    :rtype: None
+    :param plan_only: Only report what would be done
+    :type plan_only: boolean
+    :returns: Descriptions of the changes planned
+    :rtype: [str, ...]
     """
 
     # If a session has not been provided, acquire one
@@ -98,69 +392,21 @@ def setup_sdn(network_config, keystone_session=None):
         keystone_client,
         "admin",
     )
-    # Network Setup
-    subnetpools = False
-    if network_config.get("subnetpool_prefix"):
-        subnetpools = True
 
     logging.info("Configuring overcloud network")
-    # Create the external network
-    ext_network = openstack_utils.create_external_network(
-        neutron_client,
-        project_id,
-        network_config.get("dvr_enabled", False),
-        network_config["external_net_name"])
-    openstack_utils.create_external_subnet(
-        neutron_client,
-        project_id,
-        ext_network,
-        network_config["default_gateway"],
-        network_config["external_net_cidr"],
-        network_config["start_floating_ip"],
-        network_config["end_floating_ip"],
-        network_config["external_subnet_name"])
-    provider_router = (
-        openstack_utils.create_provider_router(neutron_client, project_id))
-    openstack_utils.plug_extnet_into_router(
-        neutron_client,
-        provider_router,
-        ext_network)
-    ip_version = network_config.get("ip_version") or 4
-    subnetpool = None
-    if subnetpools:
-        address_scope = openstack_utils.create_address_scope(
-            neutron_client,
-            project_id,
-            network_config.get("address_scope"),
-            ip_version=ip_version)
-        subnetpool = openstack_utils.create_subnetpool(
-            neutron_client,
-            project_id,
-            network_config.get("subnetpool_name"),
-            network_config.get("subnetpool_prefix"),
-            address_scope)
-    project_network = openstack_utils.create_project_network(
-        neutron_client,
-        project_id,
-        shared=False,
-        network_type=network_config["network_type"])
-    project_subnet = openstack_utils.create_project_subnet(
-        neutron_client,
-        project_id,
-        project_network,
-        network_config.get("private_net_cidr"),
-        subnetpool=subnetpool,
-        ip_version=ip_version)
-    openstack_utils.update_subnet_dns(
-        neutron_client,
-        project_subnet,
-        network_config["external_dns"])
-    openstack_utils.plug_subnet_into_router(
-        neutron_client,
-        network_config["router_name"],
-        project_network,
-        project_subnet)
-    openstack_utils.add_neutron_secgroup_rules(neutron_client, project_id)
+    resources, steps = plan_sdn(
+        network_config,
+        get_sdn_state(neutron_client, network_config),
+        project_id)
+    plan = [step["description"] for step in steps]
+    if not plan:
+        logging.info("Overcloud network already configured")
+    elif plan_only:
+        for description in plan:
+            logging.info("Plan: {}".format(description))
+    else:
+        apply_sdn_plan(neutron_client, resources, steps)
+    return plan
 
 
 def setup_gateway_ext_port(network_config, keystone_session=None):
@@ -234,6 +480,10 @@ def run_from_cli(**kwargs):
     parser.add_argument("--net_topology_file", "-f",
                         help="Network topology file location",
                         default="network.yaml")
+    parser.add_argument("--plan",
+                        help="only show the changes that would be made",
+                        action="store_true",
+                        default=False)
     # Handle CLI options
     options = parser.parse_args()
     net_topology = (kwargs.get('net_toplogoy') or
@@ -242,16 +492,18 @@ def run_from_cli(**kwargs):
                          _local_utils.parse_arg(options, "net_topology_file"))
     ignore_env_vars = (kwargs.get('ignore_env_vars') or
                        _local_utils.parse_arg(options, "ignore_env_vars"))
+    plan_only = (kwargs.get('plan') or
+                 _local_utils.parse_arg(options, "plan"))
 
     logging.info("Setting up %s network" % (net_topology))
     network_config = _local_utils.get_network_config(
         net_topology, ignore_env_vars, net_topology_file)
 
     # Handle network for Openstack-on-Openstack scenarios
-    if _local_utils.get_provider_type() == "openstack":
+    if _local_utils.get_provider_type() == "openstack" and not plan_only:
         setup_gateway_ext_port(network_config)
 
-    setup_sdn(network_config)
+    setup_sdn(network_config, plan_only=plan_only)
 
 
 if __name__ == "__main__":
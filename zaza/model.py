@@ -1,15 +1,44 @@
 import asyncio
+import atexit
 from async_generator import async_generator, yield_, asynccontextmanager
+from concurrent import futures
+import contextlib
 import logging
 import os
 import subprocess
 import tempfile
+import threading
+import time
 import yaml
 
-from juju import loop
 from juju.errors import JujuError
 from juju.model import Model
 
+# Connected Model objects keyed by model name, see async_get_model
+MODEL_POOL = {}
+# ZazaModel handles keyed by model name, see async_get_zaza_model
+ZAZA_MODEL_POOL = {}
+# Locks serialising connections to each model, keyed by model name
+_MODEL_LOCKS = {}
+# Default limit on concurrent operations when acting on many units at once
+DEFAULT_FAN_OUT_CONCURRENCY = 10
+# Seconds a leader looked up from the model status is trusted for
+DEFAULT_LEADER_TTL = 60
+# Seconds to wait for a unit to start acting on new application config
+DEFAULT_CONFIG_CHANGE_TIMEOUT = 300
+
+# Event loop which run executes coroutines on and the thread running it, see
+# get_event_loop
+_LOOP = None
+_LOOP_THREAD = None
+_LOOP_LOCK = threading.Lock()
+# Seconds between checks, while run waits, of the cancel event of the thread,
+# see cancel_on, and of signals which arrived as the main thread started to
+# wait
+CANCEL_CHECK_INTERVAL = 1
+# Cancel event of each thread, see cancel_on
+_CANCEL = threading.local()
+
 
 async def deployed(filter=None):
     # Create a Model instance. We need to connect our Model to a Juju api
@@ -46,20 +75,100 @@ def get_unit_from_name(unit_name, model):
     return unit
 
 
+def _run_event_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_event_loop():
+    """Return the event loop run uses, starting its thread if needed
+
+    The loop runs forever in a daemon thread so that coroutines, and the model
+    connections they open, can be shared by callers in any thread.
+
+    :returns: The event loop
+    :rtype: asyncio.AbstractEventLoop
+    """
+    global _LOOP, _LOOP_THREAD
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            _LOOP_THREAD = threading.Thread(
+                target=_run_event_loop,
+                args=(_LOOP,),
+                name='zaza-event-loop')
+            _LOOP_THREAD.daemon = True
+            _LOOP_THREAD.start()
+        return _LOOP
+
+
+class RunCancelled(KeyboardInterrupt):
+    """Raised by run in a thread whose cancel event has been set
+
+    Derived from KeyboardInterrupt so that it is not swallowed by code, such
+    as unittest, which catches every Exception.
+    """
+
+
+@contextlib.contextmanager
+def cancel_on(event):
+    """Cancel what run waits for in this thread once event is set
+
+    Unlike the main thread, a worker thread cannot be interrupted. Instead,
+    once event is set, the coroutine run is waiting for in the thread is
+    cancelled and run raises RunCancelled, as does every later call of run
+    in the with block.
+
+    :param event: Event to cancel on
+    :type event: threading.Event
+    """
+    previous = getattr(_CANCEL, 'event', None)
+    _CANCEL.event = event
+    try:
+        yield
+    finally:
+        _CANCEL.event = previous
+
+
 def run(*steps):
-    """Run the given steps in an asyncio loop
+    """Run the given steps in the shared event loop and wait for them
+
+    Safe to call from any thread, and from several threads at once, except
+    from a coroutine already running in the shared loop.
 
-    :returns: The result of the asyncio.Task
+    :returns: The result of the last step
     :rtype: Any
+    :raises: RunCancelled if the cancel event of the thread is set, see
+             cancel_on
     """
     if not steps:
         return
-    loop = asyncio.get_event_loop()
-
-    for step in steps:
-        task = loop.create_task(step)
-        loop.run_until_complete(asyncio.wait([task], loop=loop))
-    return task.result()
+    loop = get_event_loop()
+    if threading.current_thread() is _LOOP_THREAD:
+        for step in steps:
+            step.close()
+        raise RuntimeError(
+            "run called from the event loop thread, await the coroutine "
+            "instead")
+    event = getattr(_CANCEL, 'event', None)
+    result = None
+    steps = list(steps)
+    while steps:
+        future = asyncio.run_coroutine_threadsafe(steps.pop(0), loop)
+        try:
+            # Wait in steps, a signal which arrives just before the wait
+            # blocks is otherwise only handled once the wait is over
+            while not future.done():
+                if event is not None and event.is_set():
+                    raise RunCancelled()
+                futures.wait([future], timeout=CANCEL_CHECK_INTERVAL)
+            result = future.result()
+        except BaseException:
+            future.cancel()
+            for step in steps:
+                step.close()
+            raise
+    return result
 
 
 def sync_wrapper(f):
@@ -75,6 +184,96 @@ def sync_wrapper(f):
     return _wrapper
 
 
+async def async_get_model(model_name):
+    """Return a connected Model object from the pool of model connections
+
+    A connection to each model is made on first use and then kept open for
+    the lifetime of the process. If the pooled connection has gone stale it
+    is dropped and a new one is made. Concurrent callers wait for the same
+    connection rather than each making their own.
+
+    :param model_name: Name of model to connect to
+    :type model_name: str
+    :returns: The juju Model object correcsponding to model_name
+    :rtype: juju.model.Model
+    """
+    if model_name not in _MODEL_LOCKS:
+        _MODEL_LOCKS[model_name] = asyncio.Lock()
+    async with _MODEL_LOCKS[model_name]:
+        model = MODEL_POOL.get(model_name)
+        if model is not None and not model.is_connected():
+            logging.info("Connection to model {} is stale, reconnecting"
+                         .format(model_name))
+            del MODEL_POOL[model_name]
+            await model.disconnect()
+            model = None
+        if model is None:
+            model = Model()
+            await model.connect_model(model_name)
+            MODEL_POOL[model_name] = model
+    return model
+
+get_model = sync_wrapper(async_get_model)
+
+
+async def async_disconnect_model(model_name):
+    """Disconnect a model and drop it from the pool of model connections
+
+    :param model_name: Name of model to disconnect from
+    :type model_name: str
+    """
+    if model_name not in _MODEL_LOCKS:
+        _MODEL_LOCKS[model_name] = asyncio.Lock()
+    async with _MODEL_LOCKS[model_name]:
+        zaza_model = ZAZA_MODEL_POOL.pop(model_name, None)
+        if zaza_model is not None:
+            zaza_model.close()
+        model = MODEL_POOL.pop(model_name, None)
+        if model is not None:
+            await model.disconnect()
+
+disconnect_model = sync_wrapper(async_disconnect_model)
+
+
+async def async_disconnect_models():
+    """Disconnect all the models in the pool of model connections"""
+    while ZAZA_MODEL_POOL:
+        _, zaza_model = ZAZA_MODEL_POOL.popitem()
+        zaza_model.close()
+    while MODEL_POOL:
+        _, model = MODEL_POOL.popitem()
+        await model.disconnect()
+
+disconnect_models = sync_wrapper(async_disconnect_models)
+
+
+def shutdown():
+    """Disconnect the pooled models and stop the shared event loop
+
+    run will start a new loop if it is called again afterwards.
+    """
+    global _LOOP, _LOOP_THREAD
+    if _LOOP is None:
+        return
+    try:
+        disconnect_models()
+    except Exception:
+        logging.exception("Failed to disconnect models")
+    with _LOOP_LOCK:
+        loop, thread = _LOOP, _LOOP_THREAD
+        _LOOP = _LOOP_THREAD = None
+        # The locks belong to the loop being stopped
+        _MODEL_LOCKS.clear()
+    if loop is None:
+        return
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+atexit.register(shutdown)
+
+
 @asynccontextmanager
 @async_generator
 async def run_in_model(model_name):
@@ -83,15 +282,243 @@ async def run_in_model(model_name):
            async with run_in_model(model_name) as model:
                model.do_something()
 
+       The model connection is taken from the pool of model connections and
+       is left open on exit so that it can be reused by the next caller.
+
     :param model_name: Name of model to run function in
     :type model_name: str
     :returns: The juju Model object correcsponding to model_name
     :rtype: Iterator[:class:'juju.Model()']
     """
-    model = Model()
-    await model.connect_model(model_name)
+    model = await async_get_model(model_name)
     await yield_(model)
-    await model.disconnect()
+
+
+class ZazaModel(object):
+    """Long lived handle on a model with indexed unit lookups
+
+    The units of the model are indexed by name and by machine, and the
+    leader of each application by application name. The indexes are built
+    once from the pooled model connection and then kept up to date from the
+    model deltas, so lookups do not walk the units of the model each time.
+    Unit deltas do not say which unit is leader (LP#1643691), so the leaders
+    are filled in from one fetch of the model status, which is repeated once
+    they are older than leader_ttl. A cached leader is also forgotten when it
+    is removed, is dying or loses its agent, or by invalidate_leader.
+
+    Every lookup has an async method and a sync method. The sync methods run
+    in the shared event loop and so must not be called from a coroutine.
+
+    Example:
+        zaza_model = get_zaza_model(model_name)
+        unit = zaza_model.get_unit('keystone/0')
+        units = zaza_model.get_units_on_machine('0')
+    """
+
+    def __init__(self, model_name, leader_ttl=DEFAULT_LEADER_TTL):
+        """Create a handle on the model, async_connect must then be called
+
+        :param model_name: Name of model
+        :type model_name: str
+        :param leader_ttl: Seconds a leader from the model status is trusted
+        :type leader_ttl: int
+        """
+        self.model_name = model_name
+        self.leader_ttl = leader_ttl
+        self.model = None
+        self.units = {}
+        self.machine_units = {}
+        self.unit_machines = {}
+        self.leaders = {}
+        self._leaders_updated = None
+        self._observer = None
+        self._lock = None
+
+    async def async_connect(self):
+        """Connect to the model and build the indexes
+
+        The connection is taken from the pool of model connections. If the
+        pooled connection has been replaced since the last call the indexes
+        are rebuilt from the new one.
+
+        :returns: This handle
+        :rtype: ZazaModel
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            model = await async_get_model(self.model_name)
+            if model is self.model:
+                return self
+
+            async def _on_unit_change(delta, old_obj, new_obj, model):
+                self._apply_delta(delta, new_obj)
+
+            self.model = model
+            self._build_indexes()
+            # The model only holds a weak reference to the observer, so keep
+            # hold of it for as long as this handle is in use.
+            self._observer = _on_unit_change
+            model.add_observer(self._observer, entity_type='unit')
+        return self
+
+    connect = sync_wrapper(async_connect)
+
+    def close(self):
+        """Stop updating the indexes from the model"""
+        self._observer = None
+        self.model = None
+
+    def _build_indexes(self):
+        self.units = {}
+        self.machine_units = {}
+        self.unit_machines = {}
+        self.invalidate_leader()
+        for unit_name, unit in self.model.units.items():
+            self._add_unit(unit_name, unit, unit.safe_data)
+
+    def _add_unit(self, unit_name, unit, data):
+        self._remove_unit(unit_name)
+        self.units[unit_name] = unit
+        machine = data.get('machine-id')
+        if machine:
+            self.machine_units.setdefault(machine, {})[unit_name] = unit
+            self.unit_machines[unit_name] = machine
+        application = unit_name.split('/')[0]
+        if self.leaders.get(application) == unit_name:
+            # Leadership moves on when the leader is going away or has lost
+            # its agent
+            agent_status = (data.get('agent-status') or {}).get('current')
+            if data.get('life', 'alive') != 'alive' or agent_status == 'lost':
+                self.invalidate_leader(application)
+
+    def _remove_unit(self, unit_name):
+        self.units.pop(unit_name, None)
+        machine = self.unit_machines.pop(unit_name, None)
+        if machine is not None:
+            units = self.machine_units[machine]
+            del units[unit_name]
+            if not units:
+                del self.machine_units[machine]
+
+    def _apply_delta(self, delta, unit):
+        unit_name = delta.get_id()
+        if delta.type == 'remove':
+            self._remove_unit(unit_name)
+            application = unit_name.split('/')[0]
+            if self.leaders.get(application) == unit_name:
+                self.invalidate_leader(application)
+        else:
+            self._add_unit(unit_name, unit, delta.data)
+
+    async def async_get_unit(self, unit_name):
+        """Return the unit with the given name
+
+        :param unit_name: Name of unit, eg keystone/0
+        :type unit_name: str
+        :returns: Unit matching given name
+        :rtype: juju.unit.Unit
+        :raises: KeyError
+        """
+        await self.async_connect()
+        unit = self.units.get(unit_name)
+        if unit is None:
+            # The delta for a new unit may not have been handled yet
+            unit = self.model.units[unit_name]
+            self._add_unit(unit_name, unit, unit.safe_data)
+        return unit
+
+    get_unit = sync_wrapper(async_get_unit)
+
+    async def async_get_units_on_machine(self, machine):
+        """Return the units on the given machine
+
+        :param machine: Id of machine, eg 0 or 0/lxd/1
+        :type machine: str
+        :returns: List of juju units, ordered by name
+        :rtype: [juju.unit.Unit, juju.unit.Unit,...]
+        """
+        await self.async_connect()
+        units = self.machine_units.get(machine, {})
+        return [units[unit_name] for unit_name in sorted(units)]
+
+    get_units_on_machine = sync_wrapper(async_get_units_on_machine)
+
+    async def async_update_leaders(self):
+        """Fill the leader index from a single fetch of the model status"""
+        await self.async_connect()
+        status = await self.model.get_status()
+        leaders = {}
+
+        def _add_leaders(units):
+            for unit_name, unit in (units or {}).items():
+                if unit.get('leader'):
+                    leaders[unit_name.split('/')[0]] = unit_name
+                _add_leaders(unit.get('subordinates'))
+
+        for application in status.applications.values():
+            _add_leaders(application.get('units'))
+        self.leaders = leaders
+        self._leaders_updated = time.monotonic()
+
+    update_leaders = sync_wrapper(async_update_leaders)
+
+    def invalidate_leader(self, application_name=None):
+        """Forget the cached leader of an application
+
+        :param application_name: Name of application, all leaders are
+                                 forgotten if it is not given
+        :type application_name: str
+        """
+        if application_name is None:
+            self.leaders.clear()
+        else:
+            self.leaders.pop(application_name, None)
+        # Look the forgotten leader up again on the next call
+        self._leaders_updated = None
+
+    async def async_get_leader(self, application_name, refresh=False):
+        """Return the leader of the given application
+
+        The leaders are looked up in the model status when they have been
+        forgotten or are older than leader_ttl, which fills in the leaders of
+        every application at once.
+
+        :param application_name: Name of application
+        :type application_name: str
+        :param refresh: Whether to look the leader up in the model status
+                        even if it is cached
+        :type refresh: bool
+        :returns: Lead unit, or None if the application has no leader
+        :rtype: juju.unit.Unit or None
+        """
+        await self.async_connect()
+        if (refresh or self._leaders_updated is None or
+                time.monotonic() - self._leaders_updated > self.leader_ttl):
+            await self.async_update_leaders()
+        unit_name = self.leaders.get(application_name)
+        if unit_name is None:
+            return None
+        return await self.async_get_unit(unit_name)
+
+    get_leader = sync_wrapper(async_get_leader)
+
+
+async def async_get_zaza_model(model_name):
+    """Return the shared ZazaModel handle for a model
+
+    :param model_name: Name of model
+    :type model_name: str
+    :returns: Connected handle on the model
+    :rtype: ZazaModel
+    """
+    zaza_model = ZAZA_MODEL_POOL.get(model_name)
+    if zaza_model is None:
+        zaza_model = ZazaModel(model_name)
+        ZAZA_MODEL_POOL[model_name] = zaza_model
+    return await zaza_model.async_connect()
+
+get_zaza_model = sync_wrapper(async_get_zaza_model)
 
 
 async def async_scp_to_unit(model_name, unit_name, source, destination,
@@ -113,17 +540,82 @@ async def async_scp_to_unit(model_name, unit_name, source, destination,
     :param scp_opts: Additional options to the scp command
     :type scp_opts: str
     """
-    async with run_in_model(model_name) as model:
-        unit = get_unit_from_name(unit_name, model)
-        await unit.scp_to(source, destination, user=user, proxy=proxy,
-                          scp_opts=scp_opts)
+    zaza_model = await async_get_zaza_model(model_name)
+    unit = await zaza_model.async_get_unit(unit_name)
+    await unit.scp_to(source, destination, user=user, proxy=proxy,
+                      scp_opts=scp_opts)
 
 scp_to_unit = sync_wrapper(async_scp_to_unit)
 
 
+class FanOutError(Exception):
+    """Exception raised when an operation fails on one or more units
+
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        message = "Failed on units {}: {}".format(
+            ','.join(sorted(errors)),
+            '; '.join(['{}: {}'.format(k, v)
+                       for k, v in sorted(errors.items())]))
+        super(FanOutError, self).__init__(message)
+
+
+async def async_fan_out(units, func, concurrency=DEFAULT_FAN_OUT_CONCURRENCY,
+                        keep_going=False):
+    """Run func against each of the units concurrently
+
+    At most concurrency calls to func are in flight at any one time. If
+    keep_going is False the first failure cancels the calls which have not
+    completed and a FanOutError is raised. If keep_going is True every call
+    runs to completion and the exception raised by a failing call is
+    returned in place of its result.
+
+    :param units: Units to run func against
+    :type units: [juju.unit.Unit, juju.unit.Unit,...]
+    :param func: Coroutine function which takes a unit as its only argument
+    :type func: function
+    :param concurrency: Maximum number of concurrent calls to func
+    :type concurrency: int
+    :param keep_going: Whether to carry on when func fails on a unit
+    :type keep_going: bool
+    :raises: FanOutError
+    :returns: Result (or exception if keep_going) of func for each unit
+    :rtype: {str: Any}
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run(unit):
+        async with semaphore:
+            return await func(unit)
+
+    tasks = {unit.entity_id: asyncio.ensure_future(_run(unit))
+             for unit in units}
+    if not tasks:
+        return {}
+    if keep_going:
+        return_when = asyncio.ALL_COMPLETED
+    else:
+        return_when = asyncio.FIRST_EXCEPTION
+    _, pending = await asyncio.wait(tasks.values(), return_when=return_when)
+    errors = {name: task.exception() for name, task in tasks.items()
+              if task.done() and task.exception()}
+    if errors and not keep_going:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        raise FanOutError(errors)
+    return {name: errors.get(name) or task.result()
+            for name, task in tasks.items()}
+
+
 async def async_scp_to_all_units(model_name, application_name, source,
                                  destination, user='ubuntu', proxy=False,
-                                 scp_opts=''):
+                                 scp_opts='',
+                                 concurrency=DEFAULT_FAN_OUT_CONCURRENCY,
+                                 keep_going=False):
     """Transfer files from to all units of an application
 
     :param model_name: Name of model unit is in
@@ -140,12 +632,24 @@ async def async_scp_to_all_units(model_name, application_name, source,
     :type proxy: bool
     :param scp_opts: Additional options to the scp command
     :type scp_opts: str
+    :param concurrency: Maximum number of concurrent transfers
+    :type concurrency: int
+    :param keep_going: Whether to carry on when a transfer fails
+    :type keep_going: bool
+    :raises: FanOutError
+    :returns: Exception raised by each failed transfer, None on success
+    :rtype: {str: Exception or None}
     """
+    async def _scp_to(unit):
+        await unit.scp_to(source, destination, user=user, proxy=proxy,
+                          scp_opts=scp_opts)
+
     async with run_in_model(model_name) as model:
-        for unit in model.applications[application_name].units:
-            # FIXME: Should scp in parallel
-            await unit.scp_to(source, destination, user=user, proxy=proxy,
-                              scp_opts=scp_opts)
+        return await async_fan_out(
+            model.applications[application_name].units,
+            _scp_to,
+            concurrency=concurrency,
+            keep_going=keep_going)
 
 scp_to_all_units = sync_wrapper(async_scp_to_all_units)
 
@@ -169,15 +673,65 @@ async def async_scp_from_unit(model_name, unit_name, source, destination,
     :param scp_opts: Additional options to the scp command
     :type scp_opts: str
     """
-    async with run_in_model(model_name) as model:
-        unit = get_unit_from_name(unit_name, model)
-        await unit.scp_from(source, destination, user=user, proxy=proxy,
-                            scp_opts=scp_opts)
+    zaza_model = await async_get_zaza_model(model_name)
+    unit = await zaza_model.async_get_unit(unit_name)
+    await unit.scp_from(source, destination, user=user, proxy=proxy,
+                        scp_opts=scp_opts)
 
 
 scp_from_unit = sync_wrapper(async_scp_from_unit)
 
 
+async def async_scp_from_all_units(model_name, application_name, source,
+                                   destination, user='ubuntu', proxy=False,
+                                   scp_opts='',
+                                   concurrency=DEFAULT_FAN_OUT_CONCURRENCY,
+                                   keep_going=False):
+    """Transfer files from all units of an application
+
+    The files from each unit are placed in a subdirectory of destination
+    named after the unit, eg app/0 -> destination/app_0
+
+    :param model_name: Name of model unit is in
+    :type model_name: str
+    :param application_name: Name of application to scp file from
+    :type application_name: str
+    :param source: Remote path of file(s) to transfer
+    :type source: str
+    :param destination: Local directory to place transferred files in
+    :type source: str
+    :param user: Remote username
+    :type source: str
+    :param proxy: Proxy through the Juju API server
+    :type proxy: bool
+    :param scp_opts: Additional options to the scp command
+    :type scp_opts: str
+    :param concurrency: Maximum number of concurrent transfers
+    :type concurrency: int
+    :param keep_going: Whether to carry on when a transfer fails
+    :type keep_going: bool
+    :raises: FanOutError
+    :returns: Exception raised by each failed transfer, None on success
+    :rtype: {str: Exception or None}
+    """
+    async def _scp_from(unit):
+        unit_destination = os.path.join(
+            destination,
+            unit.entity_id.replace('/', '_'))
+        os.makedirs(unit_destination, exist_ok=True)
+        await unit.scp_from(source, unit_destination, user=user, proxy=proxy,
+                            scp_opts=scp_opts)
+
+    async with run_in_model(model_name) as model:
+        return await async_fan_out(
+            model.applications[application_name].units,
+            _scp_from,
+            concurrency=concurrency,
+            keep_going=keep_going)
+
+scp_from_all_units = sync_wrapper(async_scp_from_all_units)
+
+
 async def async_run_on_unit(model_name, unit_name, command, timeout=None):
     """Juju run on unit
 
@@ -199,15 +753,101 @@ async def async_run_on_unit(model_name, unit_name, command, timeout=None):
     if timeout:
         timeout = None
 
+    zaza_model = await async_get_zaza_model(model_name)
+    unit = await zaza_model.async_get_unit(unit_name)
+    action = await unit.run(command, timeout=timeout)
+    if action.data.get('results'):
+        return action.data.get('results')
+    else:
+        return {}
+
+run_on_unit = sync_wrapper(async_run_on_unit)
+
+
+async def async_run_on_units(model_name, unit_names, command, timeout=None,
+                             concurrency=DEFAULT_FAN_OUT_CONCURRENCY):
+    """Juju run on many units at once over a single model connection
+
+    :param model_name: Name of model units are in
+    :type model_name: str
+    :param unit_names: Names of units to run command on
+    :type unit_names: [str, str,...]
+    :param command: Command to execute
+    :type command: str
+    :param timeout: DISABLED due to Issue #225
+                    https://github.com/juju/python-libjuju/issues/225
+    :type timeout: int
+    :param concurrency: Maximum number of concurrent juju runs
+    :type concurrency: int
+    :raises: FanOutError
+    :returns: action.data['results'] for each unit
+    :rtype: {str: {'Code': '', 'Stderr': '', 'Stdout': ''}}
+    """
+    zaza_model = await async_get_zaza_model(model_name)
+    units = [await zaza_model.async_get_unit(unit_name)
+             for unit_name in unit_names]
+    return await _async_run_on_unit_objects(units, command, timeout,
+                                            concurrency)
+
+run_on_units = sync_wrapper(async_run_on_units)
+
+
+async def async_run_on_application(model_name, application_name, command,
+                                   timeout=None,
+                                   concurrency=DEFAULT_FAN_OUT_CONCURRENCY):
+    """Juju run on all units of an application over a single model connection
+
+    :param model_name: Name of model application is in
+    :type model_name: str
+    :param application_name: Name of application to run command on
+    :type application_name: str
+    :param command: Command to execute
+    :type command: str
+    :param timeout: DISABLED due to Issue #225
+                    https://github.com/juju/python-libjuju/issues/225
+    :type timeout: int
+    :param concurrency: Maximum number of concurrent juju runs
+    :type concurrency: int
+    :raises: FanOutError
+    :returns: action.data['results'] for each unit
+    :rtype: {str: {'Code': '', 'Stderr': '', 'Stdout': ''}}
+    """
     async with run_in_model(model_name) as model:
-        unit = get_unit_from_name(unit_name, model)
+        return await _async_run_on_unit_objects(
+            model.applications[application_name].units,
+            command,
+            timeout,
+            concurrency)
+
+run_on_application = sync_wrapper(async_run_on_application)
+
+
+async def _async_run_on_unit_objects(units, command, timeout, concurrency):
+    """Juju run command concurrently on the given units
+
+    :param units: Units to run command on
+    :type units: [juju.unit.Unit, juju.unit.Unit,...]
+    :param command: Command to execute
+    :type command: str
+    :param timeout: DISABLED due to Issue #225
+                    https://github.com/juju/python-libjuju/issues/225
+    :type timeout: int
+    :param concurrency: Maximum number of concurrent juju runs
+    :type concurrency: int
+    :raises: FanOutError
+    :returns: action.data['results'] for each unit
+    :rtype: {str: {'Code': '', 'Stderr': '', 'Stdout': ''}}
+    """
+    # Disabling timeout due to Issue #225
+    # https://github.com/juju/python-libjuju/issues/225
+    if timeout:
+        timeout = None
+
+    async def _run(unit):
         action = await unit.run(command, timeout=timeout)
-        if action.data.get('results'):
-            return action.data.get('results')
-        else:
-            return {}
+        return action.data.get('results') or {}
 
-run_on_unit = sync_wrapper(async_run_on_unit)
+    return await async_fan_out(units, _run, concurrency=concurrency)
 
 
 async def async_get_application(model_name, application_name):
@@ -329,6 +969,58 @@ async def async_set_application_config(model_name, application_name,
 set_application_config = sync_wrapper(async_set_application_config)
 
 
+async def async_set_application_config_and_wait(
+        model_name, application_name, configuration, states=None,
+        timeout=2700, change_timeout=DEFAULT_CONFIG_CHANGE_TIMEOUT):
+    """Set application configuration and wait for the units to apply it
+
+    The units are watched from before the configuration is set, so a
+    config-changed hook is seen however quickly it runs. Once a unit of the
+    application has started running config-changed, or change_timeout has
+    passed, wait for the application to reach its desired states and be idle.
+    Without this the units could still look settled from before the change.
+
+    :param model_name: Name of model to query.
+    :type model_name: str
+    :param application_name: Name of application
+    :type application_name: str
+    :param configuration: Dictionary of configuration setting(s)
+    :type configuration: dict
+    :param states: States to wait for, see async_wait_for_application_states
+    :type states: dict
+    :param timeout: Time to wait for the states to be achieved
+    :type timeout: int
+    :param change_timeout: Time to wait for config-changed to start
+    :type change_timeout: int
+    :raises: UnitError, asyncio.TimeoutError
+    """
+    async with run_in_model(model_name) as model:
+        changing = asyncio.Event()
+
+        async def _on_unit_change(delta, old_obj, new_obj, model):
+            agent_status = delta.data.get('agent-status') or {}
+            if (delta.data.get('application') == application_name and
+                    agent_status.get('current') == 'executing' and
+                    'config-changed' in agent_status.get('message', '')):
+                changing.set()
+
+        # The model only holds a weak reference to the observer, so it is
+        # dropped once this coroutine completes.
+        model.add_observer(_on_unit_change, entity_type='unit')
+        await model.applications[application_name].set_config(configuration)
+        try:
+            await asyncio.wait_for(changing.wait(), change_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("No unit of {} ran config-changed within {}s"
+                            .format(application_name, change_timeout))
+        await async_wait_for_application_states(
+            model_name, states, timeout=timeout,
+            applications=[application_name])
+
+set_application_config_and_wait = sync_wrapper(
+    async_set_application_config_and_wait)
+
+
 async def async_get_status(model_name):
     """Return full status
 
@@ -359,19 +1051,43 @@ async def async_run_action(model_name, unit_name, action_name,
     :returns: Action object
     :rtype: juju.action.Action
     """
-    async with run_in_model(model_name) as model:
-        unit = get_unit_from_name(unit_name, model)
-        action_obj = await unit.run_action(action_name, **action_params)
-        await action_obj.wait()
-        return action_obj
+    zaza_model = await async_get_zaza_model(model_name)
+    unit = await zaza_model.async_get_unit(unit_name)
+    action_obj = await unit.run_action(action_name, **action_params)
+    await action_obj.wait()
+    return action_obj
 
 run_action = sync_wrapper(async_run_action)
 
 
+async def async_get_leader_unit(model_name, application_name, refresh=False):
+    """Return the lead unit of the given application
+
+    :param model_name: Name of model to query.
+    :type model_name: str
+    :param application_name: Name of application
+    :type application_name: str
+    :param refresh: Whether to look the leader up in the model status even
+                    if it is cached
+    :type refresh: bool
+    :returns: Lead unit, or None if the application has no leader
+    :rtype: juju.unit.Unit or None
+    """
+    zaza_model = await async_get_zaza_model(model_name)
+    return await zaza_model.async_get_leader(application_name,
+                                             refresh=refresh)
+
+get_leader_unit = sync_wrapper(async_get_leader_unit)
+
+
 async def async_run_action_on_leader(model_name, application_name, action_name,
                                      action_params=None):
     """Run action on lead unit of the given application
 
+    The leader comes from the leader cache. If the action fails the leader
+    is looked up again, and if leadership has moved the action is run again
+    on the new leader.
+
     :param model_name: Name of model to query.
     :type model_name: str
     :param application_name: Name of application
@@ -383,14 +1099,22 @@ async def async_run_action_on_leader(model_name, application_name, action_name,
     :returns: Action object
     :rtype: juju.action.Action
     """
-    async with run_in_model(model_name) as model:
-        for unit in model.applications[application_name].units:
-            is_leader = await unit.is_leader_from_status()
-            if is_leader:
-                action_obj = await unit.run_action(action_name,
-                                                   **action_params)
-                await action_obj.wait()
-                return action_obj
+    unit = await async_get_leader_unit(model_name, application_name)
+    if not unit:
+        return
+    action_obj = await unit.run_action(action_name, **action_params)
+    await action_obj.wait()
+    if action_obj.status == 'failed':
+        leader = await async_get_leader_unit(model_name, application_name,
+                                             refresh=True)
+        if leader and leader.entity_id != unit.entity_id:
+            logging.info("Leader of {} moved from {} to {}, running {} again"
+                         .format(application_name, unit.entity_id,
+                                 leader.entity_id, action_name))
+            action_obj = await leader.run_action(action_name,
+                                                 **action_params)
+            await action_obj.wait()
+    return action_obj
 
 run_action_on_leader = sync_wrapper(async_run_action_on_leader)
 
@@ -433,6 +1157,25 @@ def check_model_for_hard_errors(model):
         raise UnitError(errored_units)
 
 
+def get_unit_errors(model):
+    """Return a description of each unit whose workload or agent is in error
+
+    :param model: Model object to check in
+    :type model: juju.Model
+    :returns: Error status and message keyed by unit name
+    :rtype: {str: str}
+    """
+    errors = {}
+    for unit_name, unit in model.units.items():
+        if unit.workload_status == 'error':
+            errors[unit_name] = 'workload error: {}'.format(
+                unit.workload_status_message)
+        elif unit.agent_status == 'error':
+            errors[unit_name] = 'agent error: {}'.format(
+                unit.agent_status_message)
+    return errors
+
+
 def check_unit_workload_status(model, unit, state):
     """Check that the units workload status matches the supplied state.
        This function has the side effect of also checking for *any* units
@@ -481,8 +1224,77 @@ def check_unit_workload_status_message(model, unit, message=None,
         raise ValueError("Must be called with message or prefixes")
 
 
+def units_pending_application_states(model, states,
+                                     approved_message_prefixes,
+                                     applications=None):
+    """Return the units whose workload status or message does not yet match
+       the desired states. This function also checks for *any* units in an
+       error state and aborts if any are found.
+
+    :param model: Model object to check in
+    :type model: juju.Model
+    :param states: States to look for, see async_wait_for_application_states
+    :type states: dict
+    :param approved_message_prefixes: Prefixes an acceptable workload status
+                                      message may start with when no
+                                      message is specified in states
+    :type approved_message_prefixes: tuple
+    :param applications: Only check the units of these applications. An
+                         application which is not in the model yet is
+                         reported as pending.
+    :type applications: [str, str,...]
+    :raises: UnitError
+    :returns: Current workload status and message of each pending unit
+    :rtype: {str: str}
+    """
+    errored_units = []
+    pending = {}
+    for application, app in model.applications.items():
+        check_info = states.get(application, {})
+        expected_status = check_info.get('workload-status', 'active')
+        prefixes = (check_info.get('workload-status-message') or
+                    approved_message_prefixes)
+        checked = applications is None or application in applications
+        for unit in app.units:
+            wl_status = unit.workload_status
+            wl_message = unit.workload_status_message or ''
+            if wl_status == 'error':
+                errored_units.append(unit)
+            elif checked and (wl_status != expected_status or
+                              not wl_message.startswith(prefixes)):
+                pending[unit.entity_id] = '{}: {}'.format(
+                    wl_status, wl_message)
+    if errored_units:
+        raise UnitError(errored_units)
+    for application in applications or []:
+        if application not in model.applications:
+            pending[application] = 'not in model'
+    return pending
+
+
+def units_idle(model, applications=None):
+    """Return whether the agents of all the units are idle
+
+    :param model: Model object to check in
+    :type model: juju.Model
+    :param applications: Only check the units of these applications
+    :type applications: [str, str,...]
+    :returns: Whether there are units and all their agents are idle
+    :rtype: bool
+    """
+    if applications is None:
+        return len(model.units) > 0 and model.all_units_idle()
+    units = [unit
+             for application in applications
+             if application in model.applications
+             for unit in model.applications[application].units]
+    return (len(units) > 0 and
+            all(unit.agent_status == 'idle' for unit in units))
+
+
 async def async_wait_for_application_states(model_name, states=None,
-                                            timeout=2700):
+                                            timeout=2700, applications=None,
+                                            deployed=None):
     """Wait for model to achieve the desired state
 
     Check the workload status and workload status message for every unit of
@@ -499,6 +1311,17 @@ async def async_wait_for_application_states(model_name, states=None,
         'anotherapp': {
             'workload-status-message': 'Unit is super ready'}}
 
+    Rather than polling each unit in turn, every unit is re-checked each
+    time the model reports a change to a unit. The wait fails as soon as any
+    unit enters an error state.
+
+    If applications is given only the units of those applications need to
+    reach the desired state and be idle.
+
+    If deployed is given the wait can start while the model is still being
+    deployed. The units are only taken to be idle, and the wait only ends,
+    once deployed is set, so that units and relations added late are waited
+    for too.
 
     :param model_name: Name of model to query.
     :type model_name: str
@@ -506,44 +1329,71 @@ async def async_wait_for_application_states(model_name, states=None,
     :type states: dict
     :param timeout: Time to wait for status to be achieved
     :type timeout: int
+    :param applications: Only wait for the units of these applications
+    :type applications: [str, str,...]
+    :param deployed: Event set once the deploy has finished
+    :type deployed: asyncio.Event
+    :raises: UnitError, asyncio.TimeoutError
     """
     approved_message_prefixes = ('ready', 'Ready', 'Unit is ready')
 
     if not states:
         states = {}
     async with run_in_model(model_name) as model:
-        check_model_for_hard_errors(model)
-        logging.info("Waiting for a unit to appear")
-        await model.block_until(
-            lambda: len(model.units) > 0
-        )
-        logging.info("Waiting for all units to be idle")
-        await model.block_until(
-            lambda: model.all_units_idle(), timeout=timeout)
-        for application in model.applications:
-            check_info = states.get(application, {})
-            for unit in model.applications[application].units:
-                logging.info("Checking workload status of {}".format(
-                    unit.entity_id))
-                await model.block_until(
-                    lambda: check_unit_workload_status(
-                        model,
-                        unit,
-                        check_info.get('workload-status', 'active')),
-                    timeout=timeout)
-                check_msg = check_info.get('workload-status-message')
-                logging.info("Checking workload status message of {}".format(
-                    unit.entity_id))
-                if check_msg:
-                    prefixes = (check_msg)
+        unit_changed = asyncio.Event()
+
+        async def _on_unit_change(delta, old_obj, new_obj, model):
+            unit_changed.set()
+
+        # The model only holds a weak reference to the observer, so it is
+        # dropped once this coroutine completes.
+        model.add_observer(_on_unit_change, entity_type='unit')
+
+        async def _wake_when_deployed():
+            await deployed.wait()
+            unit_changed.set()
+
+        async def _wait():
+            idle = False
+            reported = None
+            while True:
+                unit_changed.clear()
+                pending = units_pending_application_states(
+                    model,
+                    states,
+                    approved_message_prefixes,
+                    applications=applications)
+                complete = deployed is None or deployed.is_set()
+                if not idle and complete:
+                    # Once the units have been idle after the deploy they
+                    # are only checked for the desired states
+                    idle = units_idle(model, applications=applications)
+                if idle and not pending:
+                    return
+                if not model.units:
+                    progress = "Waiting for a unit to appear"
+                elif not complete:
+                    progress = "Waiting for the deploy to finish"
+                elif not idle:
+                    progress = "Waiting for all units to be idle"
                 else:
-                    prefixes = approved_message_prefixes
-                await model.block_until(
-                    lambda: check_unit_workload_status_message(
-                        model,
-                        unit,
-                        prefixes=prefixes),
-                    timeout=timeout)
+                    progress = "Waiting for {} unit(s): {}".format(
+                        len(pending),
+                        ', '.join(['{} ({})'.format(k, v)
+                                   for k, v in sorted(pending.items())]))
+                if progress != reported:
+                    logging.info(progress)
+                    reported = progress
+                await unit_changed.wait()
+
+        wake_task = None
+        if deployed is not None:
+            wake_task = asyncio.ensure_future(_wake_when_deployed())
+        try:
+            await asyncio.wait_for(_wait(), timeout)
+        finally:
+            if wake_task is not None:
+                wake_task.cancel()
 
 wait_for_application_states = sync_wrapper(async_wait_for_application_states)
 
@@ -584,8 +1434,7 @@ async def async_get_current_model():
 get_current_model = sync_wrapper(async_get_current_model)
 
 
-async def async_block_until(*conditions, timeout=None, wait_period=0.5,
-                            loop=None):
+async def async_block_until(*conditions, timeout=None, wait_period=0.5):
     """Return only after all async conditions are true.
 
     Based on juju.utils.block_until which currently does not support
@@ -597,8 +1446,6 @@ async def async_block_until(*conditions, timeout=None, wait_period=0.5,
     :type timeout: float
     :param wait_period: Time to wait between re-assing conditions.
     :type wait_period: float
-    :param loop: The evnt loop to use
-    :type loop: An event loop
     """
 
     async def _block():
@@ -610,8 +1457,8 @@ async def async_block_until(*conditions, timeout=None, wait_period=0.5,
             if all(evaluated):
                 return
             else:
-                await asyncio.sleep(wait_period, loop=loop)
-    await asyncio.wait_for(_block(), timeout, loop=loop)
+                await asyncio.sleep(wait_period)
+    await asyncio.wait_for(_block(), timeout)
 
 
 async def async_block_until_file_ready(model_name, application_name,
@@ -682,9 +1529,8 @@ block_until_file_has_contents = sync_wrapper(
 
 
 def main():
-    # Run the deploy coroutine in an asyncio event loop, using a helper
-    # that abstracts loop creation and teardown.
-    print("Current applications: {}".format(", ".join(loop.run(deployed()))))
+    # Run the deploy coroutine in the shared event loop
+    print("Current applications: {}".format(", ".join(run(deployed()))))
 
 
 if __name__ == '__main__':
@@ -12,6 +12,7 @@ import logging
 import os
 import six
 import subprocess
+import time
 import yaml
 
 from zaza import model
@@ -179,12 +180,51 @@ def remote_run(unit, remote_cmd, timeout=None, fatal=None):
     :returns: Juju run output
     :rtype: string
     """
-    if fatal is None:
-        fatal = True
     result = model.run_on_unit(lifecycle_utils.get_juju_model(),
                                unit,
                                remote_cmd,
                                timeout=timeout)
+    return get_remote_run_output(result, fatal=fatal)
+
+
+def remote_run_on_application(application, remote_cmd, timeout=None,
+                              fatal=None):
+    """Run command on all units of an application and return the output
+
+    The command is run on every unit concurrently over a single model
+    connection.
+
+    :param application: Application name
+    :type application: string
+    :param remote_cmd: Command to execute on units
+    :type remote_cmd: string
+    :param timeout: Timeout value for the command
+    :type arg: int
+    :param fatal: Command failure condidered fatal or not
+    :type fatal: boolean
+    :returns: Juju run output of each unit
+    :rtype: dict
+    """
+    results = model.run_on_application(lifecycle_utils.get_juju_model(),
+                                       application,
+                                       remote_cmd,
+                                       timeout=timeout)
+    return {unit: get_remote_run_output(result, fatal=fatal)
+            for unit, result in results.items()}
+
+
+def get_remote_run_output(result, fatal=None):
+    """Return the output from the results of a juju run
+
+    :param result: Juju run results {'Code': '', 'Stderr': '', 'Stdout': ''}
+    :type result: dict
+    :param fatal: Command failure condidered fatal or not
+    :type fatal: boolean
+    :returns: Juju run output
+    :rtype: string
+    """
+    if fatal is None:
+        fatal = True
     if result:
         if int(result.get('Code')) == 0:
             return result.get('Stdout')
@@ -207,11 +247,8 @@ def get_pkg_version(application, pkg):
     """
 
     versions = []
-    units = model.get_units(
-        lifecycle_utils.get_juju_model(), application)
-    for unit in units:
-        cmd = 'dpkg -l | grep {}'.format(pkg)
-        out = remote_run(unit.entity_id, cmd)
+    cmd = 'dpkg -l | grep {}'.format(pkg)
+    for out in remote_run_on_application(application, cmd).values():
         versions.append(out.split('\n')[0].split()[2])
     if len(set(versions)) != 1:
         raise Exception('Unexpected output from pkg version check')
@@ -267,6 +304,102 @@ def get_provider_type():
         return 'openstack'
 
 
+# Number of seconds a juju status snapshot is reused for before it is
+# fetched again.
+STATUS_SNAPSHOT_TTL = 10
+# StatusSnapshot objects keyed by model name, see get_status_snapshot
+STATUS_SNAPSHOTS = {}
+
+
+class StatusSnapshot(object):
+    """Indexed view of the output of a single juju status fetch"""
+
+    def __init__(self, status):
+        """Index the applications, units and machines of a status
+
+        :param status: Full juju status output
+        :type status: juju.client.client.FullStatus
+        """
+        self.status = status
+        self.created = time.time()
+        self.applications = status.applications or {}
+        self.machines = status.machines or {}
+        self.units = {}
+        for application in self.applications.values():
+            for unit_name, unit in (application.get('units') or {}).items():
+                self.units[unit_name] = unit
+                for sub_name, sub in (unit.get('subordinates') or {}).items():
+                    self.units[sub_name] = sub
+
+    @property
+    def age(self):
+        """Number of seconds since the status was fetched
+
+        :returns: Age of snapshot
+        :rtype: float
+        """
+        return time.time() - self.created
+
+    def application(self, application):
+        """Return the juju status for an application
+
+        :param application: Application name
+        :type application: string
+        :returns: Juju status output for an application
+        :rtype: dict
+        """
+        return self.applications.get(application)
+
+    def unit(self, unit):
+        """Return the juju status for a unit, including subordinate units
+
+        :param unit: Unit name
+        :type unit: string
+        :returns: Juju status output for a unit
+        :rtype: dict
+        """
+        return self.units.get(unit)
+
+    def machine(self, machine):
+        """Return the juju status for a machine
+
+        :param machine: Machine number
+        :type machine: string
+        :returns: Juju status output for a machine
+        :rtype: dict
+        """
+        return self.machines.get(machine)
+
+
+def get_status_snapshot():
+    """Return a snapshot of the juju status of the current model
+
+    The status is only fetched from the model if there is no snapshot or the
+    snapshot is older than STATUS_SNAPSHOT_TTL.
+
+    :returns: Snapshot of juju status
+    :rtype: StatusSnapshot
+    """
+    model_name = lifecycle_utils.get_juju_model()
+    snapshot = STATUS_SNAPSHOTS.get(model_name)
+    if snapshot is None or snapshot.age > STATUS_SNAPSHOT_TTL:
+        snapshot = StatusSnapshot(model.get_status(model_name))
+        STATUS_SNAPSHOTS[model_name] = snapshot
+    return snapshot
+
+
+def invalidate_status_snapshot(model_name=None):
+    """Discard the juju status snapshot so the next lookup fetches it afresh
+
+    :param model_name: Model to discard snapshot for, all models if None
+    :type model_name: string
+    """
+    if model_name:
+        STATUS_SNAPSHOTS.pop(model_name, None)
+    else:
+        STATUS_SNAPSHOTS.clear()
+
+
 def get_full_juju_status():
     """Return the full juju status output
 
@@ -274,8 +407,7 @@ def get_full_juju_status():
     :rtype: dict
     """
 
-    status = model.get_status(lifecycle_utils.get_juju_model())
-    return status
+    return get_status_snapshot().status
 
 
 def get_application_status(application=None, unit=None):
@@ -289,16 +421,12 @@ def get_application_status(application=None, unit=None):
     :rtype: dict
     """
 
-    status = get_full_juju_status()
-
-    if unit and not application:
-        application = unit.split("/")[0]
-
-    if application:
-        status = status.applications.get(application)
+    snapshot = get_status_snapshot()
     if unit:
-        status = status.get('units').get(unit)
-    return status
+        return snapshot.unit(unit)
+    if application:
+        return snapshot.application(application)
+    return snapshot.status
 
 
 def get_machine_status(machine, key=None):
@@ -312,8 +440,7 @@ def get_machine_status(machine, key=None):
     :rtype: dict
     """
 
-    status = get_full_juju_status()
-    status = status.machines.get(machine)
+    status = get_status_snapshot().machine(machine)
     if key:
         status = status.get(key)
     return status
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the zaza.model helpers against a fake Juju controller.
+
+For each model size the benchmark records how long each helper takes and
+how many API requests it makes, how long after the last unit settles
+wait_for_application_states notices, and how much memory the client holds
+for the model.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+import zaza.model
+import zaza.utilities.fake_juju as fake_juju
+
+DEFAULT_UNIT_COUNTS = [10, 100, 500]
+DEFAULT_UNITS_PER_APPLICATION = 10
+DEFAULT_SETTLE_STEPS = 5
+DEFAULT_SETTLE_INTERVAL = 0.2
+DEFAULT_LATENCY = 0
+
+
+def get_applications(unit_count, units_per_application):
+    """Return the number of units of each application of a synthetic model
+
+    :param unit_count: Total number of units
+    :type unit_count: int
+    :param units_per_application: Most units any one application has
+    :type units_per_application: int
+    :returns: Number of units keyed by application name
+    :rtype: {str: int}
+    """
+    applications = {}
+    remaining = unit_count
+    while remaining > 0:
+        applications['app{}'.format(len(applications))] = min(
+            remaining, units_per_application)
+        remaining -= units_per_application
+    return applications
+
+
+def measure(controller, func, *args, **kwargs):
+    """Call func and record its duration and the API requests it made
+
+    :param controller: Controller serving the model
+    :type controller: zaza.utilities.fake_juju.FakeController
+    :param func: Function to call
+    :type func: function
+    :returns: Result of func and the measurement
+    :rtype: (Any, dict)
+    """
+    controller.reset_calls()
+    start = time.time()
+    result = func(*args, **kwargs)
+    measurement = {
+        'duration': round(time.time() - start, 4),
+        'calls': dict(controller.calls)}
+    return result, measurement
+
+
+def benchmark_model(unit_count, latency=DEFAULT_LATENCY,
+                    units_per_application=DEFAULT_UNITS_PER_APPLICATION,
+                    settle_steps=DEFAULT_SETTLE_STEPS,
+                    settle_interval=DEFAULT_SETTLE_INTERVAL):
+    """Benchmark the model helpers on a model of the given size
+
+    :param unit_count: Number of units in the model
+    :type unit_count: int
+    :param latency: Seconds the controller delays each response by
+    :type latency: float
+    :param units_per_application: Most units any one application has
+    :type units_per_application: int
+    :param settle_steps: Number of batches the units settle in
+    :type settle_steps: int
+    :param settle_interval: Seconds between each batch settling
+    :type settle_interval: float
+    :returns: Results of the benchmark
+    :rtype: dict
+    """
+    model_name = 'bench-{}'.format(unit_count)
+    fake_model = fake_juju.FakeModel(
+        model_name,
+        get_applications(unit_count, units_per_application),
+        workload_status='maintenance',
+        workload_status_message='Installing',
+        agent_status='executing')
+    results = {
+        'units': unit_count,
+        'latency': latency,
+        'helpers': {}}
+    helpers = results['helpers']
+    with fake_juju.FakeController([fake_model], latency=latency) as controller:
+        tracemalloc.start()
+        try:
+            juju_model, helpers['get_model'] = measure(
+                controller, zaza.model.get_model, model_name)
+            results['memory'] = tracemalloc.get_traced_memory()[0]
+
+            _, helpers['get_status'] = measure(
+                controller, zaza.model.get_status, model_name)
+            _, helpers['get_units'] = measure(
+                controller, zaza.model.get_units, model_name, 'app0')
+            _, helpers['check_model_for_hard_errors'] = measure(
+                controller, zaza.model.check_model_for_hard_errors,
+                juju_model)
+
+            def _lookup_all_units():
+                for unit_name in fake_model.units:
+                    zaza.model.get_unit_from_name(unit_name, juju_model)
+            _, helpers['get_unit_from_name (all units)'] = measure(
+                controller, _lookup_all_units)
+
+            zaza_model, helpers['get_zaza_model'] = measure(
+                controller, zaza.model.get_zaza_model, model_name)
+
+            def _lookup_all_units_indexed():
+                for unit_name in fake_model.units:
+                    zaza_model.get_unit(unit_name)
+            _, helpers['ZazaModel.get_unit (all units)'] = measure(
+                controller, _lookup_all_units_indexed)
+
+            played = controller.play(
+                model_name,
+                fake_juju.settle_script(fake_model, steps=settle_steps,
+                                        interval=settle_interval))
+            _, helpers['wait_for_application_states'] = measure(
+                controller, zaza.model.wait_for_application_states,
+                model_name)
+            results['settle_detection_lag'] = round(
+                time.time() - played.result(), 4)
+            _, helpers['wait_for_application_states (settled)'] = measure(
+                controller, zaza.model.wait_for_application_states,
+                model_name)
+            results['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            zaza.model.disconnect_models()
+    return results
+
+
+def format_results(results):
+    """Format benchmark results as a table
+
+    :param results: Results of benchmark_model for each model size
+    :type results: [dict, ...]
+    :returns: Table
+    :rtype: str
+    """
+    lines = []
+    for result in results:
+        lines.append(
+            "{units} units, latency {latency}s: settle detected after "
+            "{settle_detection_lag}s, memory {memory} bytes "
+            "(peak {peak_memory})".format(**result))
+        for helper, measurement in sorted(result['helpers'].items()):
+            lines.append("    {:<40} {:>9.4f}s  {} API calls {}".format(
+                helper,
+                measurement['duration'],
+                sum(measurement['calls'].values()),
+                json.dumps(measurement['calls'], sort_keys=True)))
+    return '\n'.join(lines)
+
+
+def parse_args(args):
+    """Parse command line arguments
+
+    :param args: List of command line arguments
+    :type args: [str1, str2,...]
+    :returns: Parsed arguments
+    :rtype: Namespace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--units', dest='unit_counts',
+                        type=lambda s: [int(c) for c in s.split(',')],
+                        help='Comma separated model sizes to benchmark')
+    parser.add_argument('-l', '--latency', type=float,
+                        help='Seconds to delay each API response by')
+    parser.add_argument('--units-per-application',
+                        dest='units_per_application', type=int,
+                        help='Most units any one application has')
+    parser.add_argument('-o', '--output',
+                        help='Write the results as JSON to this file')
+    parser.set_defaults(unit_counts=DEFAULT_UNIT_COUNTS,
+                        latency=DEFAULT_LATENCY,
+                        units_per_application=DEFAULT_UNITS_PER_APPLICATION)
+    return parser.parse_args(args)
+
+
+def main():
+    """Run the benchmarks for each model size given on the command line"""
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(sys.argv[1:])
+    results = [
+        benchmark_model(
+            unit_count,
+            latency=args.latency,
+            units_per_application=args.units_per_application)
+        for unit_count in args.unit_counts]
+    print(format_results(results))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+    zaza.model.shutdown()
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import cryptography
+import cryptography.x509
 from cryptography.hazmat.primitives.asymmetric import rsa
 import cryptography.hazmat.primitives.hashes as hashes
 import cryptography.hazmat.primitives.serialization as serialization
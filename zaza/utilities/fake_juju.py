@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+#
+# Copyright 2018 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process fake Juju controller serving synthetic models.
+
+The controller speaks enough of the Juju API websocket protocol for
+juju.model.Model, and so zaza.model, to log in, follow a model with the
+AllWatcher and fetch its full status. It is intended for benchmarking and
+testing the model helpers on large models without a cloud.
+
+Example:
+    fake_model = FakeModel('bench', {'app': 500})
+    with FakeController([fake_model]) as controller:
+        zaza.model.get_units('bench', 'app')
+        print(controller.calls)
+"""
+
+import asyncio
+import collections
+import datetime
+import json
+import os
+import shutil
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+
+import websockets
+import yaml
+
+import zaza.utilities.cert as cert
+
+FAKE_CONTROLLER_NAME = 'fake-controller'
+FAKE_USER = 'admin'
+FAKE_PASSWORD = 'fake-password'
+FAKE_SERIES = 'bionic'
+# Facades, and their versions, which the fake controller implements
+FAKE_FACADES = {
+    'AllWatcher': [1],
+    'Client': [1, 2],
+    'ModelConfig': [1, 2],
+    'Pinger': [1],
+}
+
+
+def get_fake_agent_version():
+    """Return a controller version which the installed libjuju accepts
+
+    libjuju 2.9 only connects to 2.9 controllers and libjuju 3 only to
+    controllers of its own major version. Earlier releases do not check.
+
+    :returns: Juju version
+    :rtype: str
+    """
+    try:
+        from juju.client.connector import SUPPORTED_JUJU_API_PREFIX
+        return '{}0'.format(SUPPORTED_JUJU_API_PREFIX)
+    except ImportError:
+        pass
+    try:
+        from juju.version import CLIENT_VERSION
+        return '{}.{}.0'.format(*CLIENT_VERSION.split('.')[:2])
+    except ImportError:
+        return '2.4.0'
+
+
+FAKE_AGENT_VERSION = get_fake_agent_version()
+
+
+class FakeAPIError(Exception):
+    """Error returned to the client in place of a response"""
+
+    def __init__(self, message, code=''):
+        super(FakeAPIError, self).__init__(message)
+        self.code = code
+
+
+def _timestamp():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _status(current, message=''):
+    return {
+        'current': current,
+        'message': message,
+        'since': _timestamp(),
+        'version': ''}
+
+
+def _detailed_status(status):
+    return {
+        'status': status['current'],
+        'info': status['message'],
+        'since': status['since'],
+        'kind': '',
+        'version': status['version'],
+        'life': '',
+        'data': {}}
+
+
+class FakeModel(object):
+    """Synthetic model served by a FakeController
+
+    Every application gets its units placed on machines of their own. Each
+    change made to an entity bumps the model revision so that watchers can
+    be sent just the entities which changed since they last looked.
+    """
+
+    def __init__(self, name, applications, workload_status='active',
+                 workload_status_message='Unit is ready',
+                 agent_status='idle'):
+        """Create the entities of the model
+
+        :param name: Name of model
+        :type name: str
+        :param applications: Number of units of each application
+        :type applications: {str: int}
+        :param workload_status: Initial workload status of the units
+        :type workload_status: str
+        :param workload_status_message: Initial workload status message
+        :type workload_status_message: str
+        :param agent_status: Initial agent status of the units
+        :type agent_status: str
+        """
+        self.name = name
+        self.uuid = str(uuid.uuid4())
+        self.revision = 0
+        # Entity data and the revision it last changed at keyed by
+        # (entity type, entity id)
+        self.entities = collections.OrderedDict()
+        self.removed = {}
+        machine_id = 0
+        for application, num_units in applications.items():
+            self._set_entity('application', application, {
+                'model-uuid': self.uuid,
+                'name': application,
+                'exposed': False,
+                'charm-url': 'cs:{}-1'.format(application),
+                'owner-tag': '',
+                'life': 'alive',
+                'min-units': 0,
+                'constraints': {},
+                'subordinate': False,
+                'status': _status('active'),
+                'workload-version': ''})
+            for unit_number in range(num_units):
+                address = '10.{}.{}.{}'.format(
+                    machine_id // 65536 % 256,
+                    machine_id // 256 % 256,
+                    machine_id % 256)
+                self._set_entity('machine', str(machine_id), {
+                    'model-uuid': self.uuid,
+                    'id': str(machine_id),
+                    'instance-id': 'fake-{}'.format(machine_id),
+                    'agent-status': _status('started'),
+                    'instance-status': _status('running'),
+                    'life': 'alive',
+                    'series': FAKE_SERIES,
+                    'jobs': ['JobHostUnits'],
+                    'addresses': [],
+                    'hardware-characteristics': {},
+                    'has-vote': False,
+                    'wants-vote': False})
+                unit_name = '{}/{}'.format(application, unit_number)
+                self._set_entity('unit', unit_name, {
+                    'model-uuid': self.uuid,
+                    'name': unit_name,
+                    'application': application,
+                    'series': FAKE_SERIES,
+                    'charm-url': 'cs:{}-1'.format(application),
+                    'life': 'alive',
+                    'public-address': address,
+                    'private-address': address,
+                    'machine-id': str(machine_id),
+                    'ports': [],
+                    'port-ranges': [],
+                    'principal': '',
+                    'subordinate': False,
+                    'workload-status': _status(workload_status,
+                                               workload_status_message),
+                    'agent-status': _status(agent_status)})
+                machine_id += 1
+
+    def _set_entity(self, entity_type, entity_id, data):
+        self.revision += 1
+        self.entities[(entity_type, entity_id)] = (self.revision, data)
+        # Keep the entities ordered by the revision they changed at
+        self.entities.move_to_end((entity_type, entity_id))
+
+    @property
+    def units(self):
+        """Names of the units of the model
+
+        :returns: Unit names
+        :rtype: [str, str,...]
+        """
+        return [entity_id for entity_type, entity_id in self.entities
+                if entity_type == 'unit']
+
+    def get_entity(self, entity_type, entity_id):
+        """Return the data of an entity
+
+        :param entity_type: Type of entity, eg unit
+        :type entity_type: str
+        :param entity_id: Name or id of entity
+        :type entity_id: str
+        :returns: Entity data
+        :rtype: dict
+        """
+        return self.entities[(entity_type, entity_id)][1]
+
+    def update(self, changes):
+        """Change the status of units
+
+        changes takes the form:
+
+        {
+            'app/0': {
+                'workload-status': 'error',
+                'workload-status-message': 'hook failed: "install"'},
+            'otherapp': {
+                'agent-status': 'idle'}}
+
+        where an application name applies the change to all of its units.
+
+        :param changes: New statuses keyed by unit or application name
+        :type changes: dict
+        :returns: Names of units changed
+        :rtype: [str, str,...]
+        """
+        changed = []
+        for name, change in changes.items():
+            if '/' in name:
+                unit_names = [name]
+            else:
+                unit_names = [u for u in self.units
+                              if u.split('/')[0] == name]
+            for unit_name in unit_names:
+                data = dict(self.get_entity('unit', unit_name))
+                if 'workload-status' in change or \
+                        'workload-status-message' in change:
+                    data['workload-status'] = _status(
+                        change.get('workload-status',
+                                   data['workload-status']['current']),
+                        change.get('workload-status-message',
+                                   data['workload-status']['message']))
+                if 'agent-status' in change:
+                    data['agent-status'] = _status(change['agent-status'])
+                self._set_entity('unit', unit_name, data)
+                changed.append(unit_name)
+        return changed
+
+    def remove_unit(self, unit_name):
+        """Remove a unit from the model
+
+        :param unit_name: Name of unit
+        :type unit_name: str
+        """
+        self.revision += 1
+        _, data = self.entities.pop(('unit', unit_name))
+        self.removed[('unit', unit_name)] = (self.revision, data)
+
+    def deltas_since(self, revision):
+        """Return AllWatcher deltas for the entities changed after revision
+
+        :param revision: Model revision the watcher last saw
+        :type revision: int
+        :returns: Deltas
+        :rtype: [[str, str, dict], ...]
+        """
+        deltas = []
+        for (entity_type, _), (changed, data) in self.removed.items():
+            if changed > revision:
+                deltas.append([entity_type, 'remove', data])
+        for (entity_type, _), (changed, data) in reversed(
+                self.entities.items()):
+            if changed <= revision:
+                break
+            deltas.append([entity_type, 'change', data])
+        return deltas
+
+    def info(self):
+        """Return the response to a Client.ModelInfo request
+
+        :returns: Model info
+        :rtype: dict
+        """
+        return {
+            'name': self.name,
+            'uuid': self.uuid,
+            'type': 'iaas',
+            'controller-uuid': '',
+            'provider-type': 'fake',
+            'default-series': FAKE_SERIES,
+            'cloud-tag': 'cloud-fake',
+            'cloud-region': 'fake',
+            'owner-tag': 'user-{}'.format(FAKE_USER),
+            'life': 'alive',
+            'agent-version': FAKE_AGENT_VERSION,
+            'status': {'status': 'available', 'info': '', 'since': None},
+            'users': [],
+            'machines': []}
+
+    def full_status(self):
+        """Return the response to a Client.FullStatus request
+
+        :returns: Full status
+        :rtype: dict
+        """
+        machines = {}
+        applications = {}
+        for (entity_type, entity_id), (_, data) in self.entities.items():
+            if entity_type == 'machine':
+                machines[entity_id] = {
+                    'id': entity_id,
+                    'agent-status': _detailed_status(data['agent-status']),
+                    'instance-status': _detailed_status(
+                        data['instance-status']),
+                    'instance-id': data['instance-id'],
+                    'series': data['series'],
+                    'jobs': data['jobs'],
+                    'has-vote': False,
+                    'wants-vote': False,
+                    'containers': {},
+                    'ip-addresses': [],
+                    'network-interfaces': {}}
+            elif entity_type == 'application':
+                applications[entity_id] = {
+                    'charm': data['charm-url'],
+                    'series': FAKE_SERIES,
+                    'exposed': False,
+                    'life': '',
+                    'status': _detailed_status(data['status']),
+                    'relations': {},
+                    'subordinate-to': [],
+                    'can-upgrade-to': '',
+                    'meter-statuses': {},
+                    'workload-version': '',
+                    'units': {}}
+        for (entity_type, entity_id), (_, data) in self.entities.items():
+            if entity_type != 'unit':
+                continue
+            machine = machines[data['machine-id']]
+            machine['dns-name'] = data['public-address']
+            applications[data['application']]['units'][entity_id] = {
+                'agent-status': _detailed_status(data['agent-status']),
+                'workload-status': _detailed_status(data['workload-status']),
+                'machine': data['machine-id'],
+                'public-address': data['public-address'],
+                'opened-ports': [],
+                'charm': '',
+                'subordinates': {},
+                'workload-version': '',
+                'leader': entity_id.endswith('/0')}
+        return {
+            'model': {
+                'name': self.name,
+                'type': 'iaas',
+                'cloud-tag': 'cloud-fake',
+                'region': 'fake',
+                'version': FAKE_AGENT_VERSION,
+                'available-version': '',
+                'model-status': _detailed_status(_status('available')),
+                'meter-status': {'color': '', 'message': ''},
+                'sla': 'unsupported'},
+            'machines': machines,
+            'applications': applications,
+            'remote-applications': {},
+            'offers': {},
+            'relations': [],
+            'controller-timestamp': _timestamp()}
+
+
+def settle_script(fake_model, steps=5, interval=0.1,
+                  workload_status_message='Unit is ready'):
+    """Return a script which brings every unit to active and idle in steps
+
+    :param fake_model: Model to settle
+    :type fake_model: FakeModel
+    :param steps: Number of batches to settle the units in
+    :type steps: int
+    :param interval: Seconds between each batch
+    :type interval: float
+    :param workload_status_message: Workload status message of settled units
+    :type workload_status_message: str
+    :returns: Script for FakeController.play
+    :rtype: [(float, dict), ...]
+    """
+    units = fake_model.units
+    script = []
+    for step in range(steps):
+        batch = units[step::steps]
+        if batch:
+            script.append((interval, {
+                unit: {
+                    'workload-status': 'active',
+                    'workload-status-message': workload_status_message,
+                    'agent-status': 'idle'}
+                for unit in batch}))
+    return script
+
+
+class FakeController(object):
+    """Juju API websocket server running in a thread of its own
+
+    Used as a context manager the controller is started and JUJU_DATA
+    pointed at a client configuration which lists it as the current
+    controller, so that models can be connected to by name.
+    """
+
+    def __init__(self, models, latency=0):
+        """Create the controller
+
+        :param models: Models to serve
+        :type models: [FakeModel, ...]
+        :param latency: Seconds to delay every response by
+        :type latency: float
+        """
+        self.models = {m.name: m for m in models}
+        self.latency = latency
+        self.uuid = str(uuid.uuid4())
+        # Number of requests received keyed by 'Facade.Request'
+        self.calls = collections.Counter()
+        self.juju_data = None
+        self.endpoint = None
+        self.loop = None
+        self._thread = None
+        self._server = None
+        self._changed = {}
+        self._saved_juju_data = None
+        self._handlers = {
+            ('Admin', 'Login'): self._login,
+            ('AllWatcher', 'Next'): self._next,
+            ('AllWatcher', 'Stop'): self._stop,
+            ('Client', 'FullStatus'): self._full_status,
+            ('Client', 'ModelInfo'): self._model_info,
+            ('Client', 'WatchAll'): self._watch_all,
+            ('ModelConfig', 'ModelGet'): self._model_get,
+            ('Pinger', 'Ping'): self._ping,
+        }
+
+    def __enter__(self):
+        self.start()
+        self._saved_juju_data = os.environ.get('JUJU_DATA')
+        os.environ['JUJU_DATA'] = self.juju_data
+        return self
+
+    def __exit__(self, *args):
+        if self._saved_juju_data is None:
+            os.environ.pop('JUJU_DATA', None)
+        else:
+            os.environ['JUJU_DATA'] = self._saved_juju_data
+        self.stop()
+
+    def start(self):
+        """Start serving the models and write the client configuration"""
+        self.juju_data = tempfile.mkdtemp(prefix='fake-juju-')
+        key, ca_cert = cert.generate_cert(FAKE_CONTROLLER_NAME,
+                                          generate_ca=True)
+        cert_file = os.path.join(self.juju_data, 'controller.crt')
+        key_file = os.path.join(self.juju_data, 'controller.key')
+        with open(cert_file, 'wb') as fh:
+            fh.write(ca_cert)
+        with open(key_file, 'wb') as fh:
+            fh.write(key)
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ssl_context.load_cert_chain(cert_file, key_file)
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop,
+                                        name='fake-juju-controller')
+        self._thread.daemon = True
+        self._thread.start()
+
+        async def _serve():
+            return await websockets.serve(
+                self._serve, '127.0.0.1', 0, ssl=ssl_context, loop=self.loop,
+                max_size=None)
+        self._server = self.run(_serve())
+        port = self._server.sockets[0].getsockname()[1]
+        self.endpoint = '127.0.0.1:{}'.format(port)
+        self.write_juju_data(ca_cert.decode())
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        """Stop serving and remove the client configuration"""
+        if self._server:
+            self._server.close()
+            self.run(self._server.wait_closed())
+            self._server = None
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self.loop = None
+        if self.juju_data:
+            shutil.rmtree(self.juju_data)
+            self.juju_data = None
+
+    def run(self, coro):
+        """Run a coroutine in the controller's event loop and wait for it
+
+        :param coro: Coroutine to run
+        :type coro: coroutine
+        :returns: Result of coroutine
+        :rtype: Any
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def write_juju_data(self, ca_cert):
+        """Write a Juju client configuration listing the controller
+
+        :param ca_cert: PEM encoded CA certificate of the controller
+        :type ca_cert: str
+        """
+        files = {
+            'controllers.yaml': {
+                'controllers': {
+                    FAKE_CONTROLLER_NAME: {
+                        'uuid': self.uuid,
+                        'api-endpoints': [self.endpoint],
+                        'ca-cert': ca_cert}},
+                'current-controller': FAKE_CONTROLLER_NAME},
+            'accounts.yaml': {
+                'controllers': {
+                    FAKE_CONTROLLER_NAME: {
+                        'user': FAKE_USER,
+                        'password': FAKE_PASSWORD}}},
+            'models.yaml': {
+                'controllers': {
+                    FAKE_CONTROLLER_NAME: {
+                        'models': {
+                            '{}/{}'.format(FAKE_USER, m.name): {
+                                'uuid': m.uuid,
+                                'type': 'iaas'}
+                            for m in self.models.values()}}}}}
+        if self.models:
+            files['models.yaml']['controllers'][FAKE_CONTROLLER_NAME][
+                'current-model'] = '{}/{}'.format(
+                    FAKE_USER, list(self.models)[0])
+        for filename, contents in files.items():
+            with open(os.path.join(self.juju_data, filename), 'w') as fh:
+                yaml.safe_dump(contents, fh, default_flow_style=False)
+        os.makedirs(os.path.join(self.juju_data, 'cookies'))
+        cookie_file = os.path.join(
+            self.juju_data, 'cookies', '{}.json'.format(FAKE_CONTROLLER_NAME))
+        with open(cookie_file, 'w') as fh:
+            fh.write('[]')
+
+    def reset_calls(self):
+        """Forget the requests received so far"""
+        self.calls.clear()
+
+    def update(self, model_name, changes):
+        """Change the status of units and notify watchers of the model
+
+        :param model_name: Name of model
+        :type model_name: str
+        :param changes: New statuses, see FakeModel.update
+        :type changes: dict
+        :returns: Names of units changed
+        :rtype: [str, str,...]
+        """
+        async def _update():
+            return self._update(model_name, changes)
+        return self.run(_update())
+
+    def _update(self, model_name, changes):
+        changed = self.models[model_name].update(changes)
+        self._notify(model_name)
+        return changed
+
+    def _notify(self, model_name):
+        event = self._changed.pop(model_name, None)
+        if event:
+            event.set()
+
+    def play(self, model_name, script):
+        """Apply the changes of a script in the background
+
+        The script is a list of (delay, changes) tuples. Each delay is the
+        number of seconds to wait before applying the changes, see
+        FakeModel.update for the form they take.
+
+        :param model_name: Name of model
+        :type model_name: str
+        :param script: Changes to make
+        :type script: [(float, dict), ...]
+        :returns: Future whose result is the time the last change was made
+        :rtype: concurrent.futures.Future
+        """
+        async def _play():
+            for delay, changes in script:
+                await asyncio.sleep(delay)
+                self._update(model_name, changes)
+            return time.time()
+        return asyncio.run_coroutine_threadsafe(_play(), self.loop)
+
+    async def _serve(self, websocket, path):
+        fake_model = None
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'model':
+            for m in self.models.values():
+                if m.uuid == parts[1]:
+                    fake_model = m
+        # Watcher revisions keyed by watcher id, None once stopped
+        watchers = {}
+        tasks = set()
+        try:
+            async for message in websocket:
+                task = asyncio.ensure_future(self._respond(
+                    websocket, fake_model, watchers, json.loads(message)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _respond(self, websocket, fake_model, watchers, request):
+        facade, name = request['type'], request['request']
+        self.calls['{}.{}'.format(facade, name)] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        reply = {'request-id': request['request-id']}
+        try:
+            handler = self._handlers.get((facade, name))
+            if handler is None:
+                raise FakeAPIError(
+                    'no such request - method {}.{} is not implemented'
+                    .format(facade, name), 'not implemented')
+            if fake_model is None and facade != 'Admin':
+                raise FakeAPIError('not supported by the fake controller')
+            reply['response'] = await handler(fake_model, watchers, request)
+        except FakeAPIError as e:
+            reply.update({'error': str(e), 'error-code': e.code,
+                          'response': {}})
+        try:
+            await websocket.send(json.dumps(reply))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _login(self, fake_model, watchers, request):
+        if request['params'].get('credentials') != FAKE_PASSWORD:
+            raise FakeAPIError('invalid entity name or password',
+                               'unauthorized access')
+        return {
+            'facades': [{'name': name, 'versions': versions}
+                        for name, versions in sorted(FAKE_FACADES.items())],
+            'server-version': FAKE_AGENT_VERSION,
+            'controller-tag': 'controller-{}'.format(self.uuid),
+            'model-tag': 'model-{}'.format(
+                fake_model.uuid if fake_model else ''),
+            'servers': [[{'value': self.endpoint.split(':')[0],
+                          'port': int(self.endpoint.split(':')[1]),
+                          'type': 'ipv4',
+                          'scope': 'local-machine'}]],
+            'user-info': {
+                'display-name': FAKE_USER,
+                'identity': 'user-{}'.format(FAKE_USER),
+                'controller-access': 'superuser',
+                'model-access': 'admin'}}
+
+    async def _ping(self, fake_model, watchers, request):
+        return {}
+
+    async def _watch_all(self, fake_model, watchers, request):
+        watcher_id = str(len(watchers) + 1)
+        watchers[watcher_id] = 0
+        return {'watcher-id': watcher_id}
+
+    async def _next(self, fake_model, watchers, request):
+        watcher_id = request.get('Id')
+        while True:
+            revision = watchers.get(watcher_id)
+            if revision is None:
+                raise FakeAPIError('watcher was stopped')
+            deltas = fake_model.deltas_since(revision)
+            if deltas:
+                watchers[watcher_id] = fake_model.revision
+                return {'deltas': deltas}
+            if fake_model.name not in self._changed:
+                self._changed[fake_model.name] = asyncio.Event()
+            await self._changed[fake_model.name].wait()
+
+    async def _stop(self, fake_model, watchers, request):
+        watchers[request.get('Id')] = None
+        self._notify(fake_model.name)
+        return {}
+
+    async def _full_status(self, fake_model, watchers, request):
+        return fake_model.full_status()
+
+    async def _model_info(self, fake_model, watchers, request):
+        return fake_model.info()
+
+    async def _model_get(self, fake_model, watchers, request):
+        # Every model setting is left at its default
+        return {'config': {}}
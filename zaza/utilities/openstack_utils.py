@@ -16,12 +16,17 @@ from novaclient import client as novaclient_client
 from neutronclient.v2_0 import client as neutronclient
 from neutronclient.common import exceptions as neutronexceptions
 
+import asyncio
+import collections
+import hashlib
+import json
 import logging
 import os
 import re
 import six
 import sys
-import juju_wait
+
+from concurrent import futures
 
 from zaza import model
 from zaza.charm_lifecycle import utils as lifecycle_utils
@@ -72,6 +77,15 @@ UPGRADE_SERVICES = [
      'type': CHARM_TYPES['openstack-dashboard']},
     {'name': 'ceilometer', 'type': CHARM_TYPES['ceilometer']},
 ]
+# Command printing the installed version of a package
+PKG_VERSION_CMD = "dpkg-query -W -f='${{Version}}' {}"
+# Match the x.y.z version of swift packages and the x.y version of others
+SWIFT_VERSION_MATCHER = re.compile(r'^(\d+)\.(\d+)\.(\d+)')
+OS_VERSION_MATCHER = re.compile(r'^(\d+)\.(\d+)')
+# Authenticated keystone sessions keyed on (model name, cloud), where cloud is
+# 'overcloud' or 'undercloud'. Each value is a tuple of a fingerprint of the
+# settings the session was created from and the session itself.
+KEYSTONE_SESSIONS = {}
 
 
 # Openstack Client helpers
@@ -139,14 +153,17 @@ def get_neutron_session_client(session):
     return neutronclient.Client(session=session)
 
 
-def get_keystone_scope():
+def get_keystone_scope(os_version=None):
     """Return Keystone scope based on OpenStack release
 
+    :param os_version: OpenStack codename of keystone, looked up if not given
+    :type os_version: string
     :returns: String keystone scope
     :rtype: string
     """
 
-    os_version = get_current_os_versions("keystone")["keystone"]
+    if os_version is None:
+        os_version = get_current_os_versions("keystone")["keystone"]
     # Keystone policy.json shipped the charm with liberty requires a domain
     # scoped token. Bug #1649106
     if os_version == "liberty":
@@ -177,26 +194,100 @@ def get_keystone_session(opentackrc_creds, insecure=True, scope='PROJECT'):
     return session.Session(auth=auth, verify=not insecure)
 
 
+def get_settings_fingerprint(settings):
+    """Return a fingerprint of the given settings
+
+    :param settings: Settings to fingerprint
+    :type settings: dict
+    :returns: Hex digest of the settings
+    :rtype: string
+    """
+
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def get_cached_keystone_session(cloud, fingerprint, new_session):
+    """Return the cached session for cloud in the current model
+
+    A new session is created with new_session if there is no cached session
+    or the settings fingerprint has changed since it was created. Sessions
+    re-authenticate themselves when their token is about to expire so they
+    can be reused for the life of the process.
+
+    :param cloud: Cloud the session is for: overcloud or undercloud
+    :type cloud: string
+    :param fingerprint: Fingerprint of the settings the session depends on
+    :type fingerprint: string
+    :param new_session: Function returning a new session
+    :type new_session: callable
+    :returns keystone_session: keystoneauth1.session.Session object
+    :rtype: keystoneauth1.session.Session
+    """
+
+    key = (lifecycle_utils.get_juju_model(), cloud)
+    cached = KEYSTONE_SESSIONS.get(key)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+    keystone_session = new_session()
+    KEYSTONE_SESSIONS[key] = (fingerprint, keystone_session)
+    return keystone_session
+
+
+def invalidate_keystone_sessions(model_name=None):
+    """Forget cached keystone sessions
+
+    :param model_name: Model to forget sessions for, defaults to all models
+    :type model_name: string
+    """
+
+    for key in list(KEYSTONE_SESSIONS.keys()):
+        if model_name is None or key[0] == model_name:
+            del KEYSTONE_SESSIONS[key]
+
+
 def get_overcloud_keystone_session():
     """Return Over cloud keystone session
 
+    The session is cached and replaced when the keystone application config
+    changes.
+
     :returns keystone_session: keystoneauth1.session.Session object
     :rtype: keystoneauth1.session.Session
     """
 
-    return get_keystone_session(get_overcloud_auth(),
-                                scope=get_keystone_scope())
+    keystone_config = get_keystone_config()
+
+    def _new_session():
+        os_version = get_current_os_versions('keystone')['keystone']
+        return get_keystone_session(
+            get_overcloud_auth(keystone_config=keystone_config,
+                               os_version=os_version),
+            scope=get_keystone_scope(os_version=os_version))
+
+    return get_cached_keystone_session(
+        'overcloud',
+        get_settings_fingerprint(keystone_config),
+        _new_session)
 
 
 def get_undercloud_keystone_session():
     """Return Under cloud keystone session
 
+    The session is cached and replaced when the undercloud authentication
+    settings in the environment change.
+
     :returns keystone_session: keystoneauth1.session.Session object
     :rtype: keystoneauth1.session.Session
     """
 
-    return get_keystone_session(get_undercloud_auth(),
-                                scope=get_keystone_scope())
+    auth_settings = get_undercloud_auth()
+    return get_cached_keystone_session(
+        'undercloud',
+        get_settings_fingerprint(auth_settings),
+        lambda: get_keystone_session(auth_settings,
+                                     scope=get_keystone_scope()))
 
 
 def get_keystone_session_client(session):
@@ -283,6 +374,11 @@ def get_ovs_uuids():
 
 BRIDGE_MAPPINGS = 'bridge-mappings'
 NEW_STYLE_NETWORKING = 'physnet1:br-ex'
+# Security group rules added by add_neutron_secgroup_rules, in order
+NEUTRON_SECGROUP_RULES = collections.OrderedDict([
+    ('ssh', {'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22}),
+    ('ping', {'protocol': 'icmp'}),
+])
 
 
 def deprecated_external_networking(dvr_mode=False):
@@ -366,29 +462,56 @@ def configure_gateway_ext_port(novaclient, neutronclient,
     if not net_id:
         net_id = get_admin_net(neutronclient)['id']
 
+    ext_ports = [port
+                 for port in neutronclient.list_ports(
+                     network_id=net_id)['ports']
+                 if 'ext-port' in port['name']]
+    attached = [port['device_id'] for port in ext_ports]
     for uuid in uuids:
-        server = novaclient.servers.get(uuid)
-        ext_port_name = "{}_ext-port".format(server.name)
-        for port in neutronclient.list_ports(device_id=server.id)['ports']:
-            if port['name'] == ext_port_name:
-                logging.warning('Neutron Gateway already has additional port')
-                break
-        else:
-            logging.info('Attaching additional port to instance, '
-                         'connected to net id: {}'.format(net_id))
+        if uuid in attached:
+            logging.warning('Neutron Gateway {} already has additional port'
+                            .format(uuid))
+    missing = [uuid for uuid in uuids if uuid not in attached]
+    if missing:
+        with futures.ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            servers = list(executor.map(novaclient.servers.get, missing))
+        # Reuse ports left unattached by an earlier run
+        unattached = {port['name']: port for port in ext_ports
+                      if not port['device_id']}
+        ports = {}
+        new_port_servers = []
+        for server in servers:
+            ext_port_name = "{}_ext-port".format(server.name)
+            if ext_port_name in unattached:
+                ports[server.id] = unattached[ext_port_name]
+            else:
+                new_port_servers.append(server)
+        if new_port_servers:
+            logging.info('Creating {} additional port(s), connected to net '
+                         'id: {}'.format(len(new_port_servers), net_id))
             body_value = {
-                "port": {
+                "ports": [{
                     "admin_state_up": True,
-                    "name": ext_port_name,
+                    "name": "{}_ext-port".format(server.name),
                     "network_id": net_id,
                     "port_security_enabled": False,
-                }
+                } for server in new_port_servers]
             }
-            port = neutronclient.create_port(body=body_value)
-            server.interface_attach(port_id=port['port']['id'],
+            new_ports = neutronclient.create_port(body=body_value)['ports']
+            ext_ports.extend(new_ports)
+            for server, port in zip(new_port_servers, new_ports):
+                ports[server.id] = port
+
+        def _attach(server):
+            logging.info('Attaching additional port to instance {}'.format(
+                server.id))
+            server.interface_attach(port_id=ports[server.id]['id'],
                                     net_id=None, fixed_ip=None)
+
+        with futures.ThreadPoolExecutor(max_workers=len(servers)) as executor:
+            list(executor.map(_attach, servers))
     ext_br_macs = []
-    for port in neutronclient.list_ports(network_id=net_id)['ports']:
+    for port in ext_ports:
         if 'ext-port' in port['name']:
             if deprecated_extnet_mode:
                 ext_br_macs.append(port['mac_address'])
@@ -409,10 +532,62 @@ def configure_gateway_ext_port(novaclient, neutronclient,
         if current_data_port == ext_br_macs_str:
             logging.info('Config already set to value')
             return
-        model.set_application_config(
+        model.set_application_config_and_wait(
             lifecycle_utils.get_juju_model(), application_name,
             configuration={config_key: ext_br_macs_str})
-        juju_wait.wait(wait_for_workload=True)
+        _local_utils.invalidate_status_snapshot()
+
+
+def find_neutron_resource(neutron_client, resource_type, name):
+    """Find a neutron resource by name
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param resource_type: Plural resource type, eg 'networks'
+    :type resource_type: string
+    :param name: Resource name
+    :type name: string
+    :returns: Resource object or None if there is no such resource
+    :rtype: dict or None
+    """
+
+    lister = getattr(neutron_client, 'list_{}'.format(resource_type))
+    resources = lister(name=name)[resource_type]
+    if resources:
+        return resources[0]
+
+
+def new_project_network(neutron_client, project_id, net_name='private',
+                        shared=False, network_type='gre'):
+    """Create a new project network, without checking for an existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param net_name: Network name
+    :type net_name: string
+    :param shared: The network should be shared between projects
+    :type shared: boolean
+    :param net_type: Network type: GRE, VXLAN, local, VLAN
+    :type net_type: string
+    :returns: Network object
+    :rtype: dict
+    """
+
+    logging.info('Creating network: %s',
+                 net_name)
+    network_msg = {
+        'network': {
+            'name': net_name,
+            'shared': shared,
+            'tenant_id': project_id,
+        }
+    }
+    if network_type == 'vxlan':
+        network_msg['network']['provider:segmentation_id'] = 1233
+        network_msg['network']['provider:network_type'] = network_type
+    return neutron_client.create_network(network_msg)['network']
 
 
 def create_project_network(neutron_client, project_id, net_name='private',
@@ -435,24 +610,40 @@ def create_project_network(neutron_client, project_id, net_name='private',
     :rtype: dict
     """
 
-    networks = neutron_client.list_networks(name=net_name)
-    if len(networks['networks']) == 0:
-        logging.info('Creating network: %s',
-                     net_name)
-        network_msg = {
-            'network': {
-                'name': net_name,
-                'shared': shared,
-                'tenant_id': project_id,
-            }
-        }
-        if network_type == 'vxlan':
-            network_msg['network']['provider:segmentation_id'] = 1233
-            network_msg['network']['provider:network_type'] = network_type
-        network = neutron_client.create_network(network_msg)['network']
-    else:
+    network = find_neutron_resource(neutron_client, 'networks', net_name)
+    if network:
         logging.warning('Network %s already exists.', net_name)
-        network = networks['networks'][0]
+        return network
+    return new_project_network(neutron_client, project_id, net_name=net_name,
+                               shared=shared, network_type=network_type)
+
+
+def new_external_network(neutron_client, project_id, net_name='ext_net'):
+    """Create a new external network, without checking for an existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param net_name: Network name
+    :type net_name: string
+    :returns: Network object
+    :rtype: dict
+    """
+
+    network_msg = {
+        'name': net_name,
+        'router:external': True,
+        'tenant_id': project_id,
+        'provider:physical_network': 'physnet1',
+        'provider:network_type': 'flat',
+    }
+
+    logging.info('Creating new external network definition: %s',
+                 net_name)
+    network = neutron_client.create_network(
+        {'network': network_msg})['network']
+    logging.info('New external network created: %s', network['id'])
     return network
 
 
@@ -472,26 +663,58 @@ def create_external_network(neutron_client, project_id, dvr_mode,
     :rtype: dict
     """
 
-    networks = neutron_client.list_networks(name=net_name)
-    if len(networks['networks']) == 0:
-        logging.info('Configuring external network')
-        network_msg = {
-            'name': net_name,
-            'router:external': True,
-            'tenant_id': project_id,
-            'provider:physical_network': 'physnet1',
-            'provider:network_type': 'flat',
-        }
+    network = find_neutron_resource(neutron_client, 'networks', net_name)
+    if network:
+        logging.warning('Network %s already exists.', net_name)
+        return network
+    logging.info('Configuring external network')
+    return new_external_network(neutron_client, project_id,
+                                net_name=net_name)
+
+
+def new_project_subnet(neutron_client, project_id, network, cidr, dhcp=True,
+                       subnet_name='private_subnet', subnetpool=None,
+                       ip_version=4, prefix_len=24):
+    """Create a new project subnet, without checking for an existing one
 
-        logging.info('Creating new external network definition: %s',
-                     net_name)
-        network = neutron_client.create_network(
-            {'network': network_msg})['network']
-        logging.info('New external network created: %s', network['id'])
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param network: Network object
+    :type network: dict
+    :param cidr: Network CIDR
+    :type cidr: string
+    :param dhcp: Run DHCP on this subnet
+    :type dhcp: boolean
+    :param subnet_name: Subnet name
+    :type subnet_name: string
+    :param subnet_pool: Subnetpool object
+    :type subnet_pool: dict or None
+    :param ip_version: IP version: 4 or 6
+    :type ip_version: int
+    :param prefix_len: Prefix lenghths of subnets derived from subnet pools
+    :type prefix_len: int
+    :returns: Subnet object
+    :rtype: dict
+    """
+
+    logging.info('Creating subnet')
+    subnet_msg = {
+        'subnet': {
+            'name': subnet_name,
+            'network_id': network['id'],
+            'enable_dhcp': dhcp,
+            'ip_version': ip_version,
+            'tenant_id': project_id
+        }
+    }
+    if subnetpool:
+        subnet_msg['subnet']['subnetpool_id'] = subnetpool['id']
+        subnet_msg['subnet']['prefixlen'] = prefix_len
     else:
-        logging.warning('Network %s already exists.', net_name)
-        network = networks['networks'][0]
-    return network
+        subnet_msg['subnet']['cidr'] = cidr
+    return neutron_client.create_subnet(subnet_msg)['subnet']
 
 
 def create_project_subnet(neutron_client, project_id, network, cidr, dhcp=True,
@@ -523,28 +746,64 @@ def create_project_subnet(neutron_client, project_id, network, cidr, dhcp=True,
     :rtype: dict
     """
 
-    # Create subnet
-    subnets = neutron_client.list_subnets(name=subnet_name)
-    if len(subnets['subnets']) == 0:
-        logging.info('Creating subnet')
-        subnet_msg = {
-            'subnet': {
-                'name': subnet_name,
-                'network_id': network['id'],
-                'enable_dhcp': dhcp,
-                'ip_version': ip_version,
-                'tenant_id': project_id
-            }
-        }
-        if subnetpool:
-            subnet_msg['subnet']['subnetpool_id'] = subnetpool['id']
-            subnet_msg['subnet']['prefixlen'] = prefix_len
-        else:
-            subnet_msg['subnet']['cidr'] = cidr
-        subnet = neutron_client.create_subnet(subnet_msg)['subnet']
-    else:
+    subnet = find_neutron_resource(neutron_client, 'subnets', subnet_name)
+    if subnet:
         logging.warning('Subnet %s already exists.', subnet_name)
-        subnet = subnets['subnets'][0]
+        return subnet
+    return new_project_subnet(
+        neutron_client, project_id, network, cidr, dhcp=dhcp,
+        subnet_name=subnet_name, subnetpool=subnetpool,
+        ip_version=ip_version, prefix_len=prefix_len)
+
+
+def new_external_subnet(neutron_client, project_id, network,
+                        default_gateway=None, cidr=None,
+                        start_floating_ip=None, end_floating_ip=None,
+                        subnet_name='ext_net_subnet'):
+    """Create a new external subnet, without checking for an existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param network: Network object
+    :type network: dict
+    :param default_gateway: Deafault gateway IP address
+    :type default_gateway: string
+    :param cidr: Network CIDR
+    :type cidr: string
+    :param start_floating_ip: Start of floating IP range: IP address
+    :type start_floating_ip: string or None
+    :param end_floating_ip: End of floating IP range: IP address
+    :type end_floating_ip: string or None
+    :param subnet_name: Subnet name
+    :type subnet_name: string
+    :returns: Subnet object
+    :rtype: dict
+    """
+
+    subnet_msg = {
+        'name': subnet_name,
+        'network_id': network['id'],
+        'enable_dhcp': False,
+        'ip_version': 4,
+        'tenant_id': project_id
+    }
+
+    if default_gateway:
+        subnet_msg['gateway_ip'] = default_gateway
+    if cidr:
+        subnet_msg['cidr'] = cidr
+    if (start_floating_ip and end_floating_ip):
+        allocation_pool = {
+            'start': start_floating_ip,
+            'end': end_floating_ip,
+        }
+        subnet_msg['allocation_pools'] = [allocation_pool]
+
+    logging.info('Creating new subnet')
+    subnet = neutron_client.create_subnet({'subnet': subnet_msg})['subnet']
+    logging.info('New subnet created: %s', subnet['id'])
     return subnet
 
 
@@ -574,34 +833,16 @@ def create_external_subnet(neutron_client, project_id, network,
     :rtype: dict
     """
 
-    subnets = neutron_client.list_subnets(name=subnet_name)
-    if len(subnets['subnets']) == 0:
-        subnet_msg = {
-            'name': subnet_name,
-            'network_id': network['id'],
-            'enable_dhcp': False,
-            'ip_version': 4,
-            'tenant_id': project_id
-        }
-
-        if default_gateway:
-            subnet_msg['gateway_ip'] = default_gateway
-        if cidr:
-            subnet_msg['cidr'] = cidr
-        if (start_floating_ip and end_floating_ip):
-            allocation_pool = {
-                'start': start_floating_ip,
-                'end': end_floating_ip,
-            }
-            subnet_msg['allocation_pools'] = [allocation_pool]
-
-        logging.info('Creating new subnet')
-        subnet = neutron_client.create_subnet({'subnet': subnet_msg})['subnet']
-        logging.info('New subnet created: %s', subnet['id'])
-    else:
+    subnet = find_neutron_resource(neutron_client, 'subnets', subnet_name)
+    if subnet:
         logging.warning('Subnet %s already exists.', subnet_name)
-        subnet = subnets['subnets'][0]
-    return subnet
+        return subnet
+    return new_external_subnet(
+        neutron_client, project_id, network,
+        default_gateway=default_gateway, cidr=cidr,
+        start_floating_ip=start_floating_ip,
+        end_floating_ip=end_floating_ip,
+        subnet_name=subnet_name)
 
 
 def update_subnet_dns(neutron_client, subnet, dns_servers):
@@ -627,6 +868,32 @@ def update_subnet_dns(neutron_client, subnet, dns_servers):
     neutron_client.update_subnet(subnet['id'], msg)
 
 
+def new_provider_router(neutron_client, project_id,
+                        router_name='provider-router'):
+    """Create a new provider router, without checking for an existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param router_name: Router name
+    :type router_name: string
+    :returns: Router object
+    :rtype: dict
+    """
+
+    logging.info('Creating provider router for external network access')
+    router_info = {
+        'router': {
+            'name': router_name,
+            'tenant_id': project_id
+        }
+    }
+    router = neutron_client.create_router(router_info)['router']
+    logging.info('New router created: %s', (router['id']))
+    return router
+
+
 def create_provider_router(neutron_client, project_id):
     """Create the provider router
 
@@ -638,21 +905,32 @@ def create_provider_router(neutron_client, project_id):
     :rtype: dict
     """
 
-    routers = neutron_client.list_routers(name='provider-router')
-    if len(routers['routers']) == 0:
-        logging.info('Creating provider router for external network access')
-        router_info = {
-            'router': {
-                'name': 'provider-router',
-                'tenant_id': project_id
-            }
-        }
-        router = neutron_client.create_router(router_info)['router']
-        logging.info('New router created: %s', (router['id']))
-    else:
+    router = find_neutron_resource(
+        neutron_client, 'routers', 'provider-router')
+    if router:
         logging.warning('Router provider-router already exists.')
-        router = routers['routers'][0]
-    return router
+        return router
+    return new_provider_router(neutron_client, project_id)
+
+
+def add_router_gateway(neutron_client, router, network):
+    """Set the gateway of a virtual router, without checking the existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param router: Router object
+    :type router: dict
+    :param network: Network object
+    :type network: dict
+    :returns: Nothing: This fucntion is executed for its sideffect
+    :rtype: None
+    """
+
+    logging.info('Plugging router into %s', network.get('name', 'ext_net'))
+    neutron_client.add_gateway_router(
+        router=router['id'],
+        body={'network_id': network['id']})
+    logging.info('Router connected')
 
 
 def plug_extnet_into_router(neutron_client, router, network):
@@ -671,15 +949,30 @@ def plug_extnet_into_router(neutron_client, router, network):
     ports = neutron_client.list_ports(device_owner='network:router_gateway',
                                       network_id=network['id'])
     if len(ports['ports']) == 0:
-        logging.info('Plugging router into ext_net')
-        router = neutron_client.add_gateway_router(
-            router=router['id'],
-            body={'network_id': network['id']})
-        logging.info('Router connected')
+        add_router_gateway(neutron_client, router, network)
     else:
         logging.warning('Router already connected')
 
 
+def add_router_interface(neutron_client, router, subnet):
+    """Add a subnet interface to a virtual router, without checking the ports
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param router: Router object
+    :type router: dict
+    :param subnet: Subnet object
+    :type subnet: dict
+    :returns: Nothing: This fucntion is executed for its sideffect
+    :rtype: None
+    """
+
+    logging.info('Adding interface from subnet to %s',
+                 router.get('name', router['id']))
+    neutron_client.add_interface_router(router['id'],
+                                        {'subnet_id': subnet['id']})
+
+
 def plug_subnet_into_router(neutron_client, router, network, subnet):
     """Add subnet interface to virtual router
 
@@ -705,14 +998,42 @@ def plug_subnet_into_router(neutron_client, router, network, subnet):
             device_owner='network:router_interface',
             network_id=network['id'])
         if len(ports['ports']) == 0:
-            logging.info('Adding interface from subnet to %s' % (router))
-            router = routers['routers'][0]
-            neutron_client.add_interface_router(router['id'],
-                                                {'subnet_id': subnet['id']})
+            add_router_interface(neutron_client, routers['routers'][0],
+                                 subnet)
         else:
             logging.warning('Router already connected to subnet')
 
 
+def new_address_scope(neutron_client, project_id, name, ip_version=4):
+    """Create a new address scope, without checking for an existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param name: Address scope name
+    :type name: string
+    :param ip_version: IP version: 4 or 6
+    :type ip_version: int
+    :returns: Address scope object
+    :rtype: dict
+    """
+
+    logging.info('Creating {} address scope'.format(name))
+    address_scope_info = {
+        'address_scope': {
+            'name': name,
+            'shared': True,
+            'ip_version': ip_version,
+            'tenant_id': project_id,
+        }
+    }
+    address_scope = neutron_client.create_address_scope(
+        address_scope_info)['address_scope']
+    logging.info('New address scope created: %s', (address_scope['id']))
+    return address_scope
+
+
 def create_address_scope(neutron_client, project_id, name, ip_version=4):
     """Create address scope
 
@@ -728,24 +1049,47 @@ def create_address_scope(neutron_client, project_id, name, ip_version=4):
     :rtype: dict
     """
 
-    address_scopes = neutron_client.list_address_scopes(name=name)
-    if len(address_scopes['address_scopes']) == 0:
-        logging.info('Creating {} address scope'.format(name))
-        address_scope_info = {
-            'address_scope': {
-                'name': name,
-                'shared': True,
-                'ip_version': ip_version,
-                'tenant_id': project_id,
-            }
-        }
-        address_scope = neutron_client.create_address_scope(
-            address_scope_info)['address_scope']
-        logging.info('New address scope created: %s', (address_scope['id']))
-    else:
+    address_scope = find_neutron_resource(
+        neutron_client, 'address_scopes', name)
+    if address_scope:
         logging.warning('Address scope {} already exists.'.format(name))
-        address_scope = address_scopes['address_scopes'][0]
-    return address_scope
+        return address_scope
+    return new_address_scope(neutron_client, project_id, name,
+                             ip_version=ip_version)
+
+
+def new_subnetpool(neutron_client, project_id, name, subnetpool_prefix,
+                   address_scope, shared=True):
+    """Create a new subnet pool, without checking for an existing one
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :param name: Subnet pool name
+    :type name: string
+    :param subnetpool_prefix: CIDR network
+    :type subnetpool_prefix: string
+    :param address_scope: Address scope object
+    :type address_scope: dict
+    :param shared: The subnet pool should be shared between projects
+    :type shared: boolean
+    :returns: Subnetpool object
+    :rtype: dict
+    """
+
+    logging.info('Creating subnetpool: %s',
+                 name)
+    subnetpool_msg = {
+        'subnetpool': {
+            'name': name,
+            'shared': shared,
+            'tenant_id': project_id,
+            'prefixes': [subnetpool_prefix],
+            'address_scope_id': address_scope['id'],
+        }
+    }
+    return neutron_client.create_subnetpool(subnetpool_msg)['subnetpool']
 
 
 def create_subnetpool(neutron_client, project_id, name, subnetpool_prefix,
@@ -768,25 +1112,12 @@ def create_subnetpool(neutron_client, project_id, name, subnetpool_prefix,
     :rtype: dict
     """
 
-    subnetpools = neutron_client.list_subnetpools(name=name)
-    if len(subnetpools['subnetpools']) == 0:
-        logging.info('Creating subnetpool: %s',
-                     name)
-        subnetpool_msg = {
-            'subnetpool': {
-                'name': name,
-                'shared': shared,
-                'tenant_id': project_id,
-                'prefixes': [subnetpool_prefix],
-                'address_scope_id': address_scope['id'],
-            }
-        }
-        subnetpool = neutron_client.create_subnetpool(
-            subnetpool_msg)['subnetpool']
-    else:
+    subnetpool = find_neutron_resource(neutron_client, 'subnetpools', name)
+    if subnetpool:
         logging.warning('Network %s already exists.', name)
-        subnetpool = subnetpools['subnetpools'][0]
-    return subnetpool
+        return subnetpool
+    return new_subnetpool(neutron_client, project_id, name,
+                          subnetpool_prefix, address_scope, shared=shared)
 
 
 def create_bgp_speaker(neutron_client, local_as=12345, ip_version=4,
@@ -912,56 +1243,93 @@ def add_peer_to_bgp_speaker(neutron_client, bgp_speaker, bgp_peer):
                         .format(bgp_peer['name']))
 
 
-def add_neutron_secgroup_rules(neutron_client, project_id):
-    """Add neutron security group rules
+def find_default_secgroup(security_groups, project_id):
+    """Find the default security group of a project
 
-    :param neutron_client: Authenticated neutronclient
-    :type neutron_client: neutronclient.Client object
+    :param security_groups: Security group objects to search
+    :type security_groups: [dict, ...]
     :param project_id: Project ID
     :type project_id: string
-    :returns: Nothing: This fucntion is executed for its sideffect
-    :rtype: None
+    :returns: Security group object
+    :rtype: dict
+    :raises: Exception if the project has no default security group
     """
 
     secgroup = None
-    for group in neutron_client.list_security_groups().get('security_groups'):
+    for group in security_groups:
         if (group.get('name') == 'default' and
             (group.get('project_id') == project_id or
                 (group.get('tenant_id') == project_id))):
             secgroup = group
     if not secgroup:
         raise Exception("Failed to find default security group")
-    # Using presence of a 22 rule to indicate whether secgroup rules
-    # have been added
-    port_rules = [rule['port_range_min'] for rule in
-                  secgroup.get('security_group_rules')]
-    protocol_rules = [rule['protocol'] for rule in
-                      secgroup.get('security_group_rules')]
-    if 22 in port_rules:
-        logging.warn('Security group rules for ssh already added')
-    else:
-        logging.info('Adding ssh security group rule')
-        neutron_client.create_security_group_rule(
-            {'security_group_rule':
-                {'security_group_id': secgroup.get('id'),
-                 'protocol': 'tcp',
-                 'port_range_min': 22,
-                 'port_range_max': 22,
-                 'direction': 'ingress',
-                 }
-             })
-
-    if 'icmp' in protocol_rules:
-        logging.warn('Security group rules for ping already added')
-    else:
-        logging.info('Adding ping security group rule')
-        neutron_client.create_security_group_rule(
-            {'security_group_rule':
-                {'security_group_id': secgroup.get('id'),
-                 'protocol': 'icmp',
-                 'direction': 'ingress',
-                 }
-             })
+    return secgroup
+
+
+def get_missing_secgroup_rules(secgroup):
+    """Work out which of NEUTRON_SECGROUP_RULES a security group is missing
+
+    :param secgroup: Security group object
+    :type secgroup: dict
+    :returns: Names of the missing rules
+    :rtype: [str, ...]
+    """
+
+    # Using presence of a 22 rule to indicate whether the ssh rule has been
+    # added
+    rules = secgroup.get('security_group_rules') or []
+    port_rules = [rule['port_range_min'] for rule in rules]
+    protocol_rules = [rule['protocol'] for rule in rules]
+    missing = []
+    if 22 not in port_rules:
+        missing.append('ssh')
+    if 'icmp' not in protocol_rules:
+        missing.append('ping')
+    return missing
+
+
+def new_secgroup_rule(neutron_client, secgroup, rule_name):
+    """Add one of NEUTRON_SECGROUP_RULES to a security group
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param secgroup: Security group object
+    :type secgroup: dict
+    :param rule_name: Key of the rule in NEUTRON_SECGROUP_RULES
+    :type rule_name: string
+    :returns: Security group rule object
+    :rtype: dict
+    """
+
+    logging.info('Adding %s security group rule', rule_name)
+    rule = dict(NEUTRON_SECGROUP_RULES[rule_name],
+                security_group_id=secgroup.get('id'),
+                direction='ingress')
+    return neutron_client.create_security_group_rule(
+        {'security_group_rule': rule})['security_group_rule']
+
+
+def add_neutron_secgroup_rules(neutron_client, project_id):
+    """Add neutron security group rules
+
+    :param neutron_client: Authenticated neutronclient
+    :type neutron_client: neutronclient.Client object
+    :param project_id: Project ID
+    :type project_id: string
+    :returns: Nothing: This fucntion is executed for its sideffect
+    :rtype: None
+    """
+
+    secgroup = find_default_secgroup(
+        neutron_client.list_security_groups().get('security_groups'),
+        project_id)
+    missing = get_missing_secgroup_rules(secgroup)
+    for rule_name in NEUTRON_SECGROUP_RULES:
+        if rule_name in missing:
+            new_secgroup_rule(neutron_client, secgroup, rule_name)
+        else:
+            logging.warn('Security group rules for %s already added',
+                         rule_name)
 
 
 def create_port(neutron_client, name, network_name):
@@ -1064,11 +1432,11 @@ def get_os_code_info(package, pkg_version):
         pkg_version = pkg_version.split(':')[1:][0]
     if 'swift' in package:
         # Fully x.y.z match for swift versions
-        match = re.match('^(\d+)\.(\d+)\.(\d+)', pkg_version)
+        match = SWIFT_VERSION_MATCHER.match(pkg_version)
     else:
         # x.y match only for 20XX.X
         # and ignore patch level for other packages
-        match = re.match('^(\d+)\.(\d+)', pkg_version)
+        match = OS_VERSION_MATCHER.match(pkg_version)
 
     if match:
         vers = match.group(0)
@@ -1086,26 +1454,46 @@ def get_os_code_info(package, pkg_version):
             return OPENSTACK_CODENAMES[vers]
 
 
-def get_current_os_versions(deployed_applications):
+async def async_get_current_os_versions(deployed_applications,
+                                        model_name=None):
     """Determine OpenStack codename of deployed applications
 
+    The package version is queried on every unit of every application at
+    once over a single model connection.
+
     :param deployed_applications: List of deployed applications
     :type deployed_applications: list
+    :param model_name: Name of model to query, defaults to the current model
+    :type model_name: str
+    :raises: Exception if the units of an application disagree
     :returns: List of aplication to codenames dictionaries
     :rtype: list
     """
 
+    if not model_name:
+        model_name = lifecycle_utils.get_juju_model()
+    applications = [a for a in UPGRADE_SERVICES
+                    if a['name'] in deployed_applications]
+    results = await asyncio.gather(*[
+        model.async_run_on_application(
+            model_name,
+            application['name'],
+            PKG_VERSION_CMD.format(application['type']['pkg']))
+        for application in applications])
     versions = {}
-    for application in UPGRADE_SERVICES:
-        if application['name'] not in deployed_applications:
-            continue
-
-        version = _local_utils.get_pkg_version(application['name'],
-                                               application['type']['pkg'])
-        versions[application['name']] = (
-            get_os_code_info(application['type']['pkg'], version))
+    for application, unit_results in zip(applications, results):
+        pkg_versions = set(
+            _local_utils.get_remote_run_output(result).strip()
+            for result in unit_results.values())
+        if len(pkg_versions) != 1:
+            raise Exception('Unexpected output from pkg version check')
+        versions[application['name']] = get_os_code_info(
+            application['type']['pkg'],
+            pkg_versions.pop())
     return versions
 
+get_current_os_versions = model.sync_wrapper(async_get_current_os_versions)
+
 
 def get_application_config_keys(application):
     """Return application configuration keys
@@ -1209,34 +1597,64 @@ def get_undercloud_auth():
 
 
 # Openstack Client helpers
-def get_keystone_ip():
-    if get_application_config_option('keystone', 'vip'):
-        return get_application_config_option('keystone', 'vip')
+def get_keystone_config():
+    """Return the keystone application configuration in one lookup
+
+    :returns: Dictionary of configuration option values
+    :rtype: dict
+    """
+
+    application_config = model.get_application_config(
+        lifecycle_utils.get_juju_model(), 'keystone')
+    return {k: v.get('value') for k, v in application_config.items()}
+
+
+def get_keystone_ip(keystone_config=None):
+    """Return the address to reach keystone on
+
+    :param keystone_config: Keystone application config, looked up if not
+                            given
+    :type keystone_config: dict
+    :returns: VIP or address of the first keystone unit
+    :rtype: string
+    """
+
+    if keystone_config is None:
+        keystone_config = get_keystone_config()
+    if keystone_config.get('vip'):
+        return keystone_config['vip']
     unit = model.get_units(
         lifecycle_utils.get_juju_model(), 'keystone')[0]
     return unit.public_address
 
 
-def get_overcloud_auth():
+def get_overcloud_auth(keystone_config=None, os_version=None):
     """Get the overcloud OpenStack authentication settings from the
     environment.
 
+    :param keystone_config: Keystone application config, looked up if not
+                            given
+    :type keystone_config: dict
+    :param os_version: OpenStack codename of keystone, looked up if not given
+    :type os_version: string
     :returns: Dictionary of authentication settings
     :rtype: dict
     """
 
-    if get_application_config_option('keystone', 'use-https').lower() == 'yes':
+    if keystone_config is None:
+        keystone_config = get_keystone_config()
+    if keystone_config.get('use-https').lower() == 'yes':
         transport = 'https'
         port = 35357
     else:
         transport = 'http'
         port = 5000
-    address = get_keystone_ip()
+    address = get_keystone_ip(keystone_config=keystone_config)
 
-    os_version = get_current_os_versions('keystone')['keystone']
+    if os_version is None:
+        os_version = get_current_os_versions('keystone')['keystone']
 
-    api_version = get_application_config_option('keystone',
-                                                'preferred-api-version')
+    api_version = keystone_config.get('preferred-api-version')
     if os_version >= 'queens':
         api_version = 3
     elif api_version is None: